@@ -23,10 +23,26 @@ SOFTWARE.
 """
 import os
 import sys
+import asyncio
 import errno
 import time
 import fcntl
-from collections import namedtuple
+import signal
+import struct
+import threading
+import hashlib
+import json
+import mmap
+import socket
+import weakref
+import pickle
+import multiprocessing
+import multiprocessing.connection
+from bisect import bisect_left, bisect_right
+from collections import deque, namedtuple
+from itertools import count
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from numbers import Integral
 
 try:
 	import warnings
@@ -40,334 +56,5975 @@ class IllegalArgumentError(ValueError):
 class IllegalWithStatement(ValueError):
 	pass
 
+class LockTimeoutError(TimeoutError):
+	pass
+
+#Raised by acquire/acquire_many with deadlock detection on, when the request was picked to break a deadlock.
+#cycle is the list of wait_info of the waiters in the deadlock, when known.
+class DeadlockError(RuntimeError):
+	def __init__(self, msg, cycle = None):
+		super(DeadlockError, self).__init__(msg)
+		self.cycle = cycle
+
+#Raised by remoteLocksfile when the connection to the lock server is lost (the server released the client's locks),
+#or for a failure of the server that is not a pylocksfile error.
+class LockServerError(RuntimeError):
+	pass
+
+#Raised by the SIGALRM handler to interrupt a timed blocking lock request. Never leaves pylocksfile.
+class _lockTimeout(Exception):
+	pass
+
 #Import on pylocksfile with "from pylocksfile import *"
-__all__ = [ "pylocksfile" ]
+__all__ = [ "pylocksfile", "POSIX_BACKEND", "OFD_BACKEND", "VICTIM_REQUESTER", "VICTIM_YOUNGEST", "VICTIM_OLDEST", "VICTIM_FEWEST_LOCKS", "LockTimeoutError", "DeadlockError", "FAIR_FIFO", "FAIR_WRITER", "FAIR_PHASE", "lockMetrics", "stableKeyHash", "stripeEstimate", "scanLocks", "procLocks", "shardedLocksfile", "NODE_IS", "NODE_IX", "NODE_S", "NODE_SIX", "NODE_X", "HIERARCHY_OFFSET", "UPGRADE_GATES", "OPTIMISTIC_RETRIES", "lockServer", "remoteLocksfile", "LockServerError", "recordStore", "lockTracer", "TRACE_EVENTS", "readTrace", "traceSpans", "traceReport", "chromeTrace", "lockSemaphore", "SLOT_WAIT", "lockExecutor", "EXECUTOR_BATCH" ]
 
 __version__ = "0.0.6"
 
+#Kernel lock backends.
+#	- 'posix': classic POSIX record locks (fcntl.lockf). Owned by the process - all threads share them, and closing any fd of the file drops them.
+#	- 'ofd': Linux open file description locks. Owned by the open file (each pylocksfile instance), so threads can exclude each other.
+POSIX_BACKEND = 'posix'
+OFD_BACKEND = 'ofd'
+
+#OFD commands were added to the fcntl module in python 3.9, values from <fcntl.h>
+F_OFD_GETLK = getattr(fcntl, 'F_OFD_GETLK', 36)
+F_OFD_SETLK = getattr(fcntl, 'F_OFD_SETLK', 37)
+F_OFD_SETLKW = getattr(fcntl, 'F_OFD_SETLKW', 38)
+
+#Spin phase of timed acquire - non-blocking attempts with exponential backoff between these delays (seconds).
+#The spin budget adapts between the min/max budget: it grows when spinning acquired the lock and shrinks when it did not.
+SPIN_MIN_DELAY = 20e-6
+SPIN_MAX_DELAY = 1e-3
+SPIN_MIN_BUDGET = 50e-6
+SPIN_MAX_BUDGET = 5e-3
+
+#Deadlock detection - instances that can wait at once per lockfile, held segments each can publish exactly (more are
+#published merged), and how often (seconds) a waiter checks whether it was picked as the victim of a deadlock.
+WFG_SLOTS = 64
+WFG_RANGES = 1 << 14
+WFG_CHECK_INTERVAL = 50e-3
+
+#Deadlock victim policies - the request that closed the cycle, the waiter that started waiting last/first, or the one holding the fewest segments
+VICTIM_REQUESTER = 'requester'
+VICTIM_YOUNGEST = 'youngest'
+VICTIM_OLDEST = 'oldest'
+VICTIM_FEWEST_LOCKS = 'fewest_locks'
+
+#Fairness policies - strict FIFO (consecutive readers share), writer preference, or phase-fair (readers and writers alternate)
+FAIR_FIFO = 'fifo'
+FAIR_WRITER = 'writer'
+FAIR_PHASE = 'phase_fair'
+
+#Fairness queues - requests are queued by the stripe of their first lock (lock_n % FAIR_STRIPES), each stripe can queue
+#FAIR_QUEUE waiters at once. The turnstile of lock i is byte FAIR_TURNSTILE + i of the sidecar, so locks must be below it.
+FAIR_STRIPES = 4096
+FAIR_QUEUE = 1024
+FAIR_TURNSTILE = 1 << 62
+
+#Multi-granularity locking - the nodes of a lock hierarchy over the locks below HIERARCHY_OFFSET are laid out in the sidecar
+#file path + '.hier'. Each node takes HIERARCHY_NODE_BYTES bytes.
+HIERARCHY_OFFSET = 1 << 56
+HIERARCHY_NODE_BYTES = 4
+
+#Modes of a hierarchy node - intention shared/exclusive, shared, shared with intention exclusive, exclusive
+NODE_IS = 'IS'
+NODE_IX = 'IX'
+NODE_S = 'S'
+NODE_SIX = 'SIX'
+NODE_X = 'X'
+
+#Upgradeable read locks - the gate of lock i is byte UPGRADE_GATES + i of the lockfile, write locked by the upgradeable
+#holder of the lock, so locks must be below it. Clear of the hierarchy nodes.
+UPGRADE_GATES = 1 << 60
+
+#Optimistic reads (see versionTable) - failed attempts before a reader falls back to the read lock (adaptive, from 1 up to
+#OPTIMISTIC_RETRIES), and the machines (os.uname().machine) where they read the counters instead of always taking the lock
+OPTIMISTIC_RETRIES = 8
+ORDERED_MACHINES = ('x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686')
+
+#Lock traces (see lockTracer) - events kept per process and lockfile, and the kinds of events
+TRACE_EVENTS = 1 << 16
+TRACE_REQUEST = 1
+TRACE_ACQUIRED = 2
+TRACE_FAILED = 3
+TRACE_RELEASED = 4
+
+#acquire_any - longest wait (seconds) in the os for one busy slot before trying the others again
+SLOT_WAIT = 10e-3
+
+#lockExecutor - most tasks sent to a worker at once
+EXECUTOR_BATCH = 64
+
+#Threads of the shared pool that waits for contended acquire_async requests
+ASYNC_WAITERS = 8
+
+#Lock server - bytes read from a client at once, and pipelined requests a remoteLocksfile sends before collecting their replies
+SERVER_READ_SIZE = 1 << 16
+SERVER_PIPELINE = 64
+
+#Named keys are hashed onto KEY_STRIPES stripes, the locks [KEY_STRIPE_OFFSET, KEY_STRIPE_OFFSET + KEY_STRIPES).
+#The offset keeps them clear of the indices usually locked directly.
+KEY_STRIPES = 4096
+KEY_STRIPE_OFFSET = 1 << 32
+
+#Nanosecond clock of the metrics (time.perf_counter_ns was added in python 3.7)
+if hasattr(time, 'perf_counter_ns'):
+	perf_counter_ns = time.perf_counter_ns
+else:
+	def perf_counter_ns():
+		return int(time.perf_counter() * 1e9)
+
+#Clock of the lock traces, the same in every process (time.monotonic_ns was added in python 3.7), and their thread ids
+#(threading.get_native_id was added in python 3.8)
+if hasattr(time, 'monotonic_ns'):
+	monotonic_ns = time.monotonic_ns
+else:
+	def monotonic_ns():
+		return int(time.monotonic() * 1e9)
+
+_threadId = getattr(threading, 'get_native_id', threading.get_ident)
+
+#struct flock - short l_type, short l_whence, off_t l_start, off_t l_len, pid_t l_pid (padded to 32 bytes on 64-bit linux)
+flock_struct = struct.Struct('hhqqi4x')
+
+#Frame of the lock server protocol - payload length, followed by the JSON request or reply
+frame_struct = struct.Struct('!I')
+
+#Intervals are passed around as (lock_n, n_locks) tuples. Held intervals also carry their mode, and their hold count.
+interval_tuple = namedtuple('interval_tuple', ['lock_n' ,'n_locks'])
+interval_mode_tuple = namedtuple('interval_mode_tuple', ['lock_n' ,'n_locks', 'writeLock'])
+interval_count_tuple = namedtuple('interval_count_tuple', ['lock_n' ,'n_locks', 'writeLock', 'count'])
+
+#Lock of another holder, as reported by the os. pid is -1 for OFD locks, n_locks 0 means up to EOF.
+lock_holder_tuple = namedtuple('lock_holder_tuple', ['pid', 'writeLock', 'lock_n', 'n_locks'])
+#Waiter of the deadlock detection registry. since is its time.monotonic() when it started waiting, n_held its published held segments.
+wait_info = namedtuple('wait_info', ['slot', 'pid', 'writeLock', 'lock_n', 'n_locks', 'since', 'n_held'])
+#Entry of /proc/locks - kind is 'POSIX', 'OFDLCK', 'FLOCK'... blocked_by is the pid of the lock a waiter waits for (None for holders).
+proc_lock_tuple = namedtuple('proc_lock_tuple', ['pid', 'writeLock', 'lock_n', 'n_locks', 'kind', 'blocked_by'])
+#Event of a lock trace - event is TRACE_REQUEST, TRACE_ACQUIRED, TRACE_FAILED or TRACE_RELEASED, time_ns of monotonic_ns().
+trace_event_tuple = namedtuple('trace_event_tuple', ['time_ns', 'pid', 'tid', 'lock_n', 'n_locks', 'writeLock', 'event'])
+#Wait or hold of a lock trace (see traceSpans)
+trace_span_tuple = namedtuple('trace_span_tuple', ['pid', 'tid', 'lock_n', 'n_locks', 'writeLock', 'start_ns', 'end_ns', 'outcome'])
+
+"""
+lockInterval class implementation
+
+Sorted, non-overlapping store of held intervals, each recorded with its mode (read/write) and hold count.
+Segments are kept as parallel lists (start, end, writeLock, count), so lookups are a bisect and
+insert/remove only touch the segments that intersect the given interval (plus its direct neighbours for merging).
+"""
 class lockInterval(object):
 	def __init__(self):
-		self._intervals = list()
+		#Segment i covers locks [self._starts[i], self._ends[i]) in mode self._modes[i] (True - write, False - read),
+		#acquired self._counts[i] times. Adjacent segments differ in mode or count.
+		self._starts = list()
+		self._ends = list()
+		self._modes = list()
+		self._counts = list()
+
+		#Span [start, end) of the locks whose segments changed since the last changed() call, when tracked (see track)
+		self._tracked = False
+		self._changed = None
+
+		self.lock_interval_tuple = interval_tuple
 
-		self.lock_interval_tuple = namedtuple('interval_tuple', ['lock_n' ,'n_locks'])
+	def _merged(self, writeLock = None):
+		#Held intervals, adjacent segments of the same mode merged (counts aside). Only writeLock mode when given.
+		merged = list()
+		for start, end, mode in zip(self._starts, self._ends, self._modes):
+			if writeLock is not None and mode != writeLock:
+				continue
+			if merged and merged[-1][1] == start and merged[-1][2] == mode:
+				merged[-1][1] = end
+			else:
+				merged.append([start, end, mode])
+
+		return merged
 
 	@property
 	def intervals(self):
-		return self._intervals
-		
+		return [interval_tuple(start, end - start) for start, end, _ in self._merged()]
+
+	@property
+	def modeIntervals(self):
+		return [interval_mode_tuple(start, end - start, mode) for start, end, mode in self._merged()]
+
+	@property
+	def countIntervals(self):
+		return [interval_count_tuple(start, end - start, mode, count) for start, end, mode, count in zip(self._starts, self._ends, self._modes, self._counts)]
+
+	@property
+	def readIntervals(self):
+		return [interval_tuple(start, end - start) for start, end, _ in self._merged(False)]
+
+	@property
+	def writeIntervals(self):
+		return [interval_tuple(start, end - start) for start, end, _ in self._merged(True)]
+
+	def segments(self):
+		#Raw segment starts, ends and modes - sorted and non-overlapping, but not merged. Not to be modified.
+		return self._starts, self._ends, self._modes
+
 	def __iter__(self):
-		#Iterating over self._intervals
-		return iter(self._intervals)
+		#Iterating over the held intervals, in ascending order
+		return iter(self.intervals)
+
+	def __len__(self):
+		return len(self._starts)
+
+	def track(self):
+		#Record the span of the locks whose segments change from now on, starting with what is held - see changed()
+		self._tracked = True
+		self._changed = [self._starts[0], self._ends[-1]] if self._starts else None
+
+	def changed(self):
+		#Span [start, end) of the locks whose segments changed since the last call, None when none did.
+		#Segments crossing its bounds, or outside it, are unchanged.
+		span = self._changed
+		self._changed = None
+
+		return span
+
+	def _touch(self, start, end):
+		if self._changed is None:
+			self._changed = [start, end]
+		else:
+			self._changed[0] = min(self._changed[0], start)
+			self._changed[1] = max(self._changed[1], end)
 
 	def reset(self):
-		self._intervals = list()
+		if self._tracked and self._starts:
+			self._touch(self._starts[0], self._ends[-1])
+
+		self._starts = list()
+		self._ends = list()
+		self._modes = list()
+		self._counts = list()
 
 	def preprocessInput(self, interval):
-		if not (isinstance(interval, int) or isinstance(interval, tuple) or isinstance(interval, list) or isinstance(interval, self.lock_interval_tuple)):
+		#Fast paths for plain ints and already processed intervals
+		interval_type = type(interval)
+		if interval_type is int and interval >= 0:
+			return self.lock_interval_tuple(interval, 1)
+		if (interval_type is interval_tuple or interval_type is tuple) and len(interval) == 2 and type(interval[0]) is int and type(interval[1]) is int and interval[0] >= 0 and interval[1] > 0:
+			return interval if interval_type is interval_tuple else self.lock_interval_tuple(interval[0], interval[1])
+
+		#Integral covers NumPy integer scalars as well as int
+		if not (isinstance(interval, Integral) or isinstance(interval, tuple) or isinstance(interval, list) or isinstance(interval, self.lock_interval_tuple)):
 			raise IllegalArgumentError('lockInterval - interval argument is not a tuple, list or integer.')
 		
-		if isinstance(interval, int):
+		if isinstance(interval, Integral):
 			if (interval < 0):
 				raise IllegalArgumentError('lockInterval - integer interval must be  >=0')
 			
 			#Convert the single integer to list
-			interval = self.lock_interval_tuple(interval, 1)
+			return self.lock_interval_tuple(int(interval), 1)
 		
 		if isinstance(interval, tuple) or isinstance(interval, list):
 			if len(interval) != 2:
 				raise IllegalArgumentError('lockInterval - interval tuple or list must have shape [2] - (start_lock, n_locks_ahead)')
 
+			if not (isinstance(interval[0], Integral) and isinstance(interval[1], Integral)):
+				raise IllegalArgumentError('lockInterval - interval arguments must be integers')
+
 			if (interval[0] < 0):
 				raise IllegalArgumentError('lockInterval - interval first argument (lock_n) must be non-negative')					
 			
 			if (interval[1] <= 0):
 				raise IllegalArgumentError('lockInterval - interval second argument (n_locks) must be positive')
 
-			interval = self.lock_interval_tuple(interval[0], interval[1])
+			interval = self.lock_interval_tuple(int(interval[0]), int(interval[1]))
 
 		return interval
 
+	def coalesce(self, intervals):
+		#Merge any iterable of lock indices and (lock_n, n_locks) intervals into the fewest sorted, contiguous intervals
+		if hasattr(intervals, 'tolist'):
+			#NumPy arrays - convert to python ints in one go
+			intervals = intervals.tolist()
+
+		bounds = list()
+		for interval in intervals:
+			interval = self.preprocessInput(interval)
+			bounds.append((interval.lock_n, interval.lock_n + interval.n_locks))
+
+		bounds.sort()
+
+		merged = list()
+		for start, end in bounds:
+			if merged and start <= merged[-1][1]:
+				#Overlapping or adjacent to the previous run, so extend it
+				if end > merged[-1][1]:
+					merged[-1][1] = end
+			else:
+				merged.append([start, end])
+
+		return [self.lock_interval_tuple(start, end - start) for start, end in merged]
+
+	def overlapping(self, interval):
+		#Held segments within the interval, clipped to it
+		interval = self.preprocessInput(interval)
+
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
+
+		i, j = self._span(start, end)
+
+		return [interval_mode_tuple(max(self._starts[k], start), min(self._ends[k], end) - max(self._starts[k], start), self._modes[k]) for k in range(i, j)]
+
+	def countSegments(self, start, end):
+		#Number of held segments intersecting [start, end)
+		i, j = self._span(start, end)
+
+		return j - i
+
+	def maxCount(self, start, end):
+		#Most holds of a lock of [start, end), 0 when none is held
+		i, j = self._span(start, end)
+
+		return max(self._counts[i:j], default = 0)
+
+	def pieces(self, start, end):
+		#Held segments within [start, end), clipped to it, as [start, end, writeLock] lists - overlapping() for internal callers, without the checks
+		i, j = self._span(start, end)
+
+		return [[max(self._starts[k], start), min(self._ends[k], end), self._modes[k]] for k in range(i, j)]
+
+	def snapshot(self, interval):
+		#Held segments within the interval, clipped to it, with their counts. Put back with restore().
+		interval = self.preprocessInput(interval)
+
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
+
+		i, j = self._span(start, end)
+
+		return [interval_count_tuple(max(self._starts[k], start), min(self._ends[k], end) - max(self._starts[k], start), self._modes[k], self._counts[k]) for k in range(i, j)]
+
+	def missingSpan(self, interval, writeLock):
+		#Smallest interval covering the parts of interval not held in writeLock mode, None when all of it is
+		interval = self.preprocessInput(interval)
+
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
+
+		i, j = self._span(start, end)
+
+		if i == j:
+			return interval
+
+		if j == i + 1 and self._modes[i] == writeLock and self._starts[i] <= start and self._ends[i] >= end:
+			#All within a single segment held in this mode
+			return None
+
+		first = last = None
+		position = start
+
+		for k in range(i, j):
+			segment_start = max(self._starts[k], start)
+			segment_end = min(self._ends[k], end)
+
+			if segment_start > position:
+				#Gap before the segment
+				if first is None:
+					first = position
+				last = segment_start
+
+			if self._modes[k] != writeLock:
+				if first is None:
+					first = segment_start
+				last = segment_end
+
+			position = segment_end
+
+		if position < end:
+			if first is None:
+				first = position
+			last = end
+
+		if first is None:
+			return None
+
+		return self.lock_interval_tuple(first, last - first)
+
+	def unheld(self, interval):
+		#Parts of interval not held in either mode, as sorted intervals
+		interval = self.preprocessInput(interval)
+
+		position = interval.lock_n
+		end = interval.lock_n + interval.n_locks
+
+		i, j = self._span(position, end)
+		if i == j:
+			return [interval]
+
+		gaps = list()
+		for piece_start, piece_end, _ in self.pieces(position, end):
+			if piece_start > position:
+				gaps.append(self.lock_interval_tuple(position, piece_start - position))
+			position = piece_end
+
+		if position < end:
+			gaps.append(self.lock_interval_tuple(position, end - position))
+
+		return gaps
+
 	def inBound(self, lock_n):
-		if not isinstance(lock_n, int):
+		if not isinstance(lock_n, Integral):
 			raise IllegalArgumentError('lockInterval - lock_n argument must be positive integer.')
 		if not lock_n >= 0:
 			#Avoid comparison of non-numeric
 			raise IllegalArgumentError('lockInterval - lock_n argument must be positive integer.')
 
-		for subInterval in self._intervals:
-			#If lock_n is within the range of any subInterval, return True
-			if (lock_n >= subInterval.lock_n) and (lock_n < subInterval.lock_n + subInterval.n_locks):
-				return True
+		#Last segment starting at or before lock_n is the only candidate
+		i = bisect_right(self._starts, lock_n) - 1
 
-		#No match is found.
-		return False
+		return i >= 0 and lock_n < self._ends[i]
+
+	def lockMode(self, lock_n):
+		#Returns True/False for a write/read held lock_n, None if lock_n is not held
+		if not self.inBound(lock_n):
+			return None
+
+		return self._modes[bisect_right(self._starts, lock_n) - 1]
+
+	def lockCount(self, lock_n):
+		#Number of times lock_n is held, 0 if it is not
+		if not self.inBound(lock_n):
+			return 0
+
+		return self._counts[bisect_right(self._starts, lock_n) - 1]
+
+	def _span(self, start, end):
+		#Indices [i, j) of the segments intersecting [start, end). Ends are sorted as well, since segments do not overlap.
+		return bisect_right(self._ends, start), bisect_left(self._starts, end)
+
+	def _replace(self, lo, hi, pieces):
+		#Replace segments [lo, hi) with pieces ([start, end, writeLock, count] lists, sorted, count > 0),
+		#merging pieces of the same mode and count - with each other and with the neighbours of the slice.
+		if pieces and lo > 0 and self._ends[lo - 1] == pieces[0][0] and self._modes[lo - 1] == pieces[0][2] and self._counts[lo - 1] == pieces[0][3]:
+			lo -= 1
+			pieces[0][0] = self._starts[lo]
+
+		if pieces and hi < len(self._starts) and self._starts[hi] == pieces[-1][1] and self._modes[hi] == pieces[-1][2] and self._counts[hi] == pieces[-1][3]:
+			pieces[-1][1] = self._ends[hi]
+			hi += 1
+
+		if self._tracked and (lo < hi or pieces):
+			#Replaced segments and pieces are both sorted
+			self._touch(min(self._starts[lo] if lo < hi else pieces[0][0], pieces[0][0] if pieces else self._starts[lo]),
+				max(self._ends[hi - 1] if lo < hi else pieces[-1][1], pieces[-1][1] if pieces else self._ends[hi - 1]))
+
+		if len(pieces) == 1:
+			piece = pieces[0]
+			self._starts[lo:hi] = [piece[0]]
+			self._ends[lo:hi] = [piece[1]]
+			self._modes[lo:hi] = [piece[2]]
+			self._counts[lo:hi] = [piece[3]]
+			return
+
+		merged = list()
+		for piece in pieces:
+			if merged and merged[-1][1] == piece[0] and merged[-1][2] == piece[2] and merged[-1][3] == piece[3]:
+				merged[-1][1] = piece[1]
+			else:
+				merged.append(piece)
 
-	def insertInterval(self, interval):
-		#Create the interval and eliminate bad input
+		#Replace only the local slice of the store
+		self._starts[lo:hi] = [piece[0] for piece in merged]
+		self._ends[lo:hi] = [piece[1] for piece in merged]
+		self._modes[lo:hi] = [piece[2] for piece in merged]
+		self._counts[lo:hi] = [piece[3] for piece in merged]
+
+	def _recount(self, i, start, end, delta):
+		#Add delta holds to [start, end), all within segment i, in place. The parts of the segment outside it are split off
+		#with the old count, and the recounted part merges with a neighbour of the same mode and new count that it touches.
+		starts, ends, modes, counts = self._starts, self._ends, self._modes, self._counts
+		mode = modes[i]
+		count = counts[i]
+		changed_start = starts[i]
+		changed_end = ends[i]
+
+		if starts[i] < start:
+			starts.insert(i, starts[i])
+			ends.insert(i, start)
+			modes.insert(i, mode)
+			counts.insert(i, count)
+			i += 1
+			starts[i] = start
+
+		if ends[i] > end:
+			starts.insert(i + 1, end)
+			ends.insert(i + 1, ends[i])
+			modes.insert(i + 1, mode)
+			counts.insert(i + 1, count)
+			ends[i] = end
+
+		count += delta
+		counts[i] = count
+
+		if i + 1 < len(starts) and starts[i + 1] == end and modes[i + 1] == mode and counts[i + 1] == count:
+			ends[i] = changed_end = ends[i + 1]
+			del starts[i + 1], ends[i + 1], modes[i + 1], counts[i + 1]
+
+		if i > 0 and ends[i - 1] == start and modes[i - 1] == mode and counts[i - 1] == count:
+			changed_start = starts[i - 1]
+			ends[i - 1] = ends[i]
+			del starts[i], ends[i], modes[i], counts[i]
+
+		if self._tracked:
+			self._touch(changed_start, changed_end)
+
+	def _leftovers(self, i, j, start, end):
+		#Parts of the first and last intersected segments that stick out of [start, end)
+		left = [self._starts[i], start, self._modes[i], self._counts[i]] if i < j and self._starts[i] < start else None
+		right = [end, self._ends[j - 1], self._modes[j - 1], self._counts[j - 1]] if i < j and self._ends[j - 1] > end else None
+
+		return left, right
+
+	def insertInterval(self, interval, writeLock = False, keep = False):
+		#Acquire interval once more - parts held in the same mode count one more hold,
+		#parts held in the other mode are converted (last operation counts) and held once.
+		#With keep, parts held in the other mode count one more hold too, write locked (see pylocksfile.__call__).
 		interval = self.preprocessInput(interval)
 
-		#Temporary list to hold the new intervals after the insertion operations
-		intervals = list()
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
 
-		for subInterval in self._intervals:
-			if (subInterval.lock_n + subInterval.n_locks) <= interval.lock_n:
-				#e.g. subInterval = (0,2), locks 0,1. interval = (2,1), locks 2. Out of bound, so insert.
-				intervals.append(subInterval)
-				continue
-			elif subInterval.lock_n >= (interval.lock_n + interval.n_locks):
-				#e.g. subInterval = (1,2), locks 1,2. interval = (0,1), locks 0. Out of bound, so insert.
-				intervals.append(subInterval)
-				continue
-			elif (subInterval.lock_n + subInterval.n_locks) <= (interval.lock_n + interval.n_locks) and subInterval.lock_n >= interval.lock_n:
-				#e.g. subInterval = (1,2), locks 1,2. interval = (1,2), locks 1,2. No need to insert, it is inbound.
-				continue
+		i, j = self._span(start, end)
 
-			#If we got here, need to extend. Get new extended range and override the previous, shorter, interval
-			mergedInterval_lock_n = min(subInterval.lock_n, interval.lock_n)
-			mergedInterval_n_locks = max(subInterval.lock_n + subInterval.n_locks, interval.lock_n + interval.n_locks) - mergedInterval_lock_n
-			interval = self.lock_interval_tuple(mergedInterval_lock_n, mergedInterval_n_locks)
+		if i == j:
+			#Nothing held within the interval
+			self._replace(i, j, [[start, end, writeLock, 1]])
+			return
 
-		#Finally insert the new interval (may have been modified).
-		intervals.append(interval)
+		if j == i + 1 and self._modes[i] == writeLock and self._starts[i] <= start and self._ends[i] >= end:
+			#Nested hold within a single segment held in this mode - counted in place, without splitting and re-merging pieces
+			self._recount(i, start, end, 1)
+			return
 
-		#Override the old intervals list
-		self._intervals = intervals
-		
-		return
+		left, right = self._leftovers(i, j, start, end)
+		pieces = [left] if left is not None else list()
 
-	def removeInterval(self, interval):
-		#Create the interval and eliminate bad input
-		interval = self.preprocessInput(interval)	
+		position = start
+		for k in range(i, j):
+			segment_start = max(self._starts[k], start)
+			segment_end = min(self._ends[k], end)
 
-		#Temporary list to hold the new intervals after the insertion operations
-		intervals = list()
+			if segment_start > position:
+				pieces.append([position, segment_start, writeLock, 1])
 
-		for subInterval in self._intervals:
-			if (subInterval.lock_n + subInterval.n_locks) <= interval.lock_n:
-				#e.g. subInterval = (0,2), locks 0,1. interval = (2,1), locks 2. Out of bound, so insert.
-				intervals.append(subInterval)
-				continue
-			elif subInterval.lock_n >= (interval.lock_n + interval.n_locks):
-				#e.g. subInterval = (1,2), locks 1,2. interval = (0,1), locks 0. Out of bound, so insert.
-				intervals.append(subInterval)
-				continue
-			elif (subInterval.lock_n + subInterval.n_locks) <= (interval.lock_n + interval.n_locks) and subInterval.lock_n >= interval.lock_n:
-				#e.g. subInterval = (1,2), locks 1,2. interval = (1,2), locks 1,2. No need to insert, it is inbound.
-				continue
+			if self._modes[k] == writeLock:
+				pieces.append([segment_start, segment_end, writeLock, self._counts[k] + 1])
+			elif keep:
+				pieces.append([segment_start, segment_end, True, self._counts[k] + 1])
+			else:
+				pieces.append([segment_start, segment_end, writeLock, 1])
+			position = segment_end
 
-			#If we got here, need to decrease. This is the first ("left") interval after intersection
-			mergedInterval_lock_n = min(subInterval.lock_n, interval.lock_n)
-			mergedInterval_n_locks = max(subInterval.lock_n, interval.lock_n) - mergedInterval_lock_n
-			
-			#A new valid interval will only happen when lock_n is non-negative and interval length is positive, then reinsert to end of list (re-examined later)
-			if mergedInterval_lock_n >= 0 and mergedInterval_n_locks > 0:
-				self._intervals.append(self.lock_interval_tuple(mergedInterval_lock_n, mergedInterval_n_locks))
+		if position < end:
+			pieces.append([position, end, writeLock, 1])
 
-			#If we got here, need to decrease. This is the second ("right") interval after intersection
-			mergedInterval_lock_n = min(subInterval.lock_n + subInterval.n_locks, interval.lock_n + interval.n_locks)
-			mergedInterval_n_locks = max(subInterval.lock_n + subInterval.n_locks, interval.lock_n + interval.n_locks) - mergedInterval_lock_n
-			
-			#A new valid interval will only happen when lock_n is non-negative and interval length is positive, then reinsert to end of list (re-examined later)
-			if mergedInterval_lock_n >= 0 and mergedInterval_n_locks > 0:
-				self._intervals.append(self.lock_interval_tuple(mergedInterval_lock_n, mergedInterval_n_locks))
+		if right is not None:
+			pieces.append(right)
+
+		self._replace(i, j, pieces)
 
-		#Override the previous intervals list
-		self._intervals = intervals
-		
 		return
 
+	def releaseInterval(self, interval):
+		#Drop one hold of the held parts of interval. Returns the intervals no longer held at all, sorted and merged.
+		interval = self.preprocessInput(interval)
 
-"""
-pylocksfile class implementation
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
 
-argument:
-	- locksfile_path (str):
-		Path of the file which will be used as lock, e.g. './lockfile.lock;. 
-		If not provided, a temporary file will be created in '/tmp' directory with random name.
-			* Do not use this file for read/write operations! It should only be accessed via this class methods
+		i, j = self._span(start, end)
 
-	- verbose (bool):
-		Whether to print out read/write intervals and other messages regarding the operations.
+		if i == j:
+			return list()
 
-	- l_id (str):
-		ID of the correct instance. Used mainly as prefix of the printed information. 
+		if j == i + 1 and self._counts[i] == 1 and self._starts[i] >= start and self._ends[i] <= end:
+			#A single segment held once, all within the interval - e.g. releasing what was just acquired
+			freed = [self.lock_interval_tuple(self._starts[i], self._ends[i] - self._starts[i])]
+			if self._tracked:
+				self._touch(self._starts[i], self._ends[i])
+			del self._starts[i], self._ends[i], self._modes[i], self._counts[i]
+			return freed
 
-"""
-class pylocksfile(object):
-	def __init__(self, locksfile_path = None, verbose = False, l_id = None):
-		
-		#If locksfile_path is None, create a temporary file in /tmp with random name (posix timestamp in ms)
-		if locksfile_path is None:
-			locksfile_path = os.path.join('/tmp', str(int(time.time() * 1000)) + '.lock')
-		
-		#If l_id is None, then give it a random name...for now process pid
-		if l_id is None:
-			lid = str(os.getpid())
+		if j == i + 1 and self._counts[i] > 1 and self._starts[i] <= start and self._ends[i] >= end:
+			#Dropping a nested hold within a single segment - nothing is freed
+			self._recount(i, start, end, -1)
+			return list()
 
-		locksfile_path = os.path.abspath(locksfile_path)
-		
-		if not os.path.isdir(os.path.split(locksfile_path)[0]):
-			raise IllegalArgumentError('pylocksfile - locksfile_path directory path does not exist.')
-		
-		if not isinstance(verbose, bool):
-			raise IllegalArgumentError('pylocksfile - verbose argument is not boolean (True/False).')
-		
-		if not isinstance(locksfile_path, str):
-			raise IllegalArgumentError('pylocksfile - l_id argument is not str.')
+		left, right = self._leftovers(i, j, start, end)
+		pieces = [left] if left is not None else list()
+		freed = list()
 
-		#Get absolute path to the file
-		self._locksfile_path =  os.path.abspath(locksfile_path)
-		
-		#Determine if inside information will be printed.
-		self._verbose = verbose
+		for k in range(i, j):
+			segment_start = max(self._starts[k], start)
+			segment_end = min(self._ends[k], end)
 
-		#self._fd = None
-		self._fd  = os.open(self._locksfile_path, os.O_CREAT | os.O_TRUNC | os.O_RDWR)
+			if self._counts[k] > 1:
+				pieces.append([segment_start, segment_end, self._modes[k], self._counts[k] - 1])
+			elif freed and freed[-1][1] == segment_start:
+				freed[-1][1] = segment_end
+			else:
+				freed.append([segment_start, segment_end])
 
-		self._readLockIntervals = lockInterval()
-		self._writeLockIntervals = lockInterval()
-		
-		#For __enter__ and __exit__ recall
-		self._current_lock_n = list()
+		if right is not None:
+			pieces.append(right)
 
-		self._l_id = l_id
+		self._replace(i, j, pieces)
+
+		return [self.lock_interval_tuple(freed_start, freed_end - freed_start) for freed_start, freed_end in freed]
+
+	def removeInterval(self, interval):
+		#Drop every hold of the interval
+		interval = self.preprocessInput(interval)
+
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
+
+		i, j = self._span(start, end)
+
+		if i == j:
+			#Nothing held within the interval
+			return
+
+		#Keep the "left" and "right" leftovers of the first and last intersected segments
+		left, right = self._leftovers(i, j, start, end)
+
+		self._replace(i, j, [piece for piece in (left, right) if piece is not None])
 
 		return
 
-	@property
-	def locksfile_path(self):
-		return self._locksfile_path
+	def restore(self, interval, segments):
+		#Put the held segments within interval back to a snapshot() of it
+		interval = self.preprocessInput(interval)
 
-	@property
-	def l_id(self):
-		return self._l_id
+		start = interval.lock_n
+		end = interval.lock_n + interval.n_locks
 
-	@property
-	def verbose(self):
-		return self._verbose
+		i, j = self._span(start, end)
+		left, right = self._leftovers(i, j, start, end)
 
-	@verbose.setter
-	def verbose(self, new_verbose):
-		self._verbose = new_verbose
-	
+		pieces = [left] if left is not None else list()
+		pieces += [[segment.lock_n, segment.lock_n + segment.n_locks, segment.writeLock, segment.count] for segment in segments]
+		if right is not None:
+			pieces.append(right)
 
-	def acquire(self, writeLock = False, lock_n = 0, blocking = True):
-		if not isinstance(writeLock, bool):
-			raise IllegalArgumentError('writeLock must be boolean')
-		if not isinstance(blocking, bool):
-			raise IllegalArgumentError('blocking must be boolean')
+		self._replace(i, j, pieces)
 
-		#self.printVerbose('Attemping to lock ->' + str(lock_n))
+		return
 
-		#Create the interval of the lock. Will raise Exception on invalid input.
-		lock_interval = self._readLockIntervals.preprocessInput(lock_n)
 
-		#Set the lock type
-		lock_type = (fcntl.LOCK_EX if writeLock else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
-		
-		try:
-			#fcntl.lockf(fd, lock_type, lock_interval.n_locks, lock_interval.lock_n, 0) #len, start, whence = 0
-			fcntl.lockf(self._fd, lock_type, lock_interval.n_locks, lock_interval.lock_n, 0) #fd, cmd, len, start, whence = 0
+"""
+lockHistogram class implementation
 
-		except (IOError, OSError) as e:
-			
-			self.printVerbose("Exception" + str(e))
-			
-			if e.errno == errno.EDEADLK:
-				self.printVerbose('Deadlock detected by os. By linux policy - lock request removed for ' + str(lock_interval))
+HDR-style log-linear histogram of durations in nanoseconds. Values below 2**sub_bucket_bits are counted exactly, larger values
+are bucketed by their power of two, each power split into 2**sub_bucket_bits linear sub-buckets. So every value is recorded
+with a relative error below 2**-sub_bucket_bits, and recording is a few integer operations plus a dict update.
+"""
+class lockHistogram(object):
+	def __init__(self, sub_bucket_bits = 4):
+		self._sub_bucket_bits = sub_bucket_bits
+		self._sub_buckets = 1 << sub_bucket_bits
 
-			return False
+		#Sparse - only touched buckets are stored
+		self._counts = dict()
 
-		#Update list of locks. - last operation counts.
-		if writeLock:
-			self._writeLockIntervals.insertInterval(lock_interval)
-			self._readLockIntervals.removeInterval(lock_interval)
-		else:
-			self._readLockIntervals.insertInterval(lock_interval)
-			self._writeLockIntervals.removeInterval(lock_interval)
+		self.count = 0
+		self.total = 0
+		self.min = None
+		self.max = None
 
-		if writeLock:
-			self.printVerbose('Write lock acquired ->' + str(lock_n))
-		else:
-			self.printVerbose('Read lock acquired ->' + str(lock_n))
+	def _bucket(self, value):
+		shift = value.bit_length() - self._sub_bucket_bits - 1
+		if shift <= 0:
+			return value
 
-		self.printVerbose('read Locked ->' + str(self._readLockIntervals.intervals))
-		self.printVerbose('write Locked ->' + str(self._writeLockIntervals.intervals))
-		
-		return True
+		return ((shift + 1) << self._sub_bucket_bits) + (value >> shift) - self._sub_buckets
 
-	def release(self, lock_n = None):
+	def _upperBound(self, bucket):
+		#Largest value counted in bucket
+		shift = (bucket >> self._sub_bucket_bits) - 1
+		if shift <= 0:
+			return bucket
 
-		if lock_n is None:
-			
-			#If lock_n is None, release all the recorded locks, and reset list
-			lock_intervals = self._readLockIntervals.intervals + self._writeLockIntervals.intervals
-			
-			#Clear all the records
-			self._readLockIntervals.reset()
-			self._writeLockIntervals.reset()
-		else:
-			#Create the list of the interval of the lock. Will raise Exception on invalid input.
-			lock_intervals = [self._readLockIntervals.preprocessInput(lock_n)] 
-			
-			#Remove interval.
-			self._readLockIntervals.removeInterval(lock_intervals[0])
-			self._writeLockIntervals.removeInterval(lock_intervals[0])
+		return ((self._sub_buckets + (bucket & (self._sub_buckets - 1)) + 1) << shift) - 1
 
-		self.printVerbose('Releasing ->' + str(lock_n))
+	def record(self, value):
+		value = int(value)
+		bucket = self._bucket(value)
+		self._counts[bucket] = self._counts.get(bucket, 0) + 1
 
-		if self._fd:
-			
-			#Iterate over the interval of locks
-			for lock_i in lock_intervals:
+		self.count += 1
+		self.total += value
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
 
-				#Free the locks in current interval
-				fcntl.lockf(self._fd, fcntl.LOCK_UN, lock_i.n_locks, lock_i.lock_n, 0)
+	def percentile(self, p):
+		#Upper bound of the bucket holding the p-th percentile (0-100), clipped to the recorded max
+		if not self.count:
+			return None
 
-		#self.printVerbose('read Locked ->' + str(self._readLockIntervals.intervals))
-		#self.printVerbose('write Locked ->' + str(self._writeLockIntervals.intervals))
+		rank = p / 100.0 * self.count
+		seen = 0
+		for bucket in sorted(self._counts):
+			seen += self._counts[bucket]
+			if seen >= rank:
+				return min(self._upperBound(bucket), self.max)
 
-		return
+		return self.max
 
-	#Note - When using WITH statement, call must be blocking
-	def __call__(self, writeLock = False, lock_n = 0):
-		#save for future release. 
-		self._current_lock_n.append((writeLock, lock_n))
-		
-		return self
+	def cumulative(self, bounds):
+		#Number of values <= each bound (bucket resolution), for Prometheus style buckets
+		buckets = sorted(self._counts)
+		counts = list()
+		seen = 0
+		i = 0
+		for bound in bounds:
+			while i < len(buckets) and self._upperBound(buckets[i]) <= bound:
+				seen += self._counts[buckets[i]]
+				i += 1
+			counts.append(seen)
 
-	def __enter__(self):
-		self.printVerbose('With statement (always blocking). Locking ->' + str(self._current_lock_n[-1]))
-		
-		#Get saved arguments
-		writeLock, lock_n = self._current_lock_n[-1] 
-		
-		self.acquire(writeLock = writeLock, lock_n = lock_n)
-		
-		return self
+		return counts
 
-	def __exit__(self, exc_type, exc_value, traceback):
-		self.printVerbose('With statement. unLocking ->' + str(self._current_lock_n[-1]))
-		
-		#release last lock_n
-		_, lock_n = self._current_lock_n[-1]
-		
-		self.release(lock_n = lock_n)
-		
-		return None
+	def snapshot(self):
+		return {'count' : self.count, 'sum' : self.total, 'min' : self.min, 'max' : self.max,
+			'p50' : self.percentile(50), 'p90' : self.percentile(90), 'p99' : self.percentile(99), 'p999' : self.percentile(99.9)}
 
-	def __del__(self):
-		self.printVerbose('Deleting. Release all locks')
-		
-		#Release all
-		self.release(lock_n = None)
-		
-		return None
 
-	def printVerbose(self, msg):
-		if self._verbose:
-			print(str(type(self)), '-' , str(self._l_id) , '-', msg)
+"""
+lockMetrics class implementation
+
+Per lock bucket (lock_n // bucket_size, ranges are counted by their first lock) counters and histograms:
+	- acquires, contended (first attempt found the lock held) and deadlocks (EDEADLK) counts.
+	- wait time and hold time histograms, in nanoseconds.
+"""
+class lockMetrics(object):
+	#Prometheus histogram bucket bounds, in seconds
+	prometheus_bounds = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+	def __init__(self, bucket_size = 1):
+		if not isinstance(bucket_size, int) or bucket_size <= 0:
+			raise IllegalArgumentError('lockMetrics - bucket_size must be a positive integer.')
+
+		self._bucket_size = bucket_size
+		self.reset()
+
+	@property
+	def bucket_size(self):
+		return self._bucket_size
+
+	def reset(self):
+		#bucket -> [acquires, contended, deadlocks, wait histogram, hold histogram]
+		self._stats = dict()
+
+		#Held lock_n -> acquire time (ns), for hold times
+		self._held = dict()
+
+	def _bucketStats(self, lock_n):
+		bucket = lock_n // self._bucket_size
+		stats = self._stats.get(bucket)
+		if stats is None:
+			stats = self._stats[bucket] = [0, 0, 0, lockHistogram(), lockHistogram()]
+
+		return stats
+
+	def recordAcquire(self, lock_n, wait_time, contended, now):
+		stats = self._bucketStats(lock_n)
+		stats[0] += 1
+		if contended:
+			stats[1] += 1
+		stats[3].record(wait_time)
+
+		#Keep the earliest acquire time - re-acquiring (e.g. converting) a held lock does not restart its hold time
+		self._held.setdefault(lock_n, now)
+
+	def recordContended(self, lock_n):
+		#A contended attempt that did not acquire (non-blocking or timed out)
+		self._bucketStats(lock_n)[1] += 1
+
+	def recordDeadlock(self, lock_n):
+		stats = self._bucketStats(lock_n)
+		stats[1] += 1
+		stats[2] += 1
+
+	def recordRelease(self, lock_n, n_locks, now):
+		#Hold times of the held locks starting within [lock_n, lock_n + n_locks)
+		if n_locks <= len(self._held):
+			released = [start for start in range(lock_n, lock_n + n_locks) if start in self._held]
+		else:
+			released = [start for start in self._held if lock_n <= start < lock_n + n_locks]
+
+		for start in released:
+			self._bucketStats(start)[4].record(now - self._held.pop(start))
+
+	def recordReleaseAll(self, now):
+		for start, acquire_time in self._held.items():
+			self._bucketStats(start)[4].record(now - acquire_time)
+
+		self._held = dict()
+
+	def snapshot(self):
+		#{bucket first lock_n: {...}}, times in nanoseconds
+		return {bucket * self._bucket_size : {'acquires' : stats[0], 'contended' : stats[1], 'deadlocks' : stats[2],
+			'wait_ns' : stats[3].snapshot(), 'hold_ns' : stats[4].snapshot()} for bucket, stats in self._stats.items()}
+
+	def prometheus(self, prefix = 'pylocksfile', labels = None):
+		#Prometheus text exposition format. Lock buckets are labeled by their first lock_n, times are in seconds.
+		extra = ''.join(',' + key + '="' + str(value) + '"' for key, value in sorted((labels or dict()).items()))
+		bounds_ns = [int(bound * 1e9) for bound in self.prometheus_bounds]
+
+		lines = list()
+		for name, index, kind in (('acquires_total', 0, 'counter'), ('contended_total', 1, 'counter'), ('deadlocks_total', 2, 'counter')):
+			lines.append('# TYPE ' + prefix + '_' + name + ' ' + kind)
+			for bucket, stats in sorted(self._stats.items()):
+				lines.append(prefix + '_' + name + '{lock="' + str(bucket * self._bucket_size) + '"' + extra + '} ' + str(stats[index]))
+
+		for name, index in (('wait_seconds', 3), ('hold_seconds', 4)):
+			lines.append('# TYPE ' + prefix + '_' + name + ' histogram')
+			for bucket, stats in sorted(self._stats.items()):
+				histogram = stats[index]
+				labels_text = 'lock="' + str(bucket * self._bucket_size) + '"' + extra
+				for bound, count in zip(self.prometheus_bounds, histogram.cumulative(bounds_ns)):
+					lines.append(prefix + '_' + name + '_bucket{' + labels_text + ',le="' + repr(bound) + '"} ' + str(count))
+				lines.append(prefix + '_' + name + '_bucket{' + labels_text + ',le="+Inf"} ' + str(histogram.count))
+				lines.append(prefix + '_' + name + '_sum{' + labels_text + '} ' + repr(histogram.total / 1e9))
+				lines.append(prefix + '_' + name + '_count{' + labels_text + '} ' + str(histogram.count))
+
+		return '\n'.join(lines) + '\n'
+
+
+#Returned by pylocksfile.async_lock
+class _asyncLockContext(object):
+	def __init__(self, locksfile, writeLock, lock_n, timeout):
+		self._locksfile = locksfile
+		self._writeLock = writeLock
+		self._lock_n = lock_n
+		self._timeout = timeout
+
+	async def __aenter__(self):
+		if not await self._locksfile.acquire_async(writeLock = self._writeLock, lock_n = self._lock_n, timeout = self._timeout):
+			raise LockTimeoutError('pylocksfile - could not acquire ' + str(self._lock_n) + ' within ' + str(self._timeout) + ' seconds.')
+
+		return self._locksfile
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		self._locksfile.release(lock_n = self._lock_n)
+
+		return None
+
+
+def _keyBytes(key):
+	#Canonical, type tagged encoding of a key. Keys that compare equal in python (1, 1.0, True) must encode the same,
+	#or two processes could take different stripes for the same key.
+	if isinstance(key, str):
+		return b's' + key.encode('utf-8')
+	if isinstance(key, (bytes, bytearray)):
+		return b'b' + bytes(key)
+	if isinstance(key, float) and key.is_integer():
+		key = int(key)
+	if isinstance(key, int):
+		return b'i' + str(int(key)).encode('ascii')
+	if isinstance(key, float):
+		return b'f' + key.hex().encode('ascii')
+	if key is None:
+		return b'n'
+	if isinstance(key, tuple):
+		parts = [_keyBytes(item) for item in key]
+	elif isinstance(key, frozenset):
+		#Set order depends on python's salted hash, sort to make it stable
+		parts = sorted(_keyBytes(item) for item in key)
+	else:
+		raise IllegalArgumentError('pylocksfile - key must be str, bytes, int, float, None or a tuple/frozenset of those, got ' + str(type(key)))
+
+	return (b't' if isinstance(key, tuple) else b'z') + b''.join(struct.pack('<I', len(part)) + part for part in parts)
+
+"""
+64 bit hash of a key, the same in every process and python version (unlike the builtin hash, which is salted per process).
+"""
+def stableKeyHash(key):
+	return int.from_bytes(hashlib.blake2b(_keyBytes(key), digest_size = 8).digest(), 'little')
+
+"""
+Expected cost of hashing n_keys distinct keys onto n_stripes stripes, assuming a uniform hash. Returns a dict of:
+	- stripes_used: expected number of stripes holding at least one key.
+	- collision_rate: probability a key shares its stripe with at least one other key.
+	- contention_rate: probability two requests of keys_per_request distinct keys each (drawn from the n_keys)
+		share a stripe without sharing a key - i.e. contend only because of the striping.
+"""
+def stripeEstimate(n_keys, n_stripes = KEY_STRIPES, keys_per_request = 1):
+	if not isinstance(n_keys, Integral) or n_keys < 0:
+		raise IllegalArgumentError('n_keys must be a non-negative integer')
+	if not isinstance(n_stripes, Integral) or n_stripes < 1:
+		raise IllegalArgumentError('n_stripes must be a positive integer')
+	if not isinstance(keys_per_request, Integral) or keys_per_request < 1:
+		raise IllegalArgumentError('keys_per_request must be a positive integer')
+
+	miss = 1.0 - 1.0 / n_stripes
+	stripes_used = n_stripes * (1.0 - miss ** n_keys)
+	collision_rate = 1.0 - miss ** max(n_keys - 1, 0)
+
+	#Two keys of different requests collide with probability 1/n_stripes when they are different keys
+	m = min(keys_per_request, n_keys)
+	distinct_pair = 1.0 - 1.0 / n_keys if n_keys else 0.0
+	contention_rate = 1.0 - (1.0 - distinct_pair / n_stripes) ** (m * m)
+
+	return { 'stripes_used' : stripes_used, 'collision_rate' : collision_rate, 'contention_rate' : contention_rate }
+
+
+#Returned by pylocksfile.key
+class _keyLockContext(object):
+	def __init__(self, locksfile, keys, writeLock, timeout):
+		self._locksfile = locksfile
+		self._keys = keys
+		self._writeLock = writeLock
+		self._timeout = timeout
+
+	def __enter__(self):
+		if not self._locksfile.acquire_keys(self._keys, writeLock = self._writeLock, timeout = self._timeout):
+			raise LockTimeoutError('pylocksfile - could not acquire keys ' + str(self._keys) + ' within ' + str(self._timeout) + ' seconds.')
+
+		return self._locksfile
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._locksfile.release_keys(self._keys)
+
+		return None
+
+
+#Returned by calling a pylocksfile (shardedLocksfile, remoteLocksfile) - a with statement block over lock_n
+class _lockContext(object):
+	def __init__(self, locksfile, writeLock, lock_n):
+		self._locksfile = locksfile
+		self._writeLock = writeLock
+		self._lock_n = lock_n
+
+	def __enter__(self):
+		#A deadlock reported by the os - the body must not run unlocked
+		if self._locksfile._enterBlock(self._writeLock, self._lock_n) is False:
+			raise DeadlockError('pylocksfile - deadlock detected by os, with block of ' + str(self._lock_n) + ' not entered.')
+
+		return self._locksfile
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._locksfile._exitBlock(self._lock_n)
+
+		return None
+
+
+#Returned by pylocksfile.upgradeable
+class _upgradeableLockContext(object):
+	def __init__(self, locksfile, lock_n, timeout):
+		self._locksfile = locksfile
+		self._lock_n = lock_n
+		self._timeout = timeout
+
+	def __enter__(self):
+		if not self._locksfile.acquire_upgradeable(lock_n = self._lock_n, timeout = self._timeout):
+			raise LockTimeoutError('pylocksfile - could not acquire ' + str(self._lock_n) + ' upgradeable within ' + str(self._timeout) + ' seconds.')
+
+		return self
+
+	#Raises LockTimeoutError when not upgraded within timeout
+	def upgrade(self, timeout = None):
+		if not self._locksfile.upgrade(lock_n = self._lock_n, timeout = timeout):
+			raise LockTimeoutError('pylocksfile - could not upgrade ' + str(self._lock_n) + ' within ' + str(timeout) + ' seconds.')
+
+	def downgrade(self):
+		self._locksfile.downgrade(lock_n = self._lock_n)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self._locksfile.release_upgradeable(lock_n = self._lock_n)
+
+		return None
+
+
+"""
+Returned by pylocksfile.optimistic - an optimistic read of a lock range. Read the data, then validate(); False means a writer
+may have changed it meanwhile, and another attempt started - read it again:
+
+	with locksfile.optimistic(lock_n) as v:
+		while True:
+			record = readRecord()
+			if v.validate():
+				break
+
+An attempt starts when the counters are even, after a short yield while a writer holds the range. Once the budget of failed
+attempts is spent, the read lock is taken instead (and released on exit), so writer heavy phases can not starve the reader.
+The budget adapts per instance - halved by each fallback, doubled by each read that validates, between 1 and OPTIMISTIC_RETRIES.
+"""
+class _optimisticRead(object):
+	def __init__(self, locksfile, start, end, counters, held):
+		self._locksfile = locksfile
+		self._start = start
+		self._end = end
+		self._counters = counters
+
+		#Version seen when the attempt started, failed attempts, and whether the read lock is held (taken, or held by the instance already)
+		self._version = None
+		self._failures = 0
+		self._locked = held
+		self._taken = False
+
+	@property
+	def locked(self):
+		#True when the data is read under the read lock - validate() is always True
+		return self._locked
+
+	@property
+	def failures(self):
+		return self._failures
+
+	def __enter__(self):
+		if not self._locked:
+			self._attempt()
+
+		return self
+
+	def _read(self):
+		#Counters of the range, None while a writer holds any of them
+		if self._end - self._start == 1:
+			version = self._counters[self._start]
+			return None if version & 1 else version
+
+		versions = self._counters[self._start:self._end].tolist()
+
+		return None if any(version & 1 for version in versions) else versions
+
+	def _attempt(self):
+		#Next attempt - or the read lock, once the budget is spent
+		locksfile = self._locksfile
+
+		while self._counters is not None and self._failures < locksfile._optimistic_budget:
+			self._version = self._read()
+			if self._version is not None:
+				return
+
+			#Let the writer run
+			self._failures += 1
+			time.sleep(0)
+
+		locksfile.acquire(writeLock = False, lock_n = (self._start, self._end - self._start))
+		self._locked = self._taken = True
+
+	#True when the data read during the attempt is consistent. False starts another attempt.
+	def validate(self):
+		if self._locked or self._read() == self._version:
+			return True
+
+		self._failures += 1
+		self._attempt()
+
+		return False
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		locksfile = self._locksfile
+
+		if self._taken:
+			locksfile.release(lock_n = (self._start, self._end - self._start))
+			self._taken = False
+			locksfile._optimistic_budget = max(1, locksfile._optimistic_budget // 2)
+
+		elif exc_type is None and not self._locked and locksfile._optimistic_budget < OPTIMISTIC_RETRIES:
+			locksfile._optimistic_budget = min(OPTIMISTIC_RETRIES, locksfile._optimistic_budget * 2)
+
+		return None
+
+
+#OFD write lock of a single byte of a sidecar file (slot ownership and short critical sections of waitForGraph)
+def _lockFileByte(fd, offset, blocking):
+	fcntl.fcntl(fd, F_OFD_SETLKW if blocking else F_OFD_SETLK, flock_struct.pack(fcntl.F_WRLCK, os.SEEK_SET, offset, 1, 0))
+
+def _tryLockFileByte(fd, offset):
+	try:
+		_lockFileByte(fd, offset, False)
+	except (IOError, OSError) as e:
+		if e.errno not in (errno.EACCES, errno.EAGAIN):
+			raise
+		return False
+
+	return True
+
+def _unlockFileByte(fd, offset):
+	fcntl.fcntl(fd, F_OFD_SETLK, flock_struct.pack(fcntl.F_UNLCK, os.SEEK_SET, offset, 1, 0))
+
+#Lock type of a write (True) or read (False) lock, None unlocks
+_lock_types = { True : fcntl.F_WRLCK, False : fcntl.F_RDLCK, None : fcntl.F_UNLCK }
+
+#Lock (writeLock True/False) or unlock (None) [offset, offset + length) of a lockfile - OFD lock of the open file when ofd, POSIX lock of the process otherwise
+def _lockFileRange(fd, ofd, writeLock, offset, length, blocking):
+	if ofd:
+		command = F_OFD_SETLKW if blocking else F_OFD_SETLK
+	else:
+		command = fcntl.F_SETLKW if blocking else fcntl.F_SETLK
+
+	fcntl.fcntl(fd, command, flock_struct.pack(_lock_types[writeLock], os.SEEK_SET, offset, length, 0))
+
+"""
+waitForGraph class implementation
+
+Deadlock detection registry of the instances of a lockfile that turn detection on, in an mmap of the sidecar file path + '.wfg'.
+Each instance owns one of WFG_SLOTS slots by holding an OFD lock on the slot's byte for its lifetime.
+
+Nothing is published while requests are granted right away. A request that has to wait publishes its pending range and
+brings its held segments (which can not change while it waits) up to date in its slot, then looks for a cycle of waiters
+through itself, with an edge u -> v when the held segments of v conflict with the pending range of u. Only the span of
+segments changed since the previous wait is rewritten, the rest of the slot is kept. A new cycle can only close through
+the waiter that just started, so that is the only one searched from. An edge costs two bisects of the published segments
+(or of the write segments alone, for a read request) - a search is O(WFG_SLOTS^2 log held segments) at worst, whatever
+the number of held segments.
+Publishing and searching take the registry's detector byte, so the last waiter to join a cycle sees all the others.
+
+The victim is picked by the policy. A victim waiting in another instance finds its mark within WFG_CHECK_INTERVAL.
+"""
+class waitForGraph(object):
+	#Slot and detector lock bytes are at the start of the sidecar, the slots after this header
+	HEADER = 128
+	DETECT_BYTE = 126
+	RESIZE_BYTE = 127
+
+	#Slot record: pid, waiting, wait sequence number, victim (sequence number of the wait picked), pending lock_n and n_locks,
+	#flags, wait start (ns), number of published segments and of write segments. Followed by the segment starts and ends,
+	#then the write segment starts and ends.
+	RECORD = struct.Struct('10q')
+	RECORD_SIZE = 128
+
+	WRITE_FLAG = 1
+	POSIX_FLAG = 2
+
+	def __init__(self, locksfile_path, backend):
+		self._path = locksfile_path + '.wfg'
+		self._slot_size = self.RECORD_SIZE + 32 * WFG_RANGES
+		self._pid = os.getpid()
+		self._mmap = None
+		self._slot = None
+
+		#Segments and write segments published in the slot, and whether they were merged to fit
+		self._n_held = 0
+		self._n_write = 0
+		self._grouped = False
+
+		#Requests of posix instances of one process never wait for each other
+		self._flags = self.POSIX_FLAG if backend == POSIX_BACKEND else 0
+		self._seq = 0
+
+		#Never truncated - other processes have it mapped
+		self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR)
+
+		try:
+			length = self.HEADER + WFG_SLOTS * self._slot_size
+
+			_lockFileByte(self._fd, self.RESIZE_BYTE, True)
+			try:
+				if os.fstat(self._fd).st_size < length:
+					os.ftruncate(self._fd, length)
+			finally:
+				_unlockFileByte(self._fd, self.RESIZE_BYTE)
+
+			self._mmap = mmap.mmap(self._fd, length)
+
+			for slot in range(WFG_SLOTS):
+				if _tryLockFileByte(self._fd, slot):
+					#Free slot - a previous owner may have died waiting
+					self._setWaiting(slot, False)
+					self._slot = slot
+					break
+			else:
+				raise OSError(errno.EAGAIN, 'pylocksfile - all ' + str(WFG_SLOTS) + ' deadlock detection slots of ' + self._path + ' are in use.')
+
+		except BaseException:
+			self.close()
+			raise
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def slot(self):
+		return self._slot
+
+	def _offset(self, slot):
+		return self.HEADER + slot * self._slot_size
+
+	def _setWaiting(self, slot, waiting):
+		struct.pack_into('q', self._mmap, self._offset(slot) + 8, 1 if waiting else 0)
+
+	def _splice(self, array, n, i, j, values):
+		#Replace items [i, j) of the n items of a published array (offset of its first item) with values, moving the tail
+		tail = n - j
+		if tail and j != i + len(values):
+			self._mmap.move(array + 8 * (i + len(values)), array + 8 * j, 8 * tail)
+		if values:
+			struct.pack_into('%dq' % len(values), self._mmap, array + 8 * i, *values)
+
+	def _publish(self, held):
+		#Bring the published segments up to date with held (a tracked lockInterval). Caller holds the detector byte.
+		arrays = self._offset(self._slot) + self.RECORD_SIZE
+		span = held.changed()
+		starts, ends, modes = held.segments()
+
+		if len(starts) > WFG_RANGES or self._grouped:
+			#Beyond WFG_RANGES, consecutive segments are published merged (which may report a deadlock that is not)
+			self._grouped = len(starts) > WFG_RANGES
+			if self._grouped:
+				group = -(-len(starts) // WFG_RANGES)
+				modes = [any(modes[i:i + group]) for i in range(0, len(starts), group)]
+				ends = [ends[min(i + group, len(ends)) - 1] for i in range(0, len(starts), group)]
+				starts = starts[::group]
+
+			writes = [k for k in range(len(starts)) if modes[k]]
+			self._splice(arrays, 0, 0, 0, starts)
+			self._splice(arrays + 8 * WFG_RANGES, 0, 0, 0, ends)
+			self._splice(arrays + 16 * WFG_RANGES, 0, 0, 0, [starts[k] for k in writes])
+			self._splice(arrays + 24 * WFG_RANGES, 0, 0, 0, [ends[k] for k in writes])
+			self._n_held = len(starts)
+			self._n_write = len(writes)
+			return
+
+		if span is None:
+			return
+
+		#Held segments within the changed span replace the published ones
+		start, end = span
+		i = bisect_right(ends, start)
+		j = bisect_left(starts, end)
+		writes = [k for k in range(i, j) if modes[k]]
+
+		with memoryview(self._mmap)[arrays:arrays + 32 * WFG_RANGES].cast('q') as published:
+			held_i = bisect_right(published, start, WFG_RANGES, WFG_RANGES + self._n_held) - WFG_RANGES
+			held_j = bisect_left(published, end, 0, self._n_held)
+			write_i = bisect_right(published, start, 3 * WFG_RANGES, 3 * WFG_RANGES + self._n_write) - 3 * WFG_RANGES
+			write_j = bisect_left(published, end, 2 * WFG_RANGES, 2 * WFG_RANGES + self._n_write) - 2 * WFG_RANGES
+
+		self._splice(arrays, self._n_held, held_i, held_j, starts[i:j])
+		self._splice(arrays + 8 * WFG_RANGES, self._n_held, held_i, held_j, ends[i:j])
+		self._splice(arrays + 16 * WFG_RANGES, self._n_write, write_i, write_j, [starts[k] for k in writes])
+		self._splice(arrays + 24 * WFG_RANGES, self._n_write, write_i, write_j, [ends[k] for k in writes])
+		self._n_held += j - i - (held_j - held_i)
+		self._n_write += len(writes) - (write_j - write_i)
+
+	def wait(self, writeLock, lock_n, n_locks, held, victim):
+		#Publish a pending request and the held segments (a tracked lockInterval), then look for a deadlock through it.
+		#Returns the cycle when this request is the victim - it is then withdrawn. Another victim is marked, None returned.
+		self._seq += 1
+		offset = self._offset(self._slot)
+
+		flags = self._flags | (self.WRITE_FLAG if writeLock else 0)
+
+		_lockFileByte(self._fd, self.DETECT_BYTE, True)
+		try:
+			self._publish(held)
+
+			self.RECORD.pack_into(self._mmap, offset, self._pid, 1, self._seq, 0, lock_n, n_locks, flags, int(time.monotonic() * 1e9), self._n_held, self._n_write)
+
+			cycle = self._findCycle()
+			if cycle is None:
+				return None
+
+			if callable(victim):
+				picked = victim(cycle)
+				if picked not in cycle:
+					raise IllegalArgumentError('pylocksfile - deadlock_victim must return one of the wait_info of the cycle')
+			elif victim == VICTIM_YOUNGEST:
+				picked = max(cycle, key = lambda waiter: waiter.since)
+			elif victim == VICTIM_OLDEST:
+				picked = min(cycle, key = lambda waiter: waiter.since)
+			elif victim == VICTIM_FEWEST_LOCKS:
+				picked = min(cycle, key = lambda waiter: waiter.n_held)
+			else:
+				picked = cycle[0]
+
+			if picked.slot == self._slot:
+				#Withdraw before letting go of the detector byte, so no other search counts this wait
+				self._setWaiting(self._slot, False)
+				return cycle
+
+			#Mark the wait of the victim - a later wait of the same slot has another sequence number
+			struct.pack_into('q', self._mmap, self._offset(picked.slot) + 24, struct.unpack_from('q', self._mmap, self._offset(picked.slot) + 16)[0])
+			return None
+
+		finally:
+			_unlockFileByte(self._fd, self.DETECT_BYTE)
+
+	def _findCycle(self):
+		#Caller holds the detector byte. Waiters already picked as victims are on their way out and do not count.
+		records = dict()
+		for slot in range(WFG_SLOTS):
+			record = self.RECORD.unpack_from(self._mmap, self._offset(slot))
+			if record[1] and record[3] != record[2]:
+				records[slot] = record
+
+		alive = dict()
+
+		def isAlive(slot):
+			if slot not in alive:
+				alive[slot] = slot == self._slot or not _tryLockFileByte(self._fd, slot)
+				if not alive[slot]:
+					#The owner died waiting - clear the slot and let it go
+					self._setWaiting(slot, False)
+					_unlockFileByte(self._fd, slot)
+
+			return alive[slot]
+
+		def edges(u):
+			pid, _, _, _, lock_n, n_locks, flags, _, _, _ = records[u]
+			for v, record in records.items():
+				if v == u:
+					continue
+				if record[6] & flags & self.POSIX_FLAG and record[0] == pid:
+					continue
+				if self._conflicts(v, record[8] if flags & self.WRITE_FLAG else record[9], flags & self.WRITE_FLAG, lock_n, n_locks) and isAlive(v):
+					yield v
+
+		#Depth first search for a path back to this waiter. A waiter explored without finding one never will.
+		path = [self._slot]
+		visited = set(path)
+		stack = [edges(self._slot)]
+		while stack:
+			for v in stack[-1]:
+				if v == self._slot:
+					return [wait_info(slot, records[slot][0], bool(records[slot][6] & self.WRITE_FLAG), records[slot][4], records[slot][5], records[slot][7] / 1e9, records[slot][8]) for slot in path]
+
+				if v not in visited:
+					visited.add(v)
+					path.append(v)
+					stack.append(edges(v))
+					break
+			else:
+				stack.pop()
+				path.pop()
+
+		return None
+
+	def _conflicts(self, slot, n, writeLock, lock_n, n_locks):
+		#Whether the n published segments of slot that a request conflicts with (all of them for a write request, the write
+		#segments for a read request) intersect it - those ending after lock_n and starting before the end of the request.
+		if not n:
+			return False
+
+		#Starts and ends of the write segments follow those of all segments
+		base = 0 if writeLock else 2 * WFG_RANGES
+
+		with memoryview(self._mmap)[self._offset(slot) + self.RECORD_SIZE:self._offset(slot + 1)].cast('q') as arrays:
+			i = bisect_right(arrays, lock_n, base + WFG_RANGES, base + WFG_RANGES + n) - WFG_RANGES
+			j = bisect_left(arrays, lock_n + n_locks, base, base + n)
+
+			return i < j
+
+	def picked(self):
+		#Whether another waiter picked the current wait as the victim of a deadlock
+		return struct.unpack_from('q', self._mmap, self._offset(self._slot) + 24)[0] == self._seq
+
+	def done(self):
+		#The wait is over - acquired, timed out or given up
+		_lockFileByte(self._fd, self.DETECT_BYTE, True)
+		try:
+			self._setWaiting(self._slot, False)
+		finally:
+			_unlockFileByte(self._fd, self.DETECT_BYTE)
+
+	def close(self):
+		#Drops the slot lock
+		if self._mmap is not None:
+			if self._slot is not None:
+				self._setWaiting(self._slot, False)
+			self._mmap.close()
+			self._mmap = None
+
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+
+"""
+fairnessTable class implementation
+
+Queues of a fairness policy, shared by the instances of a lockfile in the sidecar file path + '.fair'. All its locks are OFD
+locks of the sidecar, owned by each instance, so the policy works the same with every backend. Stripe s of the table has
+a short critical section byte, a writer gate byte, FAIR_QUEUE queue node bytes, and a record of counters in the mmap -
+next ticket, phase, and the readers registered in even/odd phases.
+
+	- 'fifo' - CLH queue. A request takes the next ticket of its stripe and locks that ticket's node, then waits for the node
+		of the ticket before it. Once it holds its os lock, it lets go of its node and the next request asks the os in turn.
+		Readers following readers share the lock, a writer waits for them and the readers after it wait for the writer.
+	- 'writer' - turnstile. A writer holds the turnstile of its range while it waits for the os lock, and readers pass
+		through the turnstile (lock and unlock it) before asking the os - so new readers queue behind a waiting writer.
+	- 'phase_fair' - a writer holds the turnstile for its whole write phase, until the range is unlocked. Readers register
+		in the current phase before passing the turnstile. The next writer starts a new phase, then waits for the readers of
+		the previous one to hold their lock before taking the turnstile - readers wait for at most one writer phase, and
+		writers for at most one reader phase. The writer gate keeps writers of a stripe from starting phases at once.
+
+FIFO order holds between requests of the same stripe (the same first lock), the os arbitrates between the others.
+A 'fifo' ticket whose node is still held (FAIR_QUEUE requests of the stripe queued) is not taken until the node is let go.
+"""
+class fairnessTable(object):
+	RECORD = struct.Struct('4q')
+
+	#Locks resizing - after the queue nodes, below the turnstiles
+	RESIZE_BYTE = FAIR_TURNSTILE - 1
+
+	def __init__(self, locksfile_path, policy):
+		self._path = locksfile_path + '.fair'
+		self._policy = policy
+		self._mmap = None
+
+		#Whether this instance may hold turnstile locks ('phase_fair' writers keep them until the range is unlocked)
+		self._turnstile_held = False
+
+		#'fifo' queue nodes this instance holds - its own OFD locks never conflict with them
+		self._nodes = set()
+
+		#Never truncated - other processes have it mapped
+		self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR)
+
+		try:
+			length = FAIR_STRIPES * self.RECORD.size
+
+			_lockFileByte(self._fd, self.RESIZE_BYTE, True)
+			try:
+				if os.fstat(self._fd).st_size < length:
+					os.ftruncate(self._fd, length)
+			finally:
+				_unlockFileByte(self._fd, self.RESIZE_BYTE)
+
+			self._mmap = mmap.mmap(self._fd, length)
+
+		except BaseException:
+			self.close()
+			raise
+
+	@property
+	def policy(self):
+		return self._policy
+
+	def _lock(self, offset, length, writeLock, blocking, deadline, cancel = None):
+		#OFD lock of [offset, offset + length) of the sidecar. Polls with backoff until the deadline, if any, or until cancel
+		#(a threading.Event) is set. Returns False when not acquired.
+		request = flock_struct.pack(fcntl.F_WRLCK if writeLock else fcntl.F_RDLCK, os.SEEK_SET, offset, length, 0)
+
+		if blocking and deadline is None and cancel is None:
+			fcntl.fcntl(self._fd, F_OFD_SETLKW, request)
+			return True
+
+		delay = SPIN_MIN_DELAY
+		while True:
+			try:
+				fcntl.fcntl(self._fd, F_OFD_SETLK, request)
+				return True
+			except (IOError, OSError) as e:
+				if e.errno not in (errno.EACCES, errno.EAGAIN):
+					raise
+
+			if not blocking or not self._pause(delay, deadline, cancel):
+				return False
+
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+	def _pause(self, delay, deadline, cancel):
+		#Backoff of a polling wait - False once the deadline passed, or at once when cancel is set
+		if deadline is not None:
+			now = time.monotonic()
+			if now >= deadline:
+				return False
+			delay = min(delay, deadline - now)
+
+		if cancel is None:
+			time.sleep(delay)
+			return True
+
+		return not cancel.wait(delay)
+
+	def _unlock(self, offset, length):
+		fcntl.fcntl(self._fd, F_OFD_SETLK, flock_struct.pack(fcntl.F_UNLCK, os.SEEK_SET, offset, length, 0))
+
+	def _update(self, stripe, field, delta, phase_field = False):
+		#Add delta to a counter of the stripe in its critical section, and return its previous value.
+		#With phase_field, the counter is the readers count of the current phase, and the phase is returned.
+		offset = stripe * self.RECORD.size
+
+		_lockFileByte(self._fd, stripe, True)
+		try:
+			record = self.RECORD.unpack_from(self._mmap, offset)
+			if phase_field:
+				field = 2 + record[1] % 2
+			struct.pack_into('q', self._mmap, offset + 8 * field, record[field] + delta)
+		finally:
+			_unlockFileByte(self._fd, stripe)
+
+		return record[1] if phase_field else record[field]
+
+	def _node(self, stripe, ticket):
+		return 2 * FAIR_STRIPES + stripe * FAIR_QUEUE + ticket % FAIR_QUEUE
+
+	def enter(self, writeLock, lock_n, n_locks, blocking, deadline, cancel = None):
+		#Wait for the turn of a request. Returns a token for leave(), or None when the turn did not come (non-blocking,
+		#deadline, or cancel set - the request then left the queue).
+		if lock_n + n_locks > FAIR_TURNSTILE:
+			raise IllegalArgumentError('pylocksfile - locks must be below ' + str(FAIR_TURNSTILE) + ' with a fairness policy, got ' + str(interval_tuple(lock_n, n_locks)))
+
+		stripe = lock_n % FAIR_STRIPES
+
+		if self._policy == FAIR_FIFO:
+			#Take a ticket and lock its node in one critical section, so the node of the ticket before is always locked first.
+			#The node of the ticket FAIR_QUEUE before is the same - while that request still holds it, the queue is full.
+			delay = SPIN_MIN_DELAY
+			while True:
+				_lockFileByte(self._fd, stripe, True)
+				try:
+					ticket = self.RECORD.unpack_from(self._mmap, stripe * self.RECORD.size)[0]
+					node = self._node(stripe, ticket)
+					full = node in self._nodes or not self._lock(node, 1, True, False, None)
+					if not full:
+						struct.pack_into('q', self._mmap, stripe * self.RECORD.size, ticket + 1)
+						self._nodes.add(node)
+				finally:
+					_unlockFileByte(self._fd, stripe)
+
+				if not full:
+					break
+
+				if not blocking or not self._pause(delay, deadline, cancel):
+					return None
+
+				delay = min(delay * 2, SPIN_MAX_DELAY)
+
+			#The node of the previous ticket is let go once that request holds its lock
+			if not self._lock(self._node(stripe, ticket - 1), 1, False, blocking, deadline, cancel):
+				self._leaveQueue(stripe, ticket)
+				return None
+
+			self._unlock(self._node(stripe, ticket - 1), 1)
+			return (stripe, ticket)
+
+		turnstile = FAIR_TURNSTILE + lock_n
+
+		if not writeLock:
+			phase = None
+			if self._policy == FAIR_PHASE:
+				#Register in the current phase
+				phase = self._update(stripe, None, 1, phase_field = True)
+
+			#Pass through the turnstile - blocked while a writer waits ('writer') or is in its write phase ('phase_fair')
+			if not self._lock(turnstile, n_locks, False, blocking, deadline, cancel):
+				if phase is not None:
+					self._update(stripe, 2 + phase % 2, -1)
+				return None
+
+			self._unlock(turnstile, n_locks)
+			return (stripe, phase)
+
+		if self._policy == FAIR_WRITER:
+			if not self._lock(turnstile, n_locks, True, blocking, deadline, cancel):
+				return None
+			return (stripe, None)
+
+		#'phase_fair' writer - one writer of the stripe at a time starts a phase
+		if not self._lock(FAIR_STRIPES + stripe, 1, True, blocking, deadline, cancel):
+			return None
+
+		try:
+			phase = self._update(stripe, 1, 1)
+
+			#Readers of the previous phase first - until they hold their lock
+			delay = SPIN_MIN_DELAY
+			while self.RECORD.unpack_from(self._mmap, stripe * self.RECORD.size)[2 + phase % 2] > 0:
+				if not blocking or not self._pause(delay, deadline, cancel):
+					return None
+
+				delay = min(delay * 2, SPIN_MAX_DELAY)
+
+			if not self._lock(turnstile, n_locks, True, blocking, deadline, cancel):
+				return None
+
+			self._turnstile_held = True
+
+		finally:
+			self._unlock(FAIR_STRIPES + stripe, 1)
+
+		return (stripe, None)
+
+	def leave(self, token, writeLock, lock_n, n_locks, acquired):
+		#After asking the os for the lock. acquired tells whether it was granted.
+		stripe, state = token
+
+		if self._policy == FAIR_FIFO:
+			self._leaveQueue(stripe, state)
+		elif not writeLock:
+			if state is not None:
+				self._update(stripe, 2 + state % 2, -1)
+		elif self._policy == FAIR_WRITER or not acquired:
+			#'phase_fair' writers keep the turnstile for their write phase, until unlocked()
+			self._unlock(FAIR_TURNSTILE + lock_n, n_locks)
+
+	def _leaveQueue(self, stripe, ticket):
+		node = self._node(stripe, ticket)
+		self._nodes.discard(node)
+		self._unlock(node, 1)
+
+	def unlocked(self, lock_n, n_locks):
+		#Locks [lock_n, lock_n + n_locks) were unlocked (n_locks 0 - up to EOF) - ends the write phases on them
+		if self._turnstile_held:
+			self._unlock(FAIR_TURNSTILE + lock_n, n_locks)
+			if not lock_n and not n_locks:
+				self._turnstile_held = False
+
+	def close(self):
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+
+"""
+versionTable class implementation
+
+Version counters (seqlock) of the locks [0, size) of a lockfile, in the sidecar file path + '.seq', mapped by every instance
+created with versions. A writer makes the counters of its range odd once its os write lock is granted, and even again before
+it unlocks (or once it converted to read) - a reader that saw the same even counters before and after reading the data read it
+while no writer held the lock, without a system call. Only the holder of the write lock changes a counter, so they are
+plain loads and stores, ordered on machines that do not reorder loads with loads and stores with stores (ORDERED_MACHINES) -
+elsewhere optimistic reads always take the read lock. Each instance only makes even the counters it made odd.
+
+A writer that died leaves its counters odd - readers fall back to the read lock until the next writer of the lock makes them even.
+"""
+class versionTable(object):
+	#The counters are after this header, byte 0 locks resizing
+	HEADER = 64
+	RESIZE_BYTE = 0
+
+	def __init__(self, locksfile_path, size):
+		self._path = locksfile_path + '.seq'
+		self._size = size
+		self._mmap = None
+		self._counters = None
+
+		#Locks whose counter this instance made odd
+		self._marked = bytearray(size)
+		self._n_marked = 0
+
+		#Never truncated - other processes have it mapped
+		self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR)
+
+		try:
+			length = self.HEADER + 8 * size
+
+			#Grow the file under a lock, so a smaller table never shrinks a larger one
+			_lockFileByte(self._fd, self.RESIZE_BYTE, True)
+			try:
+				if os.fstat(self._fd).st_size < length:
+					os.ftruncate(self._fd, length)
+			finally:
+				_unlockFileByte(self._fd, self.RESIZE_BYTE)
+
+			self._mmap = mmap.mmap(self._fd, length)
+			self._counters = memoryview(self._mmap)[self.HEADER:].cast('Q')
+
+			self._ordered = os.uname().machine.lower() in ORDERED_MACHINES
+
+		except BaseException:
+			self.close()
+			raise
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def size(self):
+		return self._size
+
+	@property
+	def counters(self):
+		#memoryview of the counters, None when loads and stores may be reordered
+		return self._counters if self._ordered else None
+
+	def version(self, lock_n):
+		return self._counters[lock_n]
+
+	def begin(self, lock_n, n_locks):
+		#Write lock of [lock_n, lock_n + n_locks) granted (n_locks 0 - up to EOF). One store per versioned lock.
+		counters = self._counters
+		marked = self._marked
+
+		for i in range(lock_n, self._size if not n_locks else min(lock_n + n_locks, self._size)):
+			if not marked[i]:
+				marked[i] = 1
+				self._n_marked += 1
+				if not counters[i] & 1:
+					counters[i] += 1
+
+	def end(self, lock_n, n_locks):
+		#Before unlocking [lock_n, lock_n + n_locks), or once converted to read
+		if not self._n_marked or lock_n >= self._size:
+			return
+
+		counters = self._counters
+		marked = self._marked
+		end = self._size if not n_locks else min(lock_n + n_locks, self._size)
+
+		i = marked.find(1, lock_n, end)
+		while i != -1:
+			marked[i] = 0
+			self._n_marked -= 1
+			if counters[i] & 1:
+				counters[i] += 1
+
+			i = marked.find(1, i + 1, end)
+
+	def close(self):
+		if self._counters is not None:
+			self._counters.release()
+			self._counters = None
+
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+
+"""
+lockTracer class implementation
+
+Timeline of the lock requests of a process, for a lockfile - when each range was requested, acquired (or not) and released,
+by which process and thread. Events go to a ring buffer of size fixed records, in the file
+trace_dir/<lockfile name>.<pid>.trace, mapped - a record is a single struct store, and the file outlives the process, so
+the traces of every process (also of one that crashed or hangs) can be read together (see readTrace, chromeTrace).
+The last size events are kept.
+
+Only requests that reach the os are traced (a nested acquire of held locks makes no request), from acquire, acquire_many,
+with blocks, keys and acquire_async. With sample below 1, only the locks whose index hashes below sample are traced -
+the same locks in every process, so their timelines stay whole. Releases of a range of several locks are always traced.
+"""
+class lockTracer(object):
+	MAGIC = b'PLTRACE1'
+	#magic, size, pid, time.time_ns() - time.monotonic_ns() when created (to tell the wall clock time of events)
+	HEADER = struct.Struct('8sqqq')
+	HEADER_SIZE = 64
+	#time_ns, pid, tid, lock_n, n_locks, writeLock, event
+	RECORD = struct.Struct('<qiqqqBB2x')
+
+	def __init__(self, trace_dir, locksfile_path, size = TRACE_EVENTS, sample = 1.0, serial = 0):
+		self._pid = os.getpid()
+		self._size = size
+		self._sample = sample
+		#Hashes of the traced locks are below the threshold, None when every lock is traced
+		self._threshold = None if sample >= 1.0 else int(sample * (1 << 64))
+
+		name = os.path.basename(locksfile_path) + '.' + str(self._pid) + ('-' + str(serial) if serial else '') + '.trace'
+		self._path = os.path.join(os.path.abspath(trace_dir), name)
+
+		#A file left by an earlier process of the same pid is started over
+		fd = os.open(self._path, os.O_CREAT | os.O_RDWR | os.O_TRUNC)
+		try:
+			length = self.HEADER_SIZE + self.RECORD.size * size
+			os.ftruncate(fd, length)
+			self._mmap = mmap.mmap(fd, length)
+		finally:
+			os.close(fd)
+
+		self.HEADER.pack_into(self._mmap, 0, self.MAGIC, size, self._pid, int((time.time() - time.monotonic()) * 1e9))
+
+		#Events recorded - next() of a count is atomic, so threads never share a record
+		self._count = count()
+		self._pack_into = self.RECORD.pack_into
+		self._record_size = self.RECORD.size
+
+	@property
+	def path(self):
+		return self._path
+
+	@property
+	def size(self):
+		return self._size
+
+	@property
+	def sample(self):
+		return self._sample
+
+	def sampled(self, lock_n):
+		#Whether lock_n is traced (fibonacci hashing of the index)
+		return self._threshold is None or (lock_n * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF < self._threshold
+
+	def record(self, event, writeLock, lock_n, n_locks):
+		self._pack_into(self._mmap, self.HEADER_SIZE + (next(self._count) % self._size) * self._record_size, monotonic_ns(), self._pid, _threadId(), lock_n, n_locks, writeLock, event)
+
+	def close(self):
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+
+"""
+lockHierarchy class implementation
+
+Multi-granularity (intention) locking of a pylocksfile created with a hierarchy. sizes are the node sizes of the levels,
+coarsest first - e.g. (1 << 20, 1 << 10) splits the locks into tables of 2^20 locks, the tables into blocks of 2^10 locks,
+and the blocks into the locks themselves (rows). A held range takes the nodes it covers whole in S (read) or X (write) mode,
+and IS/IX on the nodes it covers partly. Only the rows of partly covered blocks are locked one by one. A whole table is a
+single node lock, and a table request meets row requests at the table node alone instead of every row lock.
+
+The modes follow from the held rows - they are recomputed for the nodes touched by each lock and unlock, so a table covered
+whole by row requests moves up to a table lock, and releasing part of a held table locks what is left of it at the finer
+levels. Stronger modes are taken top down and weaker ones let go bottom up. A request that fails undoes what it took.
+
+Node i of level l is the HIERARCHY_NODE_BYTES bytes of the sidecar file path + '.hier' from its level's base, locked by the
+owner of the lockfile locks (the process with 'posix', the instance with 'ofd'). The kernel keeps the locks of a file in one
+list, walked by every request on it - in their own file, node requests never walk the held row locks, nor rows the nodes.
+	- byte 0 - read locked by IS holders.
+	- byte 1 - read locked by IX and SIX holders.
+	- byte 2 - gate, write locked while a request checks for conflicting holders.
+	- byte 3 - read locked by S and SIX holders.
+X write locks the 4 bytes. IX write locks bytes 2-3 (gate and S byte) before read locking byte 1, S write locks bytes 1-2
+before read locking byte 3, and SIX write locks bytes 1-3. Holding the gate makes the check and the lock a single step,
+so an IX and an S request can not both pass their checks, while IX holders (and S holders) share.
+"""
+class lockHierarchy(object):
+	#Strength of the modes. IX and S are not ordered - SIX is stronger than both.
+	RANK = { None : 0, NODE_IS : 1, NODE_IX : 2, NODE_S : 2, NODE_SIX : 3, NODE_X : 4 }
+
+	#Bytes held in each mode as { byte : writeLock }, and the bytes write locked to check for conflicting holders
+	HOLDS = { None : {}, NODE_IS : { 0 : False }, NODE_IX : { 1 : False }, NODE_S : { 3 : False }, NODE_SIX : { 1 : False, 3 : False }, NODE_X : { 0 : True, 1 : True, 2 : True, 3 : True } }
+	CHECKS = { NODE_IX : (2, 3), NODE_S : (1, 2), NODE_SIX : (1, 2, 3) }
+
+	#Locks the children of a node need, by the node's mode - none, only the written parts, or all the held parts
+	NEED_NONE = 0
+	NEED_WRITE = 1
+	NEED_ALL = 2
+	CHILD_NEED = { None : NEED_NONE, NODE_IS : NEED_ALL, NODE_IX : NEED_ALL, NODE_S : NEED_NONE, NODE_SIX : NEED_WRITE, NODE_X : NEED_NONE }
+
+	#Requests of each mode change, filled by _transition
+	_transitions = dict()
+
+	def __init__(self, ofd, sizes, escalation = None):
+		#Set by attach, once the lockfile and the nodes sidecar are open
+		self._fd = None
+		self._nodes_fd = None
+		self._ofd = ofd
+		self._sizes = [int(size) for size in sizes]
+		self._escalation = escalation
+
+		#First byte of each level's nodes
+		self._bases = list()
+		base = 0
+		for size in self._sizes:
+			self._bases.append(base)
+			base += HIERARCHY_NODE_BYTES * -(-HIERARCHY_OFFSET // size)
+
+		#Rows locked through this hierarchy (each held once, the os has no counts), and the rows locked one by one
+		self._held = lockInterval()
+		self._leaves = lockInterval()
+
+		#Per level above the finest - node index: (rows held, rows write held), for the nodes holding any. Mode of each node holding one.
+		self._counts = [dict() for size in self._sizes[:-1]]
+		self._modes = dict()
+
+		#Nodes of the finest level locked whole by escalation
+		self._escalated = set()
+
+	def attach(self, fd, nodes_fd):
+		#Lock the rows through fd and the nodes through nodes_fd, holding nothing - on first use of the lockfile, and again in a forked child
+		self._fd = fd
+		self._nodes_fd = nodes_fd
+		self._reset()
+
+	def _reset(self):
+		self._held.reset()
+		self._leaves.reset()
+		self._counts = [dict() for size in self._sizes[:-1]]
+		self._modes = dict()
+		self._escalated = set()
+
+	@property
+	def sizes(self):
+		return tuple(self._sizes)
+
+	@property
+	def escalation(self):
+		return self._escalation
+
+	def nodes(self):
+		#Held node modes, as { (level, index) : mode }
+		return dict(self._modes)
+
+	@property
+	def leafIntervals(self):
+		#Rows locked one by one, as interval_mode_tuple
+		return self._leaves.modeIntervals
+
+	def lock(self, writeLock, lock_n, n_locks, blocking):
+		#Lock [lock_n, lock_n + n_locks) in writeLock mode - over any mode it was held in, like the os. Raises IOError/OSError when not acquired.
+		if lock_n + n_locks > HIERARCHY_OFFSET:
+			raise IllegalArgumentError('pylocksfile - locks must be below ' + str(HIERARCHY_OFFSET) + ' with a hierarchy, got ' + str(interval_tuple(lock_n, n_locks)))
+
+		self._apply(lock_n, lock_n + n_locks, writeLock, blocking)
+
+	def unlock(self, lock_n, n_locks):
+		if not n_locks:
+			#Up to EOF - every node, and the rows when any is locked one by one (the unlock walks the lockfile's list)
+			if len(self._leaves):
+				_lockFileRange(self._fd, self._ofd, None, lock_n, 0, False)
+			_lockFileRange(self._nodes_fd, self._ofd, None, 0, 0, False)
+
+			self._reset()
+			return
+
+		self._apply(lock_n, lock_n + n_locks, None, False)
+
+	def _lub(self, mode_a, mode_b):
+		#Weakest mode at least as strong as both
+		if self.RANK[mode_a] == self.RANK[mode_b] and mode_a != mode_b:
+			return NODE_SIX
+
+		return mode_a if self.RANK[mode_a] >= self.RANK[mode_b] else mode_b
+
+	def _desired(self, level, covered, written, need, escalated = False):
+		#Mode of a node of level holding covered rows (written of them write held), when its parent leaves it need.
+		#An escalated node is locked whole.
+		size = self._sizes[level]
+
+		if need == self.NEED_NONE:
+			return None
+
+		if escalated and covered:
+			if written:
+				return NODE_X
+			return NODE_S if need == self.NEED_ALL else None
+
+		if need == self.NEED_WRITE:
+			if not written:
+				return None
+			return NODE_X if written == size else NODE_IX
+
+		if not covered:
+			return None
+
+		if covered == size:
+			if written == size:
+				return NODE_X
+			return NODE_SIX if written else NODE_S
+
+		return NODE_IX if written else NODE_IS
+
+	def _heldCounts(self, start, end):
+		covered = written = 0
+		for piece_start, piece_end, writeLock in self._held.pieces(start, end):
+			covered += piece_end - piece_start
+			if writeLock:
+				written += piece_end - piece_start
+
+		return covered, written
+
+	def _newCounts(self, start, end, mode):
+		#Counts of the nodes above the finest level overlapping [start, end), once it is held in mode (None - not held)
+		counts = list()
+		range_counts = None
+
+		for level, size in enumerate(self._sizes[:-1]):
+			changed = dict()
+			for i in range(start // size, (end - 1) // size + 1):
+				node_start = max(start, i * size)
+				node_end = min(end, (i + 1) * size)
+
+				covered, written = self._counts[level].get(i, (0, 0))
+				if node_start == i * size and node_end == (i + 1) * size:
+					old_covered, old_written = covered, written
+				elif node_start == start and node_end == end:
+					#The whole range within the node - the same for every level
+					if range_counts is None:
+						range_counts = self._heldCounts(start, end)
+					old_covered, old_written = range_counts
+				else:
+					old_covered, old_written = self._heldCounts(node_start, node_end)
+
+				if mode is not None:
+					covered += node_end - node_start
+					if mode:
+						written += node_end - node_start
+
+				changed[i] = (covered - old_covered, written - old_written)
+
+			counts.append(changed)
+
+		return counts
+
+	def _view(self, start, end, changed_start, changed_end, mode):
+		#Held rows within [start, end) as sorted [start, end, writeLock] pieces, once [changed_start, changed_end) is held in mode
+		pieces = list()
+		for piece in self._held.pieces(start, end):
+			if piece[0] < changed_start:
+				pieces.append([piece[0], min(piece[1], changed_start), piece[2]])
+			if piece[1] > changed_end:
+				pieces.append([max(piece[0], changed_end), piece[1], piece[2]])
+
+		if mode is not None and max(start, changed_start) < min(end, changed_end):
+			pieces.append([max(start, changed_start), min(end, changed_end), mode])
+
+		pieces.sort()
+
+		return pieces
+
+	def _children(self, level, start, end, changed_start, changed_end):
+		#Nodes of level within [start, end) that hold rows before or after the change
+		size = self._sizes[level]
+		children = set()
+
+		bounds = self._held.pieces(start, end)
+		bounds.append((max(start, changed_start), min(end, changed_end), None))
+
+		for bound_start, bound_end, writeLock in bounds:
+			if bound_start < bound_end:
+				children.update(range(bound_start // size, (bound_end - 1) // size + 1))
+
+		return sorted(children)
+
+	def _planNode(self, level, i, need, start, end, mode, counts, nodes, leaves):
+		#New mode of node i of level and of the nodes and rows below it that change, in top down order
+		old = self._modes.get((level, i))
+		size = self._sizes[level]
+
+		if level < len(counts):
+			covered, written = counts[level].get(i) or self._counts[level].get(i, (0, 0))
+		else:
+			#Nodes of the finest level are counted from the held rows, within the node and the changed range
+			covered, written = self._heldCounts(i * size, (i + 1) * size)
+			changed_start, changed_end = max(start, i * size), min(end, (i + 1) * size)
+			if changed_start < changed_end:
+				old_covered, old_written = self._heldCounts(changed_start, changed_end)
+				covered -= old_covered
+				written -= old_written
+				if mode is not None:
+					covered += changed_end - changed_start
+					if mode:
+						written += changed_end - changed_start
+
+		new = self._desired(level, covered, written, need, level == len(counts) and i in self._escalated)
+		if new != old:
+			nodes.append((level, i, old, new))
+
+		old_need = self.CHILD_NEED[old]
+		new_need = self.CHILD_NEED[new]
+		if old_need == self.NEED_NONE and new_need == self.NEED_NONE:
+			return
+
+		if old_need == new_need:
+			#Only the changed part of the node can change below it
+			node_start, node_end = max(start, i * size), min(end, (i + 1) * size)
+		else:
+			node_start, node_end = i * size, (i + 1) * size
+
+		if node_start >= node_end:
+			return
+
+		if level + 1 < len(self._sizes):
+			for child in self._children(level + 1, node_start, node_end, start, end):
+				self._planNode(level + 1, child, new_need, start, end, mode, counts, nodes, leaves)
+		else:
+			self._planLeaves(node_start, node_end, new_need, start, end, mode, leaves)
+
+	def _planBlock(self, start, end, mode):
+		#Plan of a range within a single node of the finest level (the common row request) - one path down the levels, where
+		#the range is all each node sees of the change. None when a change of the locks a node leaves its children reaches
+		#beyond the range (_planNode then).
+		finest = self._sizes[-1]
+		if start // finest != (end - 1) // finest:
+			return None
+
+		old_covered, old_written = self._heldCounts(start, end)
+		new_covered = 0 if mode is None else end - start
+		new_written = new_covered if mode else 0
+
+		counts = list()
+		nodes = list()
+		need = old_need = self.NEED_ALL
+
+		for level, size in enumerate(self._sizes):
+			i = start // size
+			if level < len(self._counts):
+				covered, written = self._counts[level].get(i, (0, 0))
+				counts.append({ i : (covered - old_covered + new_covered, written - old_written + new_written) })
+				covered, written = counts[-1][i]
+			else:
+				covered, written = self._heldCounts(i * size, (i + 1) * size)
+				covered += new_covered - old_covered
+				written += new_written - old_written
+
+			if need == self.NEED_NONE and old_need == self.NEED_NONE:
+				continue
+
+			old = self._modes.get((level, i))
+			new = self._desired(level, covered, written, need, level == len(self._counts) and i in self._escalated)
+			if new != old:
+				nodes.append((level, i, old, new))
+
+			#A node holding rows outside the range before and after would change them too
+			old_need, need = self.CHILD_NEED[old], self.CHILD_NEED[new]
+			if need != old_need and covered and covered - new_covered + old_covered:
+				return None
+
+		#Rows of the range - only the range changes below the finest node
+		leaves = list()
+		if need != self.NEED_NONE or old_need != self.NEED_NONE:
+			new = mode if need == self.NEED_ALL or (need == self.NEED_WRITE and mode) else None
+			position = start
+			for piece_start, piece_end, old in self._leaves.pieces(start, end) + [[end, end, new]]:
+				if position < piece_start and new is not None:
+					leaves.append([position, piece_start, None, new])
+				if old != new:
+					leaves.append([piece_start, piece_end, old, new])
+				position = piece_end
+
+		return counts, nodes, leaves
+
+	def _planLeaves(self, start, end, need, changed_start, changed_end, mode, leaves):
+		#Rows of [start, end) to lock one by one under a node leaving them need, compared with the rows locked now
+		if need == self.NEED_NONE:
+			new_pieces = list()
+		else:
+			new_pieces = [piece for piece in self._view(start, end, changed_start, changed_end, mode) if need == self.NEED_ALL or piece[2]]
+
+		old_pieces = self._leaves.pieces(start, end)
+
+		bounds = sorted(set([start, end] + [bound for piece in old_pieces + new_pieces for bound in piece[:2]]))
+		old_starts = [piece[0] for piece in old_pieces]
+		new_starts = [piece[0] for piece in new_pieces]
+
+		for piece_start, piece_end in zip(bounds, bounds[1:]):
+			k = bisect_right(old_starts, piece_start) - 1
+			old = old_pieces[k][2] if k >= 0 and piece_start < old_pieces[k][1] else None
+			k = bisect_right(new_starts, piece_start) - 1
+			new = new_pieces[k][2] if k >= 0 and piece_start < new_pieces[k][1] else None
+
+			if old == new:
+				continue
+
+			if leaves and leaves[-1][1] == piece_start and leaves[-1][2] == old and leaves[-1][3] == new:
+				leaves[-1][1] = piece_end
+			else:
+				leaves.append([piece_start, piece_end, old, new])
+
+	@classmethod
+	def _byteRuns(cls, changes):
+		#(byte, writeLock) changes of a node as (first byte, n bytes, writeLock) runs of consecutive bytes
+		runs = list()
+		for byte, writeLock in changes:
+			if runs and runs[-1][0] + runs[-1][1] == byte and runs[-1][2] == writeLock:
+				runs[-1][1] += 1
+			else:
+				runs.append([byte, 1, writeLock])
+
+		return [tuple(run) for run in runs]
+
+	@classmethod
+	def _transition(cls, old, new):
+		#Requests moving a node from mode old to new - (checks and locks, which may wait, then unlocks), as byte runs
+		transition = cls._transitions.get((old, new))
+
+		if transition is None:
+			held = dict(cls.HOLDS[old])
+			target = cls.HOLDS[new]
+
+			#A stronger mode checks for conflicting holders and takes the gate in one request - the gate is let go last
+			checks = list()
+			if new in cls.CHECKS and cls.RANK[new] > cls.RANK[old]:
+				checks = cls._byteRuns((byte, True) for byte in cls.CHECKS[new])
+				held.update((byte, True) for byte in cls.CHECKS[new])
+
+			locks = checks + cls._byteRuns((byte, target[byte]) for byte in sorted(target) if held.get(byte) != target[byte])
+			unlocks = cls._byteRuns((byte, None) for byte in sorted(held) if byte not in target)
+
+			transition = cls._transitions[(old, new)] = (locks, unlocks)
+
+		return transition
+
+	def _setNode(self, level, i, old, new, blocking):
+		#Move node i of level from mode old to new. Only a stronger mode can wait. On failure the node is left in mode old.
+		offset = self._bases[level] + HIERARCHY_NODE_BYTES * i
+		locks, unlocks = self._transitions.get((old, new)) or self._transition(old, new)
+
+		try:
+			for byte, n_bytes, writeLock in locks:
+				_lockFileRange(self._nodes_fd, self._ofd, writeLock, offset + byte, n_bytes, blocking)
+			for byte, n_bytes, writeLock in unlocks:
+				_lockFileRange(self._nodes_fd, self._ofd, None, offset + byte, n_bytes, False)
+
+		except BaseException:
+			#Back to the bytes of mode old - unlocks and write to read conversions of bytes held here, which never wait
+			for byte, n_bytes, writeLock in self._byteRuns((byte, self.HOLDS[old].get(byte)) for byte in range(HIERARCHY_NODE_BYTES)):
+				_lockFileRange(self._nodes_fd, self._ofd, writeLock, offset + byte, n_bytes, False)
+			raise
+
+	def _setLeaves(self, runs, blocking):
+		#Lock runs of [start, end, writeLock] rows
+		for run_start, run_end, writeLock in runs:
+			_lockFileRange(self._fd, self._ofd, writeLock, run_start, run_end - run_start, blocking and writeLock is not None)
+
+	def _leafLub(self, old, new):
+		#Stronger of two row modes (None < read < write)
+		if old is None or new is None:
+			return new if old is None else old
+
+		return old or new
+
+	def _leafRuns(self, leaves, first):
+		#Rows to lock in the first step (to the stronger of their old and new modes) or the second (to the new mode),
+		#adjacent rows of the same mode merged into one request
+		runs = list()
+		for leaf_start, leaf_end, old, new in leaves:
+			stronger = self._leafLub(old, new)
+			current, target = (old, stronger) if first else (stronger, new)
+			if target == current:
+				continue
+
+			if runs and runs[-1][1] == leaf_start and runs[-1][2] == target:
+				runs[-1][1] = leaf_end
+			else:
+				runs.append([leaf_start, leaf_end, target])
+
+		return runs
+
+	def _apply(self, start, end, mode, blocking):
+		#Hold [start, end) in mode (None - not held): plan the node and row changes, take the stronger modes top down,
+		#then let go of the weaker ones bottom up
+
+		#A write within a node escalated to S takes its rows back one by one - upgrading the node to X would wait for
+		#every other reader of the node, and two upgrading readers would deadlock
+		deescalated = list()
+		if mode and self._escalated:
+			for i in self._escalatedWithin(start, end):
+				if self._modes.get((len(self._counts), i)) != NODE_X:
+					self._escalated.discard(i)
+					deescalated.append(i)
+
+		plan = self._planBlock(start, end, mode)
+
+		if plan is None:
+			counts = self._newCounts(start, end, mode)
+			nodes = list()
+			leaves = list()
+
+			size = self._sizes[0]
+			for i in range(start // size, (end - 1) // size + 1):
+				self._planNode(0, i, self.NEED_ALL, start, end, mode, counts, nodes, leaves)
+		else:
+			counts, nodes, leaves = plan
+
+		taken = list()
+		try:
+			for level, i, old, new in nodes:
+				stronger = self._lub(old, new)
+				if stronger != old:
+					self._setNode(level, i, old, stronger, blocking)
+					taken.append((level, i, stronger, old))
+
+			for leaf_run in self._leafRuns(leaves, True):
+				self._setLeaves([leaf_run], blocking)
+				taken.append((None, leaf_run[0], leaf_run[1], None))
+
+		except BaseException:
+			#Undo, bottom up - back to the old modes, which never waits
+			for level, first, second, old in reversed(taken):
+				if level is not None:
+					self._setNode(level, first, second, old, False)
+				else:
+					self._setLeaves([[leaf_start, leaf_end, leaf_old] for leaf_start, leaf_end, leaf_old, leaf_new in leaves if leaf_start >= first and leaf_end <= second and self._leafLub(leaf_old, leaf_new) != leaf_old], False)
+
+			self._escalated.update(deescalated)
+			raise
+
+		#Weaker modes can not fail, but a signal may interrupt them - finish, then let it through
+		failure = None
+		for leaf_run in self._leafRuns(leaves, False):
+			try:
+				self._setLeaves([leaf_run], False)
+			except BaseException as e:
+				failure = failure or e
+
+		for level, i, old, new in reversed(nodes):
+			stronger = self._lub(old, new)
+			if stronger != new:
+				try:
+					self._setNode(level, i, stronger, new, False)
+				except BaseException as e:
+					failure = failure or e
+
+		#Record the new state
+		self._held.removeInterval(interval_tuple(start, end - start))
+		if mode is not None:
+			self._held.insertInterval(interval_tuple(start, end - start), mode)
+
+		for level, changed in enumerate(counts):
+			for i, node_counts in changed.items():
+				if node_counts[0]:
+					self._counts[level][i] = node_counts
+				else:
+					self._counts[level].pop(i, None)
+
+		for level, i, old, new in nodes:
+			if new is None:
+				self._modes.pop((level, i), None)
+			else:
+				self._modes[(level, i)] = new
+
+		for leaf_start, leaf_end, old, new in leaves:
+			self._leaves.removeInterval(interval_tuple(leaf_start, leaf_end - leaf_start))
+			if new is not None:
+				self._leaves.insertInterval(interval_tuple(leaf_start, leaf_end - leaf_start), new)
+
+		finest = self._sizes[-1]
+		if mode is None:
+			#Escalation ends when the node holds nothing
+			for i in self._escalatedWithin(start, end):
+				if not self._held.countSegments(i * finest, (i + 1) * finest):
+					self._escalated.discard(i)
+
+		elif self._escalation and failure is None:
+			#Only the nodes at the ends of the range can hold rows one by one
+			for i in sorted(set((start // finest, (end - 1) // finest))):
+				if i not in self._escalated and self._leaves.countSegments(i * finest, (i + 1) * finest) > self._escalation:
+					self._escalate(i)
+
+		if failure is not None:
+			raise failure
+
+	def _escalatedWithin(self, start, end):
+		#Escalated nodes of the finest level overlapping [start, end)
+		finest = self._sizes[-1]
+		first, last = start // finest, (end - 1) // finest
+
+		if last - first < len(self._escalated):
+			return [i for i in range(first, last + 1) if i in self._escalated]
+
+		return [i for i in self._escalated if first <= i <= last]
+
+	def _escalate(self, i):
+		#Lock node i of the finest level whole instead of its rows - X when it holds write locks, S otherwise. Only when
+		#that needs no waiting, it is an optimization.
+		level = len(self._counts)
+		old = self._modes.get((level, i))
+		if old not in (NODE_IS, NODE_IX):
+			return
+
+		new = NODE_X if old == NODE_IX else NODE_S
+		try:
+			self._setNode(level, i, old, new, False)
+		except (IOError, OSError) as e:
+			if e.errno not in (errno.EACCES, errno.EAGAIN):
+				raise
+			return
+
+		size = self._sizes[-1]
+		_lockFileRange(self._fd, self._ofd, None, i * size, size, False)
+		self._leaves.removeInterval(interval_tuple(i * size, size))
+
+		self._modes[(level, i)] = new
+		self._escalated.add(i)
+
+
+"""
+Walk [lock_n, lock_n + n_locks) (n_locks 0 - up to EOF) of an open lockfile with F_GETLK (F_OFD_GETLK when ofd), and return the
+locks found as a sorted list of lock_holder_tuple. Takes no lock, so it can run next to a live workload.
+
+Each request reports one lock within the gap asked about, and the walk goes on in what that lock leaves uncovered -
+one system call per lock found, plus one per free gap. The os leaves out the caller's own locks (its process' POSIX locks,
+or its open file's OFD locks), and reports a range read locked by several holders once - procLocks lists them all.
+"""
+def scanLocks(fd, lock_n = 0, n_locks = 0, ofd = False):
+	if not isinstance(lock_n, Integral) or not isinstance(n_locks, Integral) or lock_n < 0 or n_locks < 0:
+		raise IllegalArgumentError('scanLocks - lock_n and n_locks must be non-negative integers')
+
+	command = F_OFD_GETLK if ofd else fcntl.F_GETLK
+	found = set()
+
+	#Gaps left to ask about, end None - up to EOF
+	gaps = [(int(lock_n), int(lock_n + n_locks) if n_locks else None)]
+	while gaps:
+		start, end = gaps.pop()
+
+		#A write lock conflicts with any lock. l_pid must be 0 for F_OFD_GETLK.
+		l_type, _, l_start, l_len, l_pid = flock_struct.unpack(fcntl.fcntl(fd, command, flock_struct.pack(fcntl.F_WRLCK, os.SEEK_SET, start, end - start if end is not None else 0, 0)))
+		if l_type == fcntl.F_UNLCK:
+			continue
+
+		found.add(lock_holder_tuple(l_pid, l_type == fcntl.F_WRLCK, l_start, l_len))
+
+		if l_start > start:
+			gaps.append((start, l_start))
+		if l_len and (end is None or l_start + l_len < end):
+			gaps.append((l_start + l_len, end))
+
+	return sorted(found, key = lambda holder: (holder.lock_n, holder.pid))
+
+"""
+Locks of the lockfile listed in /proc/locks - of every process and kind, held and waited for - as proc_lock_tuple, in the
+kernel's order (each lock followed by its waiters). Entries are matched on the file's device and inode.
+Returns None when /proc/locks can not be read.
+"""
+def procLocks(locksfile_path):
+	stat = os.stat(locksfile_path)
+	device = (os.major(stat.st_dev), os.minor(stat.st_dev), stat.st_ino)
+
+	try:
+		with open('/proc/locks', 'r') as f:
+			lines = f.read().splitlines()
+	except (IOError, OSError):
+		return None
+
+	entries = list()
+
+	#pid of the last entry at each depth - a waiter waits for the entry one level up
+	pids = list()
+	for line in lines:
+		#'<id>: [-> ]<kind> <ADVISORY|MANDATORY> <READ|WRITE> <pid> <major>:<minor>:<inode> <start> <end|EOF>'
+		#A waiter's '->' is indented by one more space for each level it is nested under.
+		_, _, rest = line.partition(': ')
+		body = rest.lstrip(' ')
+		depth = 0
+		if body.startswith('->'):
+			depth = len(rest) - len(body) + 1
+			body = body[2:]
+
+		fields = body.split()
+		try:
+			pid = int(fields[3])
+			major, minor, inode = fields[4].split(':')
+			file_device = (int(major, 16), int(minor, 16), int(inode))
+			lock_n = int(fields[5])
+			n_locks = 0 if fields[6] == 'EOF' else int(fields[6]) - lock_n + 1
+		except (IndexError, ValueError):
+			continue
+
+		del pids[depth:]
+		blocked_by = pids[-1] if depth and pids else None
+		pids.append(pid)
+
+		if file_device == device:
+			entries.append(proc_lock_tuple(pid, fields[2] == 'WRITE', lock_n, n_locks, fields[0], blocked_by))
+
+	return entries
+
+
+"""
+lockfileHandle class implementation
+
+An open lockfile. POSIX locks belong to the process, so the 'posix' instances of a process using the same file (found by
+inode, whatever the path) share one handle - one descriptor, opened on first use and closed with its last user. Closing any
+descriptor of a file drops every POSIX lock of the process on it, so the process never holds a second one. 'ofd' instances
+own their locks through their own open file, and get a handle each.
+
+The users of a shared handle hold the union of their locks at the os - the held intervals of the others tell what an
+unlock or a read lock must keep (see pylocksfile._lockRange).
+"""
+class lockfileHandle(object):
+	def __init__(self, path, fd, key, shared):
+		self._path = path
+		self._fd = fd
+		self._key = key
+		self._shared = shared
+
+		#id : weakref of the pylocksfile instances using it
+		self._users = dict()
+
+	@property
+	def fd(self):
+		return self._fd
+
+	@property
+	def shared(self):
+		return self._shared
+
+	def attach(self, user):
+		self._users[id(user)] = weakref.ref(user)
+
+	def others(self, user):
+		#Live users other than user
+		if len(self._users) < 2:
+			return []
+
+		return [other for other in (ref() for key, ref in list(self._users.items()) if key != id(user)) if other is not None]
+
+	def detach(self, user):
+		#Closes the lockfile after its last user
+		with _lockfiles_guard:
+			self._users.pop(id(user), None)
+
+			if self._users or self._fd is None:
+				return
+
+			if _lockfiles.get(self._key) is self:
+				del _lockfiles[self._key]
+
+			os.close(self._fd)
+			self._fd = None
+
+	def forget(self):
+		#In a forked child - close the inherited descriptor. The child holds none of the parent's POSIX locks, and the
+		#parent keeps its open file (and its OFD locks) through its own descriptor.
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+		self._users.clear()
+
+#Shared handles of the process by (st_dev, st_ino), and every live pylocksfile (re-initialized in forked children)
+_lockfiles = dict()
+_lockfiles_guard = threading.Lock()
+_instances = weakref.WeakSet()
+
+#Lock tracers of the process by (trace directory, lockfile, size, sample) - one ring buffer for the instances alike
+_tracers = dict()
+
+def _openTracer(trace_dir, locksfile_path, size, sample):
+	with _lockfiles_guard:
+		key = (os.path.abspath(trace_dir), locksfile_path, size, sample)
+		tracer = _tracers.get(key)
+
+		if tracer is None:
+			serial = sum(1 for other in _tracers if other[:2] == key[:2])
+			tracer = _tracers[key] = lockTracer(trace_dir, locksfile_path, size, sample, serial)
+
+		return tracer
+
+def _openLockfile(path, shared):
+	#Handle of the lockfile at path - the process' shared one when there is one already. Never truncates, the locks are not data.
+	with _lockfiles_guard:
+		if shared:
+			try:
+				stat = os.stat(path)
+			except FileNotFoundError:
+				pass
+			else:
+				handle = _lockfiles.get((stat.st_dev, stat.st_ino))
+				if handle is not None:
+					return handle
+
+		fd = os.open(path, os.O_CREAT | os.O_RDWR)
+		stat = os.fstat(fd)
+		handle = lockfileHandle(path, fd, (stat.st_dev, stat.st_ino), shared)
+
+		if shared:
+			_lockfiles[handle._key] = handle
+
+		return handle
+
+def _afterForkInChild():
+	#Locks are not inherited (POSIX), or belong to the parent's open files (OFD) - every instance starts over, holding nothing
+	global _lockfiles_guard
+	_lockfiles_guard = threading.Lock()
+
+	for handle in list(_lockfiles.values()):
+		handle.forget()
+	_lockfiles.clear()
+
+	#The parent's trace files - the instances trace to files of the child
+	_tracers.clear()
+
+	for instance in list(_instances):
+		instance._forked()
+
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child = _afterForkInChild)
+
+#Rebuilds a pickled pylocksfile - the path and the arguments, the held locks stay with the sender
+def _unpickleLocksfile(locksfile_path, arguments):
+	return pylocksfile(locksfile_path = locksfile_path, **arguments)
+
+
+"""
+pylocksfile class implementation
+
+argument:
+	- locksfile_path (str):
+		Path of the file which will be used as lock, e.g. './lockfile.lock;. 
+		If not provided, a temporary file will be created in '/tmp' directory with random name.
+			* Do not use this file for read/write operations! It should only be accessed via this class methods
+
+	- verbose (bool):
+		Whether to print out read/write intervals and other messages regarding the operations.
+
+	- l_id (str):
+		ID of the correct instance. Used mainly as prefix of the printed information. 
+
+	- backend (str):
+		'posix' (default) for process owned fcntl.lockf locks, or 'ofd' for linux open file description locks owned by this instance.
+		With 'ofd', threads of the same process using their own pylocksfile instances exclude each other.
+		The lockfile is opened on first use and never truncated. 'posix' instances of a process using the same file share its
+		descriptor and hold the union of their locks (see lockfileHandle) - releasing one keeps what the others hold.
+		In a forked child every instance starts over holding nothing, and an instance pickles as its path and arguments.
+
+	- metrics (bool):
+		Whether to record lock metrics (see lockMetrics), grouped in buckets of metrics_bucket consecutive locks.
+		Can also be switched with enableMetrics()/disableMetrics(). Costs a single check per operation when off.
+
+	- n_stripes (int), stripe_offset (int):
+		Named keys (see acquire_keys) are hashed onto the n_stripes locks starting at stripe_offset.
+		Every process sharing keys must use the same values. See stripeEstimate for choosing n_stripes.
+
+	- deadlock_detection (bool):
+		Whether blocking acquire/acquire_many requests that have to wait join the deadlock detection registry of the lockfile
+		(see waitForGraph). A request picked to break a deadlock raises DeadlockError instead of waiting forever, as does a
+		deadlock reported by the os. Covers every backend and chains of any length, between instances that turn it on.
+
+	- deadlock_victim (str or callable):
+		Which waiter of a deadlock gives up - 'requester' (default, the one that closed the cycle), 'youngest', 'oldest',
+		'fewest_locks', or a function picking one of the cycle's wait_info.
+
+	- fairness (str):
+		Order in which acquire/acquire_many requests get the os locks (see fairnessTable). None (default) - whoever asks when
+		the lock is free gets it, so a writer can starve under a stream of readers. 'fifo' - arrival order, consecutive
+		readers sharing the lock. 'writer' - new readers queue behind a waiting writer. 'phase_fair' - readers and writers
+		alternate, neither waits for more than one phase of the other. Every instance using the lockfile must use the same
+		policy, and locks must be below FAIR_TURNSTILE. Costs a few system calls per request that reaches the os.
+
+	- hierarchy (tuple):
+		Node sizes of a multi-granularity lock hierarchy, coarsest first, each a multiple of the next - e.g. (1 << 20, 1 << 10)
+		for tables of 2^20 locks split into blocks of 2^10 locks (see lockHierarchy). Ranges covering whole nodes lock the nodes
+		instead of the locks, with intention locks on the nodes above the locks taken one by one. The nodes are locked in the
+		sidecar file path + '.hier'. Every instance using the lockfile must use the same hierarchy, and locks must be below HIERARCHY_OFFSET.
+		With 'posix' (the process owns the locks) it must be the only instance of the lockfile in the process - the
+		constructor, or the first use of another instance, raises IllegalArgumentError. Use 'ofd' for several.
+		Note - a node changing mode (e.g. rows completing a node) can deadlock with another holder of the node like any upgrade,
+		'posix' reports it (acquire returns False).
+
+	- escalation (int):
+		With a hierarchy - a node of the finest level holding more than escalation separately locked ranges is locked whole
+		instead (S, or X when it holds write locks), when that needs no waiting. Keeps the number of kernel locks down (the os
+		checks a request against every lock of the file), at the price of holding locks that were not asked for. None (default) - off.
+
+	- versions (int):
+		Version counters for optimistic reads of the locks [0, versions) (see optimistic and versionTable) - write locks keep the
+		counters of their range odd while held. Every instance writing to the versioned locks must use it. None (default) - off.
+
+	- trace (str):
+		Existing directory to trace the lock requests to (see lockTracer) - the instances of a process alike share a ring
+		buffer file there. Read the traces with pylocksfile-trace or readTrace. None (default) - off.
+
+	- trace_size (int):
+		Events kept by the ring buffer of the process. Default - TRACE_EVENTS.
+
+	- trace_sample (float):
+		Share of the locks traced, in (0, 1] - the same locks in every process. Default - 1 (every lock).
+
+"""
+class pylocksfile(object):
+	#Shared waiter pool of acquire_async
+	_async_waiters = None
+
+	def __init__(self, locksfile_path = None, verbose = False, l_id = None, backend = POSIX_BACKEND, metrics = False, metrics_bucket = 1, n_stripes = KEY_STRIPES, stripe_offset = KEY_STRIPE_OFFSET, deadlock_detection = False, deadlock_victim = VICTIM_REQUESTER, fairness = None, hierarchy = None, escalation = None, versions = None, trace = None, trace_size = TRACE_EVENTS, trace_sample = 1.0):
+		
+		#If locksfile_path is None, create a temporary file in /tmp with random name (posix timestamp in ms)
+		if locksfile_path is None:
+			locksfile_path = os.path.join('/tmp', str(int(time.time() * 1000)) + '.lock')
+		
+		#If l_id is None, then give it a random name...for now process pid
+		if l_id is None:
+			lid = str(os.getpid())
+
+		locksfile_path = os.path.abspath(locksfile_path)
+		
+		if not os.path.isdir(os.path.split(locksfile_path)[0]):
+			raise IllegalArgumentError('pylocksfile - locksfile_path directory path does not exist.')
+		
+		if not isinstance(verbose, bool):
+			raise IllegalArgumentError('pylocksfile - verbose argument is not boolean (True/False).')
+		
+		if not isinstance(locksfile_path, str):
+			raise IllegalArgumentError('pylocksfile - l_id argument is not str.')
+
+		if backend not in (POSIX_BACKEND, OFD_BACKEND):
+			raise IllegalArgumentError('pylocksfile - backend argument must be \'posix\' or \'ofd\'.')
+
+		if backend == OFD_BACKEND and not sys.platform.startswith('linux'):
+			raise IllegalArgumentError('pylocksfile - \'' + backend + '\' backend is only available on linux.')
+
+		if not isinstance(metrics, bool):
+			raise IllegalArgumentError('pylocksfile - metrics argument is not boolean (True/False).')
+
+		if not isinstance(n_stripes, Integral) or n_stripes < 1:
+			raise IllegalArgumentError('pylocksfile - n_stripes argument must be a positive integer.')
+
+		if not isinstance(stripe_offset, Integral) or stripe_offset < 0:
+			raise IllegalArgumentError('pylocksfile - stripe_offset argument must be a non-negative integer.')
+
+		if not (callable(deadlock_victim) or deadlock_victim in (VICTIM_REQUESTER, VICTIM_YOUNGEST, VICTIM_OLDEST, VICTIM_FEWEST_LOCKS)):
+			raise IllegalArgumentError('pylocksfile - deadlock_victim argument must be \'requester\', \'youngest\', \'oldest\', \'fewest_locks\' or a function.')
+
+		if fairness not in (None, FAIR_FIFO, FAIR_WRITER, FAIR_PHASE):
+			raise IllegalArgumentError('pylocksfile - fairness argument must be None, \'fifo\', \'writer\' or \'phase_fair\'.')
+
+		if hierarchy is not None:
+			if not isinstance(hierarchy, (tuple, list)) or not hierarchy or not all(isinstance(size, Integral) and size >= 2 for size in hierarchy) or any(coarse <= fine or coarse % fine for coarse, fine in zip(hierarchy, hierarchy[1:])):
+				raise IllegalArgumentError('pylocksfile - hierarchy argument must be a tuple of node sizes, coarsest first, each at least 2 and a multiple of the next.')
+
+		if escalation is not None and (hierarchy is None or not isinstance(escalation, Integral) or escalation < 1):
+			raise IllegalArgumentError('pylocksfile - escalation argument must be None or a positive integer, with a hierarchy.')
+
+		if versions is not None and (not isinstance(versions, Integral) or versions < 1):
+			raise IllegalArgumentError('pylocksfile - versions argument must be None or a positive integer.')
+
+		if trace is not None and (not isinstance(trace, str) or not os.path.isdir(trace)):
+			raise IllegalArgumentError('pylocksfile - trace argument must be None or a directory.')
+
+		if not isinstance(trace_size, Integral) or trace_size < 1:
+			raise IllegalArgumentError('pylocksfile - trace_size argument must be a positive integer.')
+
+		if not isinstance(trace_sample, (int, float)) or not 0 < trace_sample <= 1:
+			raise IllegalArgumentError('pylocksfile - trace_sample argument must be a number in (0, 1].')
+
+		#Get absolute path to the file
+		self._locksfile_path =  os.path.abspath(locksfile_path)
+		
+		#Determine if inside information will be printed.
+		self._verbose = verbose
+
+		self._backend = backend
+
+		#Opened on first use (see lockfileHandle) - shared by the 'posix' instances of the process using the file.
+		#The same for the nodes sidecar of a hierarchy.
+		self._handle = None
+		self._fd = None
+		self._nodes_handle = None
+
+		#For pickling - rebuilt from the path and these
+		self._arguments = {'verbose' : verbose, 'l_id' : l_id, 'backend' : backend, 'metrics' : metrics, 'metrics_bucket' : metrics_bucket,
+			'n_stripes' : n_stripes, 'stripe_offset' : stripe_offset, 'deadlock_detection' : deadlock_detection,
+			'deadlock_victim' : deadlock_victim, 'fairness' : fairness, 'hierarchy' : hierarchy, 'escalation' : escalation, 'versions' : versions,
+			'trace' : trace, 'trace_size' : trace_size, 'trace_sample' : trace_sample}
+
+		#Deadlock detection registry, None when detection is off
+		self._wfg = waitForGraph(self._locksfile_path, backend) if deadlock_detection else None
+		self._deadlock_victim = deadlock_victim
+
+		#Queues of the fairness policy, None when there is none
+		self._fair = fairnessTable(self._locksfile_path, fairness) if fairness is not None else None
+
+		#Multi-granularity locking of the locks, None without a hierarchy
+		self._hierarchy = lockHierarchy(backend == OFD_BACKEND, hierarchy, escalation) if hierarchy is not None else None
+
+		#Version counters of optimistic reads, None without versions. Failed attempts before falling back to the read lock.
+		self._versions = versionTable(self._locksfile_path, int(versions)) if versions is not None else None
+		self._optimistic_budget = OPTIMISTIC_RETRIES
+
+		#Held intervals of this instance, each with its read/write mode. Deadlock detection publishes what changed.
+		self._lockIntervals = lockInterval()
+		if self._wfg is not None:
+			self._lockIntervals.track()
+
+		#Held gates of upgradeable read locks (see acquire_upgradeable)
+		self._gates = lockInterval()
+
+		#Timed acquire - current spin budget and time spent waiting by the last timed acquire (seconds)
+		self._spin_budget = SPIN_MIN_BUDGET
+		self._last_wait_time = None
+
+		#lockMetrics when metrics are on, None otherwise
+		self._metrics = lockMetrics(metrics_bucket) if metrics else None
+
+		#lockTracer of the process when tracing, None otherwise
+		self._tracer = _openTracer(trace, self._locksfile_path, int(trace_size), float(trace_sample)) if trace is not None else None
+
+		#Named keys locks
+		self._n_stripes = int(n_stripes)
+		self._stripe_offset = int(stripe_offset)
+		
+		#With statement blocks of the threads sharing the instance (see __call__) - the range one of them requests from the os,
+		#and the number of blocks waiting for it. The condition's lock is taken directly where nothing waits.
+		self._blocks_guard = threading.Lock()
+		self._blocks = threading.Condition(self._blocks_guard)
+		self._requesting = None
+		self._n_blocked = 0
+
+		#acquire_any - threads sharing the instance take turns, and its slot to try first (random, then the last one it got)
+		self._slots_guard = threading.Lock()
+		self._slot_offset = int.from_bytes(os.urandom(4), 'little')
+
+		self._l_id = l_id
+
+		_instances.add(self)
+
+		#A 'posix' hierarchy is checked to be alone in the process now, not on first use
+		if self._hierarchy is not None and backend == POSIX_BACKEND:
+			self._open()
+
+		return
+
+	def _open(self):
+		#Handle of the lockfile, opened on first use
+		if self._handle is None:
+			handle = _openLockfile(self._locksfile_path, self._backend == POSIX_BACKEND)
+			handle.attach(self)
+
+			#'posix' instances of the process keep each other's locks (see _siblingLocks) - a hierarchy's node and row locks
+			#can not be kept that way, so a 'posix' hierarchy has the lockfile to itself
+			others = handle.others(self)
+			if others and (self._hierarchy is not None or any(other._hierarchy is not None for other in others)):
+				handle.detach(self)
+				raise IllegalArgumentError('pylocksfile - a hierarchy with the posix backend must be the only instance of ' + self._locksfile_path + ' in the process (posix locks belong to the process), use the ofd backend for several.')
+
+			self._handle = handle
+			self._fd = self._handle.fd
+
+			if self._hierarchy is not None:
+				self._nodes_handle = _openLockfile(self._locksfile_path + '.hier', self._backend == POSIX_BACKEND)
+				self._nodes_handle.attach(self)
+				self._hierarchy.attach(self._fd, self._nodes_handle.fd)
+
+		return self._handle
+
+	@property
+	def locksfile_path(self):
+		return self._locksfile_path
+
+	@property
+	def l_id(self):
+		return self._l_id
+
+	@property
+	def backend(self):
+		return self._backend
+
+	@property
+	def fairness(self):
+		return self._fair.policy if self._fair is not None else None
+
+	@property
+	def hierarchy(self):
+		return None if self._hierarchy is None else self._hierarchy.sizes
+
+	@property
+	def versions(self):
+		return None if self._versions is None else self._versions.size
+
+	@property
+	def tracer(self):
+		return self._tracer
+
+	@property
+	def deadlock_detection(self):
+		return self._wfg is not None
+
+	@property
+	def n_stripes(self):
+		return self._n_stripes
+
+	@property
+	def stripe_offset(self):
+		return self._stripe_offset
+
+	@property
+	def metrics(self):
+		#lockMetrics of this instance (snapshot(), prometheus()), None when metrics are off
+		return self._metrics
+
+	def enableMetrics(self, bucket_size = 1):
+		if self._metrics is None or self._metrics.bucket_size != bucket_size:
+			self._metrics = lockMetrics(bucket_size)
+
+		return self._metrics
+
+	def disableMetrics(self):
+		self._metrics = None
+
+	@property
+	def last_wait_time(self):
+		#Seconds spent waiting by the last acquire with a timeout, None if there was none
+		return self._last_wait_time
+
+	@property
+	def verbose(self):
+		return self._verbose
+
+	@verbose.setter
+	def verbose(self, new_verbose):
+		self._verbose = new_verbose
+	
+
+	"""
+	Acquire lock_n (index or (lock_n, n_locks) interval) for reading (shared) or writing (exclusive).
+
+	With timeout (seconds), a blocking acquire gives up and returns False after the timeout. It first makes a short,
+	adaptive run of non-blocking attempts, then waits in the kernel for the rest of the timeout. The time spent
+	waiting is available as last_wait_time.
+
+	Acquires in the same mode are counted - a range acquired n times is unlocked by the n-th release, so nested blocks
+	can re-acquire what an outer block holds, and parts already held in the same mode are not requested from the os again.
+	Acquiring in the other mode converts the held parts, which are then held once.
+	"""
+	def acquire(self, writeLock = False, lock_n = 0, blocking = True, timeout = None):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+		if timeout is not None:
+			if not isinstance(timeout, (int, float)) or timeout < 0:
+				raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+			if not blocking:
+				raise IllegalArgumentError('timeout can only be used with a blocking acquire')
+
+		return self._acquire(writeLock, lock_n, blocking, timeout)
+
+	def _acquire(self, writeLock, lock_n, blocking, timeout, in_turn = False):
+		#Create the interval of the lock. Will raise Exception on invalid input.
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		#Only the parts not held in this mode yet need the os
+		missing_interval = self._lockIntervals.missingSpan(lock_interval, writeLock)
+
+		if missing_interval is None:
+			if timeout is not None:
+				self._last_wait_time = 0.0
+
+		elif not self._requestRange(writeLock, lock_interval, missing_interval, blocking, timeout, in_turn):
+			return False
+
+		#Update the held intervals. - last operation counts.
+		self._lockIntervals.insertInterval(lock_interval, writeLock)
+
+		if self._verbose:
+			self.printVerbose(('Write' if writeLock else 'Read') + ' lock acquired ->' + str(lock_n))
+			self.printVerbose('read Locked ->' + str(self._lockIntervals.readIntervals))
+			self.printVerbose('write Locked ->' + str(self._lockIntervals.writeIntervals))
+
+		return True
+
+	#Requests the missing part of lock_interval from the os. False when not acquired.
+	def _requestRange(self, writeLock, lock_interval, missing_interval, blocking, timeout, in_turn = False):
+		try:
+			if not self._acquireRange(writeLock, missing_interval, blocking, timeout, in_turn):
+				if self._verbose:
+					self.printVerbose('Not acquired ->' + str(lock_interval))
+				return False
+
+		except (IOError, OSError) as e:
+			
+			if self._verbose:
+				self.printVerbose("Exception" + str(e))
+			
+				if e.errno == errno.EDEADLK:
+					self.printVerbose('Deadlock detected by os. By linux policy - lock request removed for ' + str(lock_interval))
+
+			if e.errno == errno.EDEADLK and self._wfg is not None:
+				raise DeadlockError('pylocksfile - deadlock detected by os, lock request removed for ' + str(lock_interval))
+
+			return False
+
+		return True
+
+	"""
+	Acquire lock_n for upgradeable reading - shared with plain readers, but a lock has a single upgradeable holder at a time.
+	upgrade() turns it into a write lock without letting it go, and can not deadlock with another upgrade - the other
+	holders of the range are plain readers, which leave without waiting for it (unless they convert their own read
+	locks with acquire). downgrade() goes back to reading in place, release_upgradeable() lets the range go.
+
+	A write lock of the range's gates (bytes UPGRADE_GATES + lock_n of the lockfile) plus a read lock of the range, so
+	locks must be below UPGRADE_GATES. Like any write lock, the gates of 'posix' instances of
+	the same process do not exclude each other.
+	"""
+	def acquire_upgradeable(self, lock_n = 0, blocking = True, timeout = None):
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+		if timeout is not None:
+			if not isinstance(timeout, (int, float)) or timeout < 0:
+				raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+			if not blocking:
+				raise IllegalArgumentError('timeout can only be used with a blocking acquire')
+
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+		if lock_interval.lock_n + lock_interval.n_locks > UPGRADE_GATES:
+			raise IllegalArgumentError('pylocksfile - upgradeable locks must be below ' + str(UPGRADE_GATES) + ', got ' + str(lock_interval))
+
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		#Gates not held yet, each gap between the held ones - waits for upgradeable holders only. The gates of an outer hold
+		#are not taken again, so giving back what this call took leaves them locked.
+		taken = list()
+		acquired = False
+		try:
+			for missing_interval in self._gates.unheld(lock_interval):
+				remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+				try:
+					if not self._lockGates(missing_interval, blocking, remaining):
+						return False
+
+				except (IOError, OSError) as e:
+					if e.errno == errno.EDEADLK and self._wfg is not None:
+						raise DeadlockError('pylocksfile - deadlock detected by os, lock request removed for gates of ' + str(lock_interval))
+
+					return False
+
+				taken.append(missing_interval)
+
+			remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+			acquired = self._acquire(False, lock_interval, blocking, remaining)
+
+		finally:
+			#Gates taken for a read lock that was not acquired are given back
+			if not acquired:
+				for gate_interval in taken:
+					self._unlockGates(gate_interval)
+
+		if not acquired:
+			return False
+
+		self._gates.insertInterval(lock_interval, True)
+
+		return True
+
+	#Upgradeable read lock of lock_n to write lock. Waits for the plain readers of the range to leave (up to timeout) - it does not
+	#queue behind the requests of a fairness policy, which may be waiting for this range. Returns False when not upgraded.
+	def upgrade(self, lock_n = 0, timeout = None):
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		if self._gates.missingSpan(lock_interval, True) is not None:
+			raise IllegalArgumentError('pylocksfile - ' + str(lock_interval) + ' is not held upgradeable.')
+
+		if timeout is not None and (not isinstance(timeout, (int, float)) or timeout < 0):
+			raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+
+		return self._acquire(True, lock_interval, True, timeout, in_turn = True)
+
+	#Write lock of lock_n back to reading, in place - never waits and never leaves the range free. An upgraded range stays upgradeable.
+	def downgrade(self, lock_n = 0):
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		if self._lockIntervals.missingSpan(lock_interval, True) is not None:
+			raise IllegalArgumentError('pylocksfile - ' + str(lock_interval) + ' is not held for writing.')
+
+		return self._acquire(False, lock_interval, False, None, in_turn = True)
+
+	#Release one hold of an upgradeable (or upgraded) lock_n
+	def release_upgradeable(self, lock_n = 0):
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		#Will raise Exception on invalid input
+		freed_gates = self._gates.releaseInterval(lock_interval)
+
+		self.release(lock_n = lock_interval)
+
+		for gate_interval in freed_gates:
+			self._unlockGates(gate_interval)
+
+	#Use with "with locksfile.upgradeable(lock_n) as lock:", then lock.upgrade() and lock.downgrade().
+	#Raises LockTimeoutError when not acquired within timeout.
+	def upgradeable(self, lock_n = 0, timeout = None):
+		return _upgradeableLockContext(self, lock_n, timeout)
+
+	"""
+	Optimistic read of lock_n (index or (lock_n, n_locks) interval, below versions) - "with locksfile.optimistic(lock_n) as v:",
+	reading the data and v.validate() until it is True (see _optimisticRead). Reads the version counters of the range
+	instead of locking it, so readers make no system call unless a writer gets in the way. A range this instance holds
+	already is read as it is.
+	"""
+	def optimistic(self, lock_n = 0):
+		versions = self._versions
+		if versions is None:
+			raise IllegalArgumentError('pylocksfile - optimistic reads need versions.')
+
+		#A single lock skips the generic checks - the whole point is to cost less than a lock
+		if type(lock_n) is int and 0 <= lock_n < versions.size:
+			start, end = lock_n, lock_n + 1
+		else:
+			#Create the interval of the lock. Will raise Exception on invalid input.
+			lock_interval = self._lockIntervals.preprocessInput(lock_n)
+			start, end = lock_interval.lock_n, lock_interval.lock_n + lock_interval.n_locks
+			if start == end or end > versions.size:
+				raise IllegalArgumentError('pylocksfile - optimistic reads are for locks below versions (' + str(versions.size) + ').')
+
+		held = False
+		if len(self._lockIntervals):
+			pieces = self._lockIntervals.pieces(start, end)
+			held = sum(piece_end - piece_start for piece_start, piece_end, _ in pieces) == end - start
+			if not held and any(writeLock for _, _, writeLock in pieces):
+				#The read lock would convert the held write locks
+				raise IllegalArgumentError('pylocksfile - optimistic read of ' + str(lock_n) + ', partly write locked by this instance.')
+
+		return _optimisticRead(self, start, end, versions.counters, held)
+
+	def _lockGates(self, lock_interval, blocking, timeout):
+		#Write lock of the gates of lock_interval. Returns False when not acquired (non-blocking or timed out).
+		fd = self._open().fd
+		ofd = self._backend == OFD_BACKEND
+		offset = UPGRADE_GATES + lock_interval.lock_n
+
+		if timeout is None:
+			try:
+				_lockFileRange(fd, ofd, True, offset, lock_interval.n_locks, blocking)
+			except (IOError, OSError) as e:
+				if blocking or e.errno not in (errno.EACCES, errno.EAGAIN):
+					raise
+				return False
+
+			return True
+
+		#Poll, with the backoff capped at SPIN_MAX_DELAY
+		deadline = time.monotonic() + timeout
+		delay = SPIN_MIN_DELAY
+		while True:
+			try:
+				_lockFileRange(fd, ofd, True, offset, lock_interval.n_locks, False)
+				return True
+			except (IOError, OSError) as e:
+				if e.errno not in (errno.EACCES, errno.EAGAIN):
+					raise
+
+			now = time.monotonic()
+			if now >= deadline:
+				return False
+
+			time.sleep(min(delay, deadline - now))
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+	def _unlockGates(self, lock_interval):
+		_lockFileRange(self._fd, self._backend == OFD_BACKEND, None, UPGRADE_GATES + lock_interval.lock_n, lock_interval.n_locks, False)
+
+	def _acquireRange(self, writeLock, lock_interval, blocking, timeout = None, in_turn = False, traced = False):
+		#Kernel lock of lock_interval, recording metrics when on. Returns False when not acquired (non-blocking or timed out), raises IOError/OSError on errors.
+		if self._tracer is not None and not traced and self._tracer.sampled(lock_interval.lock_n):
+			return self._tracedAcquireRange(writeLock, lock_interval, blocking, timeout, in_turn)
+
+		if self._fair is not None and not in_turn:
+			return self._fairAcquireRange(writeLock, lock_interval, blocking, timeout)
+
+		metrics = self._metrics
+
+		if metrics is None:
+			if self._wfg is not None and blocking:
+				#Only a request that has to wait joins the deadlock detection
+				if self._tryLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks):
+					if timeout is not None:
+						self._last_wait_time = 0.0
+					return True
+
+				return self._detectedLockRange(writeLock, lock_interval, timeout)
+
+			if timeout is None:
+				self._lockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, blocking)
+				return True
+
+			return self._timedLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, timeout)
+
+		start_time = perf_counter_ns()
+
+		try:
+			#One non-blocking attempt first, so contended acquires can be told apart
+			contended = not self._tryLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks)
+
+			if not contended:
+				acquired = True
+			elif not blocking:
+				acquired = False
+			elif self._wfg is not None:
+				acquired = self._detectedLockRange(writeLock, lock_interval, timeout)
+			elif timeout is None:
+				self._lockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, True)
+				acquired = True
+			else:
+				acquired = self._timedLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, timeout)
+
+		except (IOError, OSError) as e:
+			if e.errno == errno.EDEADLK:
+				metrics.recordDeadlock(lock_interval.lock_n)
+			raise
+
+		except DeadlockError:
+			metrics.recordDeadlock(lock_interval.lock_n)
+			raise
+
+		if acquired:
+			now = perf_counter_ns()
+			metrics.recordAcquire(lock_interval.lock_n, now - start_time, contended, now)
+		else:
+			metrics.recordContended(lock_interval.lock_n)
+
+		return acquired
+
+	def _tracedAcquireRange(self, writeLock, lock_interval, blocking, timeout, in_turn):
+		#The request and its answer, around the wait (fairness turn included)
+		tracer = self._tracer
+		tracer.record(TRACE_REQUEST, writeLock, lock_interval.lock_n, lock_interval.n_locks)
+
+		acquired = False
+		try:
+			acquired = self._acquireRange(writeLock, lock_interval, blocking, timeout, in_turn, traced = True)
+		finally:
+			tracer.record(TRACE_ACQUIRED if acquired else TRACE_FAILED, writeLock, lock_interval.lock_n, lock_interval.n_locks)
+
+		return acquired
+
+	def _fairAcquireRange(self, writeLock, lock_interval, blocking, timeout):
+		#Wait for the turn of the request under the fairness policy, then ask the os
+		start_time = time.monotonic()
+		deadline = None if timeout is None else start_time + timeout
+
+		token = self._fair.enter(writeLock, lock_interval.lock_n, lock_interval.n_locks, blocking, deadline)
+
+		if token is None:
+			acquired = False
+			if self._metrics is not None:
+				self._metrics.recordContended(lock_interval.lock_n)
+		else:
+			acquired = False
+			try:
+				acquired = self._acquireRange(writeLock, lock_interval, blocking, None if deadline is None else max(deadline - time.monotonic(), 0.0), in_turn = True, traced = True)
+			finally:
+				self._fair.leave(token, writeLock, lock_interval.lock_n, lock_interval.n_locks, acquired)
+
+		if timeout is not None:
+			self._last_wait_time = time.monotonic() - start_time
+
+		return acquired
+
+	def _detectedLockRange(self, writeLock, lock_interval, timeout):
+		#Contended blocking acquire with deadlock detection. Returns False on timeout, raises DeadlockError when picked as a victim.
+		start_time = time.monotonic()
+		deadline = None if timeout is None else start_time + timeout
+
+		cycle = self._wfg.wait(writeLock, lock_interval.lock_n, lock_interval.n_locks, self._lockIntervals, victim = self._deadlock_victim)
+		try:
+			if cycle is not None:
+				raise DeadlockError('pylocksfile - deadlock of ' + str(len(cycle)) + ' waiters, request of ' + str(lock_interval) + ' picked as the victim.', cycle)
+
+			#Wait in slices, checking in between whether another waiter picked this one as a victim
+			while True:
+				wait_time = WFG_CHECK_INTERVAL
+				if deadline is not None:
+					wait_time = min(wait_time, deadline - time.monotonic())
+					if wait_time <= 0:
+						return False
+
+				if self._timedLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, wait_time):
+					return True
+
+				if self._wfg.picked():
+					raise DeadlockError('pylocksfile - request of ' + str(lock_interval) + ' picked as the victim of a deadlock.')
+
+		finally:
+			self._wfg.done()
+
+			if timeout is not None:
+				self._last_wait_time = time.monotonic() - start_time
+
+	"""
+	Acquire a scattered set of locks as a single all-or-nothing operation.
+
+	indices_or_ranges is any iterable of lock indices and (lock_n, n_locks) intervals, e.g. [3, 17, 18, 19, (900, 2)]
+	or a NumPy integer array. The locks are merged into the fewest contiguous runs and locked in ascending order,
+	so batch users can not deadlock each other (as long as they hold no other locks while waiting).
+	If any run fails (non-blocking, or deadlock reported by the os), every run taken so far is rolled back
+	to its previous state and False is returned. With deadlock detection, a deadlock rolls back and raises DeadlockError.
+	"""
+	def acquire_many(self, indices_or_ranges, writeLock = False, blocking = True):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+
+		#Create the sorted, merged runs. Will raise Exception on invalid input.
+		lock_intervals = self._lockIntervals.coalesce(indices_or_ranges)
+
+		#Runs taken so far, with the held segments they replaced
+		taken = list()
+
+		for lock_interval in lock_intervals:
+			previous = self._lockIntervals.snapshot(lock_interval)
+			missing_interval = self._lockIntervals.missingSpan(lock_interval, writeLock)
+			deadlock = None
+
+			try:
+				acquired = missing_interval is None or self._acquireRange(writeLock, missing_interval, blocking)
+
+			except (IOError, OSError) as e:
+
+				if self._verbose:
+					self.printVerbose("Exception" + str(e))
+
+					if e.errno == errno.EDEADLK:
+						self.printVerbose('Deadlock detected by os. By linux policy - lock request removed for ' + str(lock_interval))
+
+				if e.errno == errno.EDEADLK and self._wfg is not None:
+					deadlock = DeadlockError('pylocksfile - deadlock detected by os, lock request removed for ' + str(lock_interval))
+
+				acquired = False
+
+			except DeadlockError as e:
+				deadlock = e
+				acquired = False
+
+			if not acquired:
+				#All or nothing - undo the runs already taken, last first
+				for taken_interval, taken_previous in reversed(taken):
+					self._restoreIntervals(taken_interval, taken_previous, writeLock)
+
+				if deadlock is not None:
+					raise deadlock
+
+				return False
+
+			self._lockIntervals.insertInterval(lock_interval, writeLock)
+			taken.append((lock_interval, previous))
+
+		if self._verbose:
+			self.printVerbose(('Write' if writeLock else 'Read') + ' locks acquired ->' + str(lock_intervals))
+
+		return True
+
+	#Lock index of the stripe a named key is hashed to
+	def stripe(self, key):
+		return self._stripe_offset + stableKeyHash(key) % self._n_stripes
+
+	"""
+	Acquire named keys (str, bytes, numbers, None or tuples of those) for reading or writing, e.g. ["user:42", ("cache", 7)].
+
+	Keys are hashed onto stripes, so different keys may share a lock. The stripes are de-duplicated, sorted and taken
+	with acquire_many, all or nothing, so key users can not deadlock each other. A single key may use a timeout.
+	"""
+	def acquire_keys(self, keys, writeLock = False, blocking = True, timeout = None):
+		if isinstance(keys, (str, bytes)):
+			raise IllegalArgumentError('keys must be an iterable of keys, use key() or [key] for a single key')
+
+		stripes = sorted(set(self.stripe(key) for key in keys))
+
+		if timeout is not None:
+			if len(stripes) != 1:
+				raise IllegalArgumentError('timeout can only be used with keys sharing a single stripe')
+
+			return self.acquire(writeLock = writeLock, lock_n = stripes[0], blocking = blocking, timeout = timeout)
+
+		return self.acquire_many(stripes, writeLock = writeLock, blocking = blocking)
+
+	#Release one hold of the stripes of keys. Note - keys acquired together share the hold of a common stripe.
+	def release_keys(self, keys):
+		if isinstance(keys, (str, bytes)):
+			raise IllegalArgumentError('keys must be an iterable of keys, use [key] for a single key')
+
+		self.release_many(set(self.stripe(key) for key in keys))
+
+	#Use with "with locksfile.key('user:42', writeLock = True):". Raises LockTimeoutError when not acquired within timeout.
+	def key(self, key, writeLock = False, timeout = None):
+		return _keyLockContext(self, [key], writeLock, timeout)
+
+	"""
+	Acquire any one lock of lock_n ((lock_n, n_locks) interval of slots - e.g. K workers or connections), and return its index.
+	None when none was acquired (non-blocking, or timed out) - note slot 0 is falsy.
+
+	Slots are tried without blocking from this instance's own first slot (random at first, then the last one it got), so
+	processes spread over the slots instead of all trying the lowest, and one that keeps coming back finds its slot free.
+	Slots this instance holds are skipped. When all are busy and one slot is left to try (e.g. K = 1), it waits for it like
+	acquire does - in the os, or in its fairness turn - until it is free or timeout runs out. With several, it waits in the
+	os for one of them (a different one each time) for up to SLOT_WAIT, and tries them all again - the os can only wait for
+	one range at a time, and a slot another process keeps must not hide the others. Threads sharing the instance take turns.
+	See also lockSemaphore.
+	"""
+	def acquire_any(self, lock_n, writeLock = True, blocking = True, timeout = None):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+		if timeout is not None:
+			if not isinstance(timeout, (int, float)) or timeout < 0:
+				raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+			if not blocking:
+				raise IllegalArgumentError('timeout can only be used with a blocking acquire')
+
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+		if not lock_interval.n_locks:
+			raise IllegalArgumentError('pylocksfile - acquire_any needs a bounded range of slots.')
+
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		if not self._slots_guard.acquire(blocking, -1 if timeout is None else timeout):
+			return None
+
+		try:
+			return self._acquireAny(writeLock, lock_interval, blocking, deadline)
+		finally:
+			self._slots_guard.release()
+
+	def _acquireAny(self, writeLock, lock_interval, blocking, deadline):
+		start = lock_interval.lock_n
+		n_slots = lock_interval.n_locks
+		waits = 0
+
+		while True:
+			#Slots this instance does not hold, from its first slot on
+			slots = [slot for gap in self._lockIntervals.unheld(lock_interval) for slot in range(gap.lock_n, gap.lock_n + gap.n_locks)]
+			if not slots:
+				if not blocking:
+					return None
+				raise IllegalArgumentError('pylocksfile - every slot of ' + str(lock_interval) + ' is held by this instance, waiting would never end.')
+
+			k = bisect_left(slots, start + self._slot_offset % n_slots)
+			slots = slots[k:] + slots[:k]
+
+			for slot in slots:
+				if self._acquire(writeLock, interval_tuple(slot, 1), False, None):
+					self._slot_offset = slot - start
+					return slot
+
+			if not blocking:
+				return None
+
+			remaining = None
+			if deadline is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return None
+
+			#A single slot is waited for like any acquire - blocked in the os (or in its fairness turn) until it is free
+			if len(slots) == 1:
+				if self._acquire(writeLock, interval_tuple(slots[0], 1), True, remaining):
+					self._slot_offset = slots[0] - start
+					return slots[0]
+
+				return None
+
+			#Another process may hold one slot for good while the others come and go, so a wait on one of several slots is bounded
+			wait = SLOT_WAIT if remaining is None else min(SLOT_WAIT, remaining)
+
+			slot = slots[waits % len(slots)]
+			waits += 1
+
+			if self._acquire(writeLock, interval_tuple(slot, 1), True, wait):
+				self._slot_offset = slot - start
+				return slot
+
+	"""
+	asyncio version of acquire (always blocking), to be awaited from an event loop.
+
+	A free lock is taken inline with a non-blocking attempt. A contended one is waited for on the event loop, retrying
+	non-blocking attempts with backoff until the timeout. It never queues a blocking request in the kernel and needs no
+	thread, so cancelling the awaiting task leaves nothing pending.
+
+	With a fairness policy, the request takes its turn on a thread of a small shared waiter pool, with no inline attempt
+	(which would jump the queue). The turn and the os lock are polled too, so a cancelled or timed out task leaves the
+	queue and frees its thread at once - if the lock was granted just before, it is given back.
+	"""
+	async def acquire_async(self, writeLock = False, lock_n = 0, timeout = None):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if timeout is not None and (not isinstance(timeout, (int, float)) or timeout < 0):
+			raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+
+		#Create the interval of the lock. Will raise Exception on invalid input.
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		#Only the parts not held in this mode yet need the os
+		missing_interval = self._lockIntervals.missingSpan(lock_interval, writeLock)
+		if missing_interval is None:
+			self._lockIntervals.insertInterval(lock_interval, writeLock)
+			return True
+
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		if self._fair is not None:
+			try:
+				acquired = await self._fairWaitAsync(writeLock, missing_interval, deadline)
+			except (IOError, OSError) as e:
+				if self._verbose:
+					self.printVerbose("Exception" + str(e))
+				return False
+
+			if acquired:
+				self._lockIntervals.insertInterval(lock_interval, writeLock)
+
+			return acquired
+
+		metrics = self._metrics
+		if metrics is not None:
+			start_time = perf_counter_ns()
+
+		tracer = self._tracer
+		if tracer is not None and not tracer.sampled(missing_interval.lock_n):
+			tracer = None
+		if tracer is not None:
+			tracer.record(TRACE_REQUEST, writeLock, missing_interval.lock_n, missing_interval.n_locks)
+
+		try:
+			#Fast path - no wait when the lock is free
+			acquired = self._tryLockRange(writeLock, missing_interval.lock_n, missing_interval.n_locks)
+			contended = not acquired
+
+			if contended and timeout != 0:
+				acquired = await self._pollLockRange(writeLock, missing_interval.lock_n, missing_interval.n_locks, deadline)
+
+		except asyncio.CancelledError:
+			if tracer is not None:
+				tracer.record(TRACE_FAILED, writeLock, missing_interval.lock_n, missing_interval.n_locks)
+			raise
+		except (IOError, OSError) as e:
+			if tracer is not None:
+				tracer.record(TRACE_FAILED, writeLock, missing_interval.lock_n, missing_interval.n_locks)
+			if self._verbose:
+				self.printVerbose("Exception" + str(e))
+			return False
+
+		if tracer is not None:
+			tracer.record(TRACE_ACQUIRED if acquired else TRACE_FAILED, writeLock, missing_interval.lock_n, missing_interval.n_locks)
+
+		if not acquired:
+			if metrics is not None:
+				metrics.recordContended(missing_interval.lock_n)
+			if self._verbose:
+				self.printVerbose('Timed out ->' + str(lock_n))
+			return False
+
+		if metrics is not None:
+			now = perf_counter_ns()
+			metrics.recordAcquire(missing_interval.lock_n, now - start_time, contended, now)
+
+		#Update the held intervals. - last operation counts.
+		self._lockIntervals.insertInterval(lock_interval, writeLock)
+
+		if self._verbose:
+			self.printVerbose(('Write' if writeLock else 'Read') + ' lock acquired (async) ->' + str(lock_n))
+
+		return True
+
+	#Use with "async with locksfile.async_lock(writeLock, lock_n):". Raises LockTimeoutError when not acquired within timeout.
+	def async_lock(self, writeLock = False, lock_n = 0, timeout = None):
+		return _asyncLockContext(self, writeLock, lock_n, timeout)
+
+	@classmethod
+	def _asyncWaiters(cls):
+		#One bounded pool per process, created on first contended acquire_async
+		if cls._async_waiters is None:
+			cls._async_waiters = ThreadPoolExecutor(max_workers = ASYNC_WAITERS, thread_name_prefix = 'pylocksfile-waiter')
+
+		return cls._async_waiters
+
+	async def _pollLockRange(self, writeLock, lock_n, n_locks, deadline):
+		#Non-blocking attempts with capped exponential backoff, while the loop runs the other tasks - until acquired or timed out
+		delay = SPIN_MIN_DELAY
+
+		while True:
+			pause = delay if deadline is None else max(0.0, min(delay, deadline - time.monotonic()))
+			await asyncio.sleep(pause)
+
+			if self._tryLockRange(writeLock, lock_n, n_locks):
+				return True
+
+			if deadline is not None and time.monotonic() >= deadline:
+				return False
+
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+	async def _fairWaitAsync(self, writeLock, missing_interval, deadline):
+		#The fairness turn and the os lock, on a waiter thread, which gives up at the deadline. The loop gives up a backoff
+		#later - on a request still queued for a thread (the pool busy with other waits), which returns at once when it gets one.
+		cancel_event = threading.Event()
+		waiter = asyncio.get_running_loop().run_in_executor(self._asyncWaiters(), self._fairWaitRange, writeLock, missing_interval, deadline, cancel_event)
+
+		try:
+			if deadline is None:
+				return await asyncio.shield(waiter)
+
+			return await asyncio.wait_for(asyncio.shield(waiter), max(0.0, deadline - time.monotonic()) + SPIN_MAX_DELAY)
+
+		except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+			#Stop the waiter. If it got the lock in the meantime, give it back once it is done.
+			cancel_event.set()
+			waiter.add_done_callback(lambda waiter: self._cancelledWait(waiter, missing_interval, writeLock))
+			if isinstance(e, asyncio.CancelledError):
+				raise
+
+			return False
+
+	def _fairWaitRange(self, writeLock, lock_interval, deadline, cancel_event):
+		#Runs on a waiter thread - the turn of the request under the fairness policy, then non-blocking attempts with backoff,
+		#until acquired, cancelled or timed out. Leaves the queue whatever happens.
+		if cancel_event.is_set():
+			return False
+
+		tracer = self._tracer
+		if tracer is not None and not tracer.sampled(lock_interval.lock_n):
+			tracer = None
+		if tracer is not None:
+			tracer.record(TRACE_REQUEST, writeLock, lock_interval.lock_n, lock_interval.n_locks)
+
+		start_time = perf_counter_ns()
+		acquired = False
+		contended = True
+
+		try:
+			token = self._fair.enter(writeLock, lock_interval.lock_n, lock_interval.n_locks, True, deadline, cancel_event)
+
+			if token is not None:
+				try:
+					contended = not self._tryLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks)
+					acquired = not contended or self._waitLockRange(writeLock, lock_interval.lock_n, lock_interval.n_locks, deadline, cancel_event)
+				finally:
+					self._fair.leave(token, writeLock, lock_interval.lock_n, lock_interval.n_locks, acquired)
+
+		finally:
+			if tracer is not None:
+				tracer.record(TRACE_ACQUIRED if acquired else TRACE_FAILED, writeLock, lock_interval.lock_n, lock_interval.n_locks)
+
+		if self._metrics is not None:
+			if acquired:
+				now = perf_counter_ns()
+				self._metrics.recordAcquire(lock_interval.lock_n, now - start_time, contended, now)
+			else:
+				self._metrics.recordContended(lock_interval.lock_n)
+
+		return acquired
+
+	def _waitLockRange(self, writeLock, lock_n, n_locks, deadline, cancel_event):
+		#Non-blocking attempts with capped exponential backoff until acquired, cancelled or timed out
+		delay = SPIN_MIN_DELAY
+
+		while not cancel_event.is_set():
+			if self._tryLockRange(writeLock, lock_n, n_locks):
+				return True
+
+			if deadline is not None:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return False
+				delay = min(delay, remaining)
+
+			cancel_event.wait(delay)
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+		return False
+
+	def _cancelledWait(self, waiter, missing_interval, writeLock):
+		if waiter.cancelled() or waiter.exception() is not None or not waiter.result():
+			return
+
+		#The waiter locked missing_interval for a task that is gone - give the os back the holds this instance has there
+		#now (other coroutines may have taken or released some while it waited), without counting one for the task
+		current = self._lockIntervals.snapshot(missing_interval)
+		self._lockIntervals.insertInterval(missing_interval, writeLock)
+		self._restoreIntervals(missing_interval, current, writeLock)
+
+	def _restoreIntervals(self, lock_interval, previous, writeLock):
+		#Undo a successful acquire of lock_interval in writeLock mode. previous is the snapshot of the held segments it replaced.
+		gap_start = lock_interval.lock_n
+		restored = list()
+
+		for segment in previous + [interval_count_tuple(lock_interval.lock_n + lock_interval.n_locks, 0, writeLock, 0)]:
+			if segment.lock_n > gap_start:
+				#Was not held before - free it
+				self._unlockRange(gap_start, segment.lock_n - gap_start)
+
+			gap_start = segment.lock_n + segment.n_locks
+
+			if not segment.n_locks:
+				continue
+
+			if segment.writeLock != writeLock:
+				#Was held in the other mode - convert back. Going back to read never blocks, going back to write may fail.
+				try:
+					self._lockRange(segment.writeLock, segment.lock_n, segment.n_locks, False)
+				except (IOError, OSError):
+					if self._verbose:
+						self.printVerbose('Could not restore write lock on ' + str(segment) + ', kept as read lock')
+					segment = segment._replace(writeLock = writeLock)
+
+			restored.append(segment)
+
+		self._lockIntervals.restore(lock_interval, restored)
+
+		return
+
+	def release(self, lock_n = None):
+
+		if lock_n is None:
+			
+			#If lock_n is None, release all the recorded locks, and reset list
+			if not len(self._lockIntervals):
+				return
+
+			if self._metrics is not None:
+				self._metrics.recordReleaseAll(perf_counter_ns())
+
+			if self._handle is not None and not self._handle.others(self):
+				#Nothing else of this process can hold locks of the file - a single unlock of the whole file (length 0 - up to EOF)
+				lock_intervals = [interval_tuple(0, 0)]
+			else:
+				lock_intervals = self._lockIntervals.intervals
+
+			#Clear all the records
+			self._lockIntervals.reset()
+
+			#Gates of upgradeable locks - the whole-file unlock covers them, but a hierarchy's only unlocks the rows it locked
+			if len(self._gates):
+				if lock_intervals[0].n_locks or self._hierarchy is not None:
+					for gate_interval in self._gates.intervals:
+						self._unlockGates(gate_interval)
+
+				self._gates.reset()
+		else:
+			#Drop one hold of the interval. Will raise Exception on invalid input.
+			#Only the parts no longer held at all are unlocked - an outer acquire of the same locks keeps them.
+			lock_intervals = self._lockIntervals.releaseInterval(lock_n)
+
+			if self._metrics is not None:
+				now = perf_counter_ns()
+				for lock_i in lock_intervals:
+					self._metrics.recordRelease(lock_i.lock_n, lock_i.n_locks, now)
+
+		if self._verbose:
+			self.printVerbose('Releasing ->' + str(lock_n))
+
+		if self._handle is not None:
+			
+			#Iterate over the interval of locks
+			for lock_i in lock_intervals:
+
+				#Free the locks in current interval
+				self._unlockRange(lock_i.lock_n, lock_i.n_locks)
+
+		#self.printVerbose('read Locked ->' + str(self._lockIntervals.readIntervals))
+		#self.printVerbose('write Locked ->' + str(self._lockIntervals.writeIntervals))
+
+		return
+
+	"""
+	Release a scattered set of locks (indices and (lock_n, n_locks) intervals, or a NumPy integer array), one hold each.
+	The locks no longer held are unlocked in the fewest contiguous runs.
+	"""
+	def release_many(self, indices_or_ranges):
+		freed = list()
+
+		for lock_interval in self._lockIntervals.coalesce(indices_or_ranges):
+			for freed_interval in self._lockIntervals.releaseInterval(lock_interval):
+				if freed and freed[-1][1] == freed_interval.lock_n:
+					freed[-1][1] += freed_interval.n_locks
+				else:
+					freed.append([freed_interval.lock_n, freed_interval.lock_n + freed_interval.n_locks])
+
+		if self._metrics is not None:
+			now = perf_counter_ns()
+			for start, end in freed:
+				self._metrics.recordRelease(start, end - start, now)
+
+		if self._verbose:
+			self.printVerbose('Releasing ->' + str(freed))
+
+		for start, end in freed:
+			self._unlockRange(start, end - start)
+
+		return
+
+	"""
+	Locks of other holders that conflict with a write lock of lock_n (index or (lock_n, n_locks) interval, None for the whole file),
+	as a sorted list of lock_holder_tuple(pid, writeLock, lock_n, n_locks) with each lock's full range. pid is -1 for OFD holders.
+	Asks the os (see scanLocks) without taking or waiting for any lock. With 'posix' the locks of this process are left out,
+	with 'ofd' only the locks of this instance.
+	"""
+	def holders(self, lock_n = None):
+		if lock_n is None:
+			lock_interval = interval_tuple(0, 0)
+		else:
+			lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		return scanLocks(self._open().fd, lock_interval.lock_n, lock_interval.n_locks, ofd = self._backend == OFD_BACKEND)
+
+	def _lockRange(self, writeLock, lock_n, n_locks, blocking):
+		#Kernel lock of [lock_n, lock_n + n_locks). Raises IOError/OSError when not acquired.
+		if self._hierarchy is not None:
+			if self._fd is None:
+				self._open()
+
+			self._hierarchy.lock(writeLock, lock_n, n_locks, blocking)
+
+
+		elif self._backend == OFD_BACKEND:
+			if self._fd is None:
+				self._open()
+
+			#l_pid must be 0 for OFD locks
+			fcntl.fcntl(self._fd, F_OFD_SETLKW if blocking else F_OFD_SETLK, flock_struct.pack(fcntl.F_WRLCK if writeLock else fcntl.F_RDLCK, os.SEEK_SET, lock_n, n_locks, 0))
+		else:
+			if self._fd is None:
+				self._open()
+
+			if writeLock or len(self._handle._users) < 2:
+				fcntl.lockf(self._fd, (fcntl.LOCK_EX if writeLock else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB), n_locks, lock_n, 0) #fd, cmd, len, start, whence = 0
+			else:
+				self._readLockShared(self._siblingLocks(lock_n, n_locks), lock_n, n_locks, blocking)
+
+		if self._versions is not None:
+			self._versioned(writeLock, lock_n, n_locks)
+
+	def _versioned(self, writeLock, lock_n, n_locks):
+		#Counters of a granted os lock - odd while write locked, even once converted to read
+		if writeLock:
+			self._versions.begin(lock_n, n_locks)
+		else:
+			self._versions.end(lock_n, n_locks)
+
+	def _siblingLocks(self, lock_n, n_locks):
+		#lockInterval of the locks other 'posix' instances of the process hold within the range (the strongest mode of any).
+		#The process holds their union at the os.
+		segments = [segment for other in self._handle.others(self) for segment in other._lockIntervals.overlapping((lock_n, n_locks))]
+
+		#Write segments last, so they win over read ones
+		siblings = lockInterval()
+		for segment in sorted(segments, key = lambda segment: segment.writeLock):
+			siblings.insertInterval((segment.lock_n, segment.n_locks), segment.writeLock)
+
+		return siblings
+
+	def _readLockShared(self, siblings, lock_n, n_locks, blocking):
+		#Read lock with other instances of the process using the lockfile - what they write lock stays write locked.
+		#Parts the process does not hold are locked first (all or nothing), then write locks only this instance holds are
+		#converted, which never waits.
+		end = lock_n + n_locks
+		free = list()
+		converted = list()
+		gap_start = lock_n
+
+		for segment in siblings.modeIntervals + [interval_mode_tuple(end, 0, True)]:
+			if segment.lock_n > gap_start:
+				#Held by no other instance - this instance's write locks are converted, the rest is locked
+				for held in self._lockIntervals.overlapping((gap_start, segment.lock_n - gap_start)):
+					if held.lock_n > gap_start:
+						free.append((gap_start, held.lock_n - gap_start))
+					if held.writeLock:
+						converted.append((held.lock_n, held.n_locks))
+					gap_start = held.lock_n + held.n_locks
+				if segment.lock_n > gap_start:
+					free.append((gap_start, segment.lock_n - gap_start))
+
+			elif not segment.writeLock and segment.n_locks:
+				#Read locked by others - this instance's write locks there are converted
+				converted += [(held.lock_n, held.n_locks) for held in self._lockIntervals.overlapping((segment.lock_n, segment.n_locks)) if held.writeLock]
+
+			gap_start = segment.lock_n + segment.n_locks
+
+		taken = list()
+		try:
+			for start, length in free:
+				fcntl.lockf(self._fd, fcntl.LOCK_SH | (0 if blocking else fcntl.LOCK_NB), length, start, 0)
+				taken.append((start, length))
+		except BaseException:
+			for start, length in taken:
+				fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start, 0)
+			raise
+
+		for start, length in converted:
+			fcntl.lockf(self._fd, fcntl.LOCK_SH, length, start, 0)
+
+	def _tryLockRange(self, writeLock, lock_n, n_locks):
+		#Non-blocking kernel lock. Returns False when the range is held by others, raises on any other error.
+		try:
+			self._lockRange(writeLock, lock_n, n_locks, False)
+		except (IOError, OSError) as e:
+			if e.errno not in (errno.EACCES, errno.EAGAIN):
+				raise
+			return False
+
+		return True
+
+	def _timedLockRange(self, writeLock, lock_n, n_locks, timeout):
+		start_time = time.monotonic()
+		deadline = start_time + timeout
+
+		#Spin phase - non-blocking attempts with exponential backoff, within the adaptive spin budget
+		spin_deadline = min(deadline, start_time + self._spin_budget)
+		delay = SPIN_MIN_DELAY
+
+		acquired = self._tryLockRange(writeLock, lock_n, n_locks)
+		while not acquired:
+			now = time.monotonic()
+			if now >= spin_deadline:
+				break
+
+			time.sleep(min(delay, spin_deadline - now))
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+			acquired = self._tryLockRange(writeLock, lock_n, n_locks)
+
+		#Spin longer next time if spinning paid off, shorter if it did not
+		if acquired:
+			self._spin_budget = min(self._spin_budget * 2, SPIN_MAX_BUDGET)
+		else:
+			self._spin_budget = max(self._spin_budget / 2, SPIN_MIN_BUDGET)
+
+			#Blocking phase - for the rest of the timeout
+			remaining = deadline - time.monotonic()
+			if remaining > 0:
+				acquired = self._boundedLockRange(writeLock, lock_n, n_locks, remaining, deadline)
+
+		self._last_wait_time = time.monotonic() - start_time
+
+		return acquired
+
+	def _boundedLockRange(self, writeLock, lock_n, n_locks, remaining, deadline):
+		#A timer signal can only be handled by the main thread, and must not steal an alarm set by the application.
+		if threading.current_thread() is not threading.main_thread() or signal.getsignal(signal.SIGALRM) not in (signal.SIG_DFL, signal.SIG_IGN) or signal.getitimer(signal.ITIMER_REAL)[0]:
+			#Keep polling, with the backoff capped at SPIN_MAX_DELAY
+			delay = SPIN_MIN_DELAY
+			while not self._tryLockRange(writeLock, lock_n, n_locks):
+				now = time.monotonic()
+				if now >= deadline:
+					return False
+
+				time.sleep(min(delay, deadline - now))
+				delay = min(delay * 2, SPIN_MAX_DELAY)
+
+			return True
+
+		#The handler only raises while the blocking request is pending
+		armed = [True]
+		def alarmHandler(signum, frame):
+			if armed[0]:
+				armed[0] = False
+				raise _lockTimeout()
+
+		try:
+			previous_handler = signal.signal(signal.SIGALRM, alarmHandler)
+			try:
+				#setitimer truncates to microseconds, and a zero timer would never fire
+				signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-5))
+				self._lockRange(writeLock, lock_n, n_locks, True)
+				armed[0] = False
+			finally:
+				armed[0] = False
+				signal.setitimer(signal.ITIMER_REAL, 0)
+				signal.signal(signal.SIGALRM, previous_handler)
+
+		except _lockTimeout:
+			#The interrupted request was removed from the kernel's queue (EINTR), so nothing stale is left behind.
+			#The alarm may have fired just after the lock was granted - re-locking a held range is a no-op, so one last attempt tells.
+			return self._tryLockRange(writeLock, lock_n, n_locks)
+
+		return True
+
+	def _unlockRange(self, lock_n, n_locks):
+		#Ranges are always traced - they may hold sampled locks past the first
+		if self._tracer is not None and (n_locks != 1 or self._tracer.sampled(lock_n)):
+			self._tracer.record(TRACE_RELEASED, False, lock_n, n_locks)
+
+		#Writers are done before the lock is free
+		if self._versions is not None:
+			self._versions.end(lock_n, n_locks)
+
+		if self._hierarchy is not None:
+			self._hierarchy.unlock(lock_n, n_locks)
+		elif self._backend == OFD_BACKEND:
+			fcntl.fcntl(self._fd, F_OFD_SETLK, flock_struct.pack(fcntl.F_UNLCK, os.SEEK_SET, lock_n, n_locks, 0))
+		else:
+			if not n_locks or len(self._handle._users) < 2:
+				fcntl.lockf(self._fd, fcntl.LOCK_UN, n_locks, lock_n, 0)
+			else:
+				#Keep what other instances of the process hold - where they only read, a write lock of this one goes back to read
+				gap_start = lock_n
+				for segment in self._siblingLocks(lock_n, n_locks).modeIntervals + [interval_mode_tuple(lock_n + n_locks, 0, True)]:
+					if segment.lock_n > gap_start:
+						fcntl.lockf(self._fd, fcntl.LOCK_UN, segment.lock_n - gap_start, gap_start, 0)
+					if not segment.writeLock and segment.n_locks:
+						fcntl.lockf(self._fd, fcntl.LOCK_SH, segment.n_locks, segment.lock_n, 0)
+					gap_start = segment.lock_n + segment.n_locks
+
+		#Ends 'phase_fair' write phases on the range
+		if self._fair is not None:
+			self._fair.unlocked(lock_n, n_locks)
+
+	"""
+	A with statement over lock_n (always blocking) - each call is its own block, so blocks of several threads sharing the
+	instance, and blocks exited out of order, each release what they acquired. Holds are counted: an inner block over
+	locks already held makes no system call, and its exit leaves them to the outer block. Blocks never weaken a lock -
+	a read block within write locks is one more write hold, and a write block converts the read locks it covers, which
+	stay write locked (with their holds) until their last block exits.
+
+	Threads sharing an instance share its locks (the instance is a single owner, they do not exclude each other).
+	Their blocks are serialized by the instance - one block at a time waits for the os, the others enter and exit
+	what is already held meanwhile (exits overlapping the waiting request wait for it).
+	"""
+	def __call__(self, writeLock = False, lock_n = 0):
+		return _lockContext(self, writeLock, lock_n)
+
+	def __enter__(self):
+		raise IllegalWithStatement('pylocksfile - use with locksfile(writeLock, lock_n)')
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return None
+
+	def _enterBlock(self, writeLock, lock_n):
+		if self._verbose:
+			self.printVerbose('With statement (always blocking). Locking ->' + str((writeLock, lock_n)))
+
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		with self._blocks_guard:
+			while True:
+				#A write block converts the read locks of the range (of any block), a read block only needs what is not held
+				if writeLock:
+					missing_interval = self._lockIntervals.missingSpan(lock_interval, True)
+					missing_intervals = [missing_interval] if missing_interval is not None else []
+				else:
+					missing_intervals = self._lockIntervals.unheld(lock_interval)
+
+				#All held - one more hold, no system call
+				if not missing_intervals:
+					self._lockIntervals.insertInterval(lock_interval, writeLock, keep = True)
+					return True
+
+				if self._requesting is None:
+					break
+
+				self._n_blocked += 1
+				self._blocks.wait()
+				self._n_blocked -= 1
+
+			self._requesting = lock_interval
+
+		requested = list()
+		try:
+			for missing_interval in missing_intervals:
+				if not self._requestRange(writeLock, lock_interval, missing_interval, True, None):
+					break
+				requested.append(missing_interval)
+		finally:
+			with self._blocks_guard:
+				acquired = len(requested) == len(missing_intervals)
+				if acquired:
+					self._lockIntervals.insertInterval(lock_interval, writeLock, keep = True)
+				else:
+					#All or nothing
+					for missing_interval in requested:
+						self._unlockRange(missing_interval.lock_n, missing_interval.n_locks)
+
+				self._requesting = None
+				if self._n_blocked:
+					self._blocks.notify_all()
+
+		return acquired
+
+	def _exitBlock(self, lock_n):
+		if self._verbose:
+			self.printVerbose('With statement. unLocking ->' + str(lock_n))
+
+		lock_interval = self._lockIntervals.preprocessInput(lock_n)
+
+		with self._blocks_guard:
+			#The waiting request counts on what it overlaps staying held. A hierarchy's intention locks overlap any request.
+			while self._requesting is not None and (self._hierarchy is not None or (self._requesting.lock_n < lock_interval.lock_n + lock_interval.n_locks
+					and lock_interval.lock_n < self._requesting.lock_n + self._requesting.n_locks)):
+				self._n_blocked += 1
+				self._blocks.wait()
+				self._n_blocked -= 1
+
+			self.release(lock_n = lock_interval)
+
+	def __del__(self):
+		#The constructor raised before anything was opened
+		if not hasattr(self, '_lockIntervals'):
+			return
+
+		self.printVerbose('Deleting. Release all locks')
+		
+		#Release all
+		self.release(lock_n = None)
+
+		#OFD locks belong to this instance's open file, so closing it can not drop locks of other instances.
+		#POSIX locks belong to the process - the shared lockfile is closed with its last instance.
+		if self._handle is not None:
+			self._handle.detach(self)
+			self._handle = None
+			self._fd = None
+
+		if self._nodes_handle is not None:
+			self._nodes_handle.detach(self)
+			self._nodes_handle = None
+
+		if self._wfg is not None:
+			self._wfg.close()
+
+		if self._fair is not None:
+			self._fair.close()
+
+		if self._versions is not None:
+			self._versions.close()
+		
+		return None
+
+	#Pickles as the path and the arguments - e.g. for pool workers, which get their own instance holding nothing
+	def __reduce__(self):
+		return (_unpickleLocksfile, (self._locksfile_path, self._arguments))
+
+	def _forked(self):
+		#In a forked child (see _afterForkInChild) - the copy holds none of the parent's locks, and opens the lockfile again
+		#on first use. The sidecar tables' slots are the parent's, only their inherited descriptors are closed before joining again.
+		self._lockIntervals.reset()
+		self._gates.reset()
+
+		#Only the forking thread is left
+		self._blocks_guard = threading.Lock()
+		self._blocks = threading.Condition(self._blocks_guard)
+		self._requesting = None
+		self._n_blocked = 0
+
+		#Not the parent's first slot
+		self._slots_guard = threading.Lock()
+		self._slot_offset = int.from_bytes(os.urandom(4), 'little')
+
+		if self._handle is not None:
+			self._handle.forget()
+			self._handle = None
+			self._fd = None
+
+		if self._nodes_handle is not None:
+			self._nodes_handle.forget()
+			self._nodes_handle = None
+
+		for sidecar in (self._wfg, self._fair, self._versions):
+			if sidecar is not None and sidecar._fd is not None:
+				os.close(sidecar._fd)
+				sidecar._fd = None
+
+		if self._wfg is not None:
+			self._wfg = waitForGraph(self._locksfile_path, self._backend)
+
+		if self._fair is not None:
+			self._fair = fairnessTable(self._locksfile_path, self._arguments['fairness'])
+
+		#Counters this instance made odd are the parent's to make even
+		if self._versions is not None:
+			self._versions = versionTable(self._locksfile_path, int(self._arguments['versions']))
+
+		if self._tracer is not None:
+			self._tracer = _openTracer(self._arguments['trace'], self._locksfile_path, int(self._arguments['trace_size']), float(self._arguments['trace_sample']))
+
+	def printVerbose(self, msg):
+		if self._verbose:
+			print(str(type(self)), '-' , str(self._l_id) , '-', msg)
+
+
+"""
+shardedLocksfile class implementation
+
+Spreads the lock indices over n_shards lockfiles ('shard0.lock' ... in locksfile_dir), each with its own pylocksfile (open file
+and inode). Linux keeps a single lock list per inode, behind a single spinlock, and checks a request against every lock of the
+file - sharding keeps each list n_shards times shorter and lets requests of different shards run side by side.
+
+Lock i is in shard (i // block_size) % n_shards:
+	- block_size 1 (default) - by modulo, neighbouring locks go to different shards. Spreads a hot region of single locks.
+	- block_size > 1 - by block, ranges within a block stay in one shard. For range heavy workloads.
+Locks are numbered within their shard so that a range is a single contiguous range of each shard it touches.
+
+Same acquire/release API as pylocksfile - requests touching several shards are split, and taken shard by shard in shard order,
+all or nothing. Every user of the lockfiles must use the same n_shards and block_size. Other arguments (backend, fairness...)
+are passed to the pylocksfile of each shard. Note - deadlock_detection only sees cycles within a shard.
+"""
+class shardedLocksfile(object):
+	def __init__(self, locksfile_dir, n_shards, block_size = 1, **kwargs):
+		if not isinstance(locksfile_dir, str) or not os.path.isdir(locksfile_dir):
+			raise IllegalArgumentError('shardedLocksfile - locksfile_dir directory does not exist.')
+
+		if not isinstance(n_shards, Integral) or n_shards < 1:
+			raise IllegalArgumentError('shardedLocksfile - n_shards argument must be a positive integer.')
+
+		if not isinstance(block_size, Integral) or block_size < 1:
+			raise IllegalArgumentError('shardedLocksfile - block_size argument must be a positive integer.')
+
+		self._locksfile_dir = os.path.abspath(locksfile_dir)
+		self._n_shards = int(n_shards)
+		self._block_size = int(block_size)
+
+		self._shards = [pylocksfile(locksfile_path = os.path.join(self._locksfile_dir, 'shard' + str(k) + '.lock'), **kwargs) for k in range(self._n_shards)]
+
+		#Input checks and run merging
+		self._intervals = lockInterval()
+
+	@property
+	def locksfile_dir(self):
+		return self._locksfile_dir
+
+	@property
+	def n_shards(self):
+		return self._n_shards
+
+	@property
+	def block_size(self):
+		return self._block_size
+
+	@property
+	def shards(self):
+		return tuple(self._shards)
+
+	def shard(self, lock_n):
+		#(shard, lock index within the shard) of lock lock_n
+		block, offset = divmod(lock_n, self._block_size)
+
+		return block % self._n_shards, (block // self._n_shards) * self._block_size + offset
+
+	def split(self, indices_or_ranges):
+		#{shard : [interval_tuple within the shard, ...]} of any iterable of indices and (lock_n, n_locks) intervals
+		B, K = self._block_size, self._n_shards
+		parts = dict()
+
+		for interval in self._intervals.coalesce(indices_or_ranges):
+			first_block = interval.lock_n // B
+			last = interval.lock_n + interval.n_locks - 1
+			last_block = last // B
+
+			for k in range(K):
+				#First and last lock of shard k within the interval
+				block = first_block + (k - first_block) % K
+				if block > last_block:
+					continue
+				start = interval.lock_n if block == first_block else block * B
+
+				block = last_block - (last_block - k) % K
+				end = last if block == last_block else block * B + B - 1
+
+				local_start = self.shard(start)[1]
+				local_end = self.shard(end)[1] + 1
+
+				runs = parts.setdefault(k, list())
+				if runs and runs[-1].lock_n + runs[-1].n_locks == local_start:
+					runs[-1] = interval_tuple(runs[-1].lock_n, local_end - runs[-1].lock_n)
+				else:
+					runs.append(interval_tuple(local_start, local_end - local_start))
+
+		return parts
+
+	"""
+	Acquire lock_n (index or (lock_n, n_locks) interval) for reading (shared) or writing (exclusive), like pylocksfile.acquire.
+	A request of a single shard is that shard's acquire. One touching several shards takes them in shard order - if a part
+	is not acquired (non-blocking, timeout or deadlock), the parts taken so far are rolled back and False is returned.
+	timeout covers the whole request.
+	"""
+	def acquire(self, writeLock = False, lock_n = 0, blocking = True, timeout = None):
+		parts = self.split([lock_n])
+
+		if len(parts) == 1:
+			(k, runs), = parts.items()
+			if len(runs) == 1:
+				return self._shards[k].acquire(writeLock = writeLock, lock_n = runs[0], blocking = blocking, timeout = timeout)
+
+		return self._acquireParts(parts, writeLock, blocking, timeout)
+
+	#Acquire a scattered set of locks (indices and intervals, or a NumPy integer array) all or nothing, in shard order
+	def acquire_many(self, indices_or_ranges, writeLock = False, blocking = True):
+		return self._acquireParts(self.split(indices_or_ranges), writeLock, blocking, None)
+
+	def _acquireParts(self, parts, writeLock, blocking, timeout):
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		#Runs taken so far, with the held segments they replaced
+		taken = list()
+
+		try:
+			for k in sorted(parts):
+				shard = self._shards[k]
+
+				for run in parts[k]:
+					previous = shard._lockIntervals.snapshot(run)
+					remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+
+					if not shard.acquire(writeLock = writeLock, lock_n = run, blocking = blocking, timeout = remaining):
+						self._rollback(taken, writeLock)
+						return False
+
+					taken.append((shard, run, previous))
+
+		except DeadlockError:
+			self._rollback(taken, writeLock)
+			raise
+
+		return True
+
+	def _rollback(self, taken, writeLock):
+		#All or nothing - undo the runs already taken, last first
+		for shard, run, previous in reversed(taken):
+			shard._restoreIntervals(run, previous, writeLock)
+
+	#Release one hold of lock_n (as acquired), or all the locks of every shard when lock_n is None
+	def release(self, lock_n = None):
+		if lock_n is None:
+			for shard in self._shards:
+				shard.release()
+			return
+
+		for k, runs in self.split([lock_n]).items():
+			for run in runs:
+				self._shards[k].release(lock_n = run)
+
+	#Release one hold of a scattered set of locks
+	def release_many(self, indices_or_ranges):
+		for k, runs in self.split(indices_or_ranges).items():
+			self._shards[k].release_many(runs)
+
+	#A with statement over lock_n (always blocking), each call its own block
+	def __call__(self, writeLock = False, lock_n = 0):
+		return _lockContext(self, writeLock, lock_n)
+
+	def __enter__(self):
+		raise IllegalWithStatement('shardedLocksfile - use with locksfile(writeLock, lock_n)')
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return None
+
+	def _enterBlock(self, writeLock, lock_n):
+		return self.acquire(writeLock = writeLock, lock_n = lock_n)
+
+	def _exitBlock(self, lock_n):
+		self.release(lock_n = lock_n)
+
+
+"""
+recordStore class implementation
+
+Fixed size records of a data file, each guarded by a lock - record i by lock lock_offset + i of locksfile. The data file is
+memory mapped (shared), and a record is accessed in place through a memoryview of the mapping, taken under the lock:
+
+	store = recordStore("data.bin", record_size = 64, n_records = 100000)
+	with store.read(i) as view:		#read only view of record i, read locked
+		...
+	with store.write(i, n) as view:	#writable view of records i ... i + n - 1, one write locked range
+		view[0:8] = ...
+
+No copy and no system call for the data, and consecutive records are a single lock range and a single view. The view is
+released when the block exits - anything made from it (a slice, a NumPy array) still reaches the mapping, but no longer
+under the lock. Blocks are the with blocks of the locksfile (see pylocksfile.__call__), so threads may share a store,
+and nested blocks count holds.
+
+argument:
+	- data_path (str): the data file, created if missing.
+	- record_size (int): bytes per record.
+	- n_records (int): the data file is extended (with zeros) to n_records records when shorter, never truncated.
+		None - as many as the file holds, which must be a whole number of records.
+	- locksfile: a pylocksfile (or shardedLocksfile, remoteLocksfile) to share, or the path of a lockfile to open with
+		the other arguments (backend, fairness...). None - data_path + '.lock'.
+	- lock_offset (int): lock index of record 0.
+
+Every process using the data file must use the same record_size, locksfile and lock_offset. The number of records is
+fixed while the store is open. Pickles as its arguments (a store holding nothing).
+"""
+class recordStore(object):
+	def __init__(self, data_path, record_size, n_records = None, locksfile = None, lock_offset = 0, **kwargs):
+		if not isinstance(data_path, str):
+			raise IllegalArgumentError('recordStore - data_path argument must be a path.')
+
+		if not isinstance(record_size, Integral) or record_size < 1:
+			raise IllegalArgumentError('recordStore - record_size argument must be a positive integer.')
+
+		if n_records is not None and (not isinstance(n_records, Integral) or n_records < 1):
+			raise IllegalArgumentError('recordStore - n_records argument must be a positive integer.')
+
+		if not isinstance(lock_offset, Integral) or lock_offset < 0:
+			raise IllegalArgumentError('recordStore - lock_offset argument must be a non-negative integer.')
+
+		if locksfile is not None and not isinstance(locksfile, str) and kwargs:
+			raise IllegalArgumentError('recordStore - lockfile arguments only apply to a lockfile path.')
+
+		self._data_path = os.path.abspath(data_path)
+		self._record_size = int(record_size)
+		self._lock_offset = int(lock_offset)
+		self._arguments = dict(kwargs, n_records = n_records, locksfile = locksfile, lock_offset = lock_offset)
+
+		if locksfile is None or isinstance(locksfile, str):
+			locksfile = pylocksfile(locksfile_path = self._data_path + '.lock' if locksfile is None else locksfile, **kwargs)
+		self._locksfile = locksfile
+
+		self._mmap = None
+		self._view = None
+
+		fd = os.open(self._data_path, os.O_RDWR | os.O_CREAT, 0o666)
+		try:
+			size = os.fstat(fd).st_size
+
+			if n_records is None:
+				if not size or size % self._record_size:
+					raise IllegalArgumentError('recordStore - the data file does not hold a whole number of records, n_records is needed.')
+				n_records = size // self._record_size
+
+			elif size < n_records * self._record_size:
+				os.ftruncate(fd, n_records * self._record_size)
+
+			self._n_records = int(n_records)
+			self._mmap = mmap.mmap(fd, self._n_records * self._record_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+		finally:
+			os.close(fd)
+
+		self._view = memoryview(self._mmap)
+
+	@property
+	def data_path(self):
+		return self._data_path
+
+	@property
+	def record_size(self):
+		return self._record_size
+
+	@property
+	def n_records(self):
+		return self._n_records
+
+	@property
+	def lock_offset(self):
+		return self._lock_offset
+
+	@property
+	def locksfile(self):
+		return self._locksfile
+
+	def _range(self, record_n, n):
+		#Lock interval of records [record_n, record_n + n). Will raise Exception on invalid input.
+		if not (type(record_n) is int or isinstance(record_n, Integral)) or not (type(n) is int or isinstance(n, Integral)) or n < 1 or record_n < 0 or record_n + n > self._n_records:
+			raise IllegalArgumentError('recordStore - records ' + str(record_n) + ' + ' + str(n) + ' are not within the ' + str(self._n_records) + ' records.')
+
+		return interval_tuple(self._lock_offset + int(record_n), int(n))
+
+	#With block of a read only view of records record_n ... record_n + n - 1, read locked
+	def read(self, record_n, n = 1):
+		return _recordContext(self, False, self._range(record_n, n))
+
+	#With block of a writable view of records record_n ... record_n + n - 1, write locked
+	def write(self, record_n, n = 1):
+		return _recordContext(self, True, self._range(record_n, n))
+
+	#Writes the changed pages of the mapping to the data file (the os does anyway, in its time)
+	def flush(self):
+		self._mmap.flush()
+
+	#Unmaps the data file. Fails (BufferError) while a view or anything made from one is in use.
+	def close(self):
+		if self._view is not None:
+			self._view.release()
+			self._view = None
+
+		if self._mmap is not None:
+			self._mmap.close()
+			self._mmap = None
+
+	def __del__(self):
+		#The constructor raised before mapping
+		if getattr(self, '_mmap', None) is None:
+			return
+
+		try:
+			self.close()
+		except BufferError:
+			#A view still in use keeps the mapping until it goes
+			pass
+
+	def __reduce__(self):
+		return (_unpickleRecordStore, (self._data_path, self._record_size, self._arguments))
+
+def _unpickleRecordStore(data_path, record_size, arguments):
+	return recordStore(data_path = data_path, record_size = record_size, **arguments)
+
+#Returned by recordStore.read and recordStore.write - a view of the records, valid within the block
+class _recordContext(object):
+	def __init__(self, store, writeLock, lock_interval):
+		self._store = store
+		self._writeLock = writeLock
+		self._lock_interval = lock_interval
+		self._views = None
+
+	def __enter__(self):
+		store = self._store
+		#A with block of the locksfile (see _lockContext)
+		if store._locksfile._enterBlock(self._writeLock, self._lock_interval) is False:
+			raise DeadlockError('recordStore - deadlock detected by os for records of ' + str(self._lock_interval))
+
+		start = (self._lock_interval.lock_n - store._lock_offset) * store._record_size
+		view = store._view[start:start + self._lock_interval.n_locks * store._record_size]
+		self._views = (view,) if self._writeLock else (view, view.toreadonly())
+
+		return self._views[-1]
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		views = self._views
+		self._views = None
+
+		try:
+			for view in reversed(views):
+				view.release()
+		finally:
+			self._store._locksfile._exitBlock(self._lock_interval)
+
+		return None
+
+
+"""
+lockSemaphore class implementation
+
+Counting semaphore across processes - value slots, the write locks [lock_offset, lock_offset + value) of a lockfile, one per
+holder (see pylocksfile.acquire_any):
+
+	sem = lockSemaphore("workers.lock", 4)
+	with sem() as slot:			#index of the slot taken, 0 ... value - 1
+		...
+	slot = sem.acquire(timeout = 1.0)	#None when timed out
+	sem.release(slot)
+
+A slot is a lock, so the slots of a process that dies (or is killed) are free again, and the lockfile tools (holders,
+pylocksfile-top) show who holds them.
+
+argument:
+	- locksfile: a pylocksfile to share, or the path of a lockfile to open with the other arguments (backend, fairness...).
+	- value (int): number of slots.
+	- lock_offset (int): lock index of slot 0.
+
+Every process using the semaphore must use the same lockfile, value and lock_offset. Pickles as its arguments (a semaphore
+holding no slot).
+"""
+class lockSemaphore(object):
+	def __init__(self, locksfile, value, lock_offset = 0, **kwargs):
+		if not isinstance(locksfile, (str, pylocksfile)):
+			raise IllegalArgumentError('lockSemaphore - locksfile argument must be a pylocksfile or a path.')
+
+		if not isinstance(value, Integral) or value < 1:
+			raise IllegalArgumentError('lockSemaphore - value argument must be a positive integer.')
+
+		if not isinstance(lock_offset, Integral) or lock_offset < 0:
+			raise IllegalArgumentError('lockSemaphore - lock_offset argument must be a non-negative integer.')
+
+		if not isinstance(locksfile, str) and kwargs:
+			raise IllegalArgumentError('lockSemaphore - lockfile arguments only apply to a lockfile path.')
+
+		self._value = int(value)
+		self._lock_offset = int(lock_offset)
+		self._arguments = dict(kwargs, locksfile = locksfile, value = value, lock_offset = lock_offset)
+
+		if isinstance(locksfile, str):
+			locksfile = pylocksfile(locksfile_path = locksfile, **kwargs)
+		self._locksfile = locksfile
+		self._slots = interval_tuple(self._lock_offset, self._value)
+
+	@property
+	def value(self):
+		return self._value
+
+	@property
+	def lock_offset(self):
+		return self._lock_offset
+
+	@property
+	def locksfile(self):
+		return self._locksfile
+
+	#Takes a free slot and returns its index (0 ... value - 1), None when not acquired (non-blocking, or timed out)
+	def acquire(self, blocking = True, timeout = None):
+		lock_n = self._locksfile.acquire_any(self._slots, writeLock = True, blocking = blocking, timeout = timeout)
+
+		return None if lock_n is None else lock_n - self._lock_offset
+
+	def release(self, slot):
+		if not isinstance(slot, Integral) or not 0 <= slot < self._value:
+			raise IllegalArgumentError('lockSemaphore - slot ' + str(slot) + ' is not one of the ' + str(self._value) + ' slots.')
+
+		self._locksfile.release(self._lock_offset + int(slot))
+
+	#Slots held by other holders (see pylocksfile.holders) - for a 'posix' lockfile, by other processes
+	def held(self):
+		return sorted(set(lock_n - self._lock_offset for holder in self._locksfile.holders(self._slots)
+			for lock_n in range(max(holder.lock_n, self._lock_offset), min(holder.lock_n + holder.n_locks if holder.n_locks else self._lock_offset + self._value, self._lock_offset + self._value))))
+
+	#Use with "with semaphore() as slot:". Raises LockTimeoutError when not acquired within timeout.
+	def __call__(self, timeout = None):
+		return _slotContext(self, timeout)
+
+	def __enter__(self):
+		raise IllegalWithStatement('lockSemaphore - use "with semaphore() as slot:"')
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return None
+
+	def __reduce__(self):
+		return (_unpickleLockSemaphore, (self._arguments,))
+
+def _unpickleLockSemaphore(arguments):
+	return lockSemaphore(**arguments)
+
+#Returned by lockSemaphore.__call__ - the slot taken, for the block
+class _slotContext(object):
+	def __init__(self, semaphore, timeout):
+		self._semaphore = semaphore
+		self._timeout = timeout
+		self._slot = None
+
+	def __enter__(self):
+		slot = self._semaphore.acquire(timeout = self._timeout)
+		if slot is None:
+			raise LockTimeoutError('lockSemaphore - no slot of ' + str(self._semaphore.value) + ' acquired within ' + str(self._timeout) + ' seconds')
+
+		self._slot = slot
+
+		return slot
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		slot = self._slot
+		self._slot = None
+		self._semaphore.release(slot)
+
+		return None
+
+
+"""
+lockExecutor class implementation
+
+concurrent.futures executor of worker processes for tasks that lock indices of a lockfile. A task submitted with
+submit_locked declares its lock set (indices and (lock_n, n_locks) intervals, as for acquire_many), which its worker
+write locks while running it - the lock sets of a batch of tasks together, with one acquire_many (all or nothing) before
+the first of them and one release_many after the last:
+
+	with lockExecutor("accounts.lock", max_workers = 4) as executor:
+		future = executor.submit_locked([3, 17], transfer, 3, 17, 100)	#runs transfer(3, 17, 100) holding locks 3 and 17
+		future.result()
+
+Tasks queue in the executor, and are scheduled by their locks when a worker has room (at most two batches of up to
+EXECUTOR_BATCH tasks a worker at once) - a task overlapping the tasks sent to another worker waits for them, so tasks on
+the same locks run one after the other on one worker instead of blocking each other's workers, and tasks overlapping
+each other keep their order. A worker takes one group of overlapping tasks at a time, along with tasks no other queued
+task overlaps, so disjoint groups run in parallel. The locks are still taken, so tasks of other processes that use them
+are excluded (for the whole batch). Tasks of submit (no lock set) go to any worker.
+
+A queued task can be cancelled, a sent one can not. Tasks and their results are pickled, as for multiprocessing.Pool -
+module level functions. A worker that dies fails the futures of its tasks, and the executor takes no more tasks.
+
+argument:
+	- locksfile: a pylocksfile (each worker gets its own instance, holding nothing), or the path of a lockfile to open
+		with the other arguments (backend, fairness...).
+	- max_workers (int): worker processes. None - os.cpu_count().
+	- mp_context: multiprocessing context of the workers. None - the default one.
+"""
+class lockExecutor(Executor):
+	def __init__(self, locksfile, max_workers = None, mp_context = None, **kwargs):
+		if not isinstance(locksfile, (str, pylocksfile)):
+			raise IllegalArgumentError('lockExecutor - locksfile argument must be a pylocksfile or a path.')
+
+		if max_workers is not None and (not isinstance(max_workers, Integral) or max_workers < 1):
+			raise IllegalArgumentError('lockExecutor - max_workers argument must be a positive integer.')
+
+		if not isinstance(locksfile, str) and kwargs:
+			raise IllegalArgumentError('lockExecutor - lockfile arguments only apply to a lockfile path.')
+
+		if isinstance(locksfile, str):
+			locksfile = pylocksfile(locksfile_path = locksfile, **kwargs)
+		self._locksfile = locksfile
+
+		context = multiprocessing.get_context() if mp_context is None else mp_context
+
+		#Executor state, under the condition - the queued tasks, and the lock sets of all of them counting holds (a task
+		#alone on its locks overlaps no other). Per worker - the lock sets of its sent tasks (counting holds), their
+		#futures, how many of them overlap other tasks, and the batches sent not answered.
+		self._changed = threading.Condition(threading.Lock())
+		self._intervals = lockInterval()
+		self._queue = deque()
+		self._queued_sets = lockInterval()
+		self._claims = list()
+		self._futures = list()
+		self._grouped = list()
+		self._in_flight = list()
+		self._task_ids = count()
+		self._shutdown = False
+		self._broken = None
+
+		#Per worker - a pipe each way. Batches are sent by the sender thread, results read by the collector thread.
+		self._workers = list()
+		self._task_conns = list()
+		self._result_conns = list()
+
+		n_workers = (os.cpu_count() or 1) if max_workers is None else int(max_workers)
+		for _ in range(n_workers):
+			task_reader, task_writer = context.Pipe(duplex = False)
+			result_reader, result_writer = context.Pipe(duplex = False)
+
+			worker = context.Process(target = _executorWorker, args = (self._locksfile, task_reader, result_writer), daemon = True)
+			worker.start()
+			task_reader.close()
+			result_writer.close()
+
+			self._workers.append(worker)
+			self._task_conns.append(task_writer)
+			self._result_conns.append(result_reader)
+			self._claims.append(lockInterval())
+			self._futures.append(dict())
+			self._grouped.append(0)
+			self._in_flight.append(0)
+
+		self._sender = threading.Thread(target = self._send, name = 'pylocksfile-executor-sender', daemon = True)
+		self._sender.start()
+		self._collector = threading.Thread(target = self._collect, name = 'pylocksfile-executor-collector', daemon = True)
+		self._collector.start()
+
+	@property
+	def locksfile(self):
+		return self._locksfile
+
+	@property
+	def max_workers(self):
+		return len(self._workers)
+
+	#Run fn(*args, **kwargs) holding the write locks of lock_set (see acquire_many)
+	def submit_locked(self, lock_set, fn, *args, **kwargs):
+		#Create the sorted, merged runs. Will raise Exception on invalid input.
+		runs = self._intervals.coalesce(lock_set)
+
+		return self._submit(runs, fn, args, kwargs)
+
+	#Run fn(*args, **kwargs) with no lock
+	def submit(self, fn, *args, **kwargs):
+		return self._submit(list(), fn, args, kwargs)
+
+	def _submit(self, runs, fn, args, kwargs):
+		future = Future()
+
+		with self._changed:
+			if self._broken is not None:
+				raise RuntimeError(self._broken)
+			if self._shutdown:
+				raise RuntimeError('lockExecutor - cannot submit after shutdown')
+
+			for run in runs:
+				self._queued_sets.insertInterval(run, True)
+			self._queue.append((next(self._task_ids), runs, fn, args, kwargs, future))
+
+			self._changed.notify_all()
+
+		return future
+
+	def _nextBatch(self):
+		#Under the condition - a batch for the least busy worker with room and tasks it can take, None when there is none
+		for worker_i in sorted(range(len(self._workers)), key = self._in_flight.__getitem__):
+			if self._in_flight[worker_i] >= 2:
+				break
+
+			batch = self._batch(worker_i)
+			if batch:
+				self._in_flight[worker_i] += 1
+				return worker_i, batch
+
+		return None
+
+	def _batch(self, worker_i):
+		#Under the condition - takes the tasks of worker_i from the first 4 * EXECUTOR_BATCH queued ones
+		claims = self._claims[worker_i]
+		others = [claims_of for other_i, claims_of in enumerate(self._claims) if other_i != worker_i and len(claims_of)]
+		grouped = self._grouped[worker_i] > 0
+
+		#Left for later - their locks are not taken by tasks after them
+		skipped = lockInterval()
+		window = [self._queue.popleft() for _ in range(min(len(self._queue), 4 * EXECUTOR_BATCH))]
+		batch = list()
+		kept = list()
+
+		#Few queued tasks are shared by the workers
+		batch_size = min(EXECUTOR_BATCH, -(-len(window) // len(self._workers)))
+
+		for task in window:
+			bounds = [(run.lock_n, run.lock_n + run.n_locks) for run in task[1]]
+
+			if len(batch) < batch_size and not any(claims_of.countSegments(start, end) for claims_of in others for start, end in bounds) and not any(skipped.countSegments(start, end) for start, end in bounds):
+				alone = all(self._queued_sets.maxCount(start, end) == 1 for start, end in bounds)
+
+				#Alone on its locks, of this worker's group, or the first of a group
+				if alone or not grouped or any(claims.countSegments(start, end) for start, end in bounds):
+					for run in task[1]:
+						self._queued_sets.releaseInterval(run)
+						claims.insertInterval(run, True)
+
+					if not alone:
+						grouped = True
+						self._grouped[worker_i] += 1
+
+					self._futures[worker_i][task[0]] = (task[5], task[1], not alone)
+					batch.append(task)
+					continue
+
+			for run in task[1]:
+				skipped.insertInterval(run, True)
+			kept.append(task)
+
+		self._queue.extendleft(reversed(kept))
+
+		return batch
+
+	def _send(self):
+		#Sender thread - batches of queued tasks, until shut down with nothing queued
+		while True:
+			with self._changed:
+				found = self._nextBatch()
+				while found is None and not (self._shutdown and not self._queue):
+					self._changed.wait()
+					found = self._nextBatch()
+
+			if found is None:
+				break
+
+			#Cancelled meanwhile - not sent
+			worker_i, batch = found
+			cancelled = [task[0] for task in batch if not task[5].set_running_or_notify_cancel()]
+			if cancelled:
+				with self._changed:
+					for task_id in cancelled:
+						self._done(worker_i, task_id)
+				batch = [task for task in batch if task[0] not in cancelled]
+
+			batch = [task[:5] for task in batch]
+			try:
+				self._task_conns[worker_i].send(batch)
+			except (IOError, OSError):
+				#The worker is gone - the collector fails its tasks
+				pass
+			except Exception:
+				#A task does not pickle - fail those that do not, send the others
+				self._sendEach(worker_i, batch)
+
+		for conn in self._task_conns:
+			try:
+				conn.send(None)
+			except (IOError, OSError):
+				pass
+			conn.close()
+
+	def _sendEach(self, worker_i, batch):
+		sendable = list()
+		failed = list()
+
+		for task in batch:
+			try:
+				pickle.dumps(task)
+				sendable.append(task)
+			except Exception as e:
+				failed.append((task[0], e))
+
+		with self._changed:
+			futures = [(self._done(worker_i, task_id), e) for task_id, e in failed]
+			self._changed.notify_all()
+
+		for future, e in futures:
+			future.set_exception(e)
+
+		try:
+			self._task_conns[worker_i].send(sendable)
+		except (IOError, OSError):
+			pass
+
+	def _done(self, worker_i, task_id):
+		#Under the condition - the task's locks no longer hold back tasks sent to other workers
+		future, runs, grouped = self._futures[worker_i].pop(task_id)
+		for run in runs:
+			self._claims[worker_i].releaseInterval(run)
+		self._grouped[worker_i] -= grouped
+
+		return future
+
+	def _collect(self):
+		#Collector thread - results of every worker, until all of them exited
+		conns = {conn : worker_i for worker_i, conn in enumerate(self._result_conns)}
+		sentinels = {worker.sentinel : worker_i for worker_i, worker in enumerate(self._workers)}
+
+		while sentinels:
+			for ready in multiprocessing.connection.wait(list(conns) + list(sentinels)):
+				if ready in conns:
+					try:
+						self._results(conns[ready], ready.recv())
+					except EOFError:
+						del conns[ready]
+					continue
+
+				#A worker exited - its last results first
+				worker_i = sentinels.pop(ready)
+				conn = self._result_conns[worker_i]
+				if conn in conns:
+					try:
+						while conn.poll():
+							self._results(worker_i, conn.recv())
+					except EOFError:
+						pass
+					del conns[conn]
+
+				self._exited(worker_i)
+
+	def _results(self, worker_i, results):
+		with self._changed:
+			self._in_flight[worker_i] -= 1
+			done = [(self._done(worker_i, task_id), ok, value) for task_id, ok, value in results]
+			self._changed.notify_all()
+
+		for future, ok, value in done:
+			if ok:
+				future.set_result(value)
+			else:
+				future.set_exception(value)
+
+	def _exited(self, worker_i):
+		#Already gone - only reaps it, for its exit code
+		self._workers[worker_i].join()
+
+		with self._changed:
+			futures = [self._done(worker_i, task_id) for task_id in list(self._futures[worker_i])]
+
+			if not self._shutdown or futures:
+				self._broken = 'lockExecutor - worker ' + str(self._workers[worker_i].pid) + ' exited (code ' + str(self._workers[worker_i].exitcode) + ')'
+
+				#No worker takes the queued tasks of a broken executor
+				self._shutdown = True
+				futures += [task[5] for task in self._queue]
+				self._queue.clear()
+
+			self._changed.notify_all()
+
+		for future in futures:
+			if future.running() or future.set_running_or_notify_cancel():
+				future.set_exception(RuntimeError(self._broken))
+
+	def shutdown(self, wait = True, *, cancel_futures = False):
+		#Queued tasks are still run, unless cancel_futures - the workers exit once done
+		with self._changed:
+			self._shutdown = True
+
+			if cancel_futures:
+				while self._queue:
+					future = self._queue.popleft()[5]
+					future.cancel()
+					future.set_running_or_notify_cancel()
+
+			self._changed.notify_all()
+
+		if wait:
+			self._sender.join()
+			for worker in self._workers:
+				worker.join()
+			self._collector.join()
+
+			for conn in self._result_conns:
+				conn.close()
+
+def _executorWorker(locksfile, tasks, results):
+	#Worker process of lockExecutor - takes the lock sets of each batch at once (one acquire_many of their union), runs its
+	#tasks in order, and sends their results together
+	while True:
+		try:
+			batch = tasks.recv()
+		except EOFError:
+			return
+
+		if batch is None:
+			return
+
+		runs = [run for task in batch for run in task[1]]
+		acquired = False
+
+		try:
+			if runs and not locksfile.acquire_many(runs, writeLock = True):
+				raise DeadlockError('lockExecutor - deadlock detected by os for ' + str(locksfile._lockIntervals.coalesce(runs)))
+			acquired = True
+
+			done = list()
+			for task_id, _, fn, args, kwargs in batch:
+				try:
+					done.append((task_id, True, fn(*args, **kwargs)))
+				except Exception as e:
+					done.append((task_id, False, e))
+
+		except Exception as e:
+			#Not acquired - every task of the batch fails
+			done = [(task[0], False, e) for task in batch]
+
+		finally:
+			if runs and acquired:
+				locksfile.release_many(runs)
+
+		try:
+			results.send(done)
+		except Exception:
+			#A result does not pickle - replaced by the error, still one message for the batch
+			for i, result in enumerate(done):
+				try:
+					pickle.dumps(result)
+				except Exception as e:
+					done[i] = (result[0], False, RuntimeError('lockExecutor - result of task could not be sent: ' + repr(e)))
+			results.send(done)
+
+
+"""
+lockServer class implementation
+
+Serves the locks of a lockfile to remoteLocksfile clients, over a Unix socket (address is its path) or TCP (address is a
+(host, port) tuple, port 0 for any). Meant for lockfiles on network filesystems, where every fcntl call is a round trip to
+the lock manager - the server keeps the lockfile on a local disk, and the clients share it through the server.
+
+Each client gets its own pylocksfile of the lockfile, so the clients lock against each other and against direct users of
+the file. The backend is 'ofd' - the 'posix' locks of the server's clients would all belong to one process.
+A single asyncio loop serves every client. Requests are tried without blocking, and a contended one is retried with backoff
+until granted or timed out while the loop serves the others - so the fairness policies do not order the clients, and
+deadlock_detection is not supported. The requests of a client are answered in order, the replies to the requests read at
+once (pipelined) sent together. When a connection drops, the locks of the client are released, even while it waits.
+
+Other arguments (hierarchy, metrics...) are passed to the pylocksfile of each client.
+"""
+class lockServer(object):
+	def __init__(self, locksfile_path, address, backend = OFD_BACKEND, **kwargs):
+		if not (isinstance(address, str) or (isinstance(address, tuple) and len(address) == 2)):
+			raise IllegalArgumentError('lockServer - address argument must be a socket path or a (host, port) tuple.')
+
+		if backend != OFD_BACKEND:
+			raise IllegalArgumentError('lockServer - backend argument must be \'ofd\'.')
+
+		if kwargs.get('deadlock_detection'):
+			raise IllegalArgumentError('lockServer - deadlock_detection is not supported.')
+
+		#The arguments are checked now rather than by the first client
+		pylocksfile(locksfile_path = locksfile_path, backend = backend, **kwargs)
+
+		self._locksfile_path = os.path.abspath(locksfile_path)
+		self._address = address
+		self._backend = backend
+		self._kwargs = kwargs
+
+		#Loop of serve_forever while it runs, the bound address and the connected clients
+		self._loop = None
+		self._bound = None
+		self._sessions = set()
+		self._n_sessions = 0
+
+		#For start() - set when serve_forever listens (or failed to)
+		self._listening = threading.Event()
+		self._thread = None
+		self._error = None
+
+	@property
+	def locksfile_path(self):
+		return self._locksfile_path
+
+	@property
+	def address(self):
+		#Address listened on - with the actual port for TCP. None when not serving.
+		return self._bound
+
+	@property
+	def n_clients(self):
+		return len(self._sessions)
+
+	#Serves in the calling thread until shutdown() (or SIGINT/SIGTERM, in the main thread)
+	def serve_forever(self):
+		loop = asyncio.new_event_loop()
+		unix = isinstance(self._address, str)
+
+		try:
+			if unix:
+				self._removeStaleSocket()
+				listener = loop.run_until_complete(loop.create_unix_server(self._connected, path = self._address))
+			else:
+				listener = loop.run_until_complete(loop.create_server(self._connected, host = self._address[0], port = self._address[1]))
+
+		except BaseException as e:
+			self._error = e
+			self._listening.set()
+			loop.close()
+			raise
+
+		self._bound = listener.sockets[0].getsockname()
+		if not unix:
+			self._bound = self._bound[:2]
+
+		if threading.current_thread() is threading.main_thread():
+			loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+		self._loop = loop
+		self._listening.set()
+
+		try:
+			loop.run_forever()
+
+		except KeyboardInterrupt:
+			pass
+
+		finally:
+			loop.run_until_complete(self._close(listener))
+
+			self._loop = None
+			self._bound = None
+			loop.close()
+
+			if unix and os.path.exists(self._address):
+				os.unlink(self._address)
+
+	#Serves in a background (daemon) thread, returns once listening
+	def start(self):
+		self._error = None
+		self._listening.clear()
+		self._thread = threading.Thread(target = self.serve_forever, name = 'lockServer', daemon = True)
+		self._thread.start()
+		self._listening.wait()
+
+		if self._error is not None:
+			raise self._error
+
+		return self
+
+	def shutdown(self):
+		loop = self._loop
+		if loop is not None:
+			loop.call_soon_threadsafe(loop.stop)
+
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+			self._thread = None
+
+	def _removeStaleSocket(self):
+		#A socket file left by a server that is gone - refuses connections
+		if not os.path.exists(self._address):
+			return
+
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(self._address)
+		except ConnectionRefusedError:
+			os.unlink(self._address)
+		else:
+			raise IllegalArgumentError('lockServer - a server is already listening on ' + self._address + '.')
+		finally:
+			probe.close()
+
+	async def _close(self, listener):
+		#Stop listening, then drop the clients - releasing their locks
+		listener.close()
+
+		for session in list(self._sessions):
+			session.close()
+
+		await listener.wait_closed()
+
+	def _connected(self):
+		self._n_sessions += 1
+
+		return _lockSession(self, 'client-' + str(self._n_sessions))
+
+
+#Contended request of a lock server client - retried until attempt() returns True, or time.monotonic() passes the deadline (None for none)
+pending_request_tuple = namedtuple('pending_request_tuple', ['attempt', 'deadline'])
+
+#Compact JSON of the lock server protocol
+_jsonEncoder = json.JSONEncoder(separators = (',', ':'))
+
+#Lock ranges are sent as [lock_n, n_locks]
+def _wireLock(lock_n):
+	return tuple(lock_n) if isinstance(lock_n, list) else lock_n
+
+#A connected client of a lockServer, with its pylocksfile. Requests are served as they are received, all the requests of a
+#read at once - a contended one is retried by a task, and the requests after it wait for their turn in the buffer.
+class _lockSession(asyncio.Protocol):
+	#Requests a client may send - the methods of the same name
+	ops = ('hello', 'acquire', 'acquire_many', 'acquire_upgradeable', 'upgrade', 'downgrade', 'release_upgradeable', 'release', 'release_many', 'holders')
+
+	def __init__(self, server, l_id):
+		self._server = server
+		self._locksfile = pylocksfile(locksfile_path = server._locksfile_path, l_id = l_id, backend = server._backend, **server._kwargs)
+		self._transport = None
+
+		#Received bytes not parsed yet, and the task retrying a contended request
+		self._buffer = bytearray()
+		self._waiting = None
+
+	def connection_made(self, transport):
+		self._transport = transport
+		self._server._sessions.add(self)
+
+	def data_received(self, data):
+		self._buffer += data
+
+		if self._waiting is None:
+			self._serveRequests()
+
+	def connection_lost(self, exc):
+		self.close()
+
+	#A client that does not read its replies is not read from either
+	def pause_writing(self):
+		self._transport.pause_reading()
+
+	def resume_writing(self):
+		self._transport.resume_reading()
+
+	def close(self):
+		if self._waiting is not None:
+			self._waiting.cancel()
+			self._waiting = None
+
+		#Everything the client held
+		if self._locksfile is not None:
+			self._locksfile.release()
+			self._locksfile = None
+
+		self._server._sessions.discard(self)
+		self._transport.close()
+
+	def _serveRequests(self):
+		replies = list()
+
+		for payload in self._requests():
+			reply = self._execute(payload)
+
+			if isinstance(reply, pending_request_tuple):
+				self._waiting = asyncio.ensure_future(self._wait(reply))
+				break
+
+			replies.append(reply)
+
+		if replies:
+			self._transport.write(b''.join(replies))
+
+	def _requests(self):
+		#Complete requests of the buffer
+		header = frame_struct.size
+
+		while len(self._buffer) >= header:
+			length, = frame_struct.unpack_from(self._buffer)
+			if len(self._buffer) < header + length:
+				return
+
+			payload = bytes(self._buffer[header:header + length])
+			del self._buffer[:header + length]
+
+			yield payload
+
+	def _execute(self, payload):
+		#Encoded reply, or pending_request_tuple of a contended blocking request
+		try:
+			op, args = json.loads(payload)
+			if op not in self.ops:
+				raise IllegalArgumentError('lockServer - unknown request \'' + str(op) + '\'.')
+
+			result = getattr(self, op)(*args)
+
+		except Exception as e:
+			return self._error(e)
+
+		if isinstance(result, pending_request_tuple):
+			return result
+
+		return self._reply(result)
+
+	async def _wait(self, pending):
+		#Retries the request with backoff while the loop serves the other clients - cancelled when the client leaves
+		delay = SPIN_MIN_DELAY
+
+		while True:
+			pause = delay if pending.deadline is None else max(0.0, min(delay, pending.deadline - time.monotonic()))
+			await asyncio.sleep(pause)
+
+			try:
+				acquired = pending.attempt()
+			except Exception as e:
+				reply = self._error(e)
+				break
+
+			if acquired or (pending.deadline is not None and time.monotonic() >= pending.deadline):
+				reply = self._reply(acquired)
+				break
+
+			delay = min(delay * 2, SPIN_MAX_DELAY)
+
+		self._waiting = None
+		self._transport.write(reply)
+
+		#The requests received meanwhile
+		self._serveRequests()
+
+	def _reply(self, value):
+		payload = _jsonEncoder.encode([0, value]).encode('utf-8')
+
+		return frame_struct.pack(len(payload)) + payload
+
+	def _error(self, e):
+		payload = _jsonEncoder.encode([1, type(e).__name__, str(e)]).encode('utf-8')
+
+		return frame_struct.pack(len(payload)) + payload
+
+	def _attempt(self, attempt, blocking, timeout):
+		#Result of a first attempt, or the pending request when it has to wait
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+		if timeout is not None:
+			if not isinstance(timeout, (int, float)) or isinstance(timeout, bool) or timeout < 0:
+				raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+			if not blocking:
+				raise IllegalArgumentError('timeout can only be used with a blocking acquire')
+
+		if attempt():
+			return True
+
+		if not blocking or timeout == 0:
+			return False
+
+		return pending_request_tuple(attempt, None if timeout is None else time.monotonic() + timeout)
+
+	def hello(self):
+		locksfile = self._locksfile
+
+		return {'locksfile_path' : locksfile.locksfile_path, 'backend' : locksfile.backend, 'n_stripes' : locksfile.n_stripes, 'stripe_offset' : locksfile.stripe_offset}
+
+	def acquire(self, writeLock, lock_n, blocking, timeout):
+		lock_n = _wireLock(lock_n)
+
+		return self._attempt(lambda: self._locksfile.acquire(writeLock = writeLock, lock_n = lock_n, blocking = False), blocking, timeout)
+
+	def acquire_many(self, runs, writeLock, blocking):
+		runs = [_wireLock(run) for run in runs]
+
+		return self._attempt(lambda: self._locksfile.acquire_many(runs, writeLock = writeLock, blocking = False), blocking, None)
+
+	def acquire_upgradeable(self, lock_n, blocking, timeout):
+		lock_n = _wireLock(lock_n)
+
+		return self._attempt(lambda: self._locksfile.acquire_upgradeable(lock_n = lock_n, blocking = False), blocking, timeout)
+
+	def upgrade(self, lock_n, timeout):
+		lock_n = _wireLock(lock_n)
+
+		return self._attempt(lambda: self._locksfile.upgrade(lock_n = lock_n, timeout = 0), True, timeout)
+
+	def downgrade(self, lock_n):
+		return self._locksfile.downgrade(lock_n = _wireLock(lock_n))
+
+	def release_upgradeable(self, lock_n):
+		return self._locksfile.release_upgradeable(lock_n = _wireLock(lock_n))
+
+	def release(self, lock_n):
+		return self._locksfile.release(lock_n = _wireLock(lock_n))
+
+	def release_many(self, runs):
+		return self._locksfile.release_many([_wireLock(run) for run in runs])
+
+	def holders(self, lock_n):
+		return self._locksfile.holders(lock_n = _wireLock(lock_n))
+
+
+#Errors of the server raised again by remoteLocksfile - any other is a LockServerError
+_remoteErrors = {error.__name__ : error for error in (IllegalArgumentError, IllegalWithStatement, LockTimeoutError, DeadlockError)}
+
+"""
+remoteLocksfile class implementation
+
+Client of a lockServer at address (socket path, or (host, port) for TCP), with the API of pylocksfile - acquire, release,
+acquire_many, release_many, named keys, upgradeable locks, holders and with statements (not acquire_async). A blocking
+acquire waits at the server, as a single request answered when granted.
+
+release and release_many are pipelined - sent without waiting for their reply, which is collected with the reply of the
+next request, or by flush(). Their arguments are checked here, so only a failure of the server can be reported late.
+Other clients may see the locks held for the round trip after the call - flush() returns once the releases are done.
+The server releases the locks of the client when it is closed or deleted, or when the connection drops (LockServerError -
+the next request connects again, holding nothing). Like pylocksfile, an instance is for a single thread, pickles as
+its address (a new client holding nothing), and starts over in a forked child, holding nothing.
+"""
+class remoteLocksfile(object):
+	def __init__(self, address, l_id = None):
+		if not (isinstance(address, str) or (isinstance(address, tuple) and len(address) == 2)):
+			raise IllegalArgumentError('remoteLocksfile - address argument must be a socket path or a (host, port) tuple.')
+
+		self._address = address
+		self._l_id = l_id
+
+		#Connection, received bytes not parsed yet and replies not collected yet
+		self._sock = None
+		self._buffer = bytearray()
+		self._pending = 0
+
+		#Input checks and run merging
+		self._intervals = lockInterval()
+
+		self._last_wait_time = None
+
+		self._connect()
+
+		_instances.add(self)
+
+	@property
+	def address(self):
+		return self._address
+
+	@property
+	def l_id(self):
+		return self._l_id
+
+	@property
+	def locksfile_path(self):
+		#Path of the lockfile at the server
+		return self._locksfile_path
+
+	@property
+	def backend(self):
+		return self._backend
+
+	@property
+	def n_stripes(self):
+		return self._n_stripes
+
+	@property
+	def stripe_offset(self):
+		return self._stripe_offset
+
+	@property
+	def last_wait_time(self):
+		#Seconds the last acquire with a timeout took, round trip included. None if there was none.
+		return self._last_wait_time
+
+	def _connect(self):
+		if isinstance(self._address, str):
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				sock.connect(self._address)
+			except BaseException:
+				sock.close()
+				raise
+		else:
+			sock = socket.create_connection(self._address)
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		self._sock = sock
+		self._buffer = bytearray()
+		self._pending = 0
+
+		info = self._call('hello', [])
+		self._locksfile_path = info['locksfile_path']
+		self._backend = info['backend']
+		self._n_stripes = info['n_stripes']
+		self._stripe_offset = info['stripe_offset']
+
+	def _send(self, op, args):
+		if self._sock is None:
+			self._connect()
+
+		payload = _jsonEncoder.encode([op, args]).encode('utf-8')
+		try:
+			self._sock.sendall(frame_struct.pack(len(payload)) + payload)
+		except OSError as e:
+			self._lost(e)
+
+		self._pending += 1
+
+	def _call(self, op, args):
+		self._send(op, args)
+
+		return self.flush()
+
+	#Collects the replies of the requests sent, and returns the last one. Raises the first error among them.
+	def flush(self):
+		value = None
+		error = None
+
+		#Replies come in order - the pipelined ones first
+		while self._pending:
+			reply = self._receiveReply()
+			self._pending -= 1
+
+			if reply[0]:
+				if error is None:
+					error = reply
+			else:
+				value = reply[1]
+
+		if error is not None:
+			_, name, message = error
+			if name in _remoteErrors:
+				raise _remoteErrors[name](message)
+			raise LockServerError('remoteLocksfile - ' + name + ' at the lock server: ' + message)
+
+		return value
+
+	def _receiveReply(self):
+		header = frame_struct.size
+
+		while True:
+			if len(self._buffer) >= header:
+				length, = frame_struct.unpack_from(self._buffer)
+				if len(self._buffer) >= header + length:
+					reply = json.loads(bytes(self._buffer[header:header + length]))
+					del self._buffer[:header + length]
+					return reply
+
+			try:
+				data = self._sock.recv(SERVER_READ_SIZE)
+			except OSError as e:
+				self._lost(e)
+
+			if not data:
+				self._lost(None)
+
+			self._buffer += data
+
+	def _lost(self, cause):
+		self.close()
+
+		raise LockServerError('remoteLocksfile - connection to the lock server lost, the locks of this client were released.') from cause
+
+	def _pipelined(self, op, args):
+		self._send(op, args)
+
+		#Bounded, so the replies never fill the socket buffers while both sides send
+		if self._pending >= SERVER_PIPELINE:
+			self.flush()
+
+	def _wire(self, lock_n):
+		#Checked here, sent as [lock_n, n_locks]. Will raise Exception on invalid input.
+		return list(self._intervals.preprocessInput(lock_n))
+
+	"""
+	Acquire lock_n (index or (lock_n, n_locks) interval) for reading (shared) or writing (exclusive), like pylocksfile.acquire.
+	With timeout (seconds), a blocking acquire gives up and returns False after the timeout.
+	"""
+	def acquire(self, writeLock = False, lock_n = 0, blocking = True, timeout = None):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+		if timeout is not None:
+			if not isinstance(timeout, (int, float)) or timeout < 0:
+				raise IllegalArgumentError('timeout must be a non-negative number of seconds')
+			if not blocking:
+				raise IllegalArgumentError('timeout can only be used with a blocking acquire')
+
+		start_time = time.monotonic()
+		acquired = self._call('acquire', [writeLock, self._wire(lock_n), blocking, timeout])
+
+		if timeout is not None:
+			self._last_wait_time = time.monotonic() - start_time
+
+		return acquired
+
+	#Acquire a scattered set of locks (indices and intervals, or a NumPy integer array) all or nothing, like pylocksfile.acquire_many
+	def acquire_many(self, indices_or_ranges, writeLock = False, blocking = True):
+		if not isinstance(writeLock, bool):
+			raise IllegalArgumentError('writeLock must be boolean')
+		if not isinstance(blocking, bool):
+			raise IllegalArgumentError('blocking must be boolean')
+
+		return self._call('acquire_many', [[list(run) for run in self._intervals.coalesce(indices_or_ranges)], writeLock, blocking])
+
+	def acquire_upgradeable(self, lock_n = 0, blocking = True, timeout = None):
+		return self._call('acquire_upgradeable', [self._wire(lock_n), blocking, timeout])
+
+	def upgrade(self, lock_n = 0, timeout = None):
+		return self._call('upgrade', [self._wire(lock_n), timeout])
+
+	def downgrade(self, lock_n = 0):
+		self._call('downgrade', [self._wire(lock_n)])
+
+	def release_upgradeable(self, lock_n = 0):
+		self._call('release_upgradeable', [self._wire(lock_n)])
+
+	#Same as pylocksfile - on top of stripe, acquire, acquire_many and the upgradeable requests
+	stripe = pylocksfile.stripe
+	acquire_keys = pylocksfile.acquire_keys
+	release_keys = pylocksfile.release_keys
+	key = pylocksfile.key
+	upgradeable = pylocksfile.upgradeable
+
+	#Release one hold of lock_n (as acquired), or all the locks of the client when lock_n is None. Pipelined.
+	def release(self, lock_n = None):
+		self._pipelined('release', [None if lock_n is None else self._wire(lock_n)])
+
+	#Release one hold of a scattered set of locks. Pipelined.
+	def release_many(self, indices_or_ranges):
+		self._pipelined('release_many', [[list(run) for run in self._intervals.coalesce(indices_or_ranges)]])
+
+	#Locks of other holders that conflict with a write lock of lock_n, like pylocksfile.holders of the client at the server
+	def holders(self, lock_n = None):
+		return [lock_holder_tuple(*holder) for holder in self._call('holders', [None if lock_n is None else self._wire(lock_n)])]
+
+	#Disconnects - the server releases every lock of the client. The next request connects again.
+	def close(self):
+		if self._sock is not None:
+			self._sock.close()
+			self._sock = None
+
+		self._buffer = bytearray()
+		self._pending = 0
+
+	#A with statement over lock_n (always blocking), each call its own block
+	def __call__(self, writeLock = False, lock_n = 0):
+		return _lockContext(self, writeLock, lock_n)
+
+	def __enter__(self):
+		raise IllegalWithStatement('remoteLocksfile - use with locksfile(writeLock, lock_n)')
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return None
+
+	def _enterBlock(self, writeLock, lock_n):
+		return self.acquire(writeLock = writeLock, lock_n = lock_n)
+
+	def _exitBlock(self, lock_n):
+		self.release(lock_n = lock_n)
+
+	def __del__(self):
+		#The constructor raised before connecting
+		if not hasattr(self, '_sock'):
+			return
+
+		self.close()
+
+	#Pickles as the address - a new client holding nothing
+	def __reduce__(self):
+		return (remoteLocksfile, (self._address, self._l_id))
+
+	def _forked(self):
+		#In a forked child - the connection is the parent's. Only the inherited descriptor is closed (the parent keeps the
+		#connection open), and the next request connects again.
+		if self._sock is not None:
+			self._sock.close()
+			self._sock = None
+
+		self._buffer = bytearray()
+		self._pending = 0
+
+
+def _rangeText(lock_n, n_locks):
+	if n_locks == 1:
+		return str(lock_n)
+
+	return str(lock_n) + '-' + (str(lock_n + n_locks - 1) if n_locks else 'EOF')
+
+"""
+Events of the lock traces in trace_dir (see lockTracer) - of every process, or of the lockfile at locksfile_path only - as
+trace_event_tuple, sorted by time. Events are kept by each process' ring buffer, so the oldest ones of a busy process may be gone.
+"""
+def readTrace(trace_dir, locksfile_path = None):
+	prefix = None if locksfile_path is None else os.path.basename(locksfile_path) + '.'
+	events = list()
+
+	for name in sorted(os.listdir(trace_dir)):
+		if not name.endswith('.trace') or (prefix is not None and not name.startswith(prefix)):
+			continue
+
+		with open(os.path.join(trace_dir, name), 'rb') as f:
+			data = f.read()
+
+		if len(data) < lockTracer.HEADER_SIZE:
+			continue
+		magic, size, _, _ = lockTracer.HEADER.unpack_from(data)
+		if magic != lockTracer.MAGIC:
+			continue
+
+		record = lockTracer.RECORD
+		for offset in range(lockTracer.HEADER_SIZE, min(len(data), lockTracer.HEADER_SIZE + size * record.size), record.size):
+			time_ns, pid, tid, lock_n, n_locks, writeLock, event = record.unpack_from(data, offset)
+
+			#Never written
+			if not event:
+				continue
+
+			events.append(trace_event_tuple(time_ns, pid, tid, lock_n, n_locks, bool(writeLock), event))
+
+	events.sort()
+
+	return events
+
+def _tracedOverlap(lock_n, n_locks, other_lock_n, other_n_locks):
+	#n_locks 0 - up to EOF
+	return (not other_n_locks or lock_n < other_lock_n + other_n_locks) and (not n_locks or other_lock_n < lock_n + n_locks)
+
+"""
+Waits and holds of the trace events (sorted by time), as trace_span_tuple. A wait goes from a request to its answer (outcome
+'acquired' or 'failed'), a hold from an acquire to the release of its process overlapping it ('released'). Spans still
+open at the last event end there, with outcome 'waiting' or 'held'.
+"""
+def traceSpans(events):
+	waits = list()
+	holds = list()
+
+	#Request waiting for its answer, by thread. Holds not released yet, by process.
+	requests = dict()
+	held = dict()
+
+	for event in events:
+		if event.event == TRACE_REQUEST:
+			requests[(event.pid, event.tid)] = event
+
+		elif event.event in (TRACE_ACQUIRED, TRACE_FAILED):
+			request = requests.pop((event.pid, event.tid), None)
+			start_ns = event.time_ns if request is None else request.time_ns
+			acquired = event.event == TRACE_ACQUIRED
+
+			waits.append(trace_span_tuple(event.pid, event.tid, event.lock_n, event.n_locks, event.writeLock, start_ns, event.time_ns, 'acquired' if acquired else 'failed'))
+
+			if acquired:
+				held.setdefault(event.pid, list()).append(event)
+
+		elif event.event == TRACE_RELEASED:
+			kept = list()
+			for acquire in held.get(event.pid, ()):
+				if _tracedOverlap(acquire.lock_n, acquire.n_locks, event.lock_n, event.n_locks):
+					holds.append(trace_span_tuple(acquire.pid, acquire.tid, acquire.lock_n, acquire.n_locks, acquire.writeLock, acquire.time_ns, event.time_ns, 'released'))
+				else:
+					kept.append(acquire)
+			held[event.pid] = kept
+
+	end_ns = events[-1].time_ns if events else 0
+
+	for request in requests.values():
+		waits.append(trace_span_tuple(request.pid, request.tid, request.lock_n, request.n_locks, request.writeLock, request.time_ns, end_ns, 'waiting'))
+
+	for acquires in held.values():
+		for acquire in acquires:
+			holds.append(trace_span_tuple(acquire.pid, acquire.tid, acquire.lock_n, acquire.n_locks, acquire.writeLock, acquire.time_ns, end_ns, 'held'))
+
+	waits.sort(key = lambda span: span.start_ns)
+	holds.sort(key = lambda span: span.start_ns)
+
+	return waits, holds
+
+"""
+Findings of the trace events (sorted by time), as a dict:
+	- 'long_holds': holds of at least long_hold seconds, longest first.
+	- 'convoys': per lock (index of the requests' first lock), the periods when at least convoy processes waited for it at
+		once - start_ns, end_ns, the most waiters at once, and how many times the lock was acquired meanwhile.
+	- 'ping_pong': locks whose holder switched between processes most often - handoffs (consecutive holds by different
+		processes) and the mean hold in seconds.
+Lists are cut to rows entries.
+"""
+def traceReport(events, long_hold = 0.01, convoy = 3, rows = 10):
+	waits, holds = traceSpans(events)
+
+	long_holds = sorted((span for span in holds if span.end_ns - span.start_ns >= long_hold * 1e9), key = lambda span: span.start_ns - span.end_ns)
+
+	#Sweep of the waits of each lock - +1 when a process starts waiting, -1 when it stops
+	changes = dict()
+	for span in waits:
+		if span.end_ns > span.start_ns:
+			changes.setdefault(span.lock_n, list()).extend(((span.start_ns, 1), (span.end_ns, -1)))
+
+	acquired = dict()
+	for span in waits:
+		if span.outcome == 'acquired':
+			acquired.setdefault(span.lock_n, list()).append(span.end_ns)
+
+	convoys = list()
+	for lock_n, lock_changes in changes.items():
+		lock_changes.sort()
+		n_waiting = 0
+		start_ns = None
+		peak = 0
+
+		for time_ns, change in lock_changes:
+			n_waiting += change
+
+			if start_ns is None and n_waiting >= convoy:
+				start_ns = time_ns
+				peak = n_waiting
+			elif start_ns is not None:
+				peak = max(peak, n_waiting)
+				if n_waiting < convoy:
+					handoffs = sum(1 for acquired_ns in acquired.get(lock_n, ()) if start_ns <= acquired_ns <= time_ns)
+					convoys.append({'lock_n' : lock_n, 'start_ns' : start_ns, 'end_ns' : time_ns, 'waiters' : peak, 'acquires' : handoffs})
+					start_ns = None
+
+	convoys.sort(key = lambda found: found['start_ns'] - found['end_ns'])
+
+	#Holders of each lock in acquire order
+	holders = dict()
+	for span in holds:
+		holders.setdefault(span.lock_n, list()).append(span)
+
+	ping_pong = list()
+	for lock_n, spans in holders.items():
+		handoffs = sum(1 for previous, span in zip(spans, spans[1:]) if previous.pid != span.pid)
+		if handoffs:
+			ping_pong.append({'lock_n' : lock_n, 'handoffs' : handoffs, 'mean_hold' : sum(span.end_ns - span.start_ns for span in spans) / len(spans) / 1e9})
+
+	ping_pong.sort(key = lambda found: -found['handoffs'])
+
+	return { 'long_holds' : long_holds[:rows], 'convoys' : convoys[:rows], 'ping_pong' : ping_pong[:rows] }
+
+"""
+Chrome trace (about://tracing, ui.perfetto.dev) of the trace events (sorted by time), as a dict to json.dump. Waits and holds are
+slices of their process and thread, convoys (see traceReport) instant events. Times are microseconds from the first event.
+"""
+def chromeTrace(events, convoy = 3):
+	waits, holds = traceSpans(events)
+	origin_ns = events[0].time_ns if events else 0
+
+	trace_events = list()
+	for pid in sorted(set(event.pid for event in events)):
+		trace_events.append({'name' : 'process_name', 'ph' : 'M', 'pid' : pid, 'args' : {'name' : 'pid ' + str(pid)}})
+
+	for category, spans in (('wait', waits), ('hold', holds)):
+		for span in spans:
+			trace_events.append({'name' : category + ' ' + ('W ' if span.writeLock else 'R ') + _rangeText(span.lock_n, span.n_locks), 'cat' : category, 'ph' : 'X',
+				'ts' : (span.start_ns - origin_ns) / 1e3, 'dur' : (span.end_ns - span.start_ns) / 1e3, 'pid' : span.pid, 'tid' : span.tid,
+				'args' : {'lock_n' : span.lock_n, 'n_locks' : span.n_locks, 'outcome' : span.outcome}})
+
+	for found in traceReport(events, convoy = convoy, rows = len(events))['convoys']:
+		trace_events.append({'name' : 'convoy ' + str(found['lock_n']) + ' (' + str(found['waiters']) + ' waiting)', 'cat' : 'convoy', 'ph' : 'i', 's' : 'g',
+			'ts' : (found['start_ns'] - origin_ns) / 1e3, 'pid' : 0, 'tid' : 0, 'args' : found})
+
+	return {'traceEvents' : trace_events, 'displayTimeUnit' : 'ms'}
+
+
+"""
+pylocksfile-top - live view of the locks of a lockfile, e.g. 'pylocksfile-top ./lockfile.lock'.
+
+Shows the most contended ranges (by waiters seen over the refreshes), the longest waiting processes and the holders.
+Only reads /proc/locks, or when it can not be read, walks the file with F_GETLK on a read only descriptor (holders only -
+waiters are not visible that way). It never takes or waits for a lock, so it does not disturb the workload.
+"""
+def top(argv = None):
+	#Only needed by the command line tool
+	import argparse
+
+	parser = argparse.ArgumentParser(prog = 'pylocksfile-top', description = 'Live view of the holders and waiters of a pylocksfile lockfile.')
+	parser.add_argument('locksfile_path', help = 'path of the lockfile')
+	parser.add_argument('-d', '--delay', type = float, default = 1.0, help = 'seconds between refreshes (default 1)')
+	parser.add_argument('-n', '--iterations', type = int, default = 0, help = 'number of refreshes before exiting (default 0 - until interrupted)')
+	parser.add_argument('-r', '--rows', type = int, default = 10, help = 'rows of each table (default 10)')
+	args = parser.parse_args(argv)
+
+	#First time each waiter was seen, and waiters seen per range summed over the refreshes
+	waiting = dict()
+	contention = dict()
+
+	fd = None
+	clear = '\033[H\033[J' if sys.stdout.isatty() else ''
+	iteration = 0
+	try:
+		while True:
+			now = time.monotonic()
+			entries = procLocks(args.locksfile_path)
+
+			if entries is None:
+				if fd is None:
+					#Read only and never truncated - the workload's file is left untouched
+					fd = os.open(args.locksfile_path, os.O_RDONLY)
+				holders = scanLocks(fd)
+				waiters = list()
+				source = 'F_GETLK'
+			else:
+				holders = [entry for entry in entries if entry.blocked_by is None]
+				waiters = [entry for entry in entries if entry.blocked_by is not None]
+				source = '/proc/locks'
+
+			seen = dict()
+			for waiter in waiters:
+				key = (waiter.pid, waiter.kind, waiter.writeLock, waiter.lock_n, waiter.n_locks)
+				seen[key] = waiting.get(key, now)
+				contention[(waiter.lock_n, waiter.n_locks)] = contention.get((waiter.lock_n, waiter.n_locks), 0) + 1
+			waiting = seen
+
+			lines = [time.strftime('%H:%M:%S') + ' pylocksfile-top - ' + args.locksfile_path + ' (' + source + ') - ' + str(len(holders)) + ' locks held, ' + str(len(waiters)) + ' waiting', '']
+
+			lines.append('%-24s %8s %12s' % ('MOST CONTENDED', 'WAITING', 'WAIT SAMPLES'))
+			for (lock_n, n_locks), samples in sorted(contention.items(), key = lambda item: -item[1])[:args.rows]:
+				current = sum(1 for waiter in waiters if (waiter.lock_n, waiter.n_locks) == (lock_n, n_locks))
+				lines.append('%-24s %8d %12d' % (_rangeText(lock_n, n_locks), current, samples))
+
+			lines += ['', '%-8s %-7s %-6s %-24s %10s %10s' % ('PID', 'KIND', 'MODE', 'WAITING FOR', 'SECONDS', 'BLOCKED BY')]
+			for waiter in sorted(waiters, key = lambda waiter: waiting[(waiter.pid, waiter.kind, waiter.writeLock, waiter.lock_n, waiter.n_locks)])[:args.rows]:
+				since = waiting[(waiter.pid, waiter.kind, waiter.writeLock, waiter.lock_n, waiter.n_locks)]
+				lines.append('%-8d %-7s %-6s %-24s %10.1f %10d' % (waiter.pid, waiter.kind, 'write' if waiter.writeLock else 'read', _rangeText(waiter.lock_n, waiter.n_locks), now - since, waiter.blocked_by))
+
+			lines += ['', '%-8s %-6s %-24s' % ('PID', 'MODE', 'HOLDS')]
+			for holder in holders[:args.rows]:
+				lines.append('%-8d %-6s %-24s' % (holder.pid, 'write' if holder.writeLock else 'read', _rangeText(holder.lock_n, holder.n_locks)))
+
+			sys.stdout.write(clear + '\n'.join(line.rstrip() for line in lines) + '\n')
+			sys.stdout.flush()
+
+			iteration += 1
+			if args.iterations and iteration >= args.iterations:
+				break
+
+			time.sleep(args.delay)
+
+	except KeyboardInterrupt:
+		pass
+
+	finally:
+		if fd is not None:
+			os.close(fd)
+
+	return 0
+
+"""
+pylocksfile-server - serves the locks of a lockfile to remoteLocksfile clients, e.g.
+'pylocksfile-server /var/tmp/app.lock --unix /run/app/locks.sock' or 'pylocksfile-server /var/tmp/app.lock --tcp 0.0.0.0:7300'.
+
+Runs until interrupted (SIGINT or SIGTERM), then releases the locks of its clients. Keep the lockfile on a local disk -
+the clients on other machines then share it at the cost of a round trip to the server rather than to a network lock manager.
+"""
+def server(argv = None):
+	#Only needed by the command line tool
+	import argparse
+
+	parser = argparse.ArgumentParser(prog = 'pylocksfile-server', description = 'Serves the locks of a pylocksfile lockfile to remoteLocksfile clients over a Unix or TCP socket.')
+	parser.add_argument('locksfile_path', help = 'path of the lockfile, best on a local disk')
+	address = parser.add_mutually_exclusive_group(required = True)
+	address.add_argument('--unix', metavar = 'PATH', help = 'Unix socket to listen on')
+	address.add_argument('--tcp', metavar = 'HOST:PORT', help = 'TCP address to listen on')
+	parser.add_argument('--backend', choices = (OFD_BACKEND,), default = OFD_BACKEND, help = 'lock backend of the clients (default ofd)')
+	args = parser.parse_args(argv)
+
+	if args.unix is not None:
+		listen = args.unix
+	else:
+		host, _, port = args.tcp.rpartition(':')
+		if not port.isdigit():
+			parser.error('--tcp must be HOST:PORT')
+		listen = (host or '0.0.0.0', int(port))
+
+	lockServer(args.locksfile_path, listen, backend = args.backend).serve_forever()
+
+	return 0
+
+"""
+pylocksfile-trace - reads the lock traces of a directory (see lockTracer), e.g. 'pylocksfile-trace /tmp/traces -o trace.json'.
+
+Prints the long holds, the convoys and the locks bouncing between processes (see traceReport), and writes the Chrome trace
+(see chromeTrace) to open in about://tracing or ui.perfetto.dev.
+"""
+def trace(argv = None):
+	#Only needed by the command line tool
+	import argparse
+
+	parser = argparse.ArgumentParser(prog = 'pylocksfile-trace', description = 'Merges the lock traces of pylocksfile processes, flags convoys and long holds.')
+	parser.add_argument('trace_dir', help = 'directory of the traces (the trace argument of pylocksfile)')
+	parser.add_argument('-l', '--locksfile', help = 'only the traces of this lockfile')
+	parser.add_argument('-o', '--output', help = 'write the Chrome trace JSON to this file')
+	parser.add_argument('--long-hold', type = float, default = 10.0, help = 'milliseconds from which a hold is long (default 10)')
+	parser.add_argument('--convoy', type = int, default = 3, help = 'processes waiting for a lock at once that make a convoy (default 3)')
+	parser.add_argument('-r', '--rows', type = int, default = 10, help = 'rows of each table (default 10)')
+	args = parser.parse_args(argv)
+
+	events = readTrace(args.trace_dir, args.locksfile)
+	report = traceReport(events, long_hold = args.long_hold / 1e3, convoy = args.convoy, rows = args.rows)
+	origin_ns = events[0].time_ns if events else 0
+
+	lines = ['pylocksfile-trace - ' + args.trace_dir + ' - ' + str(len(events)) + ' events of ' + str(len(set(event.pid for event in events))) + ' processes', '']
+
+	lines.append('%-24s %8s %10s %12s' % ('LONG HOLDS', 'PID', 'AT (ms)', 'HELD (ms)'))
+	for span in report['long_holds']:
+		lines.append('%-24s %8d %10.3f %12.3f' % (('W ' if span.writeLock else 'R ') + _rangeText(span.lock_n, span.n_locks), span.pid, (span.start_ns - origin_ns) / 1e6, (span.end_ns - span.start_ns) / 1e6))
+
+	lines += ['', '%-24s %8s %10s %12s %9s' % ('CONVOYS', 'WAITING', 'AT (ms)', 'LASTED (ms)', 'ACQUIRES')]
+	for found in report['convoys']:
+		lines.append('%-24s %8d %10.3f %12.3f %9d' % (found['lock_n'], found['waiters'], (found['start_ns'] - origin_ns) / 1e6, (found['end_ns'] - found['start_ns']) / 1e6, found['acquires']))
 
+	lines += ['', '%-24s %8s %12s' % ('PING-PONG', 'HANDOFFS', 'HOLD (us)')]
+	for found in report['ping_pong']:
+		lines.append('%-24s %8d %12.1f' % (found['lock_n'], found['handoffs'], found['mean_hold'] * 1e6))
 
+	print('\n'.join(lines))
 
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(chromeTrace(events, convoy = args.convoy), f)
 
+	return 0
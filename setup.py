@@ -21,4 +21,11 @@ setuptools.setup(
         "Operating System :: OS Independent",
     ],
     python_requires='>=3.6',
+    entry_points={
+        "console_scripts": [
+            "pylocksfile-top = pylocksfile:top",
+            "pylocksfile-server = pylocksfile:server",
+            "pylocksfile-trace = pylocksfile:trace",
+        ],
+    },
 )
\ No newline at end of file
@@ -0,0 +1,1275 @@
+"""
+MIT License
+
+Copyright (c) 2020 Meidar-S
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+"""
+pylocksfile benchmark suite
+
+Each bench* function prints a summary and returns a list of result records -
+{'benchmark': name, 'backend': lock implementation, 'params': {...}, 'results': {...}}.
+main() runs the suite, sweeping process count, track count, read/write mix and range width, and writes all records to
+a JSON file. Runs of different versions on the same machine can be compared with --compare.
+
+	$ python3 tests/benchmarks.py --output results.json
+	$ python3 tests/benchmarks.py --quick --output new.json --compare results.json
+
+Lock implementations (backends):
+	- 'posix' / 'ofd': pylocksfile with the posix / ofd backend.
+	- 'flock': fcntl.flock on one file per track (whole-file locks, so a range locks one file per track).
+	- 'mp.Lock': one multiprocessing.Lock per track, inherited by the pool workers (exclusive only, readers lock too).
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import argparse
+import platform
+import threading
+import multiprocessing
+from multiprocessing import Pool
+import numpy as np
+
+import pylocksfile as pylocksfile_module
+from pylocksfile import pylocksfile, lockInterval, shardedLocksfile, lockServer, remoteLocksfile, recordStore, lockExecutor
+
+BACKENDS = ('posix', 'ofd', 'flock', 'mp.Lock')
+
+
+def record(benchmark, backend, params, results):
+	return {'benchmark' : benchmark, 'backend' : backend, 'params' : params, 'results' : results}
+
+def latencyStats(latencies):
+	#Latencies in seconds -> percentiles in microseconds
+	latencies = np.asarray(latencies) * 1e6
+	return {'p50_us' : float(np.percentile(latencies, 50)), 'p99_us' : float(np.percentile(latencies, 99)), 'max_us' : float(latencies.max()), 'count' : len(latencies)}
+
+def latencyPercentiles(stats):
+	return "p50 " + str(round(stats['p50_us'])) + " us, p99 " + str(round(stats['p99_us'])) + " us, max " + str(round(stats['max_us'])) + " us"
+
+def jainFairness(counts):
+	#Jain's fairness index - 1.0 when every worker got the same share, 1/n when one worker got everything
+	counts = np.asarray(counts, dtype = float)
+	if not counts.sum():
+		return 0.0
+	return float(counts.sum() ** 2 / (len(counts) * (counts ** 2).sum()))
+
+
+"""
+Lock implementations, with a common acquire(lock_n, writeLock, width) / release(lock_n, width) interface.
+"""
+class pylocksfileBench(object):
+	def __init__(self, locksfile_path, backend, n_tracks):
+		self.l = pylocksfile(locksfile_path, backend = backend)
+
+	def acquire(self, lock_n, writeLock = True, width = 1):
+		self.l.acquire(writeLock = writeLock, lock_n = (lock_n, width))
+
+	def release(self, lock_n, width = 1):
+		self.l.release(lock_n = (lock_n, width))
+
+class flockBench(object):
+	def __init__(self, locksfile_path, backend, n_tracks):
+		self.fds = [os.open(locksfile_path + '.flock.' + str(i), os.O_CREAT | os.O_RDWR) for i in range(n_tracks)]
+
+	def acquire(self, lock_n, writeLock = True, width = 1):
+		for i in range(lock_n, lock_n + width):
+			fcntl.flock(self.fds[i], fcntl.LOCK_EX if writeLock else fcntl.LOCK_SH)
+
+	def release(self, lock_n, width = 1):
+		for i in range(lock_n + width - 1, lock_n - 1, -1):
+			fcntl.flock(self.fds[i], fcntl.LOCK_UN)
+
+#multiprocessing locks must be inherited, so pool workers get them through the pool initializer
+mp_locks = None
+
+def initMpLocks(locks):
+	global mp_locks
+	mp_locks = locks
+
+class mpLockBench(object):
+	def __init__(self, locksfile_path, backend, n_tracks):
+		self.locks = mp_locks
+
+	def acquire(self, lock_n, writeLock = True, width = 1):
+		for i in range(lock_n, lock_n + width):
+			self.locks[i].acquire()
+
+	def release(self, lock_n, width = 1):
+		for i in range(lock_n + width - 1, lock_n - 1, -1):
+			self.locks[i].release()
+
+def makeBench(backend, locksfile_path, n_tracks):
+	if backend in ('posix', 'ofd'):
+		return pylocksfileBench(locksfile_path, backend, n_tracks)
+	if backend == 'flock':
+		return flockBench(locksfile_path, backend, n_tracks)
+	return mpLockBench(locksfile_path, backend, n_tracks)
+
+def makePool(backend, n_process, n_tracks):
+	if backend == 'mp.Lock':
+		pool = Pool(n_process, initializer = initMpLocks, initargs = ([multiprocessing.Lock() for _ in range(n_tracks)],))
+	else:
+		pool = Pool(n_process)
+
+	#Warm up the workers so process start-up is not measured
+	pool.map(abs, range(n_process))
+
+	return pool
+
+
+def benchIntervalStore(n_held_list = (10, 1000, 100000), n_ops = 20000, seed = 0):
+	print("Running benchIntervalStore...")
+
+	rng = np.random.default_rng(seed)
+	records = list()
+
+	for n_held in n_held_list:
+		#Scattered held ranges - (4i, 2) with alternating modes, so no two ranges merge
+		store = lockInterval()
+		for i in range(n_held):
+			store.insertInterval((4 * i, 2), bool(i % 2))
+
+		lookups = [int(x) for x in rng.integers(0, 4 * n_held, n_ops)]
+		holes = [4 * int(x) + 2 for x in rng.integers(0, n_held, n_ops)]
+
+		start_time = time.perf_counter()
+		for lock_n in lookups:
+			store.inBound(lock_n)
+		inBound_time = time.perf_counter() - start_time
+
+		#Acquire/release cycle - fill a hole between two ranges (merge) and free it again (split)
+		start_time = time.perf_counter()
+		for lock_n in holes:
+			store.insertInterval((lock_n, 2), True)
+			store.removeInterval((lock_n, 2))
+		cycle_time = time.perf_counter() - start_time
+
+		print("held ranges", n_held, "- inBound", round(inBound_time / n_ops * 1e6, 3), "us,",
+			"insert+remove", round(cycle_time / n_ops * 1e6, 3), "us")
+
+		records.append(record('intervalStore', 'lockInterval', {'n_held' : n_held}, {'inBound_us' : inBound_time / n_ops * 1e6, 'insert_remove_us' : cycle_time / n_ops * 1e6}))
+
+	print()
+
+	return records
+
+
+def benchUncontended(locksfile_path, backends = BACKENDS, n_ops = 20000):
+	print("Running benchUncontended...")
+
+	records = list()
+
+	for backend in backends:
+		if backend == 'mp.Lock':
+			initMpLocks([multiprocessing.Lock()])
+		bench = makeBench(backend, locksfile_path, 1)
+
+		for writeLock in (False, True):
+			start_time = time.perf_counter()
+			for _ in range(n_ops):
+				bench.acquire(0, writeLock)
+				bench.release(0)
+			elapsed = time.perf_counter() - start_time
+
+			print(backend, "-", "write" if writeLock else "read ", "- uncontended acquire+release", round(elapsed / n_ops * 1e6, 3), "us")
+
+			records.append(record('uncontended', backend, {'writeLock' : writeLock}, {'acquire_release_us' : elapsed / n_ops * 1e6}))
+
+	print()
+
+	return records
+
+
+def benchHeldLocks(locksfile_path, backends = ('posix', 'ofd'), n_held_list = (0, 100, 1000), n_ops = 20000):
+	print("Running benchHeldLocks...")
+
+	#The kernel walks the file's whole lock list on every request
+	records = list()
+
+	for backend in backends:
+		for n_held in n_held_list:
+			l = pylocksfile(locksfile_path, backend = backend)
+
+			#Scattered held locks - (2i + 1) with alternating modes, so no two merge
+			for i in range(n_held):
+				l.acquire(writeLock = bool(i % 2), lock_n = 2 * i + 1)
+
+			lock_n = 2 * n_held + 2
+
+			start_time = time.perf_counter()
+			for _ in range(n_ops):
+				l.acquire(writeLock = True, lock_n = lock_n)
+				l.release(lock_n = lock_n)
+			elapsed = time.perf_counter() - start_time
+
+			l.release()
+			del l
+
+			print(backend, "- held locks", n_held, "- uncontended acquire+release", round(elapsed / n_ops * 1e6, 3), "us")
+
+			records.append(record('heldLocks', backend, {'n_held' : n_held}, {'acquire_release_us' : elapsed / n_ops * 1e6}))
+
+	print()
+
+	return records
+
+
+def benchReacquire(locksfile_path, backends = ('posix', 'ofd'), n_ops = 20000):
+	print("Running benchReacquire...")
+
+	#Nested acquire+release of a range the instance already holds in the same mode - no system call needed -
+	#against a fresh acquire+release of a range it does not hold
+	records = list()
+
+	for backend in backends:
+		l = pylocksfile(locksfile_path, backend = backend)
+		l.acquire(writeLock = True, lock_n = (0, 8))
+		timings = dict()
+
+		start_time = time.perf_counter()
+		for i in range(n_ops):
+			l.acquire(writeLock = True, lock_n = (16 + i % 4, 4))
+			l.release(lock_n = (16 + i % 4, 4))
+		timings['fresh'] = time.perf_counter() - start_time
+
+		start_time = time.perf_counter()
+		for i in range(n_ops):
+			l.acquire(writeLock = True, lock_n = (i % 4, 4))
+			l.release(lock_n = (i % 4, 4))
+		timings['nested'] = time.perf_counter() - start_time
+
+		l.release()
+		del l
+
+		print(backend, "- acquire+release of a range,", ", ".join(name + " " + str(round(elapsed / n_ops * 1e6, 3)) + " us" for name, elapsed in timings.items()))
+
+		records.append(record('reacquire', backend, {}, {name + '_us' : elapsed / n_ops * 1e6 for name, elapsed in timings.items()}))
+
+	print()
+
+	return records
+
+def benchRecordStore(locksfile_path, backends = ('ofd',), record_size = 256, n_records = 4096, range_lengths = (1, 16), n_ops = 5000):
+	print("Running benchRecordStore...")
+
+	#Reading and writing records guarded by their locks - acquire, os.pread/os.pwrite, release per record, against a
+	#recordStore view of the mapped data file (one lock range and one view for consecutive records). Reads sum a byte of each record.
+	data_path = locksfile_path + '.records'
+	records = list()
+
+	for backend in backends:
+		store = recordStore(data_path, record_size, n_records = n_records, locksfile = locksfile_path, backend = backend)
+		l = store.locksfile
+		fd = os.open(data_path, os.O_RDWR)
+		payload = bytes(record_size)
+
+		for n in range_lengths:
+			starts = [(i * 7919) % (n_records - n) for i in range(n_ops)]
+			timings = dict()
+
+			start_time = time.perf_counter()
+			for record_n in starts:
+				for i in range(record_n, record_n + n):
+					l.acquire(writeLock = False, lock_n = i)
+					os.pread(fd, record_size, i * record_size)[0]
+					l.release(lock_n = i)
+			timings['pread'] = time.perf_counter() - start_time
+
+			start_time = time.perf_counter()
+			for record_n in starts:
+				with store.read(record_n, n) as view:
+					for i in range(0, n * record_size, record_size):
+						view[i]
+			timings['view_read'] = time.perf_counter() - start_time
+
+			start_time = time.perf_counter()
+			for record_n in starts:
+				for i in range(record_n, record_n + n):
+					l.acquire(writeLock = True, lock_n = i)
+					os.pwrite(fd, payload, i * record_size)
+					l.release(lock_n = i)
+			timings['pwrite'] = time.perf_counter() - start_time
+
+			start_time = time.perf_counter()
+			for record_n in starts:
+				with store.write(record_n, n) as view:
+					for i in range(0, n * record_size, record_size):
+						view[i:i + record_size] = payload
+			timings['view_write'] = time.perf_counter() - start_time
+
+			print(backend, "-", n, "records -", ", ".join(name + " " + str(round(elapsed / (n_ops * n) * 1e6, 2)) + " us" for name, elapsed in timings.items()), "per record")
+
+			records.append(record('recordStore', backend, {'n_records' : n, 'record_size' : record_size},
+				{name + '_us' : elapsed / (n_ops * n) * 1e6 for name, elapsed in timings.items()}))
+
+		os.close(fd)
+		store.close()
+		del store, l
+
+	os.remove(data_path)
+
+	print()
+
+	return records
+
+
+def benchTeardown(locksfile_path, backends = ('posix', 'ofd'), n_ranges_list = (1000, 10000)):
+	print("Running benchTeardown...")
+
+	#release() of an instance holding many scattered ranges - what a worker pays when it exits holding them
+	records = list()
+
+	for backend in backends:
+		for n_ranges in n_ranges_list:
+			l = pylocksfile(locksfile_path, backend = backend)
+
+			#(2i, 1) - no two ranges merge
+			for i in range(n_ranges):
+				l.acquire(writeLock = True, lock_n = 2 * i)
+
+			start_time = time.perf_counter()
+			l.release()
+			elapsed = time.perf_counter() - start_time
+
+			del l
+
+			print(backend, "- release of", n_ranges, "held ranges", round(elapsed * 1e3, 3), "ms")
+
+			records.append(record('teardown', backend, {'n_ranges' : n_ranges}, {'release_ms' : elapsed * 1e3}))
+
+	print()
+
+	return records
+
+
+def benchDeadlockDetection(locksfile_path, n_waiters_list = (2, 8), n_held_list = (10, 1000, 10000), n_ops = 200):
+	print("Running benchDeadlockDetection...")
+
+	#Cost of a contended wait joining the deadlock detection - publishing its held segments, and the cycle search,
+	#against a chain of waiters each holding n_held scattered segments (no cycle, so every edge is searched).
+	#The first wait publishes all the held segments, later ones only the span changed since - here a lock taken and let go.
+	records = list()
+
+	for n_waiters in n_waiters_list:
+		for n_held in n_held_list:
+			instances = [pylocksfile(locksfile_path, backend = 'ofd', deadlock_detection = True) for _ in range(n_waiters)]
+
+			#Waiter i holds (base_i + 2j, 1) and waits for a lock of waiter i + 1
+			for i, l in enumerate(instances):
+				base = i * 4 * n_held
+				for j in range(n_held):
+					l._lockIntervals.insertInterval((base + 2 * j, 1), True)
+			for i, l in enumerate(instances[1:-1], 1):
+				l._wfg.wait(True, (i + 1) * 4 * n_held + n_held, 1, l._lockIntervals, victim = 'requester')
+
+			l = instances[0]
+			start_time = time.perf_counter()
+			l._wfg.wait(True, 4 * n_held + n_held, 1, l._lockIntervals, victim = 'requester')
+			first_us = (time.perf_counter() - start_time) * 1e6
+			l._wfg.done()
+
+			start_time = time.perf_counter()
+			for _ in range(n_ops):
+				l._lockIntervals.insertInterval((n_held, 1), False)
+				l._lockIntervals.releaseInterval((n_held, 1))
+				l._wfg.wait(True, 4 * n_held + n_held, 1, l._lockIntervals, victim = 'requester')
+				l._wfg.done()
+			wait_us = (time.perf_counter() - start_time) / n_ops * 1e6
+
+			#The search alone, while waiting
+			l._wfg.wait(True, 4 * n_held + n_held, 1, l._lockIntervals, victim = 'requester')
+			start_time = time.perf_counter()
+			for _ in range(n_ops):
+				l._wfg._findCycle()
+			search_us = (time.perf_counter() - start_time) / n_ops * 1e6
+
+			for l in instances:
+				l._wfg.done()
+				l._lockIntervals.reset()
+			del instances, l
+
+			print(n_waiters, "waiters holding", n_held, "segments - first join", round(first_us, 1), "us, later joins", round(wait_us, 1), "us, cycle search", round(search_us, 1), "us")
+
+			records.append(record('deadlock_detection', 'ofd', {'n_waiters' : n_waiters, 'n_held' : n_held}, {'first_wait_us' : first_us, 'wait_us' : wait_us, 'search_us' : search_us}))
+
+	print()
+
+	return records
+
+
+def run_contended(backend, locksfile_path, n_tracks, write_ratio, width, duration, seed):
+	bench = makeBench(backend, locksfile_path, n_tracks)
+	rng = random.Random(seed)
+	n_ops = 0
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		#Random range of the given width and a random mode, then a tiny critical section
+		for _ in range(16):
+			lock_n = rng.randrange(n_tracks - width + 1)
+			bench.acquire(lock_n, rng.random() < write_ratio, width)
+			bench.release(lock_n, width)
+		n_ops += 16
+
+	return n_ops
+
+def benchContended(locksfile_path, backends = BACKENDS, n_process_list = (1, 2, 4), n_tracks_list = (16, 256), write_ratios = (0.0, 0.1, 0.5, 1.0), widths = (1, 8), duration = 0.5):
+	print("Running benchContended...")
+
+	records = list()
+
+	for backend in backends:
+		for n_process in n_process_list:
+			for n_tracks in n_tracks_list:
+				pool = makePool(backend, n_process, n_tracks)
+
+				for write_ratio in write_ratios:
+					for width in widths:
+						if width > n_tracks:
+							continue
+
+						counts = pool.starmap(run_contended, [(backend, locksfile_path, n_tracks, write_ratio, width, duration, seed) for seed in range(n_process)])
+						throughput = sum(counts) / duration
+						fairness = jainFairness(counts)
+
+						print(backend, "- processes", n_process, "tracks", n_tracks, "write ratio", write_ratio, "width", width, "-",
+							round(throughput), "ops/s, fairness", round(fairness, 3))
+
+						records.append(record('contended', backend, {'n_process' : n_process, 'n_tracks' : n_tracks, 'write_ratio' : write_ratio, 'width' : width},
+							{'ops_per_s' : throughput, 'fairness' : fairness, 'ops_per_process' : counts}))
+
+				pool.close()
+				pool.join()
+
+	print()
+
+	return records
+
+
+def handOverHand(locks, n_tracks, n_races, writeLock = True):
+	#The testRace workload - iterate a cyclic list of locks, taking the next before releasing the previous
+	locks.acquire(0, writeLock)
+
+	for step_i in range(1, n_tracks * n_races):
+		locks.acquire(step_i % n_tracks, writeLock)
+		locks.release((step_i - 1) % n_tracks)
+
+	locks.release((n_tracks * n_races - 1) % n_tracks)
+
+def run_handOverHand(backend, locksfile_path, n_tracks, n_races):
+	handOverHand(makeBench(backend, locksfile_path, n_tracks), n_tracks, n_races)
+
+def benchHandOverHand(locksfile_path, backends = BACKENDS, n_process_list = (2, 4), n_tracks = 50, n_races = 20):
+	print("Running benchHandOverHand...")
+
+	records = list()
+
+	for backend in backends:
+		for n_process in n_process_list:
+			#n_tracks must be bigger than n_process or we'll get deadlock
+			n_tracks_run = max(n_tracks, n_process + 1)
+			pool = makePool(backend, n_process, n_tracks_run)
+
+			start_time = time.perf_counter()
+			pool.starmap(run_handOverHand, [(backend, locksfile_path, n_tracks_run, n_races)] * n_process)
+			elapsed = time.perf_counter() - start_time
+
+			pool.close()
+			pool.join()
+
+			steps = n_process * n_tracks_run * n_races
+			print(backend, "- processes", n_process, "-", round(steps / elapsed), "steps/s")
+
+			records.append(record('handOverHand', backend, {'n_process' : n_process, 'n_tracks' : n_tracks_run, 'n_races' : n_races}, {'steps_per_s' : steps / elapsed}))
+
+	print()
+
+	return records
+
+
+def benchThreadsVsProcesses(locksfile_path, n_workers = 4, n_tracks = 50, n_races = 100):
+	print("Running benchThreadsVsProcesses...")
+
+	n_tracks = max(n_tracks, n_workers + 1)
+	n_steps = n_workers * n_tracks * n_races
+	records = list()
+
+	#Processes, one instance each
+	for backend in ('posix', 'ofd'):
+		pool = makePool(backend, n_workers, n_tracks)
+
+		start_time = time.perf_counter()
+		pool.starmap(run_handOverHand, [(backend, locksfile_path, n_tracks, n_races)] * n_workers)
+		elapsed = time.perf_counter() - start_time
+
+		pool.close()
+		pool.join()
+
+		print(n_workers, "processes -", backend, "-", round(n_steps / elapsed), "steps/s")
+		records.append(record('threadsVsProcesses', backend, {'workers' : 'processes', 'n_workers' : n_workers}, {'steps_per_s' : n_steps / elapsed}))
+
+	#Threads of one process, an OFD instance each
+	instances = [makeBench('ofd', locksfile_path, n_tracks) for _ in range(n_workers)]
+	threads = [threading.Thread(target = handOverHand, args = (locks, n_tracks, n_races)) for locks in instances]
+
+	start_time = time.perf_counter()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	elapsed = time.perf_counter() - start_time
+
+	print(n_workers, "threads - ofd -", round(n_steps / elapsed), "steps/s")
+	records.append(record('threadsVsProcesses', 'ofd', {'workers' : 'threads', 'n_workers' : n_workers}, {'steps_per_s' : n_steps / elapsed}))
+
+	print()
+
+	return records
+
+def nestedBlocks(l, rng, n_tracks, n_blocks):
+	#An outer write block over 4 locks, a write block of one of them and a read block of it inside
+	for _ in range(n_blocks):
+		lock_n = int(rng.integers(0, n_tracks - 4))
+		inner = lock_n + int(rng.integers(0, 4))
+		with l(writeLock = True, lock_n = (lock_n, 4)):
+			with l(writeLock = True, lock_n = inner):
+				with l(writeLock = False, lock_n = inner):
+					pass
+
+def benchWithBlocks(locksfile_path, instances = ('shared', 'own'), n_threads_list = (1, 4, 16), n_tracks = 256, n_blocks = 2000):
+	print("Running benchWithBlocks...")
+
+	#Threads running nested with statements, sharing one 'ofd' instance or with their own. Inner blocks of a shared
+	#instance are counted holds, entered without a system call. Counts every block (3 per outer block).
+	records = list()
+
+	for instance in instances:
+		for n_threads in n_threads_list:
+			if instance == 'shared':
+				locksfiles = [pylocksfile(locksfile_path, backend = 'ofd')] * n_threads
+			else:
+				locksfiles = [pylocksfile(locksfile_path, backend = 'ofd') for _ in range(n_threads)]
+
+			threads = [threading.Thread(target = nestedBlocks, args = (locksfiles[k], np.random.default_rng(k), n_tracks, n_blocks)) for k in range(n_threads)]
+
+			start_time = time.perf_counter()
+			for t in threads:
+				t.start()
+			for t in threads:
+				t.join()
+			elapsed = time.perf_counter() - start_time
+
+			#Nothing may be left held
+			assert all(not len(l._lockIntervals) for l in locksfiles)
+
+			n_with = 3 * n_blocks * n_threads
+			print(instance, "instance -", n_threads, "threads -", round(n_with / elapsed), "blocks/s")
+			records.append(record('withBlocks', 'ofd', {'instance' : instance, 'n_threads' : n_threads, 'n_tracks' : n_tracks}, {'blocks_per_s' : n_with / elapsed}))
+
+	print()
+
+	return records
+
+
+def run_contendedAcquire(locksfile_path, strategy, duration, hold_time, seed):
+	l = pylocksfile(locksfile_path)
+	rng = np.random.default_rng(seed)
+	latencies = list()
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		start_time = time.perf_counter()
+
+		if strategy == 'sleep':
+			#The loop our handlers used before timeouts - non-blocking attempts with a fixed sleep
+			while not l.acquire(writeLock = True, lock_n = 0, blocking = False):
+				time.sleep(1e-3)
+		else:
+			l.acquire(writeLock = True, lock_n = 0, timeout = 1.0)
+
+		latencies.append(time.perf_counter() - start_time)
+
+		#Hold for a random short time, then give the others a chance
+		time.sleep(rng.uniform(0, 2 * hold_time))
+		l.release()
+		time.sleep(hold_time)
+
+	return latencies
+
+def benchTimeoutLatency(locksfile_path, n_process = 4, duration = 2.0, hold_time = 200e-6):
+	print("Running benchTimeoutLatency...")
+
+	records = list()
+
+	for strategy in ('sleep', 'timeout'):
+		pool = Pool(n_process)
+		results = pool.starmap(run_contendedAcquire, [(locksfile_path, strategy, duration, hold_time, seed) for seed in range(n_process)])
+		pool.close()
+		pool.join()
+
+		stats = latencyStats([latency for result in results for latency in result])
+		print(strategy, "-", stats['count'], "acquires,", latencyPercentiles(stats))
+
+		records.append(record('timeoutLatency', 'posix', {'strategy' : strategy, 'n_process' : n_process, 'hold_time' : hold_time}, stats))
+
+	print()
+
+	return records
+
+
+def run_fairness(locksfile_path, fairness, writeLock, duration, hold_time, seed):
+	l = pylocksfile(locksfile_path, fairness = fairness)
+	rng = np.random.default_rng(seed)
+	waits = list()
+
+	#Start the readers out of step, so their holds overlap
+	time.sleep(rng.uniform(0, hold_time))
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		start_time = time.perf_counter()
+		#A writer starved past the end of the run gives up - its wait is still counted
+		acquired = l.acquire(writeLock = writeLock, lock_n = 0, timeout = max(end_time - start_time, 0.0) + hold_time)
+		waits.append(time.perf_counter() - start_time)
+
+		if not acquired:
+			break
+
+		time.sleep(rng.uniform(0.5 * hold_time, 1.5 * hold_time))
+		l.release()
+
+		#Writers come back now and then, readers right away
+		if writeLock:
+			time.sleep(4 * hold_time)
+
+	return waits
+
+def benchFairness(locksfile_path, policies = (None, 'fifo', 'writer', 'phase_fair'), n_readers = 4, n_writers = 1, duration = 2.0, hold_time = 1e-3):
+	print("Running benchFairness...")
+
+	#One hot lock - readers re-acquire it right away, so without a policy it is almost never free for a writer
+	records = list()
+
+	for fairness in policies:
+		pool = Pool(n_readers + n_writers)
+		results = pool.starmap(run_fairness, [(locksfile_path, fairness, i < n_writers, duration, hold_time, i) for i in range(n_readers + n_writers)])
+		pool.close()
+		pool.join()
+
+		for role, role_results in (('write', results[:n_writers]), ('read', results[n_writers:])):
+			stats = latencyStats([wait for result in role_results for wait in result])
+			print(fairness, role, "-", stats['count'], "acquires,", latencyPercentiles(stats))
+
+			records.append(record('fairness', 'posix', {'fairness' : str(fairness), 'role' : role, 'n_readers' : n_readers, 'n_writers' : n_writers, 'hold_time' : hold_time}, stats))
+
+	print()
+
+	return records
+
+def run_checkThenUpdate(locksfile_path, strategy, role, n_tracks, update_ratio, duration, check_time, seed):
+	l = pylocksfile(locksfile_path)
+	rng = random.Random(seed)
+	waits = list()
+	n_ops = 0
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		lock_n = rng.randrange(n_tracks)
+		start_time = time.perf_counter()
+
+		if role == 'read':
+			l.acquire(writeLock = False, lock_n = lock_n)
+			waits.append(time.perf_counter() - start_time)
+			time.sleep(check_time)
+			l.release(lock_n = lock_n)
+
+		elif strategy == 'write':
+			#Write lock up front, in case the check says to update
+			l.acquire(writeLock = True, lock_n = lock_n)
+			waits.append(time.perf_counter() - start_time)
+			time.sleep(check_time)
+			l.release(lock_n = lock_n)
+
+		else:
+			#Upgradeable read for the check, write lock only for the update
+			l.acquire_upgradeable(lock_n = lock_n)
+			waits.append(time.perf_counter() - start_time)
+			time.sleep(check_time)
+			if rng.random() < update_ratio:
+				l.upgrade(lock_n = lock_n)
+			l.release_upgradeable(lock_n = lock_n)
+
+		n_ops += 1
+
+	return n_ops, waits
+
+def benchUpgradeable(locksfile_path, strategies = ('write', 'upgradeable'), update_ratios = (0.05, 0.25), n_readers = 3, n_updaters = 2, n_tracks = 4, duration = 1.0, check_time = 200e-6):
+	print("Running benchUpgradeable...")
+
+	#Read-mostly check-then-update - updaters check a hot lock and only now and then update it, next to plain readers.
+	#Taking the write lock up front shuts the readers out of every check, an upgradeable read only of the updates.
+	records = list()
+
+	for strategy in strategies:
+		for update_ratio in update_ratios:
+			roles = ['update'] * n_updaters + ['read'] * n_readers
+			pool = Pool(len(roles))
+			results = pool.starmap(run_checkThenUpdate, [(locksfile_path, strategy, role, n_tracks, update_ratio, duration, check_time, seed) for seed, role in enumerate(roles)])
+			pool.close()
+			pool.join()
+
+			for role in ('update', 'read'):
+				role_results = [result for result, result_role in zip(results, roles) if result_role == role]
+				throughput = sum(n_ops for n_ops, waits in role_results) / duration
+				stats = latencyStats([wait for n_ops, waits in role_results for wait in waits])
+
+				print(strategy, "- update ratio", update_ratio, role, "-", round(throughput), "ops/s,", latencyPercentiles(stats))
+
+				records.append(record('upgradeable', 'posix', {'strategy' : strategy, 'update_ratio' : update_ratio, 'role' : role, 'n_readers' : n_readers, 'n_updaters' : n_updaters, 'n_tracks' : n_tracks},
+					dict(stats, ops_per_s = throughput)))
+
+	print()
+
+	return records
+def run_optimistic(locksfile_path, mode, n_tracks, write_ratio, duration, hold_time, seed):
+	l = pylocksfile(locksfile_path, backend = 'ofd', versions = n_tracks)
+	rng = random.Random(seed)
+	reads = writes = fallbacks = 0
+	read_times = list()
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		lock_n = rng.randrange(n_tracks)
+
+		if rng.random() < write_ratio:
+			l.acquire(writeLock = True, lock_n = lock_n)
+			time.sleep(hold_time)
+			l.release(lock_n = lock_n)
+			writes += 1
+			continue
+
+		start_time = time.perf_counter()
+		if mode == 'lock':
+			l.acquire(writeLock = False, lock_n = lock_n)
+			l.release(lock_n = lock_n)
+		else:
+			with l.optimistic(lock_n) as v:
+				while not v.validate():
+					pass
+				fallbacks += v.locked
+		read_times.append(time.perf_counter() - start_time)
+		reads += 1
+
+	return reads, writes, fallbacks, read_times
+
+def benchOptimistic(locksfile_path, modes = ('lock', 'optimistic'), write_ratios = (0.0, 0.01, 0.1, 0.5), n_process = 3, n_tracks = 16, duration = 1.0, hold_time = 50e-6):
+	print("Running benchOptimistic...")
+
+	#Reads of a small record guarded by one of 16 locks, taken as a read lock or read optimistically, next to writers
+	#holding the write lock for hold_time. A read that validates makes no system call, a fallback takes the read lock.
+	records = list()
+
+	for mode in modes:
+		for write_ratio in write_ratios:
+			pool = Pool(n_process)
+			results = pool.starmap(run_optimistic, [(locksfile_path, mode, n_tracks, write_ratio, duration, hold_time, seed) for seed in range(n_process)])
+			pool.close()
+			pool.join()
+
+			reads = sum(result[0] for result in results)
+			writes = sum(result[1] for result in results)
+			fallbacks = sum(result[2] for result in results)
+			stats = latencyStats([read_time for result in results for read_time in result[3]])
+
+			print(mode, "- write ratio", write_ratio, "-", round(reads / duration), "reads/s,", round(writes / duration), "writes/s,", fallbacks, "fallbacks,", latencyPercentiles(stats))
+
+			records.append(record('optimistic', 'ofd', {'mode' : mode, 'write_ratio' : write_ratio, 'n_process' : n_process, 'n_tracks' : n_tracks, 'hold_time' : hold_time},
+				dict(stats, reads_per_s = reads / duration, writes_per_s = writes / duration, fallbacks = fallbacks)))
+
+	print()
+
+	return records
+
+
+def slotFiller(locksfile_path, slots, ready, stop):
+	l = pylocksfile(locksfile_path, backend = 'ofd')
+	l.acquire_many(slots, writeLock = True)
+
+	ready.set()
+	stop.wait()
+
+def run_semaphore(locksfile_path, mode, value, duration, hold_time):
+	l = pylocksfile(locksfile_path, backend = 'ofd')
+	acquire_times = list()
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		start_time = time.perf_counter()
+
+		if mode == 'loop':
+			#Non-blocking attempts over 0 ... value - 1, backing off when all are busy
+			delay = pylocksfile_module.SPIN_MIN_DELAY
+			slot = None
+			while slot is None:
+				for lock_n in range(value):
+					if l.acquire(writeLock = True, lock_n = lock_n, blocking = False):
+						slot = lock_n
+						break
+				else:
+					time.sleep(delay)
+					delay = min(delay * 2, pylocksfile_module.SPIN_MAX_DELAY)
+		elif mode == 'acquire':
+			#A blocking acquire of the single slot - the os wait acquire_any falls back on
+			slot = 0
+			l.acquire(writeLock = True, lock_n = slot)
+		else:
+			slot = l.acquire_any((0, value))
+
+		acquire_times.append(time.perf_counter() - start_time)
+		time.sleep(hold_time)
+		l.release(lock_n = slot)
+
+	return acquire_times
+
+def benchSemaphore(locksfile_path, modes = ('loop', 'acquire', 'acquire_any'), values = (1, 4, 16, 64, 256), n_free = 2, n_process = 4, duration = 1.0, hold_time = 200e-6):
+	print("Running benchSemaphore...")
+
+	#Taking one of value slots - non-blocking acquires from slot 0 on, a blocking acquire (single slot), or acquire_any - while another process holds all but n_free
+	#of them (scattered), and n_process workers compete for those, holding a slot for hold_time.
+	records = list()
+
+	for value in values:
+		free = set(random.Random(value).sample(range(value), min(n_free, value)))
+		busy = [slot for slot in range(value) if slot not in free]
+
+		for mode in modes:
+			#A blocking acquire waits for one slot, the filler's for good
+			if mode == 'acquire' and value != 1:
+				continue
+
+			ready = multiprocessing.Event()
+			stop = multiprocessing.Event()
+			filler = multiprocessing.Process(target = slotFiller, args = (locksfile_path, busy, ready, stop))
+			filler.start()
+			ready.wait()
+
+			pool = Pool(n_process)
+			results = pool.starmap(run_semaphore, [(locksfile_path, mode, value, duration, hold_time)] * n_process)
+			pool.close()
+			pool.join()
+
+			stop.set()
+			filler.join()
+
+			acquire_times = [acquire_time for result in results for acquire_time in result]
+			stats = latencyStats(acquire_times)
+
+			print(mode, "-", value, "slots,", len(free), "free -", round(len(acquire_times) / duration), "acquires/s,", latencyPercentiles(stats))
+
+			records.append(record('semaphore', 'ofd', {'mode' : mode, 'value' : value, 'n_free' : len(free), 'n_process' : n_process, 'hold_time' : hold_time},
+				dict(stats, acquires_per_s = len(acquire_times) / duration)))
+
+	print()
+
+	return records
+
+
+#Pool workers open the lockfile once, through the pool initializer
+pool_locksfile = None
+
+def initPoolLocksfile(locksfile_path):
+	global pool_locksfile
+	pool_locksfile = pylocksfile(locksfile_path)
+
+def executorWork(hold_time):
+	time.sleep(hold_time)
+
+def pooledTask(lock_set, hold_time):
+	pool_locksfile.acquire_many(lock_set, writeLock = True)
+	try:
+		return executorWork(hold_time)
+	finally:
+		pool_locksfile.release_many(lock_set)
+
+def benchExecutor(locksfile_path, workloads = ((1, 0.3), (2, 0.5), (4, 0.8), (0, 0.0)), n_workers = 4, n_tasks = 1000, hold_time = 1e-3):
+	print("Running benchExecutor...")
+
+	#n_tasks tasks, each writing a lock for hold_time - a fraction of them one of n_hot hot locks, the others a lock of their
+	#own. Run by a Pool whose tasks lock their sets (and wait for each other), or by lockExecutor, that queues tasks of
+	#the same locks on one worker.
+	records = list()
+
+	for n_hot, hot in workloads:
+		rng = random.Random(n_hot)
+		lock_sets = [[rng.randrange(n_hot)] if rng.random() < hot else [rng.randrange(100, 1000000)] for _ in range(n_tasks)]
+
+		for mode in ('pool', 'executor'):
+			if mode == 'pool':
+				pool = Pool(n_workers, initializer = initPoolLocksfile, initargs = (locksfile_path,))
+				start_time = time.perf_counter()
+				pool.starmap(pooledTask, [(lock_set, hold_time) for lock_set in lock_sets])
+				elapsed = time.perf_counter() - start_time
+				pool.close()
+				pool.join()
+			else:
+				with lockExecutor(locksfile_path, max_workers = n_workers) as executor:
+					start_time = time.perf_counter()
+					futures = [executor.submit_locked(lock_set, executorWork, hold_time) for lock_set in lock_sets]
+					for future in futures:
+						future.result()
+					elapsed = time.perf_counter() - start_time
+
+			print(mode, "-", n_hot, "hot locks,", round(hot * 100), "% hot -", round(n_tasks / elapsed), "tasks/s")
+
+			records.append(record('executor', 'posix', {'mode' : mode, 'n_hot' : n_hot, 'hot' : hot, 'n_workers' : n_workers, 'n_tasks' : n_tasks, 'hold_time' : hold_time},
+				{'tasks_per_s' : n_tasks / elapsed}))
+
+	print()
+
+	return records
+
+
+def hierarchyHolder(locksfile_path, hierarchy, escalation, n_held, ready, stop):
+	l = pylocksfile(locksfile_path, hierarchy = hierarchy, escalation = escalation)
+
+	#Scattered read held rows - 2i, packed at the start of the table
+	l.acquire_many([2 * i for i in range(n_held)], writeLock = False)
+
+	ready.set()
+	stop.wait()
+
+def benchHierarchy(locksfile_path, configs = ((None, None), ((1 << 20, 64), None), ((1 << 20, 64), 8)), n_held_list = (0, 1000, 20000), n_ops = 2000):
+	print("Running benchHierarchy...")
+
+	#Row writes and whole table reads next to another process holding n_held scattered rows. Every request walks the whole
+	#lock list of its file - the nodes are in a sidecar of their own, and escalation folds the other process' rows into a lock per block.
+	records = list()
+	table = 1 << 20
+
+	for hierarchy, escalation in configs:
+		for n_held in n_held_list:
+			ready = multiprocessing.Event()
+			stop = multiprocessing.Event()
+			holder = multiprocessing.Process(target = hierarchyHolder, args = (locksfile_path, hierarchy, escalation, n_held, ready, stop))
+			holder.start()
+			ready.wait()
+
+			l = pylocksfile(locksfile_path, hierarchy = hierarchy, escalation = escalation)
+
+			start_time = time.perf_counter()
+			for i in range(n_ops):
+				lock_n = table // 2 + 2 * i
+				l.acquire(writeLock = True, lock_n = lock_n)
+				l.release(lock_n = lock_n)
+			row_us = (time.perf_counter() - start_time) / n_ops * 1e6
+
+			start_time = time.perf_counter()
+			for _ in range(n_ops):
+				l.acquire(writeLock = False, lock_n = (0, table))
+				l.release()
+			table_us = (time.perf_counter() - start_time) / n_ops * 1e6
+
+			stop.set()
+			holder.join()
+			del l
+
+			name = 'hierarchy ' + str(hierarchy) + ' escalation ' + str(escalation) if hierarchy else 'flat'
+			print(name, "- other process holding", n_held, "rows - row write", round(row_us, 1), "us, table read", round(table_us, 1), "us")
+
+			records.append(record('hierarchy', 'posix', {'hierarchy' : list(hierarchy) if hierarchy else None, 'escalation' : escalation, 'n_held' : n_held},
+				{'row_write_us' : row_us, 'table_read_us' : table_us}))
+
+	print()
+
+	return records
+
+
+def run_sharded(locksfile_dir, n_shards, n_held, n_tracks, duration, seed):
+	l = shardedLocksfile(locksfile_dir, n_shards)
+	rng = random.Random(seed)
+	n_ops = 0
+
+	#Scattered held locks of this worker - its own lock list load, next to the other workers'
+	base = n_tracks + seed * 2 * n_held
+	l.acquire_many([base + 2 * i for i in range(n_held)], writeLock = True)
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		for _ in range(16):
+			lock_n = rng.randrange(n_tracks)
+			l.acquire(writeLock = True, lock_n = lock_n)
+			l.release(lock_n = lock_n)
+		n_ops += 16
+
+	l.release()
+
+	return n_ops
+
+def benchSharded(locksfile_path, n_shards_list = (1, 4, 16), n_process_list = (1, 2, 4), n_held_list = (0, 5000), n_tracks = 4096, duration = 0.5):
+	print("Running benchSharded...")
+
+	#Throughput of random single lock acquires, with every worker holding n_held scattered locks, spread over n_shards lockfiles
+	#('posix'). Each kernel request walks its file's lock list, n_shards times shorter, under a per file spinlock.
+	records = list()
+
+	locksfile_dir = os.path.splitext(os.path.abspath(locksfile_path))[0] + '_shards'
+	os.makedirs(locksfile_dir, exist_ok = True)
+
+	for n_process in n_process_list:
+		pool = makePool('posix', n_process, n_tracks)
+
+		for n_shards in n_shards_list:
+			for n_held in n_held_list:
+				counts = pool.starmap(run_sharded, [(locksfile_dir, n_shards, n_held, n_tracks, duration, seed) for seed in range(n_process)])
+				throughput = sum(counts) / duration
+
+				print("shards", n_shards, "- processes", n_process, "each holding", n_held, "locks -", round(throughput), "ops/s")
+
+				records.append(record('sharded', 'posix', {'n_shards' : n_shards, 'n_process' : n_process, 'n_held' : n_held, 'cpu_count' : os.cpu_count()},
+					{'ops_per_s' : throughput, 'ops_per_process' : counts}))
+
+		pool.close()
+		pool.join()
+
+	print()
+
+	return records
+
+def serveLocks(locksfile_path, address, bound):
+	server = lockServer(locksfile_path, address).start()
+	bound.put(server.address)
+	#Until terminated
+	threading.Event().wait()
+
+def run_lockServer(locksfile_path, address, n_tracks, batch, duration, seed):
+	l = pylocksfile(locksfile_path, backend = 'ofd') if address is None else remoteLocksfile(address)
+	rng = random.Random(seed)
+	n_ops = 0
+
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		if batch == 1:
+			lock_n = rng.randrange(n_tracks)
+			l.acquire(writeLock = True, lock_n = lock_n)
+			l.release(lock_n = lock_n)
+		else:
+			locks = rng.sample(range(n_tracks), batch)
+			l.acquire_many(locks, writeLock = True)
+			l.release_many(locks)
+		n_ops += 1
+
+	return n_ops
+
+def benchLockServer(locksfile_path, modes = ('direct', 'unix', 'tcp'), n_process_list = (1, 4), batches = (1, 8), n_tracks = 4096, duration = 1.0):
+	print("Running benchLockServer...")
+
+	#Write acquire + release of random locks (or acquire_many of batch locks) - 'ofd' locks taken directly, or through a lock server
+	#(its own process) over a Unix socket or TCP on localhost. Only local fcntl here - on a network filesystem every direct
+	#request is a round trip to the lock manager instead.
+	records = list()
+
+	for mode in modes:
+		server = None
+		address = None
+		if mode != 'direct':
+			bound = multiprocessing.Queue()
+			listen = os.path.splitext(os.path.abspath(locksfile_path))[0] + '.sock' if mode == 'unix' else ('127.0.0.1', 0)
+			server = multiprocessing.Process(target = serveLocks, args = (locksfile_path, listen, bound))
+			server.start()
+			address = bound.get()
+
+		for n_process in n_process_list:
+			for batch in batches:
+				pool = Pool(n_process)
+				counts = pool.starmap(run_lockServer, [(locksfile_path, address, n_tracks, batch, duration, seed) for seed in range(n_process)])
+				pool.close()
+				pool.join()
+				throughput = sum(counts) / duration
+
+				print(mode, "- processes", n_process, "- batch", batch, "-", round(throughput), "requests/s,", round(throughput * batch), "locks/s")
+
+				records.append(record('lock_server', 'ofd', {'mode' : mode, 'n_process' : n_process, 'batch' : batch, 'n_tracks' : n_tracks, 'cpu_count' : os.cpu_count()},
+					{'ops_per_s' : throughput, 'locks_per_s' : throughput * batch}))
+
+		if server is not None:
+			server.terminate()
+			server.join()
+
+	print()
+
+	return records
+
+
+def benchMetricsOverhead(locksfile_path, n_ops = 50000):
+	print("Running benchMetricsOverhead...")
+
+	records = list()
+
+	for metrics in (False, True):
+		l = pylocksfile(locksfile_path, metrics = metrics)
+
+		start_time = time.perf_counter()
+		for i in range(n_ops):
+			l.acquire(writeLock = True, lock_n = i % 64)
+			l.release(lock_n = i % 64)
+		elapsed = time.perf_counter() - start_time
+
+		print("metrics", "on " if metrics else "off", "- uncontended acquire+release", round(elapsed / n_ops * 1e6, 3), "us")
+		records.append(record('metricsOverhead', 'posix', {'metrics' : metrics}, {'acquire_release_us' : elapsed / n_ops * 1e6}))
+
+	print()
+
+	return records
+
+def benchTracerOverhead(locksfile_path, samples = (None, 1.0, 0.01), n_ops = 50000):
+	print("Running benchTracerOverhead...")
+
+	#Uncontended acquire+release with tracing off, on, and sampled (None - off)
+	trace_dir = locksfile_path + '.traces'
+	os.makedirs(trace_dir, exist_ok = True)
+	records = list()
+
+	for sample in samples:
+		if sample is None:
+			l = pylocksfile(locksfile_path)
+		else:
+			l = pylocksfile(locksfile_path, trace = trace_dir, trace_sample = sample)
+
+		start_time = time.perf_counter()
+		for i in range(n_ops):
+			l.acquire(writeLock = True, lock_n = i % 64)
+			l.release(lock_n = i % 64)
+		elapsed = time.perf_counter() - start_time
+
+		print("trace", "off" if sample is None else "sample " + str(sample), "- uncontended acquire+release", round(elapsed / n_ops * 1e6, 3), "us")
+		records.append(record('tracerOverhead', 'posix', {'sample' : sample}, {'acquire_release_us' : elapsed / n_ops * 1e6}))
+
+	for name in os.listdir(trace_dir):
+		os.remove(os.path.join(trace_dir, name))
+	os.rmdir(trace_dir)
+
+	print()
+
+	return records
+
+
+def compareResults(records, baseline_path):
+	#Print the change of every result value against a previous run's JSON, matched by benchmark, backend and params
+	with open(baseline_path, 'r') as f:
+		baseline = json.load(f)
+
+	def key(rec):
+		return (rec['benchmark'], rec['backend'], json.dumps(rec['params'], sort_keys = True))
+
+	previous = {key(rec) : rec['results'] for rec in baseline['records']}
+
+	print("Comparing with", baseline_path, "(" + str(baseline['meta'].get('version')) + ")")
+
+	for rec in records:
+		old = previous.get(key(rec))
+		if old is None:
+			continue
+
+		changes = [name + " " + str(round(rec['results'][name] / old[name], 3)) + "x" for name in sorted(rec['results'])
+			if name in old and isinstance(old[name], (int, float)) and not isinstance(old[name], bool) and old[name]]
+
+		print(rec['benchmark'], rec['backend'], rec['params'], "-", ", ".join(changes))
+
+	print()
+
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'pylocksfile benchmark suite')
+	parser.add_argument('--locksfile', default = './benchlock.lock', help = 'lockfile used by the benchmarks')
+	parser.add_argument('--output', default = None, help = 'write the results to this JSON file')
+	parser.add_argument('--compare', default = None, help = 'JSON results of a previous run to compare with')
+	parser.add_argument('--backends', default = ','.join(BACKENDS), help = 'comma separated lock implementations')
+	parser.add_argument('--quick', action = 'store_true', help = 'smaller sweep and shorter runs')
+	args = parser.parse_args(argv)
+
+	locksfile_path = args.locksfile
+	backends = tuple(args.backends.split(','))
+
+	records = list()
+
+	if args.quick:
+		records += benchIntervalStore(n_held_list = (10, 1000), n_ops = 5000)
+		records += benchUncontended(locksfile_path, backends, n_ops = 5000)
+		records += benchHeldLocks(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')], n_held_list = (0, 1000), n_ops = 5000)
+		records += benchReacquire(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')], n_ops = 5000)
+		records += benchRecordStore(locksfile_path, [backend for backend in backends if backend == 'ofd'], n_ops = 1000)
+		records += benchTeardown(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')], n_ranges_list = (1000,))
+		records += benchDeadlockDetection(locksfile_path, n_waiters_list = (4,), n_held_list = (10, 10000), n_ops = 50)
+		records += benchContended(locksfile_path, backends, n_process_list = (2,), n_tracks_list = (16,), write_ratios = (0.1, 1.0), widths = (1,), duration = 0.2)
+		records += benchHandOverHand(locksfile_path, backends, n_process_list = (2,), n_races = 5)
+		records += benchWithBlocks(locksfile_path, n_threads_list = (1, 8), n_blocks = 500)
+		records += benchFairness(locksfile_path, duration = 0.5)
+		records += benchUpgradeable(locksfile_path, update_ratios = (0.05,), duration = 0.5)
+		records += benchOptimistic(locksfile_path, write_ratios = (0.0, 0.1), duration = 0.3)
+		records += benchSemaphore(locksfile_path, values = (1, 16, 256), duration = 0.3)
+		records += benchExecutor(locksfile_path, workloads = ((1, 0.3), (4, 0.8)), n_tasks = 300)
+		records += benchHierarchy(locksfile_path, n_held_list = (0, 20000), n_ops = 500)
+		records += benchSharded(locksfile_path, n_shards_list = (1, 16), n_process_list = (2,), duration = 0.2)
+		records += benchLockServer(locksfile_path, n_process_list = (2,), duration = 0.3)
+		records += benchTracerOverhead(locksfile_path, n_ops = 10000)
+	else:
+		records += benchIntervalStore()
+		records += benchUncontended(locksfile_path, backends)
+		records += benchHeldLocks(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')])
+		records += benchReacquire(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')])
+		records += benchRecordStore(locksfile_path, [backend for backend in backends if backend == 'ofd'])
+		records += benchTeardown(locksfile_path, [backend for backend in backends if backend in ('posix', 'ofd')])
+		records += benchDeadlockDetection(locksfile_path)
+		records += benchContended(locksfile_path, backends)
+		records += benchHandOverHand(locksfile_path, backends)
+		records += benchThreadsVsProcesses(locksfile_path)
+		records += benchWithBlocks(locksfile_path)
+		records += benchTimeoutLatency(locksfile_path)
+		records += benchFairness(locksfile_path)
+		records += benchUpgradeable(locksfile_path)
+		records += benchOptimistic(locksfile_path)
+		records += benchSemaphore(locksfile_path)
+		records += benchExecutor(locksfile_path)
+		records += benchHierarchy(locksfile_path)
+		records += benchSharded(locksfile_path)
+		records += benchLockServer(locksfile_path)
+		records += benchMetricsOverhead(locksfile_path)
+		records += benchTracerOverhead(locksfile_path)
+
+	meta = {'version' : pylocksfile_module.__version__, 'python' : platform.python_version(), 'platform' : platform.platform(),
+		'cpu_count' : os.cpu_count(), 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'argv' : sys.argv[1:] if argv is None else argv}
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'meta' : meta, 'records' : records}, f, indent = 1)
+		print("Results written to", args.output)
+
+	if args.compare:
+		compareResults(records, args.compare)
+
+
+if __name__ == '__main__':
+	main()
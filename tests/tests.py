@@ -23,13 +23,26 @@ SOFTWARE.
 """
 
 import os
-from multiprocessing import Pool, Manager, Lock, Queue
+import sys
+import subprocess
+import queue
+import asyncio
+import concurrent.futures
+import threading
+import multiprocessing
+from multiprocessing import Pool, Manager
 from functools import partial
 import time
 import numpy as np
 import operator
+import io
+import contextlib
+import pickle
+import shutil
+import json
+import struct
 
-from pylocksfile import pylocksfile
+from pylocksfile import pylocksfile, lockInterval, lockHistogram, WFG_RANGES, LockTimeoutError, DeadlockError, IllegalArgumentError, IllegalWithStatement, stableKeyHash, stripeEstimate, scanLocks, procLocks, top, shardedLocksfile, HIERARCHY_OFFSET, UPGRADE_GATES, OPTIMISTIC_RETRIES, lockServer, remoteLocksfile, LockServerError, recordStore, lockTracer, readTrace, traceSpans, traceReport, chromeTrace, trace, lockSemaphore, lockExecutor, EXECUTOR_BATCH, ASYNC_WAITERS, NODE_IS, NODE_IX, NODE_S, NODE_SIX, NODE_X
 
 
 class procRace():
@@ -62,9 +75,9 @@ class procRace():
 		self.release(track_i = step_i % self.n_tracks)
 
 class pylocksfileProcRace(procRace):
-	def __init__(self, procIdx, n_tracks, n_races, fpath, writeLock, results_queue):
+	def __init__(self, procIdx, n_tracks, n_races, fpath, writeLock, results_queue, backend = 'posix'):
 		super(pylocksfileProcRace, self).__init__(procIdx = procIdx, n_tracks = n_tracks, n_races = n_races)
-		self.l = pylocksfile(fpath, verbose = False)
+		self.l = pylocksfile(fpath, verbose = False, backend = backend)
 		self.writeLock = writeLock
 		self.results_queue = results_queue
 		self.procIdx = procIdx
@@ -81,29 +94,8 @@ class pylocksfileProcRace(procRace):
 		return
 
 
-class pythonLockProcRace(procRace):
-	def __init__(self, procIdx, n_tracks, n_races, locks_list, results_queue):
-		super(pythonLockProcRace, self).__init__(procIdx = procIdx, n_tracks = n_tracks, n_races = n_races)
-		self.locks_list = locks_list
-		self.results_queue = results_queue
-
-	def lock(self, track_i, step_i):
-		self.locks_list[track_i].acquire()
-
-		#Record the Lock
-		self.results_queue.put([self.procIdx, track_i, step_i])
-		return
-
-	def release(self, track_i):
-		self.locks_list[track_i].release()
-		return
-
-def run_pylocksfileProcRace(results_queue, procIdx, n_tracks, n_races, fpath, writeLock):
-	join_race = pylocksfileProcRace(procIdx, n_tracks, n_races, fpath, writeLock, results_queue)
-	join_race.race()
-
-def run_pythonLockProcRace(locks_list, results_queue, procIdx, n_tracks, n_races):
-	join_race = pythonLockProcRace(procIdx, n_tracks, n_races, locks_list, results_queue)
+def run_pylocksfileProcRace(results_queue, procIdx, n_tracks, n_races, fpath, writeLock, backend = 'posix'):
+	join_race = pylocksfileProcRace(procIdx, n_tracks, n_races, fpath, writeLock, results_queue, backend)
 	join_race.race()
 
 
@@ -162,73 +154,30 @@ def testCorrectness(q, n_process, verbose = True):
 def testRace(locksfile_path, n_process, n_tracks, n_races):
 	print("Running testRace...")
 
-	n_process = n_process
-
 	#n_tracks must be bigger than n_process or we'll get deadlock
-	n_tracks = n_tracks
 	n_tracks = max(n_tracks, n_process + 1)
 
-	n_races = n_races
-
 	writeLock = True
 
-	pylocksfileProcRaceArgs = list()
-	for procIdx in range(n_process):
-		pylocksfileProcRaceArgs.append( (procIdx, n_tracks, n_races, locksfile_path, writeLock) )
-	
-
-	pool = Pool(n_process)
-	m = Manager()
-	q = m.Queue()
-	func = partial(run_pylocksfileProcRace, q)
-
-	start_time = time.time()
-	
-	pool.starmap(func, pylocksfileProcRaceArgs)
-	pool.close()
-	pool.join()
-
-	end_time = time.time()
+	#Correctness only - timings are measured by benchmarks.py, without the recording queue in the way
+	for backend in ('posix', 'ofd'):
+		pylocksfileProcRaceArgs = list()
+		for procIdx in range(n_process):
+			pylocksfileProcRaceArgs.append( (procIdx, n_tracks, n_races, locksfile_path, writeLock, backend) )
 
-	pylocksfile_time = end_time - start_time
+		pool = Pool(n_process)
+		m = Manager()
+		q = m.Queue()
+		func = partial(run_pylocksfileProcRace, q)
 
-	print("pylocksfile took", pylocksfile_time)
+		pool.starmap(func, pylocksfileProcRaceArgs)
+		pool.close()
+		pool.join()
 
-	if not testCorrectness(q, n_process, verbose = True):
-		print("pylocksfile incorrect!\n")
-	else:
-		print("pylocksfile correct.\n")
-
-
-	pythonLockProcRaceArgs = list()
-	for procIdx in range(n_process):
-		pythonLockProcRaceArgs.append( (procIdx, n_tracks, n_races) )
-
-	pool = Pool(n_process)
-	m = Manager()
-	q = m.Queue()
-	#As suggested in https://stackoverflow.com/questions/25557686/python-sharing-a-lock-between-processes
-	locks_list = [m.Lock() for i in range(n_tracks)]
-	func = partial(run_pythonLockProcRace, locks_list, q)
-	
-	start_time = time.time()
-	
-	pool.starmap(func, pythonLockProcRaceArgs)
-	pool.close()
-	pool.join()
-	
-	end_time = time.time()
-	
-	pythonlock_time = end_time - start_time
-
-	print("python locks took", pythonlock_time)
-
-	if not testCorrectness(q, n_process, verbose = True):
-		print("python locks incorrect!\n")
-	else:
-		print("python locks correct.\n")
-
-	print("testRace - Speed-Up ", pythonlock_time / pylocksfile_time)
+		if not testCorrectness(q, n_process, verbose = True):
+			print("pylocksfile", backend, "incorrect!\n")
+		else:
+			print("pylocksfile", backend, "correct.\n")
 
 def testRangesProc1(globalBarrier, locksfile_path):
 	#Create pylocksfile
@@ -304,13 +253,2383 @@ def testReadWriteLocks(locksfile_path):
 	pool.join()
 
 
+def testLockInterval(n_ops = 2000, n_indices = 64, seed = 0):
+	print("Running testLockInterval...")
+
+	#Compare the interval store against a brute-force {lock index: [writeLock, count]} model
+	rng = np.random.default_rng(seed)
+	store = lockInterval()
+	model = dict()
+
+	for _ in range(n_ops):
+		lock_n = int(rng.integers(0, n_indices))
+		n_locks = int(rng.integers(1, 8))
+		writeLock = bool(rng.integers(0, 2))
+		op = rng.integers(0, 6)
+
+		#Parts not held in writeLock mode, before the operation
+		missing = [i for i in range(lock_n, lock_n + n_locks) if i not in model or model[i][0] != writeLock]
+		span = store.missingSpan((lock_n, n_locks), writeLock)
+		assert (span is None) if not missing else (span == (missing[0], missing[-1] + 1 - missing[0]))
+
+		if op < 3:
+			store.insertInterval((lock_n, n_locks), writeLock)
+			for i in range(lock_n, lock_n + n_locks):
+				model[i] = [writeLock, model[i][1] + 1 if i in model and model[i][0] == writeLock else 1]
+		elif op < 5:
+			freed = store.releaseInterval((lock_n, n_locks))
+			expected = list()
+			for i in range(lock_n, lock_n + n_locks):
+				if i in model:
+					model[i][1] -= 1
+					if not model[i][1]:
+						del model[i]
+						expected.append(i)
+			assert [i for interval in freed for i in range(interval.lock_n, interval.lock_n + interval.n_locks)] == expected
+		else:
+			store.removeInterval((lock_n, n_locks))
+			for i in range(lock_n, lock_n + n_locks):
+				model.pop(i, None)
+
+		for i in range(n_indices + 8):
+			assert store.inBound(i) == (i in model)
+			assert store.lockMode(i) == (model[i][0] if i in model else None)
+			assert store.lockCount(i) == (model[i][1] if i in model else 0)
+
+		#Segments are sorted, non-overlapping and adjacent segments always differ in mode or count
+		segments = store.countIntervals
+		for prev, cur in zip(segments, segments[1:]):
+			assert prev.lock_n + prev.n_locks <= cur.lock_n
+			assert prev.lock_n + prev.n_locks < cur.lock_n or (prev.writeLock, prev.count) != (cur.writeLock, cur.count)
+
+		#Merged mode view - adjacent intervals always differ in mode
+		segments = store.modeIntervals
+		for prev, cur in zip(segments, segments[1:]):
+			assert prev.lock_n + prev.n_locks < cur.lock_n or prev.writeLock != cur.writeLock
+
+		#snapshot/restore puts a region back as it was
+		if op == 0:
+			before = store.countIntervals
+			previous = store.snapshot((lock_n, n_locks))
+			store.insertInterval((lock_n, n_locks), not writeLock)
+			store.restore((lock_n, n_locks), previous)
+			assert store.countIntervals == before
+
+	#Nested holds within a segment are counted in place, and merge back into it when released
+	store.reset()
+	store.insertInterval((0, 8), True)
+	for nested in ((2, 4), (0, 4), (4, 4), (0, 8)):
+		store.insertInterval(nested, True)
+		assert store.lockCount(nested[0]) == 2
+		assert store.releaseInterval(nested) == []
+		assert store.countIntervals == [(0, 8, True, 1)]
+
+	store.insertInterval((0, 4), True)
+	store.insertInterval((4, 4), True)
+	assert store.countIntervals == [(0, 8, True, 2)]
+
+	print("lockInterval correct.\n")
+
+def acquireManyProc(locksfile_path, indices_or_ranges, writeLock):
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'acquireMany')
+
+	#Hold lock 1 for reading first, the failed batch must leave it held for reading
+	l.acquire(writeLock = False, lock_n = 1)
+
+	acquired = l.acquire_many(indices_or_ranges, writeLock = writeLock, blocking = False)
+
+	return acquired, l._lockIntervals.modeIntervals
+
+def testAcquireMany(locksfile_path):
+	print("Running testAcquireMany...")
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'acquireMany')
+
+	#NumPy indices and ranges are merged into the fewest runs
+	assert l.acquire_many(np.array([900, 17, 3, 19, 18]), writeLock = True)
+	assert l.acquire_many([(20, 2), 23], writeLock = False)
+	assert l._lockIntervals.modeIntervals == [(3, 1, True), (17, 3, True), (20, 2, False), (23, 1, False), (900, 1, True)]
+
+	pool = Pool(1)
+
+	#Lock 900 is taken by this process, so the whole batch must fail and be rolled back
+	acquired, held = pool.apply(acquireManyProc, (locksfile_path, [0, 1, 2, 900], True))
+	assert not acquired
+	assert held == [(1, 1, False)]
+
+	#Lock 2 is free and 20, 21 are shared, so a shared batch succeeds
+	acquired, held = pool.apply(acquireManyProc, (locksfile_path, [1, 2, (20, 2)], False))
+	assert acquired
+	assert held == [(1, 2, False), (20, 2, False)]
+
+	pool.close()
+	pool.join()
+
+	l.release()
+
+	print("acquire_many correct.\n")
+
+def tryAcquireProc(locksfile_path, lock_n, writeLock):
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'tryAcquire')
+
+	return l.acquire(writeLock = writeLock, lock_n = lock_n, blocking = False)
+
+def testNesting(locksfile_path):
+	print("Running testNesting...")
+
+	#Metrics count the acquires that reached the os
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'nesting', metrics = True)
+	pool = Pool(1)
+
+	with l(writeLock = True, lock_n = (0, 4)):
+		with l(writeLock = True, lock_n = (1, 2)):
+			pass
+
+		#The inner release must not drop what the outer block holds
+		assert l._lockIntervals.modeIntervals == [(0, 4, True)]
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 2, False))
+
+	assert l._lockIntervals.modeIntervals == []
+	assert l.metrics.snapshot()[0]['acquires'] == 1
+	assert 1 not in l.metrics.snapshot()
+
+	#Partly held - only the missing part [4, 6) is requested
+	assert l.acquire(writeLock = True, lock_n = (2, 2))
+	assert l.acquire(writeLock = True, lock_n = (2, 4))
+	assert 4 in l.metrics.snapshot()
+	assert l._lockIntervals.countIntervals == [(2, 2, True, 2), (4, 2, True, 1)]
+
+	l.release((2, 4))
+	assert l._lockIntervals.modeIntervals == [(2, 2, True)]
+	l.release((2, 4))
+	assert l._lockIntervals.modeIntervals == []
+	assert pool.apply(tryAcquireProc, (locksfile_path, (2, 2), True))
+
+	#Converting the mode replaces the holds
+	assert l.acquire(writeLock = True, lock_n = 7)
+	assert l.acquire(writeLock = True, lock_n = 7)
+	assert l.acquire(writeLock = False, lock_n = 7)
+	l.release(7)
+	assert l._lockIntervals.modeIntervals == []
+
+	pool.close()
+	pool.join()
+
+	print("nesting correct.\n")
+
+def testReleaseAll(locksfile_path, n_ranges = 2000):
+	print("Running testReleaseAll...")
+
+	pool = Pool(1)
+
+	for backend in ('posix', 'ofd'):
+		a = pylocksfile(locksfile_path = locksfile_path, l_id = 'releaseAll', backend = backend)
+
+		#Scattered ranges, released by a single whole-file unlock
+		for i in range(n_ranges):
+			a.acquire(writeLock = bool(i % 2), lock_n = 3 * i)
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 3, True))
+
+		a.release()
+		assert len(a._lockIntervals) == 0
+		assert pool.apply(tryAcquireProc, (locksfile_path, (0, 3 * n_ranges), True))
+
+		#POSIX locks belong to the process - another instance of the same file keeps its locks
+		b = pylocksfile(locksfile_path = locksfile_path, l_id = 'releaseAll', backend = backend)
+		assert a.acquire(writeLock = True, lock_n = 5)
+		assert b.acquire(writeLock = True, lock_n = 100)
+		a.release()
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 100, True))
+		b.release()
+		assert pool.apply(tryAcquireProc, (locksfile_path, 100, True))
+
+		#release_many drops one hold of each lock and unlocks what is no longer held
+		assert a.acquire_many([1, 2, 3, 10, 11], writeLock = True)
+		assert a.acquire(writeLock = True, lock_n = 3)
+		a.release_many(np.array([11, 2, 3, 10]))
+		assert a._lockIntervals.modeIntervals == [(1, 1, True), (3, 1, True)]
+		assert pool.apply(tryAcquireProc, (locksfile_path, (10, 2), True))
+		assert pool.apply(tryAcquireProc, (locksfile_path, 2, True))
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 3, True))
+		a.release()
+
+		del a, b
+
+	pool.close()
+	pool.join()
+
+	print("release all correct.\n")
+
+def testOfdThreads(locksfile_path, n_threads = 4, n_tracks = 20, n_races = 20):
+	print("Running testOfdThreads...")
+
+	#Two instances in the same process. POSIX locks do not exclude each other, OFD locks do.
+	posix_1 = pylocksfile(locksfile_path = locksfile_path)
+	posix_2 = pylocksfile(locksfile_path = locksfile_path)
+	assert posix_1.acquire(writeLock = True, lock_n = 0)
+	assert posix_2.acquire(writeLock = True, lock_n = 0, blocking = False)
+	posix_1.release()
+	posix_2.release()
+
+	ofd_1 = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	ofd_2 = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	assert ofd_1.acquire(writeLock = True, lock_n = 0)
+	assert not ofd_2.acquire(writeLock = True, lock_n = 0, blocking = False)
+	assert ofd_2.acquire(writeLock = False, lock_n = 1, blocking = False)
+	ofd_1.release()
+	assert ofd_2.acquire(writeLock = True, lock_n = 0, blocking = False)
+	ofd_2.release()
+
+	#Hand-over-hand race between threads, each with its own OFD instance
+	q = queue.Queue()
+	races = [pylocksfileProcRace(procIdx, n_tracks, n_races, locksfile_path, True, q, backend = 'ofd') for procIdx in range(n_threads)]
+	threads = [threading.Thread(target = race.race) for race in races]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+
+	assert testCorrectness(q, n_threads, verbose = False)
+
+	print("ofd threads correct.\n")
+
+def holdLockProc(locksfile_path, lock_n, hold_time, held_event):
+	l = pylocksfile(locksfile_path = locksfile_path)
+	l.acquire(writeLock = True, lock_n = lock_n)
+	held_event.set()
+
+	time.sleep(hold_time)
+	l.release()
+
+def timedAcquire(l, lock_n, timeout, results):
+	results.append((l.acquire(writeLock = True, lock_n = lock_n, timeout = timeout), l.last_wait_time))
+
+def testTimeout(locksfile_path):
+	print("Running testTimeout...")
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'timeout')
+	pool = Pool(1)
+	m = Manager()
+
+	held_event = m.Event()
+	pool.apply_async(holdLockProc, (locksfile_path, 7, 1.0, held_event))
+	held_event.wait()
+
+	#Times out while the other process holds lock 7 - both in the main thread (timer signal) and in another thread (polling)
+	assert not l.acquire(writeLock = True, lock_n = 7, timeout = 0.2)
+	assert 0.2 <= l.last_wait_time < 0.5
+
+	results = list()
+	t = threading.Thread(target = timedAcquire, args = (l, 7, 0.2, results))
+	t.start()
+	t.join()
+	assert not results[0][0]
+	assert 0.2 <= results[0][1] < 0.5
+
+	#Succeeds once the other process releases it, well within the timeout
+	assert l.acquire(writeLock = True, lock_n = 7, timeout = 5)
+	assert l.last_wait_time < 2
+	l.release()
+
+	#Uncontended - no waiting at all
+	assert l.acquire(writeLock = True, lock_n = 7, timeout = 0)
+	l.release()
+
+	pool.close()
+	pool.join()
+
+	print("timeout correct.\n")
+
+async def asyncScenario(l):
+	#Counts event loop iterations, to check the loop keeps running while a lock is contended
+	ticks = [0]
+	async def ticker():
+		while True:
+			ticks[0] += 1
+			await asyncio.sleep(0.01)
+	ticker_task = asyncio.ensure_future(ticker())
+
+	#Lock 9 is held by the other process
+	assert not await l.acquire_async(writeLock = True, lock_n = 9, timeout = 0.2)
+	assert ticks[0] >= 10
+
+	try:
+		async with l.async_lock(writeLock = True, lock_n = 9, timeout = 0.05):
+			assert False
+	except LockTimeoutError:
+		pass
+
+	#Waiting tasks take no thread - with more of them than the waiter pool has threads, a timeout is still kept
+	waiters = [asyncio.ensure_future(l.acquire_async(writeLock = True, lock_n = 9)) for _ in range(2 * ASYNC_WAITERS)]
+	await asyncio.sleep(0.05)
+	start_time = time.monotonic()
+	assert not await l.acquire_async(writeLock = True, lock_n = 9, timeout = 0.1)
+	assert time.monotonic() - start_time < 0.5
+	for waiter in waiters:
+		waiter.cancel()
+	await asyncio.gather(*waiters, return_exceptions = True)
+
+	#Cancelling a waiting task drops the request - lock 9 is not held by us once the other process lets it go
+	task = asyncio.ensure_future(l.acquire_async(writeLock = True, lock_n = 9))
+	await asyncio.sleep(0.1)
+	task.cancel()
+	try:
+		await task
+		assert False
+	except asyncio.CancelledError:
+		pass
+
+	#Free locks are taken inline
+	async with l.async_lock(writeLock = False, lock_n = (10, 2)):
+		assert l._lockIntervals.modeIntervals == [(10, 2, False)]
+	assert l._lockIntervals.modeIntervals == []
+
+	#Waits until the other process releases lock 9
+	assert await l.acquire_async(writeLock = True, lock_n = 9, timeout = 5)
+	assert l._lockIntervals.modeIntervals == [(9, 1, True)]
+	l.release()
+
+	#A waiter granted (8, 3) after its task was cancelled gives back only that request - lock 10, read locked meanwhile
+	#by another coroutine, stays held
+	async with l.async_lock(writeLock = False, lock_n = 10):
+		l._lockRange(True, 8, 3, False)
+		granted = concurrent.futures.Future()
+		granted.set_result(True)
+		l._cancelledWait(granted, l._lockIntervals.preprocessInput((8, 3)), True)
+		assert l._lockIntervals.modeIntervals == [(10, 1, False)]
+
+		pool = Pool(1)
+		assert pool.apply(tryAcquireProc, (l.locksfile_path, (8, 2), True))
+		assert not pool.apply(tryAcquireProc, (l.locksfile_path, 10, True))
+		assert pool.apply(tryAcquireProc, (l.locksfile_path, 10, False))
+		pool.close()
+		pool.join()
+	assert l._lockIntervals.modeIntervals == []
+
+	ticker_task.cancel()
+
+def testAsync(locksfile_path):
+	print("Running testAsync...")
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'async')
+	pool = Pool(1)
+	m = Manager()
+
+	held_event = m.Event()
+	pool.apply_async(holdLockProc, (locksfile_path, 9, 1.0, held_event))
+	held_event.wait()
+
+	loop = asyncio.new_event_loop()
+	loop.run_until_complete(asyncScenario(l))
+	loop.close()
+
+	pool.close()
+	pool.join()
+
+	print("async correct.\n")
+
+def testMetrics(locksfile_path):
+	print("Running testMetrics...")
+
+	#Percentiles are within the histogram's relative error
+	histogram = lockHistogram()
+	values = np.random.default_rng(0).integers(1, 10 ** 9, 10000)
+	for value in values:
+		histogram.record(value)
+	for p in (50, 90, 99):
+		assert abs(histogram.percentile(p) - np.percentile(values, p)) <= np.percentile(values, p) / 16 + 1
+	assert histogram.count == len(values) and histogram.max == values.max()
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'metrics', metrics = True)
+	pool = Pool(1)
+	m = Manager()
+
+	held_event = m.Event()
+	pool.apply_async(holdLockProc, (locksfile_path, 7, 0.5, held_event))
+	held_event.wait()
+
+	#Uncontended
+	assert l.acquire(writeLock = True, lock_n = 1)
+	l.release(1)
+
+	#Contended - fails without waiting, then times out, then waits for the other process
+	assert not l.acquire(writeLock = True, lock_n = 7, blocking = False)
+	assert not l.acquire(writeLock = True, lock_n = 7, timeout = 0.05)
+	assert l.acquire(writeLock = True, lock_n = 7)
+	time.sleep(0.01)
+	l.release()
+
+	snapshot = l.metrics.snapshot()
+	assert snapshot[1]['acquires'] == 1 and snapshot[1]['contended'] == 0 and snapshot[1]['hold_ns']['count'] == 1
+	assert snapshot[7]['acquires'] == 1 and snapshot[7]['contended'] == 3 and snapshot[7]['deadlocks'] == 0
+	assert snapshot[7]['wait_ns']['max'] >= 0.1 * 1e9
+	assert snapshot[7]['hold_ns']['min'] >= 0.01 * 1e9
+
+	prometheus = l.metrics.prometheus(labels = {'service' : 'test'})
+	assert 'pylocksfile_contended_total{lock="7",service="test"} 3' in prometheus
+	assert 'pylocksfile_wait_seconds_count{lock="7",service="test"} 1' in prometheus
+
+	#Switched off - nothing is recorded
+	l.disableMetrics()
+	assert l.metrics is None
+	assert l.acquire(writeLock = True, lock_n = 1)
+	l.release()
+
+	pool.close()
+	pool.join()
+
+	print("metrics correct.\n")
+
+def keysProc(locksfile_path, keys, writeLock):
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'keys', n_stripes = 64)
+
+	return l.acquire_keys(keys, writeLock = writeLock, blocking = False)
+
+def testKeys(locksfile_path, n_keys = 2000, n_stripes = 256):
+	print("Running testKeys...")
+
+	keys = ['user:' + str(i) for i in range(50)] + [b'blob', 7, (1, 'a'), frozenset(['x', 'y']), None]
+
+	#Same hashes in a fresh interpreter with a different hash seed
+	script = 'import sys; sys.path.insert(0, ' + repr(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + '); from pylocksfile import stableKeyHash; print([stableKeyHash(k) for k in ' + repr(keys) + '])'
+	env = dict(os.environ, PYTHONHASHSEED = '12345')
+	assert subprocess.check_output([sys.executable, '-c', script], env = env).decode().strip() == str([stableKeyHash(k) for k in keys])
+
+	#Keys equal in python share a stripe
+	assert stableKeyHash(1) == stableKeyHash(1.0) == stableKeyHash(True)
+	assert stableKeyHash('1') != stableKeyHash(1)
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'keys', n_stripes = 64)
+
+	#Stripes are de-duplicated and sorted
+	assert l.acquire_keys(['a', 'b', 'a', ('c', 1)], writeLock = True)
+	stripes = sorted(set(l.stripe(k) for k in ['a', 'b', ('c', 1)]))
+	assert [i for segment in l._lockIntervals.modeIntervals for i in range(segment.lock_n, segment.lock_n + segment.n_locks)] == stripes
+
+	pool = Pool(1)
+
+	#Another process can not take any of the held keys, all or nothing
+	assert not pool.apply(keysProc, (locksfile_path, ['zzz', 'b'], True))
+
+	l.release_keys(['a', 'b', ('c', 1)])
+	assert l._lockIntervals.intervals == []
+	assert pool.apply(keysProc, (locksfile_path, ['zzz', 'b'], True))
+
+	with l.key('user:1', writeLock = True):
+		assert not pool.apply(keysProc, (locksfile_path, ['user:1'], False))
+	assert pool.apply(keysProc, (locksfile_path, ['user:1'], False))
+
+	pool.close()
+	pool.join()
+
+	#Estimate against a simulation
+	estimate = stripeEstimate(n_keys, n_stripes)
+	counts = {}
+	for i in range(n_keys):
+		stripe = stableKeyHash('key' + str(i)) % n_stripes
+		counts[stripe] = counts.get(stripe, 0) + 1
+	collided = sum(count for count in counts.values() if count > 1) / n_keys
+	assert abs(len(counts) - estimate['stripes_used']) < 0.05 * n_stripes
+	assert abs(collided - estimate['collision_rate']) < 0.05
+
+	print("Keys correct.\n")
+
+def scanProc(locksfile_path):
+	#Own descriptor - closing it drops only this process' POSIX locks
+	fd = os.open(locksfile_path, os.O_RDONLY)
+	try:
+		return scanLocks(fd)
+	finally:
+		os.close(fd)
+
+def testHolders(locksfile_path):
+	print("Running testHolders...")
+
+	pid = os.getpid()
+	p = pylocksfile(locksfile_path = locksfile_path)
+	o = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	assert p.acquire(writeLock = True, lock_n = (5, 3))
+	assert p.acquire(writeLock = False, lock_n = 20)
+	assert o.acquire(writeLock = False, lock_n = 20)
+	assert o.acquire(writeLock = True, lock_n = 40)
+
+	#The os leaves out the caller's own locks - the process' for POSIX, the instance's for OFD. OFD holders have pid -1.
+	assert o.holders() == [(pid, True, 5, 3), (pid, False, 20, 1)]
+	assert p.holders() == [(-1, False, 20, 1), (-1, True, 40, 1)]
+	assert o.holders(6) == [(pid, True, 5, 3)]
+	assert o.holders((8, 12)) == []
+
+	#A process holding no locks sees them all, one holder per range
+	pool = Pool(1)
+	holders = pool.apply(scanProc, (locksfile_path,))
+	assert len(holders) == 3 and holders[0] == (pid, True, 5, 3) and holders[2] == (-1, True, 40, 1)
+	pool.close()
+	pool.join()
+
+	#/proc/locks lists every holder, and the waiters with who they wait for
+	entries = procLocks(locksfile_path)
+	if entries is not None:
+		assert sorted(entries, key = lambda entry: (entry.lock_n, entry.pid)) == [(pid, True, 5, 3, 'POSIX', None), (-1, False, 20, 1, 'OFDLCK', None), (pid, False, 20, 1, 'POSIX', None), (-1, True, 40, 1, 'OFDLCK', None)]
+
+		held_event = multiprocessing.Event()
+		waiter = multiprocessing.Process(target = holdLockProc, args = (locksfile_path, 6, 0, held_event))
+		waiter.start()
+
+		deadline = time.monotonic() + 5
+		while not [entry for entry in procLocks(locksfile_path) if entry.pid == waiter.pid] and time.monotonic() < deadline:
+			time.sleep(0.01)
+		assert [entry for entry in procLocks(locksfile_path) if entry.pid == waiter.pid] == [(waiter.pid, True, 6, 1, 'POSIX', pid)]
+
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			top([locksfile_path, '-n', '1'])
+		assert str(waiter.pid) in output.getvalue()
+
+		p.release()
+		waiter.join()
+		assert held_event.is_set()
+
+	p.release()
+	o.release()
+	assert o.holders() == []
+
+	print("holders correct.\n")
+
+def deadlockWorker(locksfile_path, backend, victim, held, wanted, delay, barrier, results):
+	l = pylocksfile(locksfile_path = locksfile_path, backend = backend, deadlock_detection = True, deadlock_victim = victim)
+	l.acquire(writeLock = True, lock_n = held)
+	barrier.wait()
+
+	#Stagger the waits, so the policies have a known victim
+	time.sleep(delay)
+	try:
+		results.put((held, l.acquire(writeLock = True, lock_n = wanted)))
+	except DeadlockError:
+		results.put((held, 'deadlock'))
+
+	#Let the other waiters through
+	l.release()
+
+def blockDeadlockWorker(locksfile_path, held, wanted, delay, barrier, results):
+	#With blocks of 'posix' locks, no detection of pylocksfile - the os reports the deadlock
+	l = pylocksfile(locksfile_path = locksfile_path)
+	l.acquire(writeLock = True, lock_n = held)
+	barrier.wait()
+
+	time.sleep(delay)
+	try:
+		with l(writeLock = True, lock_n = wanted):
+			results.put((held, l._lockIntervals.missingSpan((wanted, 1), True) is None))
+	except DeadlockError:
+		results.put((held, 'deadlock'))
+
+	l.release()
+
+def runDeadlock(locksfile_path, backend, victim, n, use_processes):
+	if use_processes:
+		barrier, results = multiprocessing.Barrier(n), multiprocessing.Queue()
+		workers = [multiprocessing.Process(target = deadlockWorker, args = (locksfile_path, backend, victim, i, (i + 1) % n, 0.05 * i, barrier, results)) for i in range(n)]
+	else:
+		barrier, results = threading.Barrier(n), queue.Queue()
+		workers = [threading.Thread(target = deadlockWorker, args = (locksfile_path, backend, victim, i, (i + 1) % n, 0.05 * i, barrier, results)) for i in range(n)]
+
+	for w in workers:
+		w.start()
+	outcomes = dict(results.get(timeout = 10) for _ in range(n))
+	for w in workers:
+		w.join()
+
+	return outcomes
+
+def testDeadlock(locksfile_path):
+	print("Running testDeadlock...")
+
+	#A cycle of 3 processes with 'posix' locks - the request closing it gives up, the others get their locks
+	outcomes = runDeadlock(locksfile_path, 'posix', 'requester', 3, True)
+	assert sorted(outcomes.values(), key = str) == [True, True, 'deadlock'] and outcomes[2] == 'deadlock'
+
+	#A with block the os reports a deadlock for raises - its body never runs unlocked
+	barrier, results = multiprocessing.Barrier(2), multiprocessing.Queue()
+	workers = [multiprocessing.Process(target = blockDeadlockWorker, args = (locksfile_path, i, 1 - i, 0.05 * i, barrier, results)) for i in range(2)]
+	for w in workers:
+		w.start()
+	assert dict(results.get(timeout = 10) for _ in range(2)) == {0 : True, 1 : 'deadlock'}
+	for w in workers:
+		w.join()
+
+	#Longer than the os can see, with OFD locks of threads - the policy picks the victim
+	assert runDeadlock(locksfile_path, 'ofd', 'oldest', 5, False) == {0 : 'deadlock', 1 : True, 2 : True, 3 : True, 4 : True}
+	assert runDeadlock(locksfile_path, 'ofd', 'youngest', 4, False) == {0 : True, 1 : True, 2 : True, 3 : 'deadlock'}
+	assert runDeadlock(locksfile_path, 'ofd', lambda cycle: [waiter for waiter in cycle if waiter.lock_n == 2][0], 3, False) == {0 : True, 1 : 'deadlock', 2 : True}
+
+	#Waiting for a holder that is not waiting is no deadlock - the timeout still applies
+	a = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', deadlock_detection = True)
+	b = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', deadlock_detection = True)
+	assert a.acquire(writeLock = True, lock_n = 5)
+	assert not b.acquire(writeLock = True, lock_n = 5, timeout = 0.1)
+	assert b.last_wait_time >= 0.1
+
+	#Readers do not wait for readers
+	assert a.acquire(writeLock = False, lock_n = 20)
+	assert b.acquire(writeLock = False, lock_n = 21)
+	assert a.acquire(writeLock = False, lock_n = 21, timeout = 1.0)
+	assert b.acquire(writeLock = False, lock_n = 20, timeout = 1.0)
+	b.release()
+
+	#acquire_many rolls back the runs it took before raising
+	assert b.acquire(writeLock = True, lock_n = 10)
+	waiter = threading.Thread(target = b.acquire, kwargs = { 'writeLock' : True, 'lock_n' : 5 })
+	waiter.start()
+	time.sleep(0.2)
+	try:
+		a.acquire_many([1, 10], writeLock = True)
+		assert False
+	except DeadlockError as e:
+		assert len(e.cycle) == 2 and e.cycle[0].lock_n == 10
+	assert a._lockIntervals.modeIntervals == [(5, 1, True), (20, 2, False)]
+	a.release()
+	waiter.join()
+	assert b._lockIntervals.modeIntervals == [(5, 1, True), (10, 1, True)]
+	b.release()
+
+	#Held segments are brought up to date on each wait - a lock taken after an earlier wait closes a cycle
+	assert b.acquire(writeLock = True, lock_n = 6)
+	assert a.acquire(writeLock = True, lock_n = 5)
+	assert not a.acquire(writeLock = True, lock_n = 6, timeout = 0.1)
+	assert a.acquire(writeLock = True, lock_n = 7)
+	waiter = threading.Thread(target = b.acquire, kwargs = { 'writeLock' : True, 'lock_n' : 7 })
+	waiter.start()
+	time.sleep(0.2)
+	try:
+		a.acquire(writeLock = True, lock_n = 6, timeout = 5.0)
+		assert False
+	except DeadlockError as e:
+		assert len(e.cycle) == 2
+	a.release()
+	waiter.join()
+	b.release()
+
+	#Only the changed span is rewritten - the published segments always match the held ones
+	rng = np.random.default_rng(0)
+	for _ in range(300):
+		lock_n = int(rng.integers(0, 200))
+		n_locks = int(rng.integers(1, 6))
+		if rng.integers(0, 3):
+			a.acquire(writeLock = bool(rng.integers(0, 2)), lock_n = (lock_n, n_locks))
+		else:
+			a.release(lock_n = (lock_n, n_locks))
+		if rng.integers(0, 4) == 0:
+			a.release()
+
+		a._wfg._publish(a._lockIntervals)
+		starts, ends, modes = a._lockIntervals.segments()
+		writes = [k for k in range(len(starts)) if modes[k]]
+		arrays = a._wfg._offset(a._wfg.slot) + a._wfg.RECORD_SIZE
+		published = [list(struct.unpack_from('%dq' % n, a._wfg._mmap, arrays + 8 * WFG_RANGES * k)) for k, n in enumerate((len(starts), len(starts), len(writes), len(writes)))]
+		assert published == [starts, ends, [starts[k] for k in writes], [ends[k] for k in writes]]
+		assert (a._wfg._n_held, a._wfg._n_write) == (len(starts), len(writes))
+	a.release()
+
+	try:
+		pylocksfile(locksfile_path = locksfile_path, deadlock_detection = True, deadlock_victim = 'random')
+		assert False
+	except IllegalArgumentError:
+		pass
+
+	print("deadlock correct.\n")
+
+def fairAcquire(l, writeLock, name, hold_time, order):
+	l.acquire(writeLock = writeLock, lock_n = 0)
+	order.append(name)
+	time.sleep(hold_time)
+	l.release()
+
+def startFairAcquire(locksfile_path, fairness, writeLock, name, hold_time, order):
+	#Each waiter in a thread with its own 'ofd' instance, started after the previous one is waiting
+	t = threading.Thread(target = fairAcquire, args = (pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = fairness), writeLock, name, hold_time, order))
+	t.start()
+	time.sleep(0.1)
+
+	return t
+
+def testFairness(locksfile_path):
+	print("Running testFairness...")
+
+	holder = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'writer')
+	reader = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'writer')
+
+	#Writer preference - a new reader queues behind a waiting writer
+	order = list()
+	assert holder.acquire(writeLock = False, lock_n = 0)
+	writer = startFairAcquire(locksfile_path, 'writer', True, 'writer', 0.2, order)
+	assert not reader.acquire(writeLock = False, lock_n = 0, blocking = False)
+	assert not reader.acquire(writeLock = False, lock_n = 0, timeout = 0.1)
+	holder.release()
+	assert reader.acquire(writeLock = False, lock_n = 0, timeout = 2.0)
+	assert order == ['writer']
+	writer.join()
+	reader.release()
+
+	#Without a policy the reader gets in, and the writer keeps waiting
+	unfair_holder = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	unfair_reader = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	order = list()
+	assert unfair_holder.acquire(writeLock = False, lock_n = 0)
+	writer = startFairAcquire(locksfile_path, None, True, 'writer', 0, order)
+	assert unfair_reader.acquire(writeLock = False, lock_n = 0, blocking = False)
+	unfair_holder.release()
+	unfair_reader.release()
+	writer.join()
+	del unfair_holder, unfair_reader
+
+	#FIFO - requests get the lock in arrival order, however they would have raced
+	holder = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'fifo')
+	order = list()
+	assert holder.acquire(writeLock = True, lock_n = 0)
+	threads = [startFairAcquire(locksfile_path, 'fifo', writeLock, name, 0.05, order) for writeLock, name in ((True, 'w1'), (False, 'r1'), (True, 'w2'), (False, 'r2'))]
+	holder.release()
+	for t in threads:
+		t.join()
+	assert order == ['w1', 'r1', 'w2', 'r2']
+	assert holder.acquire(writeLock = True, lock_n = (0, 3), blocking = False)
+	holder.release()
+
+	#A ticket whose node is still held - FAIR_QUEUE requests of the stripe queued - waits until it is let go
+	queued = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'fifo')
+	node = holder._fair._node(0, struct.unpack_from('q', holder._fair._mmap, 0)[0])
+	queued._fair._lock(node, 1, True, False, None)
+	assert not holder.acquire(writeLock = True, lock_n = 0, blocking = False)
+	assert not holder.acquire(writeLock = True, lock_n = 0, timeout = 0.1)
+	queued._fair._unlock(node, 1)
+	assert holder.acquire(writeLock = True, lock_n = 0, timeout = 1.0)
+
+	#acquire_async takes its turn too - a later blocking request does not overtake it
+	async_waiter = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'fifo')
+	order = list()
+	loop = asyncio.new_event_loop()
+	task = loop.create_task(async_waiter.acquire_async(writeLock = True, lock_n = 0, timeout = 5.0))
+	loop.run_until_complete(asyncio.sleep(0.1))
+	late = startFairAcquire(locksfile_path, 'fifo', True, 'late', 0, order)
+	holder.release()
+	assert loop.run_until_complete(task)
+	time.sleep(0.1)
+	assert order == []
+	async_waiter.release()
+	late.join()
+	assert order == ['late']
+
+	#Cancelled fair waits leave the queue and free their threads at once - with more of them than the waiter pool has
+	#threads, a timed request still times out, and the next one gets its turn once the lock is free
+	assert holder.acquire(writeLock = True, lock_n = 0)
+	cancelled = [pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'fifo') for _ in range(2 * ASYNC_WAITERS)]
+	tasks = [loop.create_task(waiter.acquire_async(writeLock = True, lock_n = 0)) for waiter in cancelled]
+	loop.run_until_complete(asyncio.sleep(0.1))
+	start_time = time.monotonic()
+	assert not loop.run_until_complete(async_waiter.acquire_async(writeLock = True, lock_n = 0, timeout = 0.2))
+	assert time.monotonic() - start_time < 1.0
+	for task in tasks:
+		task.cancel()
+	loop.run_until_complete(asyncio.gather(*tasks, return_exceptions = True))
+	holder.release()
+	start_time = time.monotonic()
+	assert loop.run_until_complete(async_waiter.acquire_async(writeLock = True, lock_n = 0, timeout = 1.0))
+	assert time.monotonic() - start_time < 0.5
+	assert not any(len(waiter._lockIntervals) for waiter in cancelled)
+	async_waiter.release()
+	loop.close()
+
+	#Phase-fair - readers that waited for a writer phase go before the next writer, readers arriving after it wait for it
+	holder = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'phase_fair')
+	late_reader = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'phase_fair')
+	order = list()
+	assert holder.acquire(writeLock = True, lock_n = 0)
+	threads = [startFairAcquire(locksfile_path, 'phase_fair', writeLock, name, 0.3, order) for writeLock, name in ((False, 'r1'), (True, 'w2'), (False, 'r2'))]
+	holder.release()
+	time.sleep(0.1)
+	assert order == ['r1', 'r2']
+	assert not late_reader.acquire(writeLock = False, lock_n = 0, blocking = False)
+	for t in threads:
+		t.join()
+	assert order == ['r1', 'r2', 'w2']
+	assert late_reader.acquire(writeLock = False, lock_n = 0, blocking = False)
+	late_reader.release()
+
+	try:
+		pylocksfile(locksfile_path = locksfile_path, fairness = 'random')
+		assert False
+	except IllegalArgumentError:
+		pass
+
+	print("fairness correct.\n")
+
+def hierarchyProc(locksfile_path, writeLock, lock_n):
+	l = pylocksfile(locksfile_path = locksfile_path, hierarchy = (64, 16, 4))
+
+	return l.acquire(writeLock = writeLock, lock_n = lock_n, blocking = False)
+
+def testHierarchy(locksfile_path):
+	print("Running testHierarchy...")
+
+	#Tables of 64 rows, blocks of 16 and groups of 4
+	l = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', hierarchy = (64, 16, 4))
+	other = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', hierarchy = (64, 16, 4))
+
+	#Rows take intentions on their ancestors, and are locked one by one in the finest level only
+	assert l.acquire(writeLock = True, lock_n = (5, 2))
+	assert l._hierarchy.nodes() == {(0, 0) : NODE_IX, (1, 0) : NODE_IX, (2, 1) : NODE_IX}
+	assert l._hierarchy.leafIntervals == [(5, 2, True)]
+
+	#Whole nodes are a single node lock
+	assert l.acquire(writeLock = False, lock_n = (16, 16))
+	assert l._hierarchy.nodes() == {(0, 0) : NODE_IX, (1, 0) : NODE_IX, (2, 1) : NODE_IX, (1, 1) : NODE_S}
+	assert l._hierarchy.leafIntervals == [(5, 2, True)]
+
+	#Nodes are locked in the sidecar - the lockfile only has the rows locked one by one
+	fd = os.open(locksfile_path, os.O_RDWR)
+	nodes_fd = os.open(locksfile_path + '.hier', os.O_RDWR)
+	assert [(holder.lock_n, holder.n_locks) for holder in scanLocks(fd, ofd = True)] == [(5, 2)]
+	assert len(scanLocks(nodes_fd, ofd = True)) > 0
+	os.close(fd)
+	os.close(nodes_fd)
+
+	#Row requests meet at the rows, table requests at the table node
+	assert other.acquire(writeLock = True, lock_n = 4, blocking = False)
+	assert not other.acquire(writeLock = True, lock_n = 5, blocking = False)
+	assert other.acquire(writeLock = False, lock_n = 17, blocking = False)
+	assert not other.acquire(writeLock = True, lock_n = 17, blocking = False)
+	assert not other.acquire(writeLock = False, lock_n = (0, 64), blocking = False)
+	assert other.acquire(writeLock = True, lock_n = (64, 64), blocking = False)
+	other.release()
+
+	#Covering a node with rows moves up to the node, and releasing part of it goes back down
+	assert l.acquire(writeLock = True, lock_n = (0, 5))
+	assert l.acquire(writeLock = True, lock_n = (7, 9))
+	assert l._hierarchy.nodes() == {(0, 0) : NODE_IX, (1, 0) : NODE_X, (1, 1) : NODE_S}
+	assert l._hierarchy.leafIntervals == []
+	l.release((5, 2))
+	assert l._hierarchy.nodes()[(1, 0)] == NODE_IX
+	assert (2, 1) in l._hierarchy.nodes()
+	assert l._hierarchy.leafIntervals == [(4, 1, True), (7, 1, True)]
+	assert other.acquire(writeLock = True, lock_n = (5, 2), blocking = False)
+	other.release()
+
+	#A write under a read held node - SIX on the node
+	assert l.acquire(writeLock = True, lock_n = 20)
+	assert l._hierarchy.nodes()[(1, 1)] == NODE_SIX
+	assert other.acquire(writeLock = False, lock_n = 17, blocking = False)
+	assert not other.acquire(writeLock = False, lock_n = 20, blocking = False)
+	other.release()
+
+	#Release all - one whole-file unlock, rows and nodes
+	l.release()
+	assert l._hierarchy.nodes() == {}
+	assert l._hierarchy.leafIntervals == []
+	assert other.acquire(writeLock = True, lock_n = (0, 64), blocking = False)
+	other.release()
+
+	#Context manager and nesting, like without a hierarchy
+	with l(True, (0, 64)):
+		assert l._hierarchy.nodes() == {(0, 0) : NODE_X}
+		with l(True, 10):
+			assert l._hierarchy.nodes() == {(0, 0) : NODE_X}
+		assert not other.acquire(writeLock = False, lock_n = 10, blocking = False)
+	assert l._hierarchy.nodes() == {}
+
+	#'posix' - the holder is the process
+	p = pylocksfile(locksfile_path = locksfile_path, hierarchy = (64, 16, 4))
+	assert p.acquire(writeLock = True, lock_n = 3)
+	pool = Pool(1)
+	assert not pool.apply(hierarchyProc, (locksfile_path, False, (0, 64)))
+	assert not pool.apply(hierarchyProc, (locksfile_path, False, 3))
+	assert pool.apply(hierarchyProc, (locksfile_path, True, 2))
+	p.release()
+	assert pool.apply(hierarchyProc, (locksfile_path, True, (0, 64)))
+
+	#Other 'posix' instances of the process would share the node locks - a release by one would drop the other's. Rejected,
+	#when created or on first use.
+	try:
+		pylocksfile(locksfile_path = locksfile_path, hierarchy = (64, 16, 4))
+		assert False
+	except IllegalArgumentError:
+		pass
+	flat = pylocksfile(locksfile_path = locksfile_path)
+	try:
+		flat.acquire(writeLock = True, lock_n = 100)
+		assert False
+	except IllegalArgumentError:
+		pass
+	del p, flat
+	flat = pylocksfile(locksfile_path = locksfile_path)
+	assert flat.acquire(writeLock = True, lock_n = 100)
+	try:
+		pylocksfile(locksfile_path = locksfile_path, hierarchy = (64, 16, 4))
+		assert False
+	except IllegalArgumentError:
+		pass
+	del flat
+
+	#'ofd' instances keep their own - releasing a row of one leaves the other's table intention locked
+	assert l.acquire(writeLock = True, lock_n = 5) and other.acquire(writeLock = True, lock_n = 100)
+	l.release(lock_n = 5)
+	assert not pool.apply(hierarchyProc, (locksfile_path, False, (64, 64)))
+	assert pool.apply(hierarchyProc, (locksfile_path, False, (0, 64)))
+	other.release()
+	pool.close()
+	pool.join()
+
+	#Escalation - more than 2 row segments in a block locks the block whole
+	e = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', hierarchy = (64, 16), escalation = 2)
+	assert e.acquire_many([0, 2], writeLock = False)
+	assert e._hierarchy.leafIntervals == [(0, 1, False), (2, 1, False)]
+	assert e.acquire(writeLock = False, lock_n = 4)
+	assert e._hierarchy.nodes() == {(0, 0) : NODE_IS, (1, 0) : NODE_S}
+	assert e._hierarchy.leafIntervals == []
+	#The escalated block also covers the rows it does not hold
+	assert other.acquire(writeLock = False, lock_n = 1, blocking = False)
+	assert not other.acquire(writeLock = True, lock_n = 3, blocking = False)
+	other.release()
+	#A write into it goes back to the rows, and is escalated again - to X, it holds a write
+	assert e.acquire(writeLock = True, lock_n = 8)
+	assert e._hierarchy.nodes() == {(0, 0) : NODE_IX, (1, 0) : NODE_X}
+	assert not other.acquire(writeLock = False, lock_n = 1, blocking = False)
+	#Row requests stay below the threshold
+	e.release()
+	assert e.acquire_many([0, 8], writeLock = True)
+	assert e._hierarchy.leafIntervals == [(0, 1, True), (8, 1, True)]
+	assert other.acquire(writeLock = True, lock_n = 3, blocking = False)
+	other.release()
+	e.release()
+	assert other.acquire(writeLock = True, lock_n = (0, 64), blocking = False)
+	other.release()
+
+	for kwargs in ({'hierarchy' : (16, 32)}, {'hierarchy' : (16, 6)}, {'hierarchy' : (1,)}, {'hierarchy' : 16}, {'escalation' : 2}, {'hierarchy' : (16, 4), 'escalation' : 0}):
+		try:
+			pylocksfile(locksfile_path = locksfile_path, **kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	try:
+		l.acquire(writeLock = True, lock_n = (HIERARCHY_OFFSET - 1, 2))
+		assert False
+	except IllegalArgumentError:
+		pass
+
+	print("hierarchy correct.\n")
+
+def shardedProc(locksfile_dir, writeLock, lock_n):
+	l = shardedLocksfile(locksfile_dir, 4, block_size = 8)
+
+	return l.acquire(writeLock = writeLock, lock_n = lock_n, blocking = False)
+
+def testSharded(locksfile_path):
+	print("Running testSharded...")
+
+	locksfile_dir = os.path.join(os.path.dirname(os.path.abspath(locksfile_path)), 'testshards')
+	os.makedirs(locksfile_dir, exist_ok = True)
+
+	#By modulo - neighbouring locks in different shards, numbered within the shard
+	l = shardedLocksfile(locksfile_dir, 4, backend = 'ofd')
+	other = shardedLocksfile(locksfile_dir, 4, backend = 'ofd')
+	assert [l.shard(i) for i in (0, 1, 5, 8)] == [(0, 0), (1, 0), (1, 1), (0, 2)]
+	assert l.split([(2, 8)]) == {2 : [(0, 2)], 3 : [(0, 2)], 0 : [(1, 2)], 1 : [(1, 2)]}
+
+	#A range is split over the shards, and each part conflicts as without shards
+	assert l.acquire(writeLock = True, lock_n = (2, 8))
+	assert l.shards[0]._lockIntervals.modeIntervals == [(1, 2, True)]
+	assert sorted(os.listdir(locksfile_dir)) == ['shard0.lock', 'shard1.lock', 'shard2.lock', 'shard3.lock']
+	assert not other.acquire(writeLock = False, lock_n = 9, blocking = False)
+	assert other.acquire(writeLock = True, lock_n = 10, blocking = False)
+	other.release()
+
+	#All or nothing - the shards taken before the failing one are rolled back
+	assert not other.acquire(writeLock = True, lock_n = (0, 3), blocking = False)
+	assert not other.acquire(writeLock = True, lock_n = (0, 3), timeout = 0.05)
+	assert not other.acquire_many([12, 13, 9], writeLock = True, blocking = False)
+	assert all(not len(shard._lockIntervals) for shard in other.shards)
+
+	#Nested acquires and releases per part
+	with l(True, (2, 8)):
+		pass
+	assert not other.acquire(writeLock = True, lock_n = 2, blocking = False)
+	l.release((2, 8))
+	assert other.acquire_many([2, (6, 3), 100], writeLock = True, blocking = False)
+	other.release_many([2, (6, 3), 100])
+	assert all(not len(shard._lockIntervals) for shard in other.shards)
+
+	#By block - a range within a block stays in one shard, 'posix' locks are held by the process
+	b = shardedLocksfile(locksfile_dir, 4, block_size = 8)
+	assert b.split([(8, 8)]) == {1 : [(0, 8)]}
+	assert b.split([(30, 4)]) == {3 : [(6, 2)], 0 : [(8, 2)]}
+	assert b.acquire(writeLock = True, lock_n = (30, 4))
+	pool = Pool(1)
+	assert not pool.apply(shardedProc, (locksfile_dir, False, 33))
+	assert pool.apply(shardedProc, (locksfile_dir, True, (34, 30)))
+	b.release()
+	assert pool.apply(shardedProc, (locksfile_dir, True, (0, 64)))
+	pool.close()
+	pool.join()
+
+	for args in ((locksfile_dir, 0), (locksfile_dir, 2, 0), (os.path.join(locksfile_dir, 'missing'), 2)):
+		try:
+			shardedLocksfile(*args)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	print("sharded correct.\n")
+
+def forkedChild(l, lock_n):
+	#Runs in a forked child - holds nothing of the parent's, and the parent's lock still excludes it
+	code = 0 if not len(l._lockIntervals) and not l.acquire(writeLock = False, lock_n = lock_n, blocking = False) else 1
+	l.release()
+	os._exit(code)
+
+def testHandles(locksfile_path):
+	print("Running testHandles...")
+
+	handles_path = os.path.join(os.path.dirname(os.path.abspath(locksfile_path)), 'testhandles.lock')
+	link_path = handles_path + '.link'
+	for path in (handles_path, link_path):
+		if os.path.lexists(path):
+			os.remove(path)
+
+	#Opened on first use, never truncated
+	a = pylocksfile(locksfile_path = handles_path)
+	assert not os.path.exists(handles_path)
+	with open(handles_path, 'w') as f:
+		f.write('data')
+	os.symlink(handles_path, link_path)
+	b = pylocksfile(locksfile_path = link_path)
+	assert a.acquire(writeLock = True, lock_n = 5)
+	assert b.acquire(writeLock = True, lock_n = 5)
+	#(Reading it back with open() would drop the process' locks on close)
+	assert os.path.getsize(handles_path) == 4
+
+	#'posix' instances of the file (by inode) share one descriptor
+	assert a._handle is b._handle and a._fd == b._fd
+
+	pool = Pool(1)
+
+	#Releasing one instance keeps what the other holds - 5 stays write locked
+	del b
+	assert not pool.apply(tryAcquireProc, (handles_path, 5, False))
+
+	#Write locks of one instance outlive read locks of the other over them, a read lock over them leaves them write locked
+	b = pylocksfile(locksfile_path = handles_path)
+	assert a.acquire(writeLock = True, lock_n = 7)
+	assert b.acquire(writeLock = False, lock_n = (6, 3))
+	assert not pool.apply(tryAcquireProc, (handles_path, 7, False))
+	assert pool.apply(tryAcquireProc, (handles_path, 8, False))
+	assert not pool.apply(tryAcquireProc, (handles_path, 8, True))
+	b.release((6, 3))
+	assert not pool.apply(tryAcquireProc, (handles_path, 7, False))
+	assert pool.apply(tryAcquireProc, (handles_path, (6, 1), True))
+	assert pool.apply(tryAcquireProc, (handles_path, (8, 1), True))
+
+	#A write lock of one instance over a read lock of the other goes back to read when released
+	assert a.acquire(writeLock = False, lock_n = 9)
+	assert b.acquire(writeLock = True, lock_n = 9)
+	assert not pool.apply(tryAcquireProc, (handles_path, 9, False))
+	b.release(9)
+	assert pool.apply(tryAcquireProc, (handles_path, 9, False))
+	assert not pool.apply(tryAcquireProc, (handles_path, 9, True))
+
+	#Release all of one instance - a single whole-file unlock only for the last one
+	b.acquire(writeLock = True, lock_n = 11)
+	b.release()
+	assert not pool.apply(tryAcquireProc, (handles_path, 5, False))
+	del b
+	a.release()
+	assert pool.apply(tryAcquireProc, (handles_path, (0, 16), True))
+
+	#The descriptor is closed with the last instance
+	fd = a._fd
+	del a
+	try:
+		os.fstat(fd)
+		assert False
+	except OSError:
+		pass
+
+	pool.close()
+	pool.join()
+
+	#Forked children start over, holding nothing - 'posix' and 'ofd'
+	for backend in ('posix', 'ofd'):
+		l = pylocksfile(locksfile_path = handles_path, backend = backend)
+		assert l.acquire(writeLock = True, lock_n = 20)
+		pid = os.fork()
+		if not pid:
+			forkedChild(l, 20)
+		assert os.waitpid(pid, 0)[1] == 0
+		assert l._lockIntervals.modeIntervals == [(20, 1, True)]
+		other = pylocksfile(locksfile_path = handles_path, backend = 'ofd')
+		assert not other.acquire(writeLock = False, lock_n = 20, blocking = False)
+		l.release()
+		assert other.acquire(writeLock = True, lock_n = 20, blocking = False)
+		del l, other
+
+	#Pickled as the path and the arguments
+	l = pylocksfile(locksfile_path = handles_path, backend = 'ofd', n_stripes = 64)
+	assert l.acquire(writeLock = True, lock_n = 3)
+	copy = pickle.loads(pickle.dumps(l))
+	assert copy.locksfile_path == l.locksfile_path and copy.backend == 'ofd' and copy.n_stripes == 64
+	assert not len(copy._lockIntervals)
+	assert not copy.acquire(writeLock = True, lock_n = 3, blocking = False)
+	l.release()
+	del l, copy
+
+	os.remove(link_path)
+
+	print("handles correct.\n")
+
+def upgradeableProc(locksfile_path, lock_n):
+	l = pylocksfile(locksfile_path = locksfile_path)
+
+	return l.acquire_upgradeable(lock_n = lock_n, blocking = False), l.acquire(writeLock = False, lock_n = lock_n, blocking = False)
+
+def checkThenUpdate(locksfile_path, lock_n, counter, n_updates):
+	l = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+
+	for _ in range(n_updates):
+		with l.upgradeable(lock_n) as lock:
+			value = counter[0]
+			time.sleep(0.001)
+			lock.upgrade()
+			counter[0] = value + 1
+
+def testUpgradeable(locksfile_path):
+	print("Running testUpgradeable...")
+
+	a = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	b = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	c = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+
+	#Shared with plain readers, a single upgradeable holder, writers wait
+	assert a.acquire_upgradeable(lock_n = 5)
+	assert b.acquire(writeLock = False, lock_n = 5, blocking = False)
+	assert not b.acquire_upgradeable(lock_n = (4, 2), blocking = False)
+	assert not b.acquire_upgradeable(lock_n = 5, timeout = 0.05)
+	assert b.acquire_upgradeable(lock_n = 6, blocking = False)
+	b.release_upgradeable(lock_n = 6)
+	assert not c.acquire(writeLock = True, lock_n = 5, blocking = False)
+
+	#A nested request that fails gives back the gates it took only - the outer hold keeps its own
+	assert c.acquire(writeLock = True, lock_n = 7)
+	assert not a.acquire_upgradeable(lock_n = (4, 4), blocking = False)
+	assert a._gates.modeIntervals == [(5, 1, True)]
+	assert not b.acquire_upgradeable(lock_n = 5, blocking = False)
+	assert b.acquire_upgradeable(lock_n = 4, blocking = False) and b.acquire_upgradeable(lock_n = 6, blocking = False)
+	b.release_upgradeable(lock_n = 4)
+	b.release_upgradeable(lock_n = 6)
+	c.release(lock_n = 7)
+
+	#upgrade waits for the plain readers
+	assert not a.upgrade(lock_n = 5, timeout = 0.05)
+	assert a._lockIntervals.modeIntervals == [(5, 1, False)]
+	assert not c.acquire_upgradeable(lock_n = 5, blocking = False)
+	releaser = threading.Timer(0.2, b.release, kwargs = {'lock_n' : 5})
+	releaser.start()
+	assert a.upgrade(lock_n = 5)
+	releaser.join()
+	assert a._lockIntervals.modeIntervals == [(5, 1, True)]
+	assert not b.acquire(writeLock = False, lock_n = 5, blocking = False)
+
+	#downgrade - readers get in at once, the range stays upgradeable and never free for writers
+	a.downgrade(lock_n = 5)
+	assert b.acquire(writeLock = False, lock_n = 5, blocking = False)
+	assert not b.acquire_upgradeable(lock_n = 5, blocking = False)
+	assert not c.acquire(writeLock = True, lock_n = 5, blocking = False)
+	b.release(lock_n = 5)
+
+	#A plain write lock can be downgraded too
+	assert c.acquire(writeLock = True, lock_n = 20)
+	c.downgrade(lock_n = 20)
+	assert b.acquire(writeLock = False, lock_n = 20, blocking = False)
+	c.release()
+	b.release()
+
+	a.release_upgradeable(lock_n = 5)
+	assert c.acquire_upgradeable(lock_n = 5, blocking = False)
+	assert c.upgrade(lock_n = 5, timeout = 0)
+	c.release_upgradeable(lock_n = 5)
+	assert not len(c._lockIntervals) and not len(c._gates)
+
+	#Check-then-update from several threads - upgrades do not deadlock, and no update is lost
+	counter = [0]
+	threads = [threading.Thread(target = checkThenUpdate, args = (locksfile_path, 7, counter, 20)) for _ in range(3)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert counter[0] == 60
+
+	#An upgrade does not queue behind a writer of a fairness policy waiting for the same range (fairAcquire takes lock 0)
+	fair = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', fairness = 'writer')
+	assert fair.acquire_upgradeable(lock_n = 0)
+	order = list()
+	writer = startFairAcquire(locksfile_path, 'writer', True, 'writer', 0, order)
+	time.sleep(0.1)
+	assert fair.upgrade(lock_n = 0, timeout = 2.0)
+	assert order == []
+	fair.release_upgradeable(lock_n = 0)
+	writer.join()
+	assert order == ['writer']
+
+	#'posix' - held by the process. release() drops the gates too.
+	p = pylocksfile(locksfile_path = locksfile_path)
+	with p.upgradeable((10, 2)):
+		pool = Pool(1)
+		assert pool.apply(upgradeableProc, (locksfile_path, 11)) == (False, True)
+		pool.close()
+		pool.join()
+	assert p.acquire_upgradeable(lock_n = 12)
+	p.release()
+	assert c.acquire_upgradeable(lock_n = 12, blocking = False)
+	c.release()
+
+	for call, kwargs in ((a.upgrade, {'lock_n' : 3}), (a.downgrade, {'lock_n' : 3}), (a.acquire_upgradeable, {'lock_n' : UPGRADE_GATES})):
+		try:
+			call(**kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	print("upgradeable correct.\n")
+
+def remoteHolderProc(address, held, wanted):
+	#Holds held and waits for wanted at the server - until killed
+	l = remoteLocksfile(address)
+	l.acquire(writeLock = True, lock_n = held)
+	l.acquire(writeLock = True, lock_n = wanted)
+
+def remoteCounterProc(address, counter, n_updates):
+	l = remoteLocksfile(address)
+	for _ in range(n_updates):
+		with l(writeLock = True, lock_n = 3):
+			value = counter.value
+			time.sleep(0.0005)
+			counter.value = value + 1
+
+def remotePickledProc(l, lock_n):
+	#A pickled client is a new connection, holding nothing
+	return l.acquire(writeLock = True, lock_n = lock_n, blocking = False)
+
+def testLockServer(locksfile_path):
+	print("Running testLockServer...")
+
+	socket_path = os.path.abspath('./testlock.sock')
+	server = lockServer(locksfile_path, socket_path).start()
+	assert server.address == socket_path
+
+	a = remoteLocksfile(socket_path)
+	b = remoteLocksfile(socket_path)
+	direct = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd')
+	assert a.locksfile_path == os.path.abspath(locksfile_path) and a.backend == 'ofd' and server.n_clients == 2
+
+	#Clients lock against each other and against direct users of the lockfile
+	assert a.acquire(writeLock = True, lock_n = 5)
+	assert not b.acquire(writeLock = False, lock_n = 5, blocking = False)
+	assert not direct.acquire(writeLock = False, lock_n = 5, blocking = False)
+	assert not b.acquire(writeLock = False, lock_n = (4, 3), timeout = 0.1)
+	assert 0.1 <= b.last_wait_time < 1.0
+	assert b.acquire(writeLock = False, lock_n = 6)
+	assert b.holders(5) == [(-1, True, 5, 1)]
+
+	#A blocking acquire waits at the server, the release is pipelined
+	releaser = threading.Timer(0.2, a.release, kwargs = {'lock_n' : 5})
+	start = time.monotonic()
+	releaser.start()
+	assert b.acquire(writeLock = False, lock_n = 5)
+	releaser.join()
+	assert time.monotonic() - start >= 0.2
+	assert direct.acquire(writeLock = False, lock_n = 5, blocking = False)
+	direct.release()
+	b.release()
+
+	#acquire_many all or nothing, keys, upgradeable locks
+	assert direct.acquire(writeLock = True, lock_n = 30)
+	assert not a.acquire_many([10, 11, (20, 11)], writeLock = True, blocking = False)
+	assert b.acquire(writeLock = True, lock_n = 10, blocking = False)
+	b.release(10)
+	direct.release()
+	assert a.acquire_many(np.array([10, 11, 30]), writeLock = True)
+	assert not b.acquire(writeLock = False, lock_n = 11, blocking = False)
+	a.release_many([10, 11, 30])
+	a.flush()
+	assert b.acquire_many([10, 11, 30], writeLock = True, blocking = False)
+	b.release()
+
+	with a.key('user:42', writeLock = True):
+		assert a.stripe('user:42') == direct.stripe('user:42')
+		assert not b.acquire_keys(['user:42'], blocking = False)
+	#Pipelined releases are done at the server once flushed
+	a.flush()
+	assert b.acquire_keys(['user:42'], writeLock = True, blocking = False)
+	b.release_keys(['user:42'])
+
+	with a.upgradeable(8) as lock:
+		assert b.acquire(writeLock = False, lock_n = 8, blocking = False)
+		assert not a.upgrade(lock_n = 8, timeout = 0.05)
+		b.release(8)
+		lock.upgrade()
+		assert not b.acquire(writeLock = False, lock_n = 8, blocking = False)
+		lock.downgrade()
+		assert b.acquire(writeLock = False, lock_n = 8, blocking = False)
+		b.release(8)
+
+	#Errors of the server are raised by the client, bad input before sending
+	for call, kwargs in ((a.upgrade, {'lock_n' : 3}), (a.acquire, {'lock_n' : -1}), (a.acquire_upgradeable, {'lock_n' : 3, 'blocking' : False, 'timeout' : 1})):
+		try:
+			call(**kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+	assert a.acquire(writeLock = True, lock_n = 3, blocking = False)
+	a.release(3)
+
+	#A dropped client releases its locks - also while it waits
+	assert a.acquire(writeLock = True, lock_n = 40)
+	proc = multiprocessing.Process(target = remoteHolderProc, args = (socket_path, 41, 40))
+	proc.start()
+	deadline = time.monotonic() + 10
+	while direct.acquire(writeLock = True, lock_n = 41, blocking = False):
+		direct.release()
+		assert time.monotonic() < deadline
+		time.sleep(0.01)
+	proc.terminate()
+	proc.join()
+	assert direct.acquire(writeLock = True, lock_n = 41, timeout = 2.0)
+	direct.release()
+	a.close()
+	assert direct.acquire(writeLock = True, lock_n = 40, timeout = 2.0)
+	direct.release()
+
+	#The next request of a closed client connects again
+	assert a.acquire(writeLock = True, lock_n = 40, blocking = False)
+	a.release()
+
+	#Clients of several processes - no update lost
+	counter = multiprocessing.Value('i', 0, lock = False)
+	procs = [multiprocessing.Process(target = remoteCounterProc, args = (socket_path, counter, 50)) for _ in range(3)]
+	for proc in procs:
+		proc.start()
+	for proc in procs:
+		proc.join()
+	assert counter.value == 150
+
+	#Pickled and forked clients hold nothing
+	assert a.acquire(writeLock = True, lock_n = 50)
+	pool = Pool(1)
+	assert pool.apply(remotePickledProc, (a, 50)) is False
+	assert pool.apply(remotePickledProc, (a, 51)) is True
+	pool.close()
+	pool.join()
+	pid = os.fork()
+	if pid == 0:
+		os._exit(0 if a.acquire(writeLock = True, lock_n = 50, blocking = False) is False and not a._pending else 1)
+	assert os.waitpid(pid, 0)[1] == 0
+	assert not b.acquire(writeLock = True, lock_n = 50, blocking = False)
+	a.release()
+
+	#TCP, with a second server of the same lockfile
+	tcp = lockServer(locksfile_path, ('127.0.0.1', 0)).start()
+	c = remoteLocksfile(tcp.address)
+	assert b.acquire(writeLock = True, lock_n = 60)
+	assert not c.acquire(writeLock = False, lock_n = 60, blocking = False)
+	b.release()
+	b.flush()
+	assert c.acquire(writeLock = False, lock_n = 60, blocking = False)
+	c.release()
+	tcp.shutdown()
+
+	#Shut down - clients lose their connection and locks, the socket file is removed
+	assert b.acquire(writeLock = True, lock_n = 70)
+	server.shutdown()
+	assert not os.path.exists(socket_path)
+	assert direct.acquire(writeLock = True, lock_n = 70, blocking = False)
+	direct.release()
+	try:
+		b.acquire(writeLock = True, lock_n = 70)
+		assert False
+	except LockServerError:
+		pass
+
+	#pylocksfile-server
+	proc = subprocess.Popen([sys.executable, '-c', 'import sys, pylocksfile; sys.exit(pylocksfile.server(sys.argv[1:]))', locksfile_path, '--unix', socket_path], env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path)))
+	deadline = time.monotonic() + 10
+	while not os.path.exists(socket_path):
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+	d = remoteLocksfile(socket_path)
+	assert d.acquire(writeLock = True, lock_n = 80)
+	assert not direct.acquire(writeLock = True, lock_n = 80, blocking = False)
+	proc.terminate()
+	assert proc.wait(10) == 0
+	assert not os.path.exists(socket_path)
+	assert direct.acquire(writeLock = True, lock_n = 80, blocking = False)
+	direct.release()
+
+	print("lock server correct.\n")
+
+def optimisticWriter(locksfile_path, record, n_updates):
+	#Updates the two halves of the record one after the other, under the write lock
+	l = pylocksfile(locksfile_path = locksfile_path, versions = 64)
+	for i in range(n_updates):
+		with l(writeLock = True, lock_n = 9):
+			record[0] = i
+			time.sleep(0.0002)
+			record[1] = i
+
+def optimisticReader(locksfile_path, record, duration, results):
+	#Torn reads that validated, reads, and reads that fell back to the lock
+	l = pylocksfile(locksfile_path = locksfile_path, versions = 64)
+	torn = reads = fallbacks = 0
+
+	end_time = time.monotonic() + duration
+	while time.monotonic() < end_time:
+		with l.optimistic(9) as v:
+			while True:
+				first, second = record[0], record[1]
+				if v.validate():
+					break
+			fallbacks += v.locked
+
+		torn += first != second
+		reads += 1
+
+	results.put((torn, reads, fallbacks))
+
+def deadWriterProc(locksfile_path):
+	l = pylocksfile(locksfile_path = locksfile_path, versions = 64)
+	l.acquire(writeLock = True, lock_n = 12)
+	os._exit(0)
+
+def testOptimistic(locksfile_path):
+	print("Running testOptimistic...")
+
+	w = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', versions = 64)
+	r = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', versions = 64)
+	versions = w._versions
+
+	#Counters are odd while write locked - nested, ranges, conversions and release all
+	base = versions.version(3)
+	assert not base & 1
+	assert w.acquire(writeLock = True, lock_n = 3)
+	assert versions.version(3) == base + 1
+	assert w.acquire(writeLock = True, lock_n = (0, 8))
+	assert versions.version(3) == base + 1 and versions.version(0) & 1 and versions.version(7) & 1
+	w.release(lock_n = 3)
+	assert versions.version(3) == base + 1
+	w.release(lock_n = (0, 8))
+	assert versions.version(3) == base + 2 and not versions.version(0) & 1
+	assert w.acquire(writeLock = True, lock_n = (2, 3))
+	assert w.acquire(writeLock = False, lock_n = (2, 3))
+	assert not any(versions.version(i) & 1 for i in range(2, 5))
+	assert w.acquire_many([20, 22, (30, 2)], writeLock = True)
+	assert versions.version(22) & 1 and versions.version(31) & 1 and not versions.version(21) & 1
+	w.release()
+	assert not any(versions.version(i) & 1 for i in range(64))
+
+	#Counters only change for the write holder - a reader's release does not touch them
+	assert w.acquire(writeLock = True, lock_n = 40)
+	assert r.acquire(writeLock = False, lock_n = 41)
+	r.release()
+	assert versions.version(40) & 1
+	w.release()
+
+	#Validates without a writer, not across one
+	with r.optimistic(5) as v:
+		attempts = 0
+		while True:
+			attempts += 1
+			if attempts == 1:
+				w.acquire(writeLock = True, lock_n = 5)
+				w.release(lock_n = 5)
+			if v.validate():
+				break
+	assert attempts == 2 and v.failures == 1 and not v.locked
+	assert not len(r._lockIntervals)
+
+	with r.optimistic((10, 4)) as v:
+		assert v.validate() and not v.locked
+
+	#A writer holding the lock - the reader falls back to the read lock, which waits for it, and the budget shrinks
+	budget = r._optimistic_budget
+	assert w.acquire(writeLock = True, lock_n = 6)
+	releaser = threading.Timer(0.2, w.release, kwargs = {'lock_n' : 6})
+	releaser.start()
+	start = time.monotonic()
+	with r.optimistic(6) as v:
+		assert v.locked and v.failures == budget
+		assert time.monotonic() - start >= 0.2
+		assert r._lockIntervals.modeIntervals == [(6, 1, False)]
+		assert not w.acquire(writeLock = True, lock_n = 6, blocking = False)
+		assert v.validate()
+	releaser.join()
+	assert not len(r._lockIntervals)
+	assert r._optimistic_budget == max(1, budget // 2)
+	with r.optimistic(6) as v:
+		assert v.validate()
+	assert r._optimistic_budget == min(OPTIMISTIC_RETRIES, 2 * max(1, budget // 2))
+
+	#Held by the instance already - read as it is, and not released
+	assert w.acquire(writeLock = True, lock_n = (50, 4))
+	with w.optimistic((51, 2)) as v:
+		assert v.locked and v.validate()
+	assert w._lockIntervals.modeIntervals == [(50, 4, True)]
+	w.release()
+
+	#Optimistic readers never see a torn record of a writer process
+	record = multiprocessing.Array('q', 2, lock = False)
+	writer = multiprocessing.Process(target = optimisticWriter, args = (locksfile_path, record, 2000))
+	results = multiprocessing.Queue()
+	readers = [multiprocessing.Process(target = optimisticReader, args = (locksfile_path, record, 1.0, results)) for _ in range(2)]
+	writer.start()
+	for reader in readers:
+		reader.start()
+	results = [results.get() for reader in readers]
+	for proc in readers + [writer]:
+		proc.join()
+	assert sum(torn for torn, reads, fallbacks in results) == 0
+	assert all(reads > fallbacks for torn, reads, fallbacks in results)
+
+	#A writer that died leaves its counter odd - readers take the lock until the next writer
+	proc = multiprocessing.Process(target = deadWriterProc, args = (locksfile_path, ))
+	proc.start()
+	proc.join()
+	assert versions.version(12) & 1
+	with r.optimistic(12) as v:
+		assert v.locked
+	assert w.acquire(writeLock = True, lock_n = 12)
+	w.release()
+	assert not versions.version(12) & 1
+	with r.optimistic(12) as v:
+		assert not v.locked and v.validate()
+
+	#'ofd' and 'posix' writers bump the same counters
+	s = pylocksfile(locksfile_path = locksfile_path, backend = 'ofd', versions = 64)
+	p = pylocksfile(locksfile_path = locksfile_path, versions = 64)
+	for writer in (s, p):
+		assert writer.acquire(writeLock = True, lock_n = 13)
+		assert versions.version(13) & 1
+		writer.release()
+		assert not versions.version(13) & 1
+
+	for call in (lambda: pylocksfile(locksfile_path = locksfile_path).optimistic(1), lambda: r.optimistic(64), lambda: r.optimistic((60, 5)), lambda: r.optimistic((3, 0)), lambda: pylocksfile(locksfile_path = locksfile_path, versions = 0)):
+		try:
+			call()
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	assert w.acquire(writeLock = True, lock_n = (0, 4))
+	assert w.acquire(writeLock = False, lock_n = 8)
+	try:
+		w.optimistic((2, 8))
+		assert False
+	except IllegalArgumentError:
+		pass
+	w.release()
+
+	print("optimistic correct.\n")
+
+def nestedBlocksThread(l, seed, n_blocks, errors):
+	rng = np.random.default_rng(seed)
+
+	try:
+		for _ in range(n_blocks):
+			lock_n = (int(rng.integers(0, 60)), int(rng.integers(1, 4)))
+			writeLock = bool(rng.integers(0, 2))
+
+			with l(writeLock = writeLock, lock_n = lock_n):
+				with l(writeLock = writeLock, lock_n = lock_n):
+					with l(writeLock = False, lock_n = lock_n[0]):
+						#Every block of the threads holds what it entered
+						assert l._lockIntervals.lockCount(lock_n[0]) >= 3
+	except Exception as e:
+		errors.append(e)
+
+def testWithBlocks(locksfile_path, n_threads = 8, n_blocks = 500):
+	print("Running testWithBlocks...")
+
+	l = pylocksfile(locksfile_path = locksfile_path, l_id = 'blocks', backend = 'ofd', metrics = True)
+	pool = Pool(1)
+
+	#Each call is its own block - exited out of order, each releases its own locks
+	blocks = [l(writeLock = True, lock_n = i) for i in range(3)]
+	for block in blocks:
+		assert block.__enter__() is l
+	blocks[1].__exit__(None, None, None)
+	assert l._lockIntervals.modeIntervals == [(0, 1, True), (2, 1, True)]
+	blocks[0].__exit__(None, None, None)
+	blocks[2].__exit__(None, None, None)
+	assert l._lockIntervals.modeIntervals == []
+
+	#Blocks keep no state on the instance
+	for _ in range(1000):
+		with l(writeLock = False, lock_n = 4):
+			pass
+	assert not hasattr(l, '_current_lock_n') and l._requesting is None
+
+	#A read block within a write block - one more write hold, the outer block stays write locked
+	l.metrics.reset()
+	with l(writeLock = True, lock_n = (0, 4)):
+		with l(writeLock = False, lock_n = 2):
+			assert l._lockIntervals.countIntervals == [(0, 2, True, 1), (2, 1, True, 2), (3, 1, True, 1)]
+		assert l._lockIntervals.modeIntervals == [(0, 4, True)]
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 2, False))
+	assert l.metrics.snapshot()[0]['acquires'] == 1
+
+	try:
+		with l:
+			pass
+		assert False
+	except IllegalWithStatement:
+		pass
+
+	#Threads sharing the instance - an inner block of another thread does not unlock the outer one
+	entered = threading.Event()
+	leave = threading.Event()
+
+	def outerBlock():
+		with l(writeLock = True, lock_n = 5):
+			with l(writeLock = False, lock_n = 9):
+				entered.set()
+				leave.wait()
+
+	outer = threading.Thread(target = outerBlock)
+	outer.start()
+	entered.wait()
+
+	for _ in range(50):
+		with l(writeLock = True, lock_n = 5):
+			pass
+	assert l._lockIntervals.countIntervals == [(5, 1, True, 1), (9, 1, False, 1)]
+	assert not pool.apply(tryAcquireProc, (locksfile_path, 5, False))
+
+	#While a block waits for the os, the others enter and exit what is held - only an overlapping exit waits for it
+	other = pylocksfile(locksfile_path = locksfile_path, l_id = 'blocks other', backend = 'ofd')
+	assert other.acquire(writeLock = True, lock_n = 7)
+
+	def waitingBlock():
+		with l(writeLock = True, lock_n = (5, 3)):
+			pass
+
+	waiting = threading.Thread(target = waitingBlock)
+	waiting.start()
+	time.sleep(0.2)
+	assert l._requesting == (5, 3)
+
+	start_time = time.perf_counter()
+	with l(writeLock = False, lock_n = 9):
+		pass
+	assert time.perf_counter() - start_time < 0.1
+
+	#The outer thread's exit of 9 does not wait, its exit of 5 waits for the request
+	leave.set()
+	time.sleep(0.2)
+	assert outer.is_alive() and l._lockIntervals.modeIntervals == [(5, 1, True)]
+
+	other.release(lock_n = 7)
+	waiting.join()
+	outer.join()
+	assert l._lockIntervals.modeIntervals == [] and l._requesting is None
+	assert pool.apply(tryAcquireProc, (locksfile_path, (5, 3), True))
+
+	#A write block of another thread converts held read locks, which keep their holds
+	with l(writeLock = False, lock_n = (10, 2)):
+		converting = threading.Thread(target = lambda: l(writeLock = True, lock_n = (11, 2)).__enter__())
+		converting.start()
+		converting.join()
+		assert l._lockIntervals.countIntervals == [(10, 1, False, 1), (11, 1, True, 2), (12, 1, True, 1)]
+		l._exitBlock((11, 2))
+	assert l._lockIntervals.modeIntervals == []
+
+	#Nested blocks of many threads over random ranges - every block holds its locks, nothing is left
+	errors = list()
+	threads = [threading.Thread(target = nestedBlocksThread, args = (l, seed, n_blocks, errors)) for seed in range(n_threads)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	assert not errors, errors
+	assert l._lockIntervals.modeIntervals == [] and l._requesting is None
+	assert pool.apply(tryAcquireProc, (locksfile_path, (0, 64), True))
+
+	#shardedLocksfile and remoteLocksfile blocks
+	locksfile_dir = os.path.join(os.path.dirname(os.path.abspath(locksfile_path)), 'blockshards')
+	os.makedirs(locksfile_dir, exist_ok = True)
+	sharded = shardedLocksfile(locksfile_dir = locksfile_dir, n_shards = 2)
+	blocks = [sharded(writeLock = True, lock_n = (0, 3)), sharded(writeLock = True, lock_n = 1)]
+	for block in blocks:
+		assert block.__enter__() is sharded
+	blocks[0].__exit__(None, None, None)
+	assert [len(shard._lockIntervals) for shard in sharded._shards] == [0, 1]
+	blocks[1].__exit__(None, None, None)
+	assert [len(shard._lockIntervals) for shard in sharded._shards] == [0, 0]
+
+	pool.close()
+	pool.join()
+
+	print("with blocks correct.\n")
+
+def recordStoreProc(locksfile_path, data_path, record_size, n_updates, seed):
+	#Increments the counter of record 0, and rewrites a range of 4 records with one value, read back whole
+	store = recordStore(data_path, record_size, locksfile = locksfile_path, backend = 'ofd')
+	rng = np.random.default_rng(seed)
+	torn = 0
+
+	for _ in range(n_updates):
+		with store.write(0) as view:
+			counter = view.cast('q')
+			counter[0] += 1
+			counter.release()
+
+		#Aligned ranges - two of them are the same or disjoint
+		record_n = 4 * int(rng.integers(1, store.n_records // 4))
+		with store.write(record_n, 4) as view:
+			view[:] = bytes([int(rng.integers(0, 256))]) * len(view)
+
+		with store.read(record_n, 4) as view:
+			torn += len(set(bytes(view))) != 1
+
+	store.close()
+
+	return torn
+
+def testRecordStore(locksfile_path, n_process = 4, n_updates = 500):
+	print("Running testRecordStore...")
+
+	data_path = os.path.join(os.path.dirname(os.path.abspath(locksfile_path)), 'records.bin')
+	if os.path.exists(data_path):
+		os.remove(data_path)
+
+	store = recordStore(data_path, record_size = 16, n_records = 64, locksfile = locksfile_path, backend = 'ofd')
+	assert os.path.getsize(data_path) == 64 * 16 and store.n_records == 64
+
+	#Writes go to the data file, a range is a single contiguous view
+	with store.write(3, 2) as view:
+		assert len(view) == 32 and not view.readonly
+		view[:] = b'ab' * 16
+	with open(data_path, 'rb') as f:
+		assert os.pread(f.fileno(), 32, 48) == b'ab' * 16
+
+	#Read views are read only, and released with the block
+	with store.read(3, 2) as view:
+		assert view.readonly and bytes(view) == b'ab' * 16
+		try:
+			view[0] = 0
+			assert False
+		except TypeError:
+			pass
+
+		#Read locked meanwhile - a reader gets in, a writer does not
+		pool = Pool(1)
+		assert pool.apply(tryAcquireProc, (locksfile_path, (3, 2), False))
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 4, True))
+	try:
+		view[0]
+		assert False
+	except ValueError:
+		pass
+	assert pool.apply(tryAcquireProc, (locksfile_path, (3, 2), True))
+
+	#Nested blocks count holds
+	with store.write(5) as outer:
+		with store.read(5) as inner:
+			assert bytes(inner) == bytes(outer)
+		assert not pool.apply(tryAcquireProc, (locksfile_path, 5, False))
+	assert not len(store.locksfile._lockIntervals)
+
+	#Lock offset, sizes from the data file, pickling
+	other = recordStore(data_path, record_size = 16, locksfile = store.locksfile, lock_offset = 1000)
+	assert other.n_records == 64
+	with other.write(2):
+		assert store.locksfile._lockIntervals.modeIntervals == [(1002, 1, True)]
+	other.close()
+
+	copy = pickle.loads(pickle.dumps(store))
+	with copy.read(3, 2) as view:
+		assert bytes(view) == b'ab' * 16
+	copy.close()
+
+	pool.close()
+	pool.join()
+
+	#Processes updating records in place - no update lost, no torn range
+	pool = Pool(n_process)
+	results = pool.starmap(recordStoreProc, [(locksfile_path, data_path, 16, n_updates, seed) for seed in range(n_process)])
+	pool.close()
+	pool.join()
+
+	with store.read(0) as view:
+		assert view.cast('q')[0] == n_process * n_updates
+	assert sum(results) == 0
+
+	#Errors
+	for bad in ((-1, 1), (63, 2), (0, 0), (1.5, 1)):
+		try:
+			store.read(*bad)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	with open(data_path, 'ab') as f:
+		f.write(b'x')
+	try:
+		recordStore(data_path, record_size = 16)
+		assert False
+	except IllegalArgumentError:
+		pass
+
+	store.close()
+	os.remove(data_path)
+
+	print("record store correct.\n")
+
+def tracedHolderProc(locksfile_path, trace_dir, lock_n, hold_time, held_event):
+	l = pylocksfile(locksfile_path = locksfile_path, trace = trace_dir)
+	l.acquire(writeLock = True, lock_n = lock_n)
+	held_event.set()
+	time.sleep(hold_time)
+	l.release(lock_n)
+
+def tracedWaiterProc(locksfile_path, trace_dir, lock_n):
+	l = pylocksfile(locksfile_path = locksfile_path, trace = trace_dir)
+	l.acquire(writeLock = True, lock_n = lock_n)
+	l.release(lock_n)
+
+def testTracer(locksfile_path, n_waiters = 3):
+	print("Running testTracer...")
+
+	#A directory per part - the tracers of the process stay open
+	trace_dir = os.path.join(os.path.dirname(os.path.abspath(locksfile_path)), 'traces')
+	if os.path.exists(trace_dir):
+		shutil.rmtree(trace_dir)
+	sample_dir, ring_dir, convoy_dir = (os.path.join(trace_dir, name) for name in ('sample', 'ring', 'convoy'))
+	for directory in (trace_dir, sample_dir, ring_dir, convoy_dir):
+		os.mkdir(directory)
+
+	#Requests that reach the os - a nested acquire makes none
+	l = pylocksfile(locksfile_path = locksfile_path, trace = trace_dir)
+	assert l.tracer is not None and os.path.basename(l.tracer.path) == os.path.basename(locksfile_path) + '.' + str(os.getpid()) + '.trace'
+	l.acquire(writeLock = True, lock_n = 3)
+	l.acquire(writeLock = True, lock_n = 3)
+	l.acquire(writeLock = False, lock_n = (10, 5))
+	l.release(3)
+	l.release(3)
+	l.release((10, 5))
+
+	events = readTrace(trace_dir)
+	assert [(event.event, event.lock_n, event.n_locks, event.writeLock) for event in events] == [(1, 3, 1, True), (2, 3, 1, True), (1, 10, 5, False), (2, 10, 5, False), (4, 3, 1, False), (4, 10, 5, False)]
+	assert all(event.pid == os.getpid() for event in events)
+
+	waits, holds = traceSpans(events)
+	assert [(span.lock_n, span.outcome) for span in waits] == [(3, 'acquired'), (10, 'acquired')]
+	assert [(span.lock_n, span.outcome) for span in holds] == [(3, 'released'), (10, 'released')]
+
+	#Instances alike share the ring of the process, others get their own
+	assert pylocksfile(locksfile_path = locksfile_path, trace = trace_dir).tracer is l.tracer
+	sampled = pylocksfile(locksfile_path = locksfile_path, trace = trace_dir, trace_sample = 0.25)
+	assert sampled.tracer is not l.tracer and sampled.tracer.path != l.tracer.path
+
+	#Sampling - the same locks for every instance, with whole timelines
+	sampled = pylocksfile(locksfile_path = locksfile_path, trace = sample_dir, trace_sample = 0.25)
+	for lock_n in range(400):
+		sampled.acquire(writeLock = True, lock_n = lock_n)
+		sampled.release(lock_n)
+	traced = set(event.lock_n for event in readTrace(sample_dir))
+	assert traced == set(lock_n for lock_n in range(400) if sampled.tracer.sampled(lock_n))
+	assert 50 < len(traced) < 150
+	assert len(readTrace(sample_dir)) == 3 * len(traced)
+
+	#The ring keeps the last events
+	small = pylocksfile(locksfile_path = locksfile_path, trace = ring_dir, trace_size = 8)
+	for lock_n in range(20):
+		small.acquire(writeLock = False, lock_n = lock_n)
+		small.release(lock_n)
+	events = readTrace(ring_dir)
+	assert len(events) == 8 and [event.lock_n for event in events] == [17, 17, 18, 18, 18, 19, 19, 19]
+
+	#A forked child traces to its own file
+	pid = os.fork()
+	if pid == 0:
+		l.acquire(writeLock = True, lock_n = 50)
+		l.release(50)
+		os._exit(0)
+	os.waitpid(pid, 0)
+	events = [event for event in readTrace(trace_dir, locksfile_path) if event.pid == pid]
+	assert [event.lock_n for event in events] == [50, 50, 50]
+	assert os.path.exists(os.path.join(trace_dir, os.path.basename(locksfile_path) + '.' + str(pid) + '.trace'))
+	assert not readTrace(trace_dir, 'other.lock')
+
+	#Processes waiting for a long held lock - a convoy and a long hold
+	held_event = multiprocessing.Event()
+	holder = multiprocessing.Process(target = tracedHolderProc, args = (locksfile_path, convoy_dir, 7, 0.5, held_event))
+	holder.start()
+	held_event.wait()
+
+	waiters = [multiprocessing.Process(target = tracedWaiterProc, args = (locksfile_path, convoy_dir, 7)) for _ in range(n_waiters)]
+	for waiter in waiters:
+		waiter.start()
+	holder.join()
+	for waiter in waiters:
+		waiter.join()
+
+	events = readTrace(convoy_dir)
+	assert len(set(event.pid for event in events)) == n_waiters + 1
+	waits, holds = traceSpans(events)
+	assert len(waits) == n_waiters + 1 and all(span.outcome == 'acquired' for span in waits)
+	assert len(holds) == n_waiters + 1 and all(span.outcome == 'released' for span in holds)
+	#No two holds of the write lock overlap
+	holds.sort(key = lambda span: span.start_ns)
+	assert all(previous.end_ns <= span.start_ns for previous, span in zip(holds, holds[1:]))
+
+	report = traceReport(events, long_hold = 0.2, convoy = n_waiters)
+	assert len(report['long_holds']) == 1 and report['long_holds'][0].pid == holder.pid
+	assert len(report['convoys']) == 1 and report['convoys'][0]['lock_n'] == 7 and report['convoys'][0]['waiters'] == n_waiters
+	assert report['ping_pong'][0]['lock_n'] == 7 and report['ping_pong'][0]['handoffs'] == n_waiters
+
+	#Chrome trace - a slice per wait and hold, the convoy as an instant event
+	chrome = json.loads(json.dumps(chromeTrace(events, convoy = n_waiters)))
+	slices = [event for event in chrome['traceEvents'] if event['ph'] == 'X']
+	assert len(slices) == 2 * (n_waiters + 1) and all(event['dur'] >= 0 and event['ts'] >= 0 for event in slices)
+	assert [event['cat'] for event in chrome['traceEvents'] if event['ph'] == 'i'] == ['convoy']
+
+	#Command line tool
+	output_path = os.path.join(trace_dir, 'trace.json')
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		assert trace([convoy_dir, '-o', output_path, '--long-hold', '200', '--convoy', str(n_waiters)]) == 0
+	assert 'W 7' in output.getvalue() and str(holder.pid) in output.getvalue()
+	with open(output_path) as f:
+		assert len(json.load(f)['traceEvents']) == len(chrome['traceEvents'])
+
+	#Errors
+	for kwargs in ({'trace' : os.path.join(trace_dir, 'missing')}, {'trace' : trace_dir, 'trace_size' : 0}, {'trace' : trace_dir, 'trace_sample' : 0}, {'trace' : trace_dir, 'trace_sample' : 1.5}):
+		try:
+			pylocksfile(locksfile_path = locksfile_path, **kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	assert pylocksfile(locksfile_path = locksfile_path).tracer is None
+
+	shutil.rmtree(trace_dir)
+
+	print("tracer correct.\n")
+
+def anySlotProc(locksfile_path, n_slots):
+	#First slot a new instance of a process takes
+	l = pylocksfile(locksfile_path = locksfile_path)
+	slot = l.acquire_any((0, n_slots))
+	l.release()
+
+	return slot
+
+def semaphoreSlotProc(sem):
+	slot = sem.acquire(blocking = False)
+	if slot is not None:
+		sem.release(slot)
+
+	return slot
+
+def semaphoreHeldProc(sem):
+	return sem.held()
+
+def semaphoreTimeoutProc(sem):
+	try:
+		with sem(timeout = 0.1):
+			return False
+	except LockTimeoutError:
+		return True
+
+def semaphoreProc(locksfile_path, value, occupied, errors, proc_i, n_acquires, hold_time):
+	#Takes slots - no slot has two holders at once
+	sem = lockSemaphore(locksfile_path, value)
+
+	for _ in range(n_acquires):
+		with sem() as slot:
+			errors[proc_i] += occupied[slot] != 0
+			occupied[slot] = 1
+			time.sleep(hold_time)
+			occupied[slot] = 0
+
+def slotHolderProc(locksfile_path, slots, held_event, release_event):
+	l = pylocksfile(locksfile_path = locksfile_path)
+	for slot in slots:
+		l.acquire(writeLock = True, lock_n = slot)
+	held_event.set()
+	release_event.wait()
+	l.release()
+
+def testSemaphore(locksfile_path, n_process = 6, value = 3, n_acquires = 50):
+	print("Running testSemaphore...")
+
+	l = pylocksfile(locksfile_path = locksfile_path)
+
+	#Free slots are found wherever they are, held slots of this instance are skipped
+	held_event = multiprocessing.Event()
+	release_event = multiprocessing.Event()
+	holder = multiprocessing.Process(target = slotHolderProc, args = (locksfile_path, [10, 11, 13], held_event, release_event))
+	holder.start()
+	held_event.wait()
+
+	assert l.acquire_any((10, 4)) == 12
+	assert l.acquire_any((10, 4), blocking = False) is None
+	start_time = time.monotonic()
+	assert l.acquire_any((10, 4), timeout = 0.2) is None
+	assert 0.15 < time.monotonic() - start_time < 1.0
+
+	#All busy - waits until one is freed
+	release_timer = threading.Timer(0.3, release_event.set)
+	release_timer.start()
+	slot = l.acquire_any((10, 4), timeout = 5.0)
+	assert slot in (10, 11, 13) and l._lockIntervals.missingSpan((slot, 1), True) is None and l._lockIntervals.missingSpan((12, 1), True) is None
+	holder.join()
+	release_timer.join()
+
+	#The slot of the last acquire is tried first
+	l.release(slot)
+	assert l.acquire_any((10, 4)) == slot
+
+	#One slot left to try (the others held by this instance) - waited for like an acquire, past SLOT_WAIT
+	held_event.clear()
+	release_event.clear()
+	holder = multiprocessing.Process(target = slotHolderProc, args = (locksfile_path, [20], held_event, release_event))
+	holder.start()
+	held_event.wait()
+	l.acquire_many([21, 22], writeLock = True)
+	start_time = time.monotonic()
+	assert l.acquire_any((20, 3), timeout = 0.2) is None
+	assert 0.15 < time.monotonic() - start_time < 1.0
+	release_timer = threading.Timer(0.3, release_event.set)
+	release_timer.start()
+	assert l.acquire_any((20, 3)) == 20
+	holder.join()
+	release_timer.join()
+	l.release_many([20, 21, 22])
+
+	#Every slot held by this instance
+	l.release()
+	for _ in range(4):
+		l.acquire_any((10, 4))
+	assert l.acquire_any((10, 4), blocking = False) is None
+	try:
+		l.acquire_any((10, 4))
+		assert False
+	except IllegalArgumentError:
+		pass
+	l.release()
+
+	#Processes start from different slots
+	pool = Pool(4)
+	assert len(set(pool.starmap(anySlotProc, [(locksfile_path, 1000)] * 16))) > 1
+	pool.close()
+	pool.join()
+
+	#Semaphore - slots relative to lock_offset, with blocks, pickling, holders
+	sem = lockSemaphore(locksfile_path, 2, lock_offset = 100)
+	first = sem.acquire()
+	assert first in (0, 1) and sem.locksfile._lockIntervals.modeIntervals == [(100 + first, 1, True)]
+	second = sem.acquire(blocking = False)
+	assert second == 1 - first
+	pool = Pool(1)
+	assert pool.apply(semaphoreSlotProc, (sem,)) is None
+	assert pool.apply(semaphoreHeldProc, (sem,)) == [0, 1] and sem.held() == []
+	sem.release(second)
+	assert pool.apply(semaphoreSlotProc, (sem,)) == second
+	pool.close()
+	pool.join()
+	sem.release(first)
+
+	with sem() as slot:
+		assert slot in (0, 1) and sem.locksfile._lockIntervals.modeIntervals == [(100 + slot, 1, True)]
+	assert not len(sem.locksfile._lockIntervals)
+
+	shared = lockSemaphore(l, 1, lock_offset = 200)
+	assert shared.locksfile is l
+	with shared() as slot:
+		pool = Pool(1)
+		assert pool.apply(semaphoreTimeoutProc, (shared,))
+		assert pool.apply(semaphoreHeldProc, (shared,)) == [0]
+		pool.close()
+		pool.join()
+	try:
+		with shared:
+			pass
+		assert False
+	except IllegalWithStatement:
+		pass
+
+	#Processes sharing slots - never two holders of a slot
+	occupied = multiprocessing.Array('i', value, lock = False)
+	errors = multiprocessing.Array('i', n_process, lock = False)
+	procs = [multiprocessing.Process(target = semaphoreProc, args = (locksfile_path, value, occupied, errors, proc_i, n_acquires, 0.002)) for proc_i in range(n_process)]
+	for proc in procs:
+		proc.start()
+	for proc in procs:
+		proc.join()
+	assert sum(errors) == 0 and not any(occupied)
+
+	#Errors
+	for args in ((locksfile_path, 0), (locksfile_path, 2.5), (None, 2), (locksfile_path, 2, -1)):
+		try:
+			lockSemaphore(*args)
+			assert False
+		except IllegalArgumentError:
+			pass
+	for kwargs in ({'lock_n' : (0, 0)}, {'lock_n' : (0, 4), 'writeLock' : 1}, {'lock_n' : (0, 4), 'blocking' : False, 'timeout' : 1.0}):
+		try:
+			l.acquire_any(**kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+	try:
+		sem.release(2)
+		assert False
+	except IllegalArgumentError:
+		pass
+
+	print("semaphore correct.\n")
+
+def executorTask(occupied, lock_ns, hold_time):
+	#Marks its locks busy while it runs - 1 if another task had one of them
+	clash = 0
+	for lock_n in lock_ns:
+		occupied[lock_n] += 1
+		clash |= occupied[lock_n] > 1
+	time.sleep(hold_time)
+	for lock_n in lock_ns:
+		occupied[lock_n] -= 1
+
+	return clash
+
+def executorHeld(held_event, release_event):
+	#Holds its locks until released
+	held_event.set()
+	release_event.wait()
+
+	return os.getpid()
+
+def executorOrder(order, lock_n, value):
+	order.append((lock_n, value))
+
+def executorRaise(message):
+	raise KeyError(message)
+
+def executorExit(code):
+	os._exit(code)
+
+def testExecutor(locksfile_path, max_workers = 4, n_tasks = 400, n_locks = 12):
+	print("Running testExecutor...")
+
+	#Tasks hold their locks - no other process gets them meanwhile
+	with lockExecutor(locksfile_path, max_workers = max_workers) as executor:
+		assert executor.max_workers == max_workers and isinstance(executor.locksfile, pylocksfile)
+		l = pylocksfile(locksfile_path = locksfile_path)
+		manager = Manager()
+		held_event = manager.Event()
+		release_event = manager.Event()
+		future = executor.submit_locked([(3, 2)], executorHeld, held_event, release_event)
+		held_event.wait()
+		assert not l.acquire(False, 4, blocking = False) and l.acquire(False, 5, blocking = False)
+		release_event.set()
+		assert future.result() > 0
+		assert l.acquire(True, 3, timeout = 5.0)
+		l.release()
+
+		#Overlapping tasks never run together (tasks are pickled - counts in the manager), disjoint ones are spread over the workers
+		occupied = manager.list([0] * n_locks)
+		rng = np.random.default_rng(1)
+		lock_sets = [rng.choice(n_locks, rng.integers(1, 4), replace = False).tolist() for _ in range(n_tasks)]
+		futures = [executor.submit_locked(lock_ns, executorTask, occupied, lock_ns, 0.001) for lock_ns in lock_sets]
+		assert sum(future.result() for future in futures) == 0 and not any(occupied)
+
+		assert len(set(executor.map(executorHeld, [held_event] * 64, [release_event] * 64))) > 1
+
+		#Tasks of a lock run in their order
+		order = manager.list()
+		futures = [executor.submit_locked([value % 3], executorOrder, order, value % 3, value) for value in range(60)]
+		for future in futures:
+			future.result()
+		for lock_n in range(3):
+			values = [value for order_lock_n, value in order if order_lock_n == lock_n]
+			assert values == sorted(values) and len(values) == 20
+
+		#Exceptions of tasks, and tasks that do not pickle
+		try:
+			executor.submit_locked([7], executorRaise, 'x').result()
+			assert False
+		except KeyError:
+			pass
+		try:
+			executor.submit_locked([7], lambda: None).result()
+			assert False
+		except Exception:
+			pass
+		assert executor.submit_locked([7], executorHeld, held_event, release_event).result() > 0
+
+	try:
+		executor.submit(os.getpid)
+		assert False
+	except RuntimeError:
+		pass
+
+	#A batch takes the lock sets of its tasks at once - the lock of its second task is held while the first one runs.
+	#Two batches of lock 30 in flight, so the tasks of locks 40 and 41 queue up and are sent together.
+	with lockExecutor(locksfile_path, max_workers = 1) as executor:
+		first_held, first_release, held_event, release_event = [manager.Event() for _ in range(4)]
+		futures = [executor.submit_locked([30], executorHeld, first_held, first_release)]
+		first_held.wait()
+		futures.append(executor.submit_locked([30], executorHeld, first_held, first_release))
+		time.sleep(0.2)
+		futures += [executor.submit_locked([40], executorHeld, held_event, release_event), executor.submit_locked([41], executorHeld, held_event, release_event)]
+		first_release.set()
+		held_event.wait()
+		assert not l.acquire(False, 41, blocking = False) and l.acquire(False, 42, blocking = False)
+		release_event.set()
+		assert all(future.result() > 0 for future in futures)
+		l.release()
+
+	#Queued tasks can be cancelled
+	executor = lockExecutor(locksfile_path, max_workers = 1)
+	futures = [executor.submit_locked([0], time.sleep, 0.05) for _ in range(4 * EXECUTOR_BATCH)]
+	executor.shutdown(wait = True, cancel_futures = True)
+	assert futures[-1].cancelled() and all(future.cancelled() or future.result() is None for future in futures)
+
+	#A worker that dies breaks the executor
+	executor = lockExecutor(pylocksfile(locksfile_path = locksfile_path), max_workers = 2)
+	try:
+		executor.submit_locked([1], executorExit, 3).result()
+		assert False
+	except RuntimeError as e:
+		assert 'code 3' in str(e)
+	try:
+		executor.submit_locked([1], os.getpid)
+		assert False
+	except RuntimeError:
+		pass
+	executor.shutdown()
+
+	#Errors
+	for args, kwargs in (((None,), {}), ((locksfile_path,), {'max_workers' : 0}), ((pylocksfile(locksfile_path = locksfile_path),), {'backend' : 'ofd'})):
+		try:
+			lockExecutor(*args, **kwargs)
+			assert False
+		except IllegalArgumentError:
+			pass
+	with lockExecutor(locksfile_path, max_workers = 1) as executor:
+		try:
+			executor.submit_locked([(0, 0)], os.getpid)
+			assert False
+		except IllegalArgumentError:
+			pass
+
+	print("executor correct.\n")
+
 def main():
 	locksfile_path = './testlock.lock'
 
+	testLockInterval()
+
+	print("\n")
+
 	testReadWriteLocks(locksfile_path = locksfile_path)
 
 	print("\n")
 
+	testAcquireMany(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testNesting(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testReleaseAll(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testOfdThreads(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testTimeout(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testAsync(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testMetrics(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testKeys(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testHolders(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testDeadlock(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testFairness(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testHierarchy(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testSharded(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testHandles(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testUpgradeable(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testLockServer(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testOptimistic(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testWithBlocks(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testRecordStore(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testTracer(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testSemaphore(locksfile_path = locksfile_path)
+
+	print("\n")
+
+	testExecutor(locksfile_path = locksfile_path)
+
+	print("\n")
+
 	testRace(locksfile_path = locksfile_path, n_process = 4, n_tracks = 50, n_races = 100)
 	
 